@@ -0,0 +1,411 @@
+"""
+Bộ microbenchmark cho các đường nóng trong coupled_tank_gui.py.
+
+Ví dụ:
+    python benchmarks/bench_hot_paths.py -o bench_results.json
+    python benchmarks/bench_hot_paths.py --baseline benchmarks/baseline.json
+    python benchmarks/bench_hot_paths.py --update-baseline
+
+Kết quả là JSON (ns/lần gọi, số lần gọi/giây). Khi có --baseline, mỗi benchmark chậm hơn
+baseline quá --threshold (mặc định 25%) bị đánh dấu hồi quy và mã thoát khác 0.
+Phép so sánh dùng thời gian đã chuẩn hóa theo một tải tham chiếu đo trong cùng lần chạy,
+để giảm ảnh hưởng của xung nhịp CPU thay đổi giữa các lần chạy.
+Benchmark GUI cần màn hình (hoặc Xvfb); nếu không mở được Tk, benchmark đó được bỏ qua.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tkinter as tk
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from coupled_tank_gui import (PIDController, FuzzyPIDController, MPCController, GainScheduledPIDController,
+                              CoupledTankSystem, SimulationEngine, MultiRateEngine, RelayAutoTuner)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Đăng ký một hàm tạo benchmark. Hàm trả về (callable, số thao tác mỗi lần gọi)."""
+    def decorator(factory):
+        BENCHMARKS[name] = factory
+        return factory
+    return decorator
+
+
+def _time_callable(func, ops_per_call, min_time=0.2, repeats=5):
+    """Tự chọn số lần lặp để mỗi lần đo kéo dài ~min_time, lấy min và trung vị của các lần đo."""
+    func()  # Khởi động (warm-up)
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time / 4 or number >= 1 << 24:
+            break
+        number *= 4
+    number = max(1, int(number * (min_time / max(elapsed, 1e-9))))
+
+    per_op = []
+    for _ in range(repeats):
+        t0 = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        per_op.append((time.perf_counter_ns() - t0) / (number * ops_per_call))
+    best = min(per_op)
+    return {
+        'ns_per_op': best,
+        'median_ns_per_op': float(np.median(per_op)),
+        'ops_per_s': 1e9 / best if best > 0 else None,
+        'iterations': number * ops_per_call,
+    }
+
+
+# --- Bộ điều khiển ---
+@benchmark('pid.update')
+def _bench_pid_update():
+    pid = PIDController(Kp=83.5, Ki=14.5, Kd=120, set_point=25.0)
+    pv = iter(np.tile(np.linspace(0, 40, 1000), 1 << 16)).__next__
+    return (lambda: pid.update(pv(), 0.1)), 1
+
+
+@benchmark('fuzzy.update')
+def _bench_fuzzy_update():
+    fuzzy = FuzzyPIDController(set_point=25.0)
+    pv = iter(np.tile(np.linspace(0, 40, 1000), 1 << 10)).__next__
+    return (lambda: fuzzy.update(pv(), 0.1)), 1
+
+
+@benchmark('fuzzy.update_sugeno')
+def _bench_fuzzy_update_sugeno():
+    """Cùng tải với fuzzy.update (Mamdani) để so sánh chi phí; hệ số khác Mamdani (xem FUZZY_PID_DOCUMENTATION.md)."""
+    fuzzy = FuzzyPIDController(set_point=25.0, inference='sugeno')
+    pv = iter(np.tile(np.linspace(0, 40, 1000), 1 << 10)).__next__
+    return (lambda: fuzzy.update(pv(), 0.1)), 1
+
+
+@benchmark('fuzzy._fuzzify')
+def _bench_fuzzify():
+    fuzzy = FuzzyPIDController(set_point=25.0)
+    return (lambda: fuzzy._fuzzify(7.3, fuzzy.error_universe, fuzzy.e_mf)), 1
+
+
+@benchmark('fuzzy._fuzzy_inference')
+def _bench_fuzzy_inference():
+    fuzzy = FuzzyPIDController(set_point=25.0)
+    e_degrees = fuzzy._fuzzify(7.3, fuzzy.error_universe, fuzzy.e_mf)
+    ce_degrees = fuzzy._fuzzify(-2.1, fuzzy.ce_universe, fuzzy.ce_mf)
+    return (lambda: fuzzy._fuzzy_inference(e_degrees, ce_degrees)), 1
+
+
+@benchmark('fuzzy._defuzzify')
+def _bench_defuzzify():
+    fuzzy = FuzzyPIDController(set_point=25.0)
+    e_degrees = fuzzy._fuzzify(7.3, fuzzy.error_universe, fuzzy.e_mf)
+    ce_degrees = fuzzy._fuzzify(-2.1, fuzzy.ce_universe, fuzzy.ce_mf)
+    kp_fuzzy, _, _ = fuzzy._fuzzy_inference(e_degrees, ce_degrees)
+    return (lambda: fuzzy._defuzzify(kp_fuzzy, fuzzy.kp_universe)), 1
+
+
+@benchmark('fuzzy._rule_levels')
+def _bench_rule_levels():
+    fuzzy = FuzzyPIDController(set_point=25.0)
+    e_degrees = fuzzy._fuzzify(7.3, fuzzy.error_universe, fuzzy.e_mf)
+    ce_degrees = fuzzy._fuzzify(-2.1, fuzzy.ce_universe, fuzzy.ce_mf)
+    return (lambda: fuzzy._rule_levels(e_degrees, ce_degrees)), 1
+
+
+@benchmark('fuzzy._defuzzify_analytic')
+def _bench_defuzzify_analytic():
+    """Cả ba đầu ra trong một lần gọi (độ chính xác: tests/test_fuzzy_pid.py)."""
+    fuzzy = FuzzyPIDController(set_point=25.0)
+    e_degrees = fuzzy._fuzzify(7.3, fuzzy.error_universe, fuzzy.e_mf)
+    ce_degrees = fuzzy._fuzzify(-2.1, fuzzy.ce_universe, fuzzy.ce_mf)
+    levels = fuzzy._rule_levels(e_degrees, ce_degrees)
+    return (lambda: fuzzy._defuzzify_analytic(levels)), 1
+
+
+@benchmark('fuzzy._sugeno_gains')
+def _bench_sugeno_gains():
+    fuzzy = FuzzyPIDController(set_point=25.0, inference='sugeno')
+    e_degrees = fuzzy._fuzzify(7.3, fuzzy.error_universe, fuzzy.e_mf)
+    ce_degrees = fuzzy._fuzzify(-2.1, fuzzy.ce_universe, fuzzy.ce_mf)
+    return (lambda: fuzzy._sugeno_gains(fuzzy._rule_strengths(e_degrees, ce_degrees))), 1
+
+
+@benchmark('fuzzy_surface.rule_edit')
+def _bench_surface_rule_edit():
+    """Sửa một luật rồi tính lại bề mặt 41x41 (chỉ vùng bị ảnh hưởng)."""
+    from fuzzy_surface import ControlSurface
+
+    surface = ControlSurface(FuzzyPIDController(set_point=25.0))
+    surface.refresh()
+    options = iter([('PS', 'ZO', 'NS'), ('ZO', 'ZO', 'ZO')] * (1 << 16)).__next__
+
+    def edit():
+        surface.set_rule('ZO', 'ZO', options())
+        surface.refresh()
+    return edit, 1
+
+
+@benchmark('mpc.update')
+def _bench_mpc_update():
+    # sample_time = dt nên mỗi lần gọi đều giải QP (điểm làm việc đã nằm trong bộ nhớ đệm)
+    plant = CoupledTankSystem()
+    mpc = MPCController(set_point=25.0, plant=plant, sample_time=0.1)
+    pv = iter(np.tile(np.linspace(20, 30, 1000), 1 << 12)).__next__
+    return (lambda: mpc.update(pv(), 0.1)), 1
+
+
+@benchmark('scheduled.update')
+def _bench_scheduled_update():
+    # Điểm làm việc không đổi: chỉ có chi phí PID cộng phép so sánh khóa lập lịch
+    scheduled = GainScheduledPIDController(set_point=25.0, plant=CoupledTankSystem())
+    pv = iter(np.tile(np.linspace(0, 40, 1000), 1 << 16)).__next__
+    return (lambda: scheduled.update(pv(), 0.1)), 1
+
+
+@benchmark('scheduled.lookup')
+def _bench_scheduled_lookup():
+    table = GainScheduledPIDController(set_point=25.0).table
+    return (lambda: table.lookup(17.3, 64.0, 81.0)), 1
+
+
+# --- Hệ bồn và vòng kín ---
+@benchmark('plant.update')
+def _bench_plant_update():
+    plant = CoupledTankSystem()
+    plant.H1, plant.H2 = 25.0, 20.0
+    return (lambda: plant.update(120.0, 0, 0.1, 0.0)), 1
+
+
+@benchmark('network.update_cascade500')
+def _bench_network_update():
+    from tank_network import TankNetwork
+    network = TankNetwork.cascade(500)
+    network.H[:] = np.linspace(0, 40, 500)
+    inflows = np.full(500, 50.0)
+    return (lambda: network.update(inflows, 0.1)), 1
+
+
+@benchmark('closed_loop.pid_steps')
+def _bench_closed_loop_pid():
+    engine = SimulationEngine(PIDController(Kp=83.5, Ki=14.5, Kd=120, set_point=25.0))
+
+    def run():
+        for _ in range(1000):
+            engine.step()
+    return run, 1000
+
+
+@benchmark('closed_loop.multirate_pid_steps')
+def _bench_closed_loop_multirate():
+    # Bộ điều khiển 0.5 s, cảm biến 0.1 s: đo chi phí hàng đợi sự kiện so với closed_loop.pid_steps
+    engine = MultiRateEngine(PIDController(Kp=83.5, Ki=14.5, Kd=120, set_point=25.0), controller_period=0.5,
+                             sensor_period=0.1)
+
+    def run():
+        for _ in range(1000):
+            engine.step()
+    return run, 1000
+
+
+@benchmark('closed_loop.fuzzy_steps')
+def _bench_closed_loop_fuzzy():
+    engine = SimulationEngine(FuzzyPIDController(set_point=25.0))
+
+    def run():
+        for _ in range(100):
+            engine.step()
+    return run, 100
+
+
+@benchmark('sensitivity.simulate_batch')
+def _bench_sensitivity_batch():
+    # Một lô 1024 bộ tham số, bước 20 s; tính theo từng lần mô phỏng vòng kín
+    import sensitivity
+    samples = sensitivity.saltelli_sample(128, list(sensitivity.PARAMETERS.values()))[:1024]
+    return (lambda: sensitivity.simulate_batch(samples, duration=20.0)), 1024
+
+
+@benchmark('relay_tuning.wall_time')
+def _bench_relay_tuning():
+    # Thí nghiệm như GUI chạy: bước mặc định của RelayAutoTuner (1 s, chuyển relay đúng thời điểm)
+    def run():
+        tuner = RelayAutoTuner(CoupledTankSystem(), set_point=20.0, relay_amplitude=200.0)
+        if tuner.run() is None:
+            raise RuntimeError("Thí nghiệm relay không hội tụ")
+    return run, 1
+
+
+@benchmark('relay_tuning.wall_time_dt1')
+def _bench_relay_tuning_large_step():
+    # Bước 1 s tường minh: cùng Ku, Tu (sai khác <2%) với bước 0.02 s
+    def run():
+        tuner = RelayAutoTuner(CoupledTankSystem(), set_point=20.0, relay_amplitude=200.0, dt=1.0)
+        if tuner.run() is None:
+            raise RuntimeError("Thí nghiệm relay không hội tụ")
+    return run, 1
+
+
+# --- Một nhịp GUI vẽ ngoài màn hình ---
+@benchmark('gui.tick')
+def _bench_gui_tick():
+    from coupled_tank_gui import SimulationGUI
+
+    root = tk.Tk()  # Ném TclError nếu không có màn hình
+    root.withdraw()
+    gui = SimulationGUI(root)
+    root.update()
+    gui.draw_tanks()
+    gui.is_running = True
+
+    def tick():
+        gui.run_simulation_step()
+        h1, h2 = gui.tank_system.get_levels()
+        qi1 = gui.active_controller._last_output
+        gui._update_status_labels(h1, h2, qi1)
+        gui.update_water_display(h1, h2)
+        gui._update_graph_data(gui.simulation_time, h1, h2, gui.setpoint_var.get(), qi1)
+        gui._animate_water_flow()
+        gui._redraw_trend()
+        gui.graph_canvas.draw()
+        root.update_idletasks()
+    return tick, 1
+
+
+@benchmark('gui.cold_start')
+def _bench_gui_cold_start():
+    # Tiến trình mới từ lúc khởi động tới lần vẽ đầu tiên và biểu đồ sẵn sàng (coupled_tank_gui --startup-report)
+    tk.Tk().destroy()  # Ném TclError nếu không có màn hình
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'coupled_tank_gui.py')
+    cache_dir = tempfile.mkdtemp(prefix='coupled_tank_bench_')
+    env = dict(os.environ, COUPLED_TANK_CACHE_DIR=cache_dir)
+
+    def run():
+        subprocess.run([sys.executable, script, '--startup-report'], env=env, check=True,
+                       stdout=subprocess.DEVNULL, timeout=60)
+    return run, 1
+
+
+def _reference_workload():
+    """Tải tham chiếu cố định (Python thuần + NumPy nhỏ) để chuẩn hóa kết quả giữa các lần chạy."""
+    acc = 0.0
+    for i in range(200):
+        acc += math.sqrt(i) * 0.5
+    return acc + float(np.sum(_REFERENCE_ARRAY))
+
+
+_REFERENCE_ARRAY = np.linspace(0, 1, 101)
+
+
+def run_benchmarks(names=None, min_time=0.2):
+    """
+    Chạy các benchmark đã đăng ký.
+
+    Returns:
+        tuple: (kết quả, bỏ qua, lỗi, reference_ns). Chỉ benchmark GUI thiếu màn hình (TclError)
+               được bỏ qua; mọi lỗi khác (kể cả kiểm tra độ đúng trong hàm tạo) nằm trong "lỗi".
+    """
+    reference_ns = _time_callable(_reference_workload, 1, min_time=min_time)['ns_per_op']
+    results = {}
+    skipped = {}
+    errors = {}
+    for name, factory in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        try:
+            func, ops = factory()
+            results[name] = _time_callable(func, ops, min_time=min_time)
+        except tk.TclError as e:  # Thiếu màn hình cho Tk
+            skipped[name] = f"{type(e).__name__}: {e}"
+            continue
+        except Exception as e:
+            errors[name] = "".join(traceback.format_exception(e)).rstrip()
+            continue
+        # Đo lại tải tham chiếu ngay sau mỗi benchmark để bám theo xung nhịp hiện tại
+        local_reference_ns = _time_callable(_reference_workload, 1, min_time=min_time / 4)['ns_per_op']
+        results[name]['normalized'] = results[name]['ns_per_op'] / local_reference_ns
+    return results, skipped, errors, reference_ns
+
+
+def compare(results, baseline, threshold):
+    """Trả về danh sách (tên, tỉ lệ hiện tại/baseline) của các benchmark bị hồi quy."""
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        if 'normalized' in res and 'normalized' in base:
+            ratio = res['normalized'] / base['normalized']
+        else:
+            ratio = res['ns_per_op'] / base['ns_per_op']
+        res['baseline_ratio'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark các đường nóng của mô phỏng bồn nước đôi.")
+    parser.add_argument('-o', '--output', help="File JSON kết quả")
+    parser.add_argument('--baseline', help="File baseline để so sánh (mặc định: không so sánh)")
+    parser.add_argument('--threshold', type=float, default=0.25, help="Ngưỡng hồi quy tương đối (0.25 = chậm hơn 25%%)")
+    parser.add_argument('--update-baseline', action='store_true', help=f"Ghi kết quả làm baseline mới ({DEFAULT_BASELINE})")
+    parser.add_argument('--min-time', type=float, default=0.2, help="Thời gian tối thiểu mỗi lần đo (giây)")
+    parser.add_argument('-k', '--only', nargs='*', help="Chỉ chạy các benchmark có tên này")
+    args = parser.parse_args(argv)
+
+    results, skipped, errors, reference_ns = run_benchmarks(args.only, args.min_time)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'reference_ns': reference_ns,
+        },
+        'results': results,
+        'skipped': skipped,
+        'errors': errors,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report['regressions'] = [name for name, _ in regressions]
+
+    for name, res in results.items():
+        ratio = res.get('baseline_ratio')
+        ratio_text = f"  x{ratio:.2f} so với baseline" if ratio is not None else ""
+        print(f"{name:<28}{res['ns_per_op'] / 1e3:>12.3f} us/op{res['ops_per_s']:>14.0f} op/s{ratio_text}")
+    for name, reason in skipped.items():
+        print(f"{name:<28} bỏ qua ({reason})")
+    for name, ratio in regressions:
+        print(f"HỒI QUY: {name} chậm hơn baseline {100 * (ratio - 1):.0f}%")
+    for name, error in errors.items():
+        print(f"LỖI: {name}\n{error}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.update_baseline and not errors:
+        with open(DEFAULT_BASELINE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if regressions or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,36 @@
 import tkinter as tk
 from tkinter import ttk
-from tkinter.filedialog import asksaveasfilename
+from tkinter.filedialog import asksaveasfilename, askopenfilename
 import math
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
+import time
 import numpy as np
 import tkinter.messagebox as messagebox
 import csv
+import json
+from collections import deque
 import os
+import logging
+
+from run_recording import RunRecorder, RunRecording, ReplayPlayer
+from trend_pyramid import TrendPyramid
+from hotpath_profiler import StageProfiler, StartupTimer
+from event_scheduler import EventScheduler
+from tuning_cache import TuningCache
+from shared_state import (SharedStatePublisher, DEFAULT_SHM_NAME, CMD_SETPOINT, CMD_VALVES,
+                          CMD_DISTURBANCE, controller_internals)
+
+logger = logging.getLogger(__name__)
 
 # --- LỚP BỘ ĐIỀU KHIỂN PID ---
 class PIDController:
     """
     Một lớp để triển khai bộ điều khiển PID (Proportional-Integral-Derivative).
     """
+    controller_type = 'pid'
+    # Các thuộc tính tạo nên trạng thái đầy đủ (dùng cho snapshot/restore)
+    _STATE_ATTRS = ('Kp', 'Ki', 'Kd', 'set_point', '_proportional', '_integral', '_derivative',
+                    '_last_error', '_last_output')
+
     def __init__(self, Kp, Ki, Kd, set_point, output_limits=(0, 300)):
         self.Kp = Kp
         self.Ki = Ki
@@ -85,6 +101,15 @@ class PIDController:
         self.set_point = set_point
         self.reset()
 
+    def snapshot(self):
+        """Trạng thái hiện tại (hệ số, tích phân, sai số và đầu ra lần trước) dưới dạng dict."""
+        return {name: float(getattr(self, name)) for name in self._STATE_ATTRS}
+
+    def restore(self, state):
+        """Khôi phục trạng thái từ snapshot()."""
+        for name in self._STATE_ATTRS:
+            setattr(self, name, state[name])
+
 
 # --- LỚP BỘ ĐIỀU KHIỂN FUZZY PID ---
 class FuzzyPIDController:
@@ -92,12 +117,23 @@ class FuzzyPIDController:
     Mamdani-style Fuzzy PID Controller for coupled tank system.
     Uses fuzzy logic to dynamically tune Kp, Ki, Kd based on error and change of error.
     """
-    def __init__(self, set_point, output_limits=(0, 300)):
-        self.set_point = set_point
-        self.output_min, self.output_max = output_limits
-        self._last_error = 0
-        self._last_output = 0
-        self._integral = 0
+    controller_type = 'fuzzy'
+    # Runtime state (membership functions and rules are configuration, not state)
+    _STATE_ATTRS = ('set_point', '_integral', '_last_error', '_last_output')
+    DEFUZZIFICATION_METHODS = ('analytic', 'sampled')
+    INFERENCE_METHODS = ('mamdani', 'sugeno')
+
+    def __init__(self, set_point, output_limits=(0, 300), defuzzification='analytic', inference='mamdani'):
+        """
+        Args:
+            defuzzification: 'analytic' computes the exact centroid of the clipped output
+                triangles (no sampled universe); 'sampled' is the original 101-point
+                discrete centroid. Mamdani inference only.
+            inference: 'mamdani' (max-min aggregation + centroid) or 'sugeno' (zero-order
+                Takagi-Sugeno: weighted average of singleton consequents, see
+                sugeno_from_mamdani()).
+        """
+        self._init_options(set_point, output_limits, defuzzification, inference)
         
         # Linguistic variables for error (E) and change of error (CE)
         self.linguistic_terms = ['NB', 'NM', 'NS', 'ZO', 'PS', 'PM', 'PB']  # Negative Big to Positive Big
@@ -116,63 +152,70 @@ class FuzzyPIDController:
         
         # Initialize fuzzy rule base for Kp, Ki, Kd tuning
         self._init_rule_base()
+
+        # Index tables for the analytic inference/defuzzification path
+        self._init_analytic_tables()
+
+        # Singleton consequents for Sugeno inference, converted from the Mamdani output sets
+        self.singletons = self.sugeno_from_mamdani()
+        self._init_sugeno_tables()
     
+    def _init_options(self, set_point, output_limits, defuzzification, inference):
+        """Per-instance options and runtime state (everything that config_tables() leaves out)."""
+        if defuzzification not in self.DEFUZZIFICATION_METHODS:
+            raise ValueError(f"defuzzification must be one of {self.DEFUZZIFICATION_METHODS}")
+        if inference not in self.INFERENCE_METHODS:
+            raise ValueError(f"inference must be one of {self.INFERENCE_METHODS}")
+        self.defuzzification = defuzzification
+        self.inference = inference
+        self.set_point = set_point
+        self.output_min, self.output_max = output_limits
+        self._last_error = 0
+        self._last_output = 0
+        self._integral = 0
+        self._last_gains = (0.0, 0.0, 0.0)  # Kp, Ki, Kd suy ra ở bước gần nhất
+
     def _init_membership_functions(self):
         """Initialize triangular membership functions for all linguistic variables."""
+        # Triangle parameters (a, b, c) per linguistic term; the sampled membership
+        # arrays below are built from them, the analytic defuzzifier uses them directly.
         # Membership functions for Error (E)
-        self.e_mf = {
-            'NB': self._triangular_mf(self.error_universe, -50, -50, -30),
-            'NM': self._triangular_mf(self.error_universe, -50, -30, -10),
-            'NS': self._triangular_mf(self.error_universe, -30, -10, 0),
-            'ZO': self._triangular_mf(self.error_universe, -10, 0, 10),
-            'PS': self._triangular_mf(self.error_universe, 0, 10, 30),
-            'PM': self._triangular_mf(self.error_universe, 10, 30, 50),
-            'PB': self._triangular_mf(self.error_universe, 30, 50, 50)
+        self.e_params = {
+            'NB': (-50, -50, -30), 'NM': (-50, -30, -10), 'NS': (-30, -10, 0), 'ZO': (-10, 0, 10),
+            'PS': (0, 10, 30), 'PM': (10, 30, 50), 'PB': (30, 50, 50)
         }
         
         # Membership functions for Change of Error (CE)
-        self.ce_mf = {
-            'NB': self._triangular_mf(self.ce_universe, -20, -20, -12),
-            'NM': self._triangular_mf(self.ce_universe, -20, -12, -4),
-            'NS': self._triangular_mf(self.ce_universe, -12, -4, 0),
-            'ZO': self._triangular_mf(self.ce_universe, -4, 0, 4),
-            'PS': self._triangular_mf(self.ce_universe, 0, 4, 12),
-            'PM': self._triangular_mf(self.ce_universe, 4, 12, 20),
-            'PB': self._triangular_mf(self.ce_universe, 12, 20, 20)
+        self.ce_params = {
+            'NB': (-20, -20, -12), 'NM': (-20, -12, -4), 'NS': (-12, -4, 0), 'ZO': (-4, 0, 4),
+            'PS': (0, 4, 12), 'PM': (4, 12, 20), 'PB': (12, 20, 20)
         }
         
         # Membership functions for Kp output
-        self.kp_mf = {
-            'NB': self._triangular_mf(self.kp_universe, 0, 0, 50),
-            'NM': self._triangular_mf(self.kp_universe, 0, 50, 100),
-            'NS': self._triangular_mf(self.kp_universe, 50, 100, 150),
-            'ZO': self._triangular_mf(self.kp_universe, 100, 150, 200),
-            'PS': self._triangular_mf(self.kp_universe, 150, 200, 200),
-            'PM': self._triangular_mf(self.kp_universe, 200, 200, 200),
-            'PB': self._triangular_mf(self.kp_universe, 200, 200, 200)
+        self.kp_params = {
+            'NB': (0, 0, 50), 'NM': (0, 50, 100), 'NS': (50, 100, 150), 'ZO': (100, 150, 200),
+            'PS': (150, 200, 200), 'PM': (200, 200, 200), 'PB': (200, 200, 200)
         }
         
         # Membership functions for Ki output
-        self.ki_mf = {
-            'NB': self._triangular_mf(self.ki_universe, 0, 0, 10),
-            'NM': self._triangular_mf(self.ki_universe, 0, 10, 20),
-            'NS': self._triangular_mf(self.ki_universe, 10, 20, 30),
-            'ZO': self._triangular_mf(self.ki_universe, 20, 30, 40),
-            'PS': self._triangular_mf(self.ki_universe, 30, 40, 50),
-            'PM': self._triangular_mf(self.ki_universe, 40, 50, 50),
-            'PB': self._triangular_mf(self.ki_universe, 50, 50, 50)
+        self.ki_params = {
+            'NB': (0, 0, 10), 'NM': (0, 10, 20), 'NS': (10, 20, 30), 'ZO': (20, 30, 40),
+            'PS': (30, 40, 50), 'PM': (40, 50, 50), 'PB': (50, 50, 50)
         }
         
         # Membership functions for Kd output
-        self.kd_mf = {
-            'NB': self._triangular_mf(self.kd_universe, 0, 0, 50),
-            'NM': self._triangular_mf(self.kd_universe, 0, 50, 100),
-            'NS': self._triangular_mf(self.kd_universe, 50, 100, 150),
-            'ZO': self._triangular_mf(self.kd_universe, 100, 150, 200),
-            'PS': self._triangular_mf(self.kd_universe, 150, 200, 250),
-            'PM': self._triangular_mf(self.kd_universe, 200, 250, 300),
-            'PB': self._triangular_mf(self.kd_universe, 250, 300, 300)
+        self.kd_params = {
+            'NB': (0, 0, 50), 'NM': (0, 50, 100), 'NS': (50, 100, 150), 'ZO': (100, 150, 200),
+            'PS': (150, 200, 250), 'PM': (200, 250, 300), 'PB': (250, 300, 300)
         }
+
+        def sampled(universe, params):
+            return {term: self._triangular_mf(universe, *abc) for term, abc in params.items()}
+        self.e_mf = sampled(self.error_universe, self.e_params)
+        self.ce_mf = sampled(self.ce_universe, self.ce_params)
+        self.kp_mf = sampled(self.kp_universe, self.kp_params)
+        self.ki_mf = sampled(self.ki_universe, self.ki_params)
+        self.kd_mf = sampled(self.kd_universe, self.kd_params)
     
     def _triangular_mf(self, universe, a, b, c):
         """Create triangular membership function."""
@@ -283,6 +326,330 @@ class FuzzyPIDController:
         # Centroid defuzzification
         centroid = np.sum(fuzzy_output * universe) / np.sum(fuzzy_output)
         return centroid
+
+    def _init_analytic_tables(self):
+        """
+        Precompute index arrays for the analytic path. Must be called again after the
+        membership function parameters or the rule base change.
+
+        Output sets are laid out as a (3, 7) grid: rows Kp, Ki, Kd; columns linguistic_terms.
+        """
+        terms = self.linguistic_terms
+        n = len(terms)
+        index = {term: i for i, term in enumerate(terms)}
+        self._e_terms = list(self.e_mf)
+        self._ce_terms = list(self.ce_mf)
+
+        # fires[o, t, k]: rule with antecedents (E, CE) = divmod(k, 7) in the e_mf/ce_mf order
+        # sets output o to term t
+        e_pos = {term: i for i, term in enumerate(self._e_terms)}
+        ce_pos = {term: i for i, term in enumerate(self._ce_terms)}
+        fires = np.zeros((3, n, len(e_pos) * len(ce_pos)))
+        for (e_term, ce_term), outputs in self.rule_base.items():
+            k = e_pos[e_term] * len(ce_pos) + ce_pos[ce_term]
+            for o, term in enumerate(outputs):
+                fires[o, index[term], k] = 1.0
+        self._rule_fires = fires
+
+        tri = np.array([[params[term] for term in terms]
+                        for params in (self.kp_params, self.ki_params, self.kd_params)], dtype=float)
+        a, b, c = tri[..., 0], tri[..., 1], tri[..., 2]
+        # Zero-width sets (a == c, e.g. Kp 'PM') are identically zero in the sampled MFs too
+        self._active_sets = c > a
+        # Vertical edges (a == b or b == c) become ramps of width eps whose inner end is a
+        # breakpoint, so the aggregated set stays continuous and piecewise linear. A power of
+        # two keeps a + eps, c - eps and the ramp value 1 exact in floating point.
+        eps = 2.0 ** -30
+        rise, fall = np.maximum(b - a, eps), np.maximum(c - b, eps)
+        self._tri = (a[:, :, None], c[:, :, None], (1.0 / rise)[:, :, None], (1.0 / fall)[:, :, None])
+
+        # Breakpoints that do not depend on the clip levels: triangle vertices, inner ends of
+        # vertical edges and crossings between edges of sets of the same output
+        static = []
+        for o in range(3):
+            points = list(tri[o].ravel())
+            edges = []
+            for i in range(n):
+                if not self._active_sets[o, i]:
+                    continue
+                points += [a[o, i] + rise[o, i], c[o, i] - fall[o, i]]
+                # Edge: y = m x + q on [x0, x1]
+                edges.append((1.0 / rise[o, i], -a[o, i] / rise[o, i], a[o, i], a[o, i] + rise[o, i]))
+                edges.append((-1.0 / fall[o, i], c[o, i] / fall[o, i], c[o, i] - fall[o, i], c[o, i]))
+            for i, (m1, q1, lo1, hi1) in enumerate(edges):
+                for m2, q2, lo2, hi2 in edges[i + 1:]:
+                    if m1 != m2:
+                        x = (q2 - q1) / (m1 - m2)
+                        if max(lo1, lo2) < x < min(hi1, hi2):
+                            points.append(x)
+            lo, hi = a[o].min(), c[o].max()
+            static.append(sorted({min(max(x, lo), hi) for x in points}))
+        # Breakpoints that move with the clip level h_i, x = base + h_i * slope: where the
+        # plateau of set i meets the rising or falling edge of set j (i == j gives the clip
+        # points). Only active pairs with overlapping supports.
+        pairs = [[(i, j) for i in range(n) for j in range(n)
+                  if self._active_sets[o, i] and self._active_sets[o, j]
+                  and (i == j or (a[o, i] < c[o, j] and a[o, j] < c[o, i]))] for o in range(3)]
+        width = max(len(x) for x in static)
+        n_pairs = max(len(p) for p in pairs)
+        # Pad each output to the same length by repeating a point (zero-width segments add nothing)
+        self._static_x = np.array([x + [x[0]] * (width - len(x)) for x in static])
+        pairs = [p + [p[0]] * (n_pairs - len(p)) for p in pairs]
+        pair_i = np.array([[i for i, _ in p] * 2 for p in pairs])
+        pair_j = np.array([[j for _, j in p] for p in pairs])
+        rows = np.arange(3)[:, None]
+        self._pair_index = rows * n + pair_i  # Flat indices into levels
+        self._pair_base = np.concatenate((a[rows, pair_j], c[rows, pair_j]), axis=1)
+        self._pair_slope = np.concatenate((rise[rows, pair_j], -fall[rows, pair_j]), axis=1)
+
+    def _rule_strengths(self, e_degrees, ce_degrees):
+        """Firing strength min(E degree, CE degree) of all 49 antecedent pairs (flat, E-major)."""
+        e = np.array([e_degrees[term] for term in self._e_terms])
+        ce = np.array([ce_degrees[term] for term in self._ce_terms])
+        return np.minimum.outer(e, ce).ravel()
+
+    def _rule_levels(self, e_degrees, ce_degrees):
+        """
+        Clip level of every output set (3 x 7 array): the max over the rules firing the set
+        of min(E degree, CE degree). Equivalent to _fuzzy_inference without sampled outputs.
+        """
+        return (self._rule_fires * self._rule_strengths(e_degrees, ce_degrees)).max(axis=2)
+
+    def sugeno_from_mamdani(self):
+        """
+        Convert the Mamdani output sets to zero-order Sugeno singletons: each term maps to
+        the centroid of its (unclipped) triangle. Zero-width sets (e.g. Kp 'PM') map to their
+        vertex, but like under Mamdani inference (where they add no area) rules concluding
+        them carry no weight for that output, see _init_sugeno_tables().
+
+        Returns:
+            dict: {'Kp': {term: value}, 'Ki': {...}, 'Kd': {...}}, the format of self.singletons.
+        """
+        singletons = {}
+        for name, params in (('Kp', self.kp_params), ('Ki', self.ki_params), ('Kd', self.kd_params)):
+            singletons[name] = {term: (a + b + c) / 3.0 if c > a else float(b) for term, (a, b, c) in params.items()}
+        return singletons
+
+    def _init_sugeno_tables(self):
+        """
+        Per-rule singleton gains stacked over per-rule weights (6 x 49, same rule order as
+        _rule_strengths), so one product gives both numerators and denominators. Antecedent pairs without a rule, and rules whose consequent for an output is a
+        zero-width set (no area under Mamdani inference, see _active_sets), carry no weight
+        for that output. Must be called again after self.singletons, the rule base or the
+        output sets change (after _init_analytic_tables).
+        """
+        n_ce = len(self._ce_terms)
+        table = np.zeros((6, len(self._e_terms) * n_ce))  # Rows: Kp, Ki, Kd singletons, then weights
+        for (e_term, ce_term), outputs in self.rule_base.items():
+            k = self._e_terms.index(e_term) * n_ce + self._ce_terms.index(ce_term)
+            for o, (name, term) in enumerate(zip(('Kp', 'Ki', 'Kd'), outputs)):
+                if self._active_sets[o, self.linguistic_terms.index(term)]:
+                    table[o, k] = self.singletons[name][term]
+                    table[3 + o, k] = 1.0
+        self._sugeno_table = table
+
+    def _sugeno_gains(self, strengths):
+        """
+        Kp, Ki, Kd as the strength-weighted average of the rule singletons (an output is 0 if
+        no weighted rule fires, as the Mamdani centroid of an empty set).
+        """
+        kp, ki, kd, kp_total, ki_total, kd_total = (self._sugeno_table @ strengths).tolist()
+        return (kp / kp_total if kp_total > 0 else 0.0,
+                ki / ki_total if ki_total > 0 else 0.0,
+                kd / kd_total if kd_total > 0 else 0.0)
+
+    # Variable name -> (parameter dict, sampled MF dict, universe) attribute names
+    MF_VARIABLES = {
+        'E': ('e_params', 'e_mf', 'error_universe'),
+        'CE': ('ce_params', 'ce_mf', 'ce_universe'),
+        'Kp': ('kp_params', 'kp_mf', 'kp_universe'),
+        'Ki': ('ki_params', 'ki_mf', 'ki_universe'),
+        'Kd': ('kd_params', 'kd_mf', 'kd_universe'),
+    }
+
+    def set_membership(self, variable, term, params):
+        """
+        Change the (a, b, c) breakpoints of one membership function of the live controller
+        and rebuild the derived tables. For output variables the Sugeno singleton of the
+        term is re-converted from the new triangle.
+
+        Returns:
+            tuple: The previous (a, b, c).
+        """
+        if variable not in self.MF_VARIABLES:
+            raise ValueError(f"variable must be one of {tuple(self.MF_VARIABLES)}")
+        params_attr, mf_attr, universe_attr = self.MF_VARIABLES[variable]
+        table = getattr(self, params_attr)
+        if term not in table:
+            raise ValueError(f"unknown term {term!r}")
+        a, b, c = (float(v) for v in params)
+        universe = getattr(self, universe_attr)
+        if not universe[0] <= a <= b <= c <= universe[-1]:
+            raise ValueError(f"need {universe[0]:g} <= a <= b <= c <= {universe[-1]:g}, got ({a:g}, {b:g}, {c:g})")
+        previous = table[term]
+        table[term] = (a, b, c)
+        getattr(self, mf_attr)[term] = self._triangular_mf(universe, a, b, c)
+        if variable in self.singletons:
+            self.singletons[variable][term] = self.sugeno_from_mamdani()[variable][term]
+        self._init_analytic_tables()
+        self._init_sugeno_tables()
+        return previous
+
+    def set_rule(self, e_term, ce_term, outputs):
+        """
+        Set the consequents (Kp, Ki, Kd terms) of rule (E, CE) on the live controller.
+
+        Returns:
+            tuple: The previous consequents (None if the rule did not exist).
+        """
+        outputs = tuple(outputs)
+        terms = self.linguistic_terms
+        if e_term not in terms or ce_term not in terms or len(outputs) != 3 or any(t not in terms for t in outputs):
+            raise ValueError(f"rule terms must be in {terms}")
+        previous = self.rule_base.get((e_term, ce_term))
+        self.rule_base[(e_term, ce_term)] = outputs
+        self._init_analytic_tables()
+        self._init_sugeno_tables()
+        return previous
+
+    def reset_configuration(self):
+        """Restore the default membership functions, rule base and singletons."""
+        self._init_membership_functions()
+        self._init_rule_base()
+        self._init_analytic_tables()
+        self.singletons = self.sugeno_from_mamdani()
+        self._init_sugeno_tables()
+
+    _OPTION_ATTRS = ('defuzzification', 'inference', 'set_point', 'output_min', 'output_max', '_last_error',
+                     '_last_output', '_integral', '_last_gains')
+
+    def config_tables(self):
+        """
+        The configuration (membership functions, rule base, singletons and every derived
+        table) as a dict of attribute name -> value, for from_tables(). Values are not copied.
+        """
+        return {name: value for name, value in vars(self).items() if name not in self._OPTION_ATTRS}
+
+    @classmethod
+    def from_tables(cls, tables, set_point, output_limits=(0, 300), defuzzification='analytic', inference='mamdani'):
+        """
+        Build a controller from config_tables() output without recomputing any table.
+        NumPy arrays are shared with `tables` and may be read-only (e.g. views into shared
+        memory): the editing methods replace arrays instead of writing into them. Dicts
+        and lists are copied so that edits stay local to the new controller.
+        """
+        def copy_containers(value):
+            if isinstance(value, dict):
+                return {key: copy_containers(v) for key, v in value.items()}
+            if isinstance(value, list):
+                return [copy_containers(v) for v in value]
+            return value
+
+        controller = cls.__new__(cls)
+        for name, value in tables.items():
+            setattr(controller, name, copy_containers(value))
+        controller._init_options(set_point, output_limits, defuzzification, inference)
+        return controller
+
+    def membership_degrees(self, variable, values):
+        """
+        Degrees of `values` in every term of input variable 'E' or 'CE' (N x 7, in the
+        rule order used by gains_from_strengths). Same interpolation as _fuzzify.
+        """
+        _, mf_attr, universe_attr = self.MF_VARIABLES[variable]
+        mfs, universe = getattr(self, mf_attr), getattr(self, universe_attr)
+        terms = self._e_terms if variable == 'E' else self._ce_terms
+        return np.stack([np.interp(values, universe, mfs[term]) for term in terms], axis=1)
+
+    def gains_from_strengths(self, strengths):
+        """
+        Kp, Ki, Kd (N x 3) for a batch of rule strength vectors (N x 49, E-major as in
+        _rule_strengths), using this controller's inference and defuzzification method.
+        """
+        strengths = np.asarray(strengths, dtype=float)
+        if self.inference == 'sugeno':
+            sums = strengths @ self._sugeno_table.T
+            gains, total = sums[:, :3], sums[:, 3:]
+            return np.divide(gains, total, out=np.zeros_like(gains), where=total > 0)
+        levels = (self._rule_fires[None] * strengths[:, None, None, :]).max(axis=3)
+        if self.defuzzification == 'analytic':
+            return self._centroids(levels)
+        # Sampled: max-min aggregation on the 101-point universes, then discrete centroids
+        result = np.zeros(levels.shape[:2])
+        for o, (mfs, universe) in enumerate(((self.kp_mf, self.kp_universe), (self.ki_mf, self.ki_universe),
+                                             (self.kd_mf, self.kd_universe))):
+            stacked = np.stack([mfs[term] for term in self.linguistic_terms])
+            aggregated = np.minimum(levels[:, o, :, None], stacked).max(axis=1)
+            total = aggregated.sum(axis=1)
+            result[:, o] = np.divide(aggregated @ universe, total, out=np.zeros_like(total), where=total > 0)
+        return result
+
+    def _defuzzify_analytic(self, levels):
+        """
+        Exact centroids (Kp, Ki, Kd) of the union (max) of output triangles clipped at
+        `levels` (3 x 7), using piecewise-linear area and moment formulas.
+
+        The aggregated membership is linear between consecutive breakpoints (vertices,
+        clip points and edge crossings), so evaluating it at the breakpoints and summing
+        trapezoid areas and first moments is exact. Outputs with no active set give 0,
+        as _defuzzify does.
+        """
+        levels = np.where(self._active_sets, levels, 0.0)
+        x = np.concatenate((self._static_x, self._pair_base + levels.take(self._pair_index) * self._pair_slope),
+                           axis=1)
+        x.sort(axis=1)
+        area, moment = self._area_moment(x, levels)
+        return tuple(m / (3.0 * s) if s > 0 else 0.0 for m, s in zip(moment.tolist(), area.tolist()))
+
+    def _centroids(self, levels):
+        """Batched _defuzzify_analytic: levels (N x 3 x 7) -> centroids (N x 3)."""
+        levels = np.where(self._active_sets, levels, 0.0)
+        dynamic = self._pair_base + levels.reshape(len(levels), -1)[:, self._pair_index] * self._pair_slope
+        x = np.concatenate((np.broadcast_to(self._static_x, (len(levels),) + self._static_x.shape), dynamic), axis=2)
+        x.sort(axis=2)
+        area, moment = self._area_moment(x, levels)
+        return np.divide(moment, 3.0 * area, out=np.zeros_like(area), where=area > 0)
+
+    def _area_moment(self, x, levels):
+        """2 x area and 6 x first moment of the aggregated sets, given sorted breakpoints x (..., 3, K)."""
+        a, c, inv_rise, inv_fall = self._tri
+        points = x[..., None, :]
+        mu = (points - a) * inv_rise
+        np.minimum(mu, (c - points) * inv_fall, out=mu)
+        np.minimum(mu, levels[..., None], out=mu)
+        y = np.maximum(mu.max(axis=-2), 0.0)
+
+        # Per segment: area w (y0 + y1) / 2, first moment w (x0 (2 y0 + y1) + x1 (y0 + 2 y1)) / 6
+        # = w ((x0 + x1)(y0 + y1) + x0 y0 + x1 y1) / 6
+        width = np.diff(x, axis=-1)
+        y_sum = y[..., :-1] + y[..., 1:]
+        xy = x * y
+        area = (width * y_sum).sum(axis=-1)
+        moment = (width * ((x[..., :-1] + x[..., 1:]) * y_sum + xy[..., :-1] + xy[..., 1:])).sum(axis=-1)
+        return area, moment
+
+    def centroid_reference(self, levels, points=200001):
+        """
+        Fine-grid reference for _defuzzify_analytic (trapezoidal integration on `points`
+        samples of each output universe). For validation only.
+        """
+        result = []
+        for o, (params, universe) in enumerate(((self.kp_params, self.kp_universe),
+                                                (self.ki_params, self.ki_universe),
+                                                (self.kd_params, self.kd_universe))):
+            x = np.linspace(universe[0], universe[-1], points)
+            mu = np.zeros_like(x)
+            for t, term in enumerate(self.linguistic_terms):
+                a, b, c = params[term]
+                if a == c:
+                    continue
+                rise = np.where(x >= a, 1.0, 0.0) if b == a else (x - a) / (b - a)
+                fall = np.where(x <= c, 1.0, 0.0) if c == b else (c - x) / (c - b)
+                mu = np.maximum(mu, np.minimum(levels[o, t], np.clip(np.minimum(rise, fall), 0.0, 1.0)))
+            area = np.trapezoid(mu, x) if hasattr(np, 'trapezoid') else np.trapz(mu, x)
+            moment = np.trapezoid(mu * x, x) if hasattr(np, 'trapezoid') else np.trapz(mu * x, x)
+            result.append(moment / area if area > 0 else 0.0)
+        return tuple(result)
     
     def update(self, process_variable, dt):
         """
@@ -310,13 +677,20 @@ class FuzzyPIDController:
         e_degrees = self._fuzzify(error, self.error_universe, self.e_mf)
         ce_degrees = self._fuzzify(change_of_error, self.ce_universe, self.ce_mf)
         
-        # Step 2: Fuzzy Inference
-        kp_fuzzy, ki_fuzzy, kd_fuzzy = self._fuzzy_inference(e_degrees, ce_degrees)
-        
-        # Step 3: Defuzzification
-        Kp = self._defuzzify(kp_fuzzy, self.kp_universe)
-        Ki = self._defuzzify(ki_fuzzy, self.ki_universe)
-        Kd = self._defuzzify(kd_fuzzy, self.kd_universe)
+        if self.inference == 'sugeno':
+            # Steps 2-3: weighted average of singleton consequents
+            Kp, Ki, Kd = self._sugeno_gains(self._rule_strengths(e_degrees, ce_degrees))
+        elif self.defuzzification == 'analytic':
+            # Steps 2-3: clip levels per output set, then exact centroids
+            Kp, Ki, Kd = self._defuzzify_analytic(self._rule_levels(e_degrees, ce_degrees))
+        else:
+            # Step 2: Fuzzy Inference
+            kp_fuzzy, ki_fuzzy, kd_fuzzy = self._fuzzy_inference(e_degrees, ce_degrees)
+            
+            # Step 3: Defuzzification
+            Kp = self._defuzzify(kp_fuzzy, self.kp_universe)
+            Ki = self._defuzzify(ki_fuzzy, self.ki_universe)
+            Kd = self._defuzzify(kd_fuzzy, self.kd_universe)
         
         # Step 4: PID computation with dynamic gains
         # Proportional term
@@ -336,6 +710,7 @@ class FuzzyPIDController:
         
         # Update state
         self._last_error = error
+        self._last_gains = (Kp, Ki, Kd)
         self._last_output = np.clip(output, self.output_min, self.output_max)
         
         return self._last_output
@@ -352,6 +727,32 @@ class FuzzyPIDController:
         self._last_error = 0
         self._last_output = 0
         self._integral = 0
+        self._last_gains = (0.0, 0.0, 0.0)
+
+    def snapshot(self):
+        """
+        Return the runtime state (integral, last error/output, last gains) and the
+        inference/defuzzification modes as a dict.
+        """
+        state = {name: float(getattr(self, name)) for name in self._STATE_ATTRS}
+        state['_last_gains'] = [float(g) for g in self._last_gains]
+        state['inference'] = self.inference
+        state['defuzzification'] = self.defuzzification
+        return state
+
+    def restore(self, state):
+        """Restore runtime state produced by snapshot() (modes too, if recorded)."""
+        inference = state.get('inference', self.inference)
+        defuzzification = state.get('defuzzification', self.defuzzification)
+        if inference not in self.INFERENCE_METHODS:
+            raise ValueError(f"inference must be one of {self.INFERENCE_METHODS}")
+        if defuzzification not in self.DEFUZZIFICATION_METHODS:
+            raise ValueError(f"defuzzification must be one of {self.DEFUZZIFICATION_METHODS}")
+        self.inference = inference
+        self.defuzzification = defuzzification
+        for name in self._STATE_ATTRS:
+            setattr(self, name, state[name])
+        self._last_gains = tuple(state['_last_gains'])
 
 
 # --- LỚP HỆ THỐNG BỒN NƯỚC ĐÔI ---
@@ -429,6 +830,17 @@ class CoupledTankSystem:
         self.H1 = max(0, min(self.H1, self.max_height))
         self.H2 = max(0, min(self.H2, self.max_height))
 
+    def derivatives(self, H1, H2, Qi1, Qi2=0.0):
+        """
+        Vế phải (dH1/dt, dH2/dt) của phương trình hệ bồn tại mực nước (H1, H2), không đổi trạng thái.
+        Cùng phương trình với update() (không gồm nhiễu); dùng cho các bộ tích phân bậc cao.
+        """
+        Qo1 = 0.0 if self.valve1_open < 1e-3 else (self.valve1_open / 100.0) * self.alpha1 * math.sqrt(max(0, H1))
+        Qo2 = 0.0 if self.valve2_open < 1e-3 else (self.valve2_open / 100.0) * self.alpha2 * math.sqrt(max(0, H2))
+        delta_H = H1 - H2
+        Qo3 = self.alpha3 * math.sqrt(delta_H) if delta_H > 0 else -self.alpha3 * math.sqrt(-delta_H)
+        return (Qi1 - Qo1 - Qo3) / self.A1, (Qi2 - Qo2 + Qo3) / self.A2
+
     def set_valve_openings(self, valve1_open, valve2_open):
         """
         Đặt độ mở của các van.
@@ -450,6 +862,10 @@ class CoupledTankSystem:
         self.disturbance_active = True
         self.disturbance_start_time = current_time
 
+    def stop_disturbance(self):
+        """Tắt nhiễu."""
+        self.disturbance_active = False
+
     def get_levels(self):
         """Trả về mực nước hiện tại."""
         return self.H1, self.H2
@@ -460,11 +876,1088 @@ class CoupledTankSystem:
         self.H2 = 0.0
         self.disturbance_active = False
 
+    _STATE_ATTRS = ('H1', 'H2', 'valve1_open', 'valve2_open', 'disturbance_active',
+                    'disturbance_start_time', 'disturbance_duration', 'disturbance_flow')
+
+    def snapshot(self):
+        """Trạng thái hiện tại (mực nước, van, nhiễu) dưới dạng dict."""
+        return {name: getattr(self, name) for name in self._STATE_ATTRS}
+
+    def restore(self, state):
+        """Khôi phục trạng thái từ snapshot()."""
+        for name in self._STATE_ATTRS:
+            setattr(self, name, state[name])
+
+    def steady_state(self, H2):
+        """
+        Điểm làm việc xác lập với mực nước bồn 2 bằng H2 và độ mở van hiện tại.
+
+        Returns:
+            tuple: (H1, H2, Qi1) với Qi1 là lưu lượng vào cân bằng (cm³/s).
+        """
+        H2 = max(H2, 0.5)  # Tránh điểm kỳ dị của sqrt tại H = 0
+        # Xác lập: Qo2 = Qo3 => (v2 * alpha2)^2 * H2 = alpha3^2 * (H1 - H2)
+        ratio = (self.valve2_open / 100.0) * self.alpha2 / self.alpha3
+        H1 = H2 * (1.0 + ratio * ratio)
+        Qo1 = (self.valve1_open / 100.0) * self.alpha1 * math.sqrt(H1)
+        Qo2 = (self.valve2_open / 100.0) * self.alpha2 * math.sqrt(H2)
+        return H1, H2, Qo1 + Qo2
+
+    def linearize(self, H1, H2):
+        """
+        Ma trận Jacobian (A, B) của mô hình liên tục dH/dt = f(H, Qi1) tại (H1, H2).
+        Trạng thái [H1, H2], đầu vào Qi1.
+        """
+        eps = 1e-3
+        k1 = (self.valve1_open / 100.0) * self.alpha1 / (2.0 * math.sqrt(max(H1, eps)))
+        k2 = (self.valve2_open / 100.0) * self.alpha2 / (2.0 * math.sqrt(max(H2, eps)))
+        k3 = self.alpha3 / (2.0 * math.sqrt(max(abs(H1 - H2), eps)))
+        A = np.array([[-(k1 + k3) / self.A1, k3 / self.A1],
+                      [k3 / self.A2, -(k2 + k3) / self.A2]])
+        B = np.array([[1.0 / self.A1], [0.0]])
+        return A, B
+
+
+# --- LỚP BỘ ĐIỀU KHIỂN DỰ BÁO MÔ HÌNH (MPC) ---
+def _expm(M):
+    """Lũy thừa ma trận e^M (Taylor với scaling and squaring), đủ chính xác cho ma trận nhỏ."""
+    norm = np.abs(M).sum(axis=1).max()
+    squarings = max(0, int(math.ceil(math.log2(norm))) + 1) if norm > 0.5 else 0
+    A = M / (1 << squarings)
+    result = np.eye(len(M))
+    term = np.eye(len(M))
+    for k in range(1, 16):
+        term = term @ A / k
+        result = result + term
+    for _ in range(squarings):
+        result = result @ result
+    return result
+
+
+class MPCController:
+    """
+    Bộ điều khiển dự báo mô hình (MPC) cho hệ bồn nước đôi, chỉ dùng NumPy.
+
+    - Mô hình: tuyến tính hóa CoupledTankSystem quanh điểm làm việc (trạng thái xác lập ứng với
+      setpoint và độ mở van hiện tại), rời rạc hóa ZOH với chu kỳ lấy mẫu sample_time.
+    - Ma trận dự báo và ma trận QP rút gọn được tính một lần cho mỗi điểm làm việc và lưu
+      trong bộ nhớ đệm LRU (khóa: setpoint, độ mở van, chu kỳ lấy mẫu).
+    - Mỗi chu kỳ giải bài toán QP ràng buộc hộp output_limits bằng gradient chiếu tăng tốc
+      (FISTA), khởi động ấm từ kế hoạch trước, dừng khi hội tụ hoặc hết ngân sách thời gian.
+    - Chỉ đo được H2: H1 và nhiễu lưu lượng vào được ước lượng bằng bộ quan sát trên mô hình
+      phi tuyến (nhiễu ước lượng cho tác động tích phân, không có sai số xác lập).
+
+    Thống kê: last_solve_ns, last_iterations, solves, budget_overruns; nếu gán profiler
+    (StageProfiler), thời gian giải QP được ghi vào giai đoạn 'MPCController.qp'.
+    """
+    controller_type = 'mpc'
+    _STATE_ATTRS = ('set_point', '_last_output', '_last_error', '_integral', '_since_solve')
+    CACHE_SIZE = 64
+
+    def __init__(self, set_point, output_limits=(0, 300), plant=None, sample_time=1.0,
+                 prediction_horizon=40, control_horizon=8, output_weight=1.0, move_weight=1e-3,
+                 time_budget_ms=2.0, max_iterations=200, observer_gains=(0.2, 0.5), disturbance_gain=0.5):
+        self.set_point = set_point
+        self.output_min, self.output_max = output_limits
+        self.plant = plant if plant is not None else CoupledTankSystem()  # Chỉ đọc tham số và độ mở van
+        self.sample_time = sample_time
+        self.prediction_horizon = prediction_horizon
+        self.control_horizon = control_horizon
+        self.output_weight = output_weight
+        self.move_weight = move_weight
+        self.time_budget_ns = int(time_budget_ms * 1e6)
+        self.max_iterations = max_iterations
+        self.observer_gains = observer_gains
+        self.disturbance_gain = disturbance_gain
+        self.profiler = None
+
+        self._cache = {}  # Khóa điểm làm việc -> ma trận; dict giữ thứ tự chèn để loại LRU
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.solves = 0
+        self.budget_overruns = 0
+        self.last_solve_ns = 0
+        self.last_iterations = 0
+        self.reset()
+
+    # --- Mô hình ---
+    def _flows(self, H1, H2):
+        p = self.plant
+        Qo1 = (p.valve1_open / 100.0) * p.alpha1 * math.sqrt(max(H1, 0.0))
+        Qo2 = (p.valve2_open / 100.0) * p.alpha2 * math.sqrt(max(H2, 0.0))
+        delta_H = H1 - H2
+        Qo3 = math.copysign(p.alpha3 * math.sqrt(abs(delta_H)), delta_H)
+        return Qo1, Qo2, Qo3
+
+    def _matrices(self, set_point):
+        """Ma trận dự báo và QP rút gọn cho điểm làm việc hiện tại (có bộ nhớ đệm LRU)."""
+        p = self.plant
+        key = (round(set_point, 1), round(p.valve1_open, 1), round(p.valve2_open, 1), self.sample_time)
+        entry = self._cache.pop(key, None)
+        if entry is not None:
+            self.cache_hits += 1
+            self._cache[key] = entry  # Đưa về cuối (mới dùng gần nhất)
+            return entry
+        self.cache_misses += 1
+
+        H1e, H2e, ue = p.steady_state(set_point)
+        Ac, Bc = p.linearize(H1e, H2e)
+        # Rời rạc hóa ZOH: exp([[A, B], [0, 0]] * Ts)
+        M = np.zeros((3, 3))
+        M[:2, :2] = Ac
+        M[:2, 2:] = Bc
+        E = _expm(M * self.sample_time)
+        Ad, Bd = E[:2, :2], E[:2, 2]
+
+        Np, Nc = self.prediction_horizon, self.control_horizon
+        C = np.array([0.0, 1.0])
+        # F: đáp ứng tự do của H2 theo độ lệch trạng thái ban đầu; G: đáp ứng theo từng bước vào
+        F = np.empty((Np, 2))
+        markov = np.empty(Np)  # C Ad^k Bd
+        Ak = np.eye(2)
+        for k in range(Np):
+            markov[k] = C @ Ak @ Bd
+            Ak = Ad @ Ak
+            F[k] = C @ Ak
+        G = np.zeros((Np, Np))
+        for k in range(Np):
+            G[k, :k + 1] = markov[k::-1]
+        # Chặn bước điều khiển: đầu vào giữ nguyên sau control_horizon
+        blocking = np.zeros((Np, Nc))
+        blocking[np.arange(Np), np.minimum(np.arange(Np), Nc - 1)] = 1.0
+        S = G @ blocking
+        # Phạt thay đổi đầu vào: D U - e1 u_prev
+        D = np.eye(Nc) - np.eye(Nc, k=-1)
+        q, r = self.output_weight, self.move_weight
+        hessian = q * S.T @ S + r * D.T @ D
+        entry = {
+            'x_eq': np.array([H1e, H2e]),
+            'u_eq': ue,
+            'F': F,
+            'S1': S.sum(axis=1),
+            'qST': q * S.T,
+            'r_D0': r * D[0],  # Hàng D^T e1 (= cột đầu của D^T)
+            'hessian': hessian,
+            'hessian_inv': np.linalg.inv(hessian),
+            'step': 1.0 / np.linalg.eigvalsh(hessian).max(),
+        }
+        self._cache[key] = entry
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.pop(next(iter(self._cache)))
+        return entry
+
+    # --- Bộ quan sát ---
+    def _observe(self, measured_H2, dt):
+        """Dự báo trạng thái bằng mô hình phi tuyến với đầu vào vừa áp dụng, rồi hiệu chỉnh theo H2 đo."""
+        p = self.plant
+        H1, H2 = self._x_hat
+        Qo1, Qo2, Qo3 = self._flows(H1, H2)
+        inflow = self._last_output + self._integral
+        H1 = min(max(H1 + (inflow - Qo1 - Qo3) / p.A1 * dt, 0.0), p.max_height)
+        H2 = min(max(H2 + (Qo3 - Qo2) / p.A2 * dt, 0.0), p.max_height)
+        innovation = measured_H2 - H2
+        l1, l2 = self.observer_gains
+        self._x_hat = np.array([H1 + l1 * innovation, H2 + l2 * innovation])
+        # Nhiễu lưu lượng vào (rò rỉ, sai lệch mô hình) ước lượng như một khâu tích phân
+        self._integral += self.disturbance_gain * p.A2 * innovation * dt
+
+    # --- Giải QP ---
+    def _solve(self):
+        m = self._matrices(self.set_point)
+        # Nhiễu ước lượng dịch chuyển lưu lượng cân bằng cần thiết
+        u_eq = m['u_eq'] - self._integral
+        c = m['x_eq'][1] + m['F'] @ (self._x_hat - m['x_eq']) - u_eq * m['S1']
+        gradient_offset = m['qST'] @ (c - self.set_point) - m['r_D0'] * self._last_output
+
+        clock = time.perf_counter_ns
+        t0 = clock()
+        # Nghiệm không ràng buộc (một phép nhân ma trận); nếu nằm trong giới hạn thì là nghiệm QP
+        U = -m['hessian_inv'] @ gradient_offset
+        iterations = 0
+        if U.min() < self.output_min or U.max() > self.output_max:
+            U, iterations = self._projected_gradient(m, gradient_offset, t0 + self.time_budget_ns)
+        elapsed = clock() - t0
+
+        self._plan = U
+        self.solves += 1
+        self.last_solve_ns = elapsed
+        self.last_iterations = iterations
+        if self.profiler is not None:
+            self.profiler.record('MPCController.qp', elapsed)
+        return U[0]
+
+    def _projected_gradient(self, m, gradient_offset, deadline):
+        """FISTA với phép chiếu lên hộp [output_min, output_max], dừng khi hội tụ hoặc quá deadline (ns)."""
+        lo, hi = self.output_min, self.output_max
+        hessian, step = m['hessian'], m['step']
+        clock = time.perf_counter_ns
+        # Khởi động ấm: kế hoạch trước dịch đi một bước
+        U = np.clip(np.append(self._plan[1:], self._plan[-1]), lo, hi)
+        Y = U.copy()
+        t_k = 1.0
+        iterations = 0
+        while iterations < self.max_iterations:
+            iterations += 1
+            U_next = np.clip(Y - step * (hessian @ Y + gradient_offset), lo, hi)
+            converged = np.abs(U_next - U).max() < 1e-3
+            t_next = 0.5 * (1.0 + math.sqrt(1.0 + 4.0 * t_k * t_k))
+            Y = U_next + ((t_k - 1.0) / t_next) * (U_next - U)
+            U, t_k = U_next, t_next
+            if converged:
+                break
+            if clock() > deadline:
+                self.budget_overruns += 1
+                break
+        return U, iterations
+
+    # --- Giao diện bộ điều khiển ---
+    def update(self, process_variable, dt):
+        """
+        Tính lưu lượng Qi1. QP được giải mỗi sample_time; giữa các lần giải, đầu vào được giữ nguyên.
+
+        Args:
+            process_variable (float): Mực nước H2 đo được.
+            dt (float): Bước thời gian kể từ lần gọi trước.
+        """
+        if dt <= 0:
+            return self._last_output
+        self._observe(process_variable, dt)
+        self._last_error = self.set_point - process_variable
+        self._since_solve += dt
+        if self._since_solve >= self.sample_time - 1e-9 or not self._solved:
+            self._since_solve = 0.0
+            self._solved = True
+            self._last_output = float(self._solve())
+        return self._last_output
+
+    def set_setpoint(self, set_point):
+        """Đổi setpoint và giải lại ngay ở lần cập nhật kế tiếp (giữ trạng thái bộ quan sát)."""
+        self.set_point = set_point
+        self._solved = False
+
+    def reset(self):
+        self._x_hat = np.zeros(2)
+        self._plan = np.zeros(self.control_horizon)
+        self._last_output = 0.0
+        self._last_error = 0.0
+        self._integral = 0.0  # Nhiễu lưu lượng vào ước lượng (cm³/s)
+        self._since_solve = 0.0
+        self._solved = False
+
+    def snapshot(self):
+        state = {name: float(getattr(self, name)) for name in self._STATE_ATTRS}
+        state['_x_hat'] = self._x_hat.tolist()
+        state['_plan'] = self._plan.tolist()
+        state['_solved'] = self._solved
+        return state
+
+    def restore(self, state):
+        for name in self._STATE_ATTRS:
+            setattr(self, name, state[name])
+        self._x_hat = np.array(state['_x_hat'])
+        self._plan = np.array(state['_plan'])
+        self._solved = state['_solved']
+
+
+# --- PID LẬP LỊCH HỆ SỐ (GAIN SCHEDULING) ---
+def simc_pid_gains(plant, set_point, tau_c):
+    """
+    Hệ số PID (dạng song song Kp, Ki, Kd) theo quy tắc SIMC của Skogestad cho mô hình tuyến
+    tính hóa bậc hai của hệ bồn tại điểm làm việc H2 = set_point với độ mở van hiện tại.
+
+    Args:
+        plant (CoupledTankSystem): Hệ bồn (tham số và độ mở van).
+        set_point (float): Mực nước H2 của điểm làm việc (cm).
+        tau_c (float): Hằng số thời gian vòng kín mong muốn (s); nhỏ hơn thì mạnh hơn.
+    """
+    H1, H2, _ = plant.steady_state(set_point)
+    A, B = plant.linearize(H1, H2)
+    gain = -np.linalg.solve(A, B)[1, 0]  # Hệ số khuếch đại tĩnh H2/Qi1
+    tau1, tau2 = sorted(-1.0 / np.linalg.eigvals(A).real, reverse=True)
+    Kc = tau1 / (gain * tau_c)
+    tau_i = min(tau1, 4.0 * tau_c)
+    # Dạng nối tiếp Kc(1 + 1/(tau_i s))(1 + tau2 s) đổi sang dạng song song
+    return Kc * (1.0 + tau2 / tau_i), Kc / tau_i, Kc * tau2
+
+
+class GainScheduleTable:
+    """
+    Bảng hệ số PID trên lưới đều (setpoint x độ mở van 1 x độ mở van 2), nội suy tam tuyến tính.
+    Bảng được tinh chỉnh ngoại tuyến (xem gain_schedule.py) và lưu dạng JSON.
+    """
+    def __init__(self, setpoints, valve1, valve2, gains, meta=None):
+        self.axes = [np.asarray(axis, dtype=float) for axis in (setpoints, valve1, valve2)]
+        self.gains = np.asarray(gains, dtype=float)
+        if self.gains.shape != tuple(len(axis) for axis in self.axes) + (3,):
+            raise ValueError("Kích thước bảng hệ số không khớp với các trục lưới.")
+        for axis in self.axes:
+            if len(axis) < 2 or not np.allclose(np.diff(axis), axis[1] - axis[0]):
+                raise ValueError("Mỗi trục của bảng hệ số phải là lưới đều có ít nhất 2 điểm.")
+        self._origin = [axis[0] for axis in self.axes]
+        self._step = [axis[1] - axis[0] for axis in self.axes]
+        self.meta = meta or {}
+
+    def lookup(self, set_point, valve1_open, valve2_open):
+        """Nội suy (Kp, Ki, Kd) tại điểm làm việc; ngoài lưới thì lấy giá trị ở biên."""
+        index = []
+        weights = []
+        for value, origin, step, axis in zip((set_point, valve1_open, valve2_open), self._origin, self._step, self.axes):
+            pos = min(max((value - origin) / step, 0.0), len(axis) - 1.0)
+            i = min(int(pos), len(axis) - 2)
+            index.append(i)
+            weights.append((1.0 - (pos - i), pos - i))
+        i, j, k = index
+        block = self.gains[i:i + 2, j:j + 2, k:k + 2]
+        w = np.multiply.outer(np.multiply.outer(weights[0], weights[1]), weights[2])
+        Kp, Ki, Kd = np.tensordot(w, block, 3)
+        return float(Kp), float(Ki), float(Kd)
+
+    def to_dict(self):
+        return {
+            'setpoints': self.axes[0].tolist(),
+            'valve1': self.axes[1].tolist(),
+            'valve2': self.axes[2].tolist(),
+            'gains': self.gains.tolist(),
+            'meta': self.meta,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['setpoints'], data['valve1'], data['valve2'], data['gains'], data.get('meta'))
+
+    def save(self, filepath):
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=1, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def from_simc(cls, setpoints, valve1, valve2, tau_c=2.0):
+        """
+        Bảng chỉ dùng quy tắc SIMC (không tinh chỉnh bằng mô phỏng); đủ nhanh để dựng lúc chạy.
+        Trục van nên bắt đầu từ trên 0: khi cả hai van đóng, mô hình là khâu tích phân thuần.
+        """
+        plant = CoupledTankSystem()
+        gains = np.empty((len(setpoints), len(valve1), len(valve2), 3))
+        for a, sp in enumerate(setpoints):
+            for b, v1 in enumerate(valve1):
+                for c, v2 in enumerate(valve2):
+                    plant.set_valve_openings(v1, v2)
+                    gains[a, b, c] = simc_pid_gains(plant, sp, tau_c)
+        return cls(setpoints, valve1, valve2, gains, {'method': 'simc', 'tau_c': tau_c})
+
+
+DEFAULT_GAIN_SCHEDULE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gain_schedule.json')
+_default_gain_schedule = None
+
+
+def default_gain_schedule():
+    """Bảng hệ số mặc định: gain_schedule.json nếu có, nếu không thì bảng SIMC dựng tại chỗ."""
+    global _default_gain_schedule
+    if _default_gain_schedule is None:
+        try:
+            _default_gain_schedule = GainScheduleTable.load(DEFAULT_GAIN_SCHEDULE_PATH)
+        except (OSError, ValueError, KeyError):
+            _default_gain_schedule = GainScheduleTable.from_simc(
+                np.arange(5.0, 40.0, 5.0), np.linspace(20, 100, 5), np.linspace(20, 100, 5))
+    return _default_gain_schedule
+
+
+class GainScheduledPIDController(PIDController):
+    """
+    PID với hệ số tra từ bảng theo điểm làm việc (setpoint, độ mở hai van).
+
+    Việc tra bảng chỉ xảy ra khi setpoint hoặc độ mở van thay đổi; mỗi bước còn lại chi phí
+    như PIDController. Đổi hệ số không đặt lại tích phân nên chuyển điểm làm việc không bị giật.
+    set_gains() ghi đè hệ số thủ công cho tới lần đổi điểm làm việc kế tiếp.
+    """
+    controller_type = 'scheduled'
+
+    def __init__(self, set_point, table=None, plant=None, output_limits=(0, 300)):
+        self.table = table if table is not None else default_gain_schedule()
+        self.plant = plant if plant is not None else CoupledTankSystem()  # Chỉ đọc độ mở van
+        self._schedule_key = None
+        super().__init__(0.0, 0.0, 0.0, set_point, output_limits)
+        self._reschedule()
+
+    def _reschedule(self):
+        key = (self.set_point, self.plant.valve1_open, self.plant.valve2_open)
+        if key != self._schedule_key:
+            self._schedule_key = key
+            self.Kp, self.Ki, self.Kd = self.table.lookup(*key)
+
+    def update(self, process_variable, dt):
+        self._reschedule()
+        return super().update(process_variable, dt)
+
+
+# --- VÒNG ĐIỀU KHIỂN KÍN KHÔNG GIAO DIỆN ---
+CONTROLLER_TYPES = ('pid', 'fuzzy', 'mpc', 'scheduled')
+DEFAULT_PID_GAINS = {'Kp': 83.5, 'Ki': 14.5, 'Kd': 120.0}
+
+
+# Bảng cấu hình Fuzzy PID mà create_controller dùng chung cho mọi bộ 'fuzzy' (worker_pool đặt bảng
+# nằm trong shared memory ở tiến trình con); None: mỗi bộ điều khiển tự xây bảng
+_shared_fuzzy_tables = None
+
+
+def install_fuzzy_tables(tables):
+    """Đặt bảng (FuzzyPIDController.config_tables()) cho create_controller; None để bỏ."""
+    global _shared_fuzzy_tables
+    _shared_fuzzy_tables = tables
+
+
+def create_controller(controller_type, set_point, gains=None, output_limits=(0, 300), plant=None,
+                      fuzzy_inference='mamdani'):
+    """
+    Tạo bộ điều khiển theo tên ('pid', 'fuzzy', 'mpc' hoặc 'scheduled').
+
+    Args:
+        controller_type (str): Loại bộ điều khiển.
+        set_point (float): Giá trị đặt ban đầu.
+        gains (dict): Hệ số Kp, Ki, Kd cho PID (mặc định DEFAULT_PID_GAINS).
+        output_limits (tuple): Giới hạn lưu lượng ra (cm³/s).
+        plant (CoupledTankSystem): Hệ bồn mà MPC và PID lập lịch đọc tham số, độ mở van.
+        fuzzy_inference (str): Kiểu suy luận của Fuzzy PID ('mamdani' hoặc 'sugeno').
+    """
+    if controller_type == 'pid':
+        g = dict(DEFAULT_PID_GAINS, **(gains or {}))
+        return PIDController(Kp=g['Kp'], Ki=g['Ki'], Kd=g['Kd'], set_point=set_point, output_limits=output_limits)
+    if controller_type == 'fuzzy':
+        if _shared_fuzzy_tables is not None:
+            return FuzzyPIDController.from_tables(_shared_fuzzy_tables, set_point, output_limits,
+                                                  inference=fuzzy_inference)
+        return FuzzyPIDController(set_point=set_point, output_limits=output_limits, inference=fuzzy_inference)
+    if controller_type == 'mpc':
+        return MPCController(set_point=set_point, output_limits=output_limits, plant=plant)
+    if controller_type == 'scheduled':
+        return GainScheduledPIDController(set_point=set_point, plant=plant, output_limits=output_limits)
+    raise ValueError(f"Loại bộ điều khiển không hợp lệ: {controller_type!r} (hợp lệ: {', '.join(CONTROLLER_TYPES)})")
+
+
+class SimulationEngine:
+    """
+    Vòng điều khiển kín không phụ thuộc Tkinter: một hệ bồn nước đôi và một bộ điều khiển.
+    Dùng cho chạy kịch bản hàng loạt và các công cụ không giao diện.
+
+    measurement_noise là độ lệch chuẩn (cm) của nhiễu đo cộng vào H2 trước khi đưa vào bộ
+    điều khiển; nhiễu lấy từ self.rng nên trạng thái RNG nằm trong snapshot().
+    """
+    def __init__(self, controller, tank_system=None, dt=0.1, measurement_noise=0.0, seed=None):
+        self.controller = controller
+        self.tank_system = tank_system if tank_system is not None else CoupledTankSystem()
+        self.dt = dt
+        self.simulation_time = 0.0
+        self.last_inflow = 0.0
+        self.measurement_noise = measurement_noise
+        self.rng = np.random.default_rng(seed)
+        self.recorder = None  # RunRecorder tùy chọn, ghi lại mỗi bước
+
+    def step(self):
+        """Thực hiện một bước: bộ điều khiển tính Qi1 từ H2, sau đó cập nhật hệ bồn."""
+        measured_h2 = self.tank_system.H2
+        if self.measurement_noise:
+            measured_h2 += self.rng.normal(0.0, self.measurement_noise)
+        qi1 = self.controller.update(measured_h2, self.dt)
+        self.tank_system.update(qi1, 0, self.dt, self.simulation_time)
+        self.simulation_time += self.dt
+        self.last_inflow = qi1
+        if self.recorder is not None:
+            ts = self.tank_system
+            self.recorder.append(self.simulation_time, ts.H1, ts.H2, qi1, self.controller.set_point,
+                                 ts.valve1_open, ts.valve2_open, ts.disturbance_active)
+        return qi1
+
+    def set_setpoint(self, set_point):
+        self.controller.set_setpoint(set_point)
+
+    def trigger_disturbance(self, flow=None, duration=None):
+        """Kích hoạt nhiễu rút nước bồn 2 ngay bây giờ (flow, duration mặc định theo hệ bồn)."""
+        ts = self.tank_system
+        if flow is not None:
+            ts.disturbance_flow = flow
+        if duration is not None:
+            ts.disturbance_duration = duration
+        ts.trigger_disturbance(self.simulation_time)
+
+    def state(self):
+        """Trạng thái hiện tại dưới dạng dict."""
+        ts = self.tank_system
+        return {
+            'time': self.simulation_time,
+            'H1': ts.H1,
+            'H2': ts.H2,
+            'Qi1': float(self.last_inflow),
+            'setpoint': self.controller.set_point,
+            'valve1': ts.valve1_open,
+            'valve2': ts.valve2_open,
+            'disturbance': ts.disturbance_active,
+        }
+
+    def snapshot(self):
+        """
+        Ảnh chụp toàn bộ trạng thái mô phỏng: hệ bồn, bộ điều khiển, thời gian và RNG.
+        Chỉ gồm kiểu dữ liệu thuần Python nên có thể pickle (gửi sang tiến trình khác) hoặc ghi JSON.
+        """
+        return {
+            'time': self.simulation_time,
+            'dt': self.dt,
+            'last_inflow': float(self.last_inflow),
+            'measurement_noise': self.measurement_noise,
+            'tank': self.tank_system.snapshot(),
+            'controller_type': self.controller.controller_type,
+            'controller': self.controller.snapshot(),
+            'rng': self.rng.bit_generator.state,
+        }
+
+    def restore(self, snapshot):
+        """
+        Khôi phục trạng thái từ snapshot(). Nếu loại bộ điều khiển khác với bộ hiện tại,
+        một bộ điều khiển mới được tạo.
+        """
+        if self.controller.controller_type != snapshot['controller_type']:
+            self.controller = create_controller(snapshot['controller_type'], snapshot['controller']['set_point'],
+                                                plant=self.tank_system,
+                                                fuzzy_inference=snapshot['controller'].get('inference', 'mamdani'))
+        self.controller.restore(snapshot['controller'])
+        self.tank_system.restore(snapshot['tank'])
+        self.simulation_time = snapshot['time']
+        self.dt = snapshot['dt']
+        self.last_inflow = snapshot['last_inflow']
+        self.measurement_noise = snapshot['measurement_noise']
+        self.rng.bit_generator.state = snapshot['rng']
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Tạo một engine độc lập (nhánh) từ snapshot()."""
+        tank_system = CoupledTankSystem()
+        engine = cls(create_controller(snapshot['controller_type'], snapshot['controller']['set_point'],
+                                       plant=tank_system,
+                                       fuzzy_inference=snapshot['controller'].get('inference', 'mamdani')),
+                     tank_system)
+        engine.restore(snapshot)
+        return engine
+
+
+class MultiRateEngine(SimulationEngine):
+    """
+    Vòng điều khiển đa tốc độ chạy trên bộ lập lịch sự kiện (event_scheduler.EventScheduler).
+
+    Cảm biến (lấy mẫu H2), bộ điều khiển và cơ cấu chấp hành (chốt lệnh Qi1) là các sự kiện
+    tuần hoàn với chu kỳ riêng; giữa hai sự kiện hệ bồn được tích phân với bước không quá dt,
+    lưu lượng vào giữ nguyên (ZOH). Tác vụ chậm chỉ chạy theo chu kỳ của nó, không theo dt.
+    Nhiễu và setpoint có thể hẹn giờ (schedule_disturbance, schedule_setpoint); hệ bồn được
+    tích phân tới đúng thời điểm sự kiện.
+
+    Khi cả ba chu kỳ bằng dt, kết quả trùng với SimulationEngine. step() tiến thêm dt nên
+    engine dùng được thay SimulationEngine trong chạy kịch bản.
+
+    snapshot() ghi thêm các chu kỳ, pha và giá trị đang giữ của các tác vụ, cùng các sự kiện hẹn
+    giờ chưa chạy (setpoint, nhiễu, kết thúc nhiễu); restore() và from_snapshot() đăng ký lại
+    chúng nên engine khôi phục chạy tiếp trùng khớp với engine gốc.
+    """
+    def __init__(self, controller, tank_system=None, dt=0.1, controller_period=None, sensor_period=None,
+                 actuator_period=None, measurement_noise=0.0, seed=None):
+        super().__init__(controller, tank_system, dt, measurement_noise, seed)
+        self.controller_period = controller_period or dt
+        self.sensor_period = sensor_period or self.controller_period
+        self.actuator_period = actuator_period or self.controller_period
+        self.scheduler = EventScheduler(self.simulation_time)
+        self._timed_events = {}  # ScheduledEvent chưa chạy -> mô tả (dict thuần) để ghi vào snapshot
+        self._schedule_tasks()
+
+    def _schedule_tasks(self, state=None):
+        """
+        Đăng ký lại các tác vụ tuần hoàn (sau khởi tạo hoặc restore). Không có state: bắt đầu từ
+        thời điểm hiện tại; có state (từ snapshot()): tiếp tục đúng pha và giá trị đang giữ.
+        """
+        s = self.scheduler
+        s.clear()
+        s.now = t0 = self.simulation_time
+        if state is None:
+            state = {'measured_h2': self.tank_system.H2, 'command': self.last_inflow,
+                     'next': dict.fromkeys(('sensor', 'controller', 'actuator'), t0)}
+        self.measured_h2 = state['measured_h2']
+        self.command = state['command']
+        start = state['next']
+        # Cùng thời điểm: cảm biến -> bộ điều khiển -> cơ cấu chấp hành
+        self._tasks = {
+            'sensor': s.call_every(self.sensor_period, self._sample_sensor, start=start['sensor'], priority=0,
+                                   name='sensor'),
+            'controller': s.call_every(self.controller_period, self._run_controller, start=start['controller'],
+                                       priority=1, name='controller'),
+            'actuator': s.call_every(self.actuator_period, self._update_actuator, start=start['actuator'],
+                                     priority=2, name='actuator'),
+        }
+
+    # --- Tác vụ ---
+    def _sample_sensor(self, t):
+        self.measured_h2 = self.tank_system.H2
+        if self.measurement_noise:
+            self.measured_h2 += self.rng.normal(0.0, self.measurement_noise)
+
+    def _run_controller(self, t):
+        self.command = self.controller.update(self.measured_h2, self.controller_period)
+
+    def _update_actuator(self, t):
+        self.last_inflow = self.command
+
+    def _advance_plant(self, t):
+        """Tích phân hệ bồn từ thời điểm hiện tại tới t với bước không quá dt."""
+        ts = self.tank_system
+        now = self.simulation_time
+        while t - now > 1e-9:
+            h = self.dt if t - now > self.dt - 1e-9 else t - now  # Bước đủ dt giữ kết quả trùng SimulationEngine
+            ts.update(self.last_inflow, 0, h, now)
+            now += h
+        self.simulation_time = t
+
+    # --- Giao diện engine ---
+    def run_until(self, end_time):
+        """Chạy mọi sự kiện trước end_time (sự kiện tại end_time thuộc khoảng kế tiếp)."""
+        self.scheduler.run_until(end_time, self._advance_plant, inclusive=False)
+        self.simulation_time = end_time
+
+    def step(self):
+        """Tiến thêm dt; trả về Qi1 đang áp dụng ở cuối bước."""
+        self.run_until(self.simulation_time + self.dt)
+        if self.recorder is not None:
+            ts = self.tank_system
+            self.recorder.append(self.simulation_time, ts.H1, ts.H2, self.last_inflow, self.controller.set_point,
+                                 ts.valve1_open, ts.valve2_open, ts.disturbance_active)
+        return self.last_inflow
+
+    def _call_timed(self, time, name, **params):
+        """Đăng ký sự kiện hẹn giờ một lần, mô tả bằng tên và tham số thuần (ghi được vào snapshot)."""
+        def run(t):
+            del self._timed_events[event]
+            self._run_timed(t, name, params)
+        event = self.scheduler.call_at(time, run, priority=-1, name=name)
+        self._timed_events[event] = dict(params, name=name)
+        return event
+
+    def _run_timed(self, t, name, params):
+        ts = self.tank_system
+        if name == 'setpoint':
+            self.set_setpoint(params['set_point'])
+        elif name == 'disturbance':
+            ts.disturbance_flow = params['flow']
+            ts.disturbance_duration = params['duration']
+            # Nhiễu vẫn có hạn trong hệ bồn nên tự tắt cả khi không còn sự kiện kết thúc
+            # (ví dụ nhánh SimulationEngine từ snapshot); sự kiện dưới đây tắt đúng thời điểm.
+            ts.trigger_disturbance(t)
+            self._call_timed(t + params['duration'], 'disturbance_end')
+        elif name == 'disturbance_end':
+            ts.stop_disturbance()
+
+    def schedule_setpoint(self, time, set_point):
+        """Hẹn giờ đổi setpoint."""
+        return self._call_timed(time, 'setpoint', set_point=set_point)
+
+    def schedule_disturbance(self, time, flow=None, duration=None):
+        """
+        Hẹn giờ nhiễu rút nước bồn 2 trong [time, time + duration): bật và tắt là hai sự kiện,
+        hệ bồn được tích phân tới đúng thời điểm tắt.
+        """
+        ts = self.tank_system
+        flow = ts.disturbance_flow if flow is None else flow
+        duration = ts.disturbance_duration if duration is None else duration
+        return self._call_timed(time, 'disturbance', flow=flow, duration=duration)
+
+    def trigger_disturbance(self, flow=None, duration=None):
+        self.schedule_disturbance(self.simulation_time, flow, duration)
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot['rates'] = {'controller': self.controller_period, 'sensor': self.sensor_period,
+                             'actuator': self.actuator_period}
+        snapshot['tasks'] = {'measured_h2': float(self.measured_h2), 'command': float(self.command),
+                             'next': {name: event.time for name, event in self._tasks.items()}}
+        snapshot['timed_events'] = sorted((dict(spec, time=event.time) for event, spec in self._timed_events.items()
+                                           if not event.cancelled), key=lambda spec: spec['time'])
+        return snapshot
+
+    def restore(self, snapshot):
+        super().restore(snapshot)
+        rates = snapshot.get('rates')
+        if rates is not None:
+            self.controller_period = rates['controller']
+            self.sensor_period = rates['sensor']
+            self.actuator_period = rates['actuator']
+        # Pha của tác vụ chỉ dùng được khi chu kỳ cũng lấy từ snapshot
+        self._schedule_tasks(snapshot.get('tasks') if rates is not None else None)
+        self._timed_events = {}
+        for spec in snapshot.get('timed_events', ()):
+            params = {key: value for key, value in spec.items() if key not in ('name', 'time')}
+            self._call_timed(spec['time'], spec['name'], **params)
+
+
+# --- THÍ NGHIỆM RELAY (ÅSTRÖM-HÄGGLUND) ---
+class RelayAutoTuner:
+    """
+    Thí nghiệm relay để tìm độ lợi tới hạn Ku và chu kỳ tới hạn Tu.
+    Không phụ thuộc giao diện: GUI gọi step() mỗi bước mô phỏng, còn các công cụ
+    không giao diện có thể gọi run() để chạy trọn thí nghiệm.
+
+    estimator:
+        'spectral': lưu H2 và Qi1 relay sau mỗi bước; thời điểm H2 cắt lên setpoint được nội suy
+            tuyến tính giữa hai mẫu (độ phân giải dưới dt). Sau mỗi chu kỳ, tìm thành phần cơ bản
+            c + a*cos(wt) + b*sin(wt) của sai số H2 (Y1, bình phương tối thiểu trên mẫu) và của Qi1
+            (U1, tích phân đúng của hàm bậc thang) trên cùng fit_cycles chu kỳ gần nhất (w từ các
+            điểm cắt) -> Tu = chu kỳ trung bình, Ku = |U1| / |Y1| = 1/|G(jw)|. Relay cấp Qi1 trong
+            {0, d} nên |U1| <= 2d/pi (nhỏ hơn khi độ rộng xung khác 50%); công thức 4d/(pi*a) của
+            relay đối xứng ±d cho Ku gấp khoảng 2.6 lần. Dừng ngay khi hai cửa sổ
+            liên tiếp (lệch nhau một chu kỳ) cho Ku và Tu khác nhau không quá tolerance (tương đối);
+            nếu không, dừng khi đủ transient_cycles + measurement_cycles điểm cắt (cùng độ dài như cách cũ).
+        'peaks': cách cũ, lấy H2 tại các thời điểm chuyển relay làm đỉnh/đáy.
+
+    switching:
+        'event': mỗi bước dt được tích phân bằng RK4; nếu H2 vượt ngưỡng chuyển trong bước, thời điểm
+            chuyển được tìm bằng chia đôi trên nội suy Hermite bậc ba (dense output) của H2, hệ bồn
+            được tích phân tới đúng thời điểm đó rồi relay chuyển và tích phân tiếp phần còn lại.
+            Chu kỳ và biên độ dao động không còn bị lượng tử hóa theo dt nên mặc định dùng bước lớn
+            (dt = 1 s, khoảng 7 bước mỗi chu kỳ ở d = 200, setpoint 20).
+        'sampled': cách cũ, relay chỉ chuyển ở đầu bước, hệ bồn cập nhật bằng update() (Euler);
+            cần bước nhỏ (dt = 0.1 như trước).
+    Relay có trễ hysteresis (cm): bật khi H2 < setpoint - hysteresis, tắt khi H2 >= setpoint + hysteresis.
+    Khi chuyển đúng thời điểm, relay lý tưởng (hysteresis = 0) trên hệ bậc hai không có trễ cho dao
+    động tắt dần về biên độ 0, nên chế độ 'event' cần hysteresis > 0.
+
+    Hệ hai bồn không có trễ nên pha không bao giờ tới -180°: không có điểm tới hạn hữu hạn. Ku là
+    nghịch đảo độ lợi của đối tượng tại tần số dao động, nhưng tần số đó (pha gần -180° + arcsin(eps/a))
+    phụ thuộc hysteresis, một tham số của thí nghiệm (chỉnh được trên giao diện). Với d = 200,
+    setpoint 20, 'event': eps = 0.5 -> Ku ≈ 95, Tu ≈ 12.0 s; eps = 0.1 -> Ku ≈ 266, Tu ≈ 7.1 s;
+    eps = 0.02 -> Ku ≈ 791, Tu ≈ 4.06 s, khớp 1/|G(jw)| của mô hình tuyến tính hóa trong khoảng 3%
+    (ở cả dt = 0.02 và dt = 1). eps càng nhỏ thì dao động càng nhanh và hệ số Z-N suy ra càng lớn.
+    """
+    ESTIMATORS = ('spectral', 'peaks')
+    SWITCHING_MODES = ('event', 'sampled')
+    MAX_EVENTS_PER_STEP = 16
+
+    def __init__(self, tank_system, set_point=20.0, relay_amplitude=100.0, dt=1.0,
+                 transient_cycles=3, measurement_cycles=4, timeout=200.0, start_time=0.0,
+                 estimator='spectral', tolerance=0.03, fit_cycles=2, switching='event', hysteresis=0.1):
+        if estimator not in self.ESTIMATORS:
+            raise ValueError(f"estimator phải là một trong {self.ESTIMATORS}")
+        if switching not in self.SWITCHING_MODES:
+            raise ValueError(f"switching phải là một trong {self.SWITCHING_MODES}")
+        if switching == 'event' and hysteresis <= 0:
+            raise ValueError("Chế độ chuyển 'event' cần hysteresis > 0")
+        self.tank_system = tank_system
+        self.set_point = set_point
+        self.relay_amplitude = relay_amplitude
+        self.dt = dt
+        self.transient_cycles = transient_cycles
+        self.measurement_cycles = measurement_cycles
+        self.timeout = timeout
+        self.relay_start_time = start_time
+        self.estimator = estimator
+        self.tolerance = tolerance
+        self.fit_cycles = fit_cycles
+        self.switching = switching
+        self.hysteresis = hysteresis
+
+        self.relay_state = 'off'  # Trạng thái relay ('on' hoặc 'off')
+        self.cycle_count = 0  # Đếm số chu kỳ để bỏ qua giai đoạn quá độ
+        self.relay_peaks = []  # Lưu các đỉnh của dao động relay
+        self.relay_troughs = []  # Lưu các đáy của dao động relay
+        self.last_output = 0.0
+        self.Ku = 0.0
+        self.Tu = 0.0
+        # Bộ đệm của ước lượng phổ: mẫu (t, H2 - setpoint, Qi1), điểm cắt lên, ước lượng (Ku, Tu) mỗi chu kỳ
+        self._sample_times = []
+        self._sample_errors = []
+        self._sample_inflows = []
+        self.crossings = []
+        self.estimates = []
+        self.converged = False
+
+    # Tham số hệ bồn xác định kết quả thí nghiệm (cùng với trạng thái trong snapshot())
+    _PLANT_PARAMS = ('A1', 'A2', 'alpha1', 'alpha2', 'alpha3', 'max_height')
+
+    def config(self):
+        """
+        Cấu hình xác định hoàn toàn kết quả thí nghiệm: tham số và trạng thái ban đầu của hệ bồn
+        cùng các tham số relay. Dùng làm khóa bộ nhớ đệm (xem tuning_cache.py); phải gọi trước khi chạy.
+        """
+        ts = self.tank_system
+        return {
+            'plant': {name: getattr(ts, name) for name in self._PLANT_PARAMS},
+            'state': ts.snapshot(),
+            'set_point': self.set_point,
+            'relay_amplitude': self.relay_amplitude,
+            'dt': self.dt,
+            'transient_cycles': self.transient_cycles,
+            'measurement_cycles': self.measurement_cycles,
+            'timeout': self.timeout,
+            'estimator': self.estimator,
+            'tolerance': self.tolerance,
+            'fit_cycles': self.fit_cycles,
+            'switching': self.switching,
+            'hysteresis': self.hysteresis,
+        }
+
+    def step(self, current_time):
+        """
+        Áp dụng luật relay và cập nhật hệ bồn một bước dt. Trả về lưu lượng Qi1 (trung bình trong
+        bước nếu relay chuyển giữa bước).
+        """
+        h2 = self.tank_system.H2
+        if h2 < self.set_point - self.hysteresis:
+            # Mực nước thấp hơn setpoint -> bật relay
+            if self.relay_state != 'on':
+                self.relay_state = 'on'
+                # Ghi nhận điểm chuyển đổi (từ off sang on)
+                self.record_transition('on', current_time)
+        elif h2 >= self.set_point + self.hysteresis:
+            # Mực nước cao hơn hoặc bằng setpoint -> tắt relay
+            if self.relay_state != 'off':
+                self.relay_state = 'off'
+                # Ghi nhận điểm chuyển đổi (từ on sang off)
+                self.record_transition('off', current_time)
+
+        if self.switching == 'event':
+            qi1 = self._step_events(current_time)
+        else:
+            qi1 = self.relay_amplitude if self.relay_state == 'on' else 0.0
+            self.tank_system.update(qi1, 0, self.dt, current_time)
+        self.last_output = qi1
+        if self.estimator == 'spectral':
+            self._record_sample(current_time + self.dt, self.tank_system.H2 - self.set_point,
+                                self.relay_amplitude if self.relay_state == 'on' else 0.0)
+        return qi1
+
+    def _rk4(self, H1, H2, qi1, qi2, h):
+        # Cùng phương trình với CoupledTankSystem.derivatives(), khai triển sẵn cho bốn lần đánh giá:
+        # đây là đường nóng của thí nghiệm (mỗi bước dt gọi ít nhất một lần), gọi hàm tốn hơn cả phép tính
+        ts = self.tank_system
+        sqrt = math.sqrt
+        kv1 = 0.0 if ts.valve1_open < 1e-3 else (ts.valve1_open / 100.0) * ts.alpha1
+        kv2 = 0.0 if ts.valve2_open < 1e-3 else (ts.valve2_open / 100.0) * ts.alpha2
+        alpha3, A1, A2 = ts.alpha3, ts.A1, ts.A2
+        half = 0.5 * h
+
+        d = H1 - H2
+        Qo3 = alpha3 * sqrt(d) if d > 0 else -alpha3 * sqrt(-d)
+        k11 = (qi1 - kv1 * sqrt(H1 if H1 > 0 else 0) - Qo3) / A1
+        k12 = (qi2 - kv2 * sqrt(H2 if H2 > 0 else 0) + Qo3) / A2
+        x1, x2 = H1 + half * k11, H2 + half * k12
+        d = x1 - x2
+        Qo3 = alpha3 * sqrt(d) if d > 0 else -alpha3 * sqrt(-d)
+        k21 = (qi1 - kv1 * sqrt(x1 if x1 > 0 else 0) - Qo3) / A1
+        k22 = (qi2 - kv2 * sqrt(x2 if x2 > 0 else 0) + Qo3) / A2
+        x1, x2 = H1 + half * k21, H2 + half * k22
+        d = x1 - x2
+        Qo3 = alpha3 * sqrt(d) if d > 0 else -alpha3 * sqrt(-d)
+        k31 = (qi1 - kv1 * sqrt(x1 if x1 > 0 else 0) - Qo3) / A1
+        k32 = (qi2 - kv2 * sqrt(x2 if x2 > 0 else 0) + Qo3) / A2
+        x1, x2 = H1 + h * k31, H2 + h * k32
+        d = x1 - x2
+        Qo3 = alpha3 * sqrt(d) if d > 0 else -alpha3 * sqrt(-d)
+        k41 = (qi1 - kv1 * sqrt(x1 if x1 > 0 else 0) - Qo3) / A1
+        k42 = (qi2 - kv2 * sqrt(x2 if x2 > 0 else 0) + Qo3) / A2
+        top = ts.max_height
+        return (min(max(H1 + h / 6 * (k11 + 2 * k21 + 2 * k31 + k41), 0.0), top),
+                min(max(H2 + h / 6 * (k12 + 2 * k22 + 2 * k32 + k42), 0.0), top))
+
+    def _step_events(self, current_time):
+        """Tích phân một bước dt, chuyển relay đúng thời điểm H2 chạm ngưỡng. Trả về Qi1 trung bình."""
+        ts = self.tank_system
+        qi2 = 0.0
+        if ts.disturbance_active:
+            # Như update(): nhiễu rút nước bồn 2, xét hết hạn ở đầu bước
+            if current_time - ts.disturbance_start_time < ts.disturbance_duration:
+                qi2 = -ts.disturbance_flow
+            else:
+                ts.disturbance_active = False
+
+        t, remaining, volume = current_time, self.dt, 0.0
+        H1, H2 = ts.H1, ts.H2
+        for _ in range(self.MAX_EVENTS_PER_STEP):
+            on = self.relay_state == 'on'
+            qi1 = self.relay_amplitude if on else 0.0
+            # Bật: chờ H2 lên tới setpoint + hysteresis; tắt: chờ H2 xuống tới setpoint - hysteresis
+            level = self.set_point + self.hysteresis if on else self.set_point - self.hysteresis
+            sign = 1.0 if on else -1.0
+            end = self._rk4(H1, H2, qi1, qi2, remaining)
+            if sign * (end[1] - level) < 0:
+                H1, H2 = end
+                volume += qi1 * remaining
+                break
+            # Nội suy Hermite bậc ba của H2 trên [0, remaining] từ giá trị và đạo hàm hai đầu
+            d0 = ts.derivatives(H1, H2, qi1, qi2)[1] * remaining
+            d1 = ts.derivatives(end[0], end[1], qi1, qi2)[1] * remaining
+            lo, hi = 0.0, 1.0  # Đầu bước chưa chạm ngưỡng, cuối bước đã chạm
+            for _ in range(40):
+                s = 0.5 * (lo + hi)
+                s2, s3 = s * s, s * s * s
+                h = (2 * s3 - 3 * s2 + 1) * H2 + (s3 - 2 * s2 + s) * d0 + (3 * s2 - 2 * s3) * end[1] + (s3 - s2) * d1
+                if sign * (h - level) < 0:
+                    lo = s
+                else:
+                    hi = s
+            tau = hi * remaining
+            H1, H2 = self._rk4(H1, H2, qi1, qi2, tau)
+            volume += qi1 * tau
+            t += tau
+            remaining -= tau
+            ts.H1, ts.H2 = H1, H2
+            self.relay_state = 'off' if on else 'on'
+            self.record_transition(self.relay_state, t)
+            if self.estimator == 'spectral':
+                self._record_sample(t, H2 - self.set_point, qi1)
+            if remaining <= 1e-12:
+                break
+        else:
+            # Quá nhiều lần chuyển trong một bước: tích phân nốt phần còn lại không chuyển
+            qi1 = self.relay_amplitude if self.relay_state == 'on' else 0.0
+            H1, H2 = self._rk4(H1, H2, qi1, qi2, remaining)
+            volume += qi1 * remaining
+        ts.H1, ts.H2 = H1, H2
+        return volume / self.dt
+
+    def _record_sample(self, t, error, inflow):
+        """
+        Lưu một mẫu: sai số H2 - setpoint tại t và Qi1 relay đã cấp trên khoảng từ mẫu trước tới t
+        (không đổi trên khoảng đó). Tại mỗi điểm cắt lên (nội suy giữa hai mẫu) cập nhật ước lượng.
+        """
+        times, errors = self._sample_times, self._sample_errors
+        times.append(t)
+        errors.append(error)
+        self._sample_inflows.append(inflow)
+        if len(errors) > 1 and errors[-2] < 0 <= error:
+            t0, e0 = times[-2], errors[-2]
+            self.crossings.append(t0 + (t - t0) * (-e0) / (error - e0))
+            self._update_estimate()
+
+    def _fit_fundamental(self, cycles):
+        """
+        Khớp thành phần cơ bản của sai số H2 (Y1) và của Qi1 relay (U1) trên cycles chu kỳ gần
+        nhất, cùng cửa sổ và cùng cơ sở cos/sin. Trả về (Ku, Tu) với Ku = |U1| / |Y1|.
+        """
+        t0, t1 = self.crossings[-1 - cycles], self.crossings[-1]
+        times = np.asarray(self._sample_times)
+        start, stop = np.searchsorted(times, (t0, t1))
+        Tu = (t1 - t0) / cycles
+        w = 2 * np.pi / Tu
+        phase = w * (times[start:stop] - t0)
+        basis = np.array((np.ones_like(phase), np.cos(phase), np.sin(phase)))
+        # Phương trình chuẩn 3x3 (rẻ hơn lstsq, cửa sổ luôn chứa hàng chục mẫu)
+        _, y_cos, y_sin = np.linalg.solve(basis @ basis.T, basis @ np.array(self._sample_errors[start:stop]))
+        # Qi1 là hàm bậc thang đã biết chính xác (không đổi trên mỗi khoảng giữa hai mẫu), nên hệ số
+        # trên cùng cơ sở được tích phân đúng thay vì khớp từ mẫu: với bước lớn, mẫu của sóng vuông
+        # chỉ còn vài điểm mỗi chu kỳ và bình phương tối thiểu trên mẫu sai hàng chục phần trăm
+        edges = w * (np.clip(times[start - 1:stop + 1], t0, t1) - t0)
+        inflows = np.asarray(self._sample_inflows[start:stop + 1])
+        scale = 2 / (w * (t1 - t0))
+        u_cos = scale * (inflows @ np.diff(np.sin(edges)))
+        u_sin = -scale * (inflows @ np.diff(np.cos(edges)))
+        return np.hypot(u_cos, u_sin) / np.hypot(y_cos, y_sin), Tu
+
+    def _update_estimate(self):
+        # Điểm cắt đầu tiên kết thúc lần nạp ban đầu; chu kỳ đầu tiên chỉ dùng khi chưa đủ fit_cycles
+        cycles = min(self.fit_cycles, len(self.crossings) - 2)
+        if cycles < 1:
+            return
+        Ku, Tu = self._fit_fundamental(cycles)
+        if self.estimates:
+            last_Ku, last_Tu = self.estimates[-1]
+            self.converged = bool(abs(Ku - last_Ku) <= self.tolerance * Ku and abs(Tu - last_Tu) <= self.tolerance * Tu)
+        self.estimates.append((Ku, Tu))
+        # Chỉ giữ mẫu của các chu kỳ còn cần cho cửa sổ kế tiếp
+        keep = np.searchsorted(self._sample_times, self.crossings[-self.fit_cycles]) - 1 \
+            if len(self.crossings) >= self.fit_cycles else 0
+        if keep > 0:
+            del self._sample_times[:keep], self._sample_errors[:keep], self._sample_inflows[:keep]
+
+    def record_transition(self, new_state, current_time):
+        """Ghi nhận điểm chuyển đổi trạng thái relay."""
+        h2 = self.tank_system.H2
+        if new_state == 'on':
+            # Chuyển từ off sang on -> đây là một đáy (trough)
+            if len(self.relay_troughs) == 0 or (current_time - self.relay_troughs[-1][0]) > 0.5:
+                self.relay_troughs.append((current_time, h2))
+                self.cycle_count += 1
+        else:  # new_state == 'off'
+            # Chuyển từ on sang off -> đây là một đỉnh (peak)
+            if len(self.relay_peaks) == 0 or (current_time - self.relay_peaks[-1][0]) > 0.5:
+                self.relay_peaks.append((current_time, h2))
+
+    def timed_out(self, current_time):
+        return current_time - self.relay_start_time > self.timeout
+
+    def is_complete(self):
+        """Kiểm tra xem đã có đủ dữ liệu để tính toán chưa."""
+        if self.estimator == 'spectral':
+            return self.converged or (
+                bool(self.estimates) and len(self.crossings) >= self.transient_cycles + self.measurement_cycles)
+        # Cần ít nhất transient_cycles + measurement_cycles chu kỳ
+        if self.cycle_count < self.transient_cycles + self.measurement_cycles:
+            return False
+        # Kiểm tra xem có đủ đỉnh và đáy để đo lường không
+        if len(self.relay_peaks) < self.measurement_cycles or len(self.relay_troughs) < self.measurement_cycles:
+            return False
+        return True
+
+    def calculate_parameters(self):
+        """Tính toán Ku và Tu (ước lượng phổ gần nhất, hoặc từ các đỉnh/đáy gần nhất)."""
+        if self.estimator == 'spectral':
+            self.Ku, self.Tu = self.estimates[-1]
+            return self.Ku, self.Tu
+        recent_peaks = self.relay_peaks[-self.measurement_cycles:]
+        recent_troughs = self.relay_troughs[-self.measurement_cycles:]
+
+        # Tính chu kỳ tới hạn Tu
+        peak_periods = [recent_peaks[i][0] - recent_peaks[i-1][0] for i in range(1, len(recent_peaks))]
+        trough_periods = [recent_troughs[i][0] - recent_troughs[i-1][0] for i in range(1, len(recent_troughs))]
+        Tu = np.mean(peak_periods + trough_periods)
+
+        # Tính biên độ dao động a
+        amplitudes = [abs(recent_peaks[i][1] - recent_troughs[i][1])
+                      for i in range(min(len(recent_peaks), len(recent_troughs)))]
+        a = np.mean(amplitudes)
+
+        # Tính độ lợi tới hạn Ku
+        Ku = (4 * self.relay_amplitude) / (np.pi * a)
+
+        self.Ku = Ku
+        self.Tu = Tu
+        return Ku, Tu
+
+    def ziegler_nichols(self):
+        """Hệ số PID theo quy tắc Ziegler-Nichols (không vọt lố) từ Ku, Tu."""
+        Kp = 0.33 * self.Ku
+        Ki = 0.6 * self.Ku / self.Tu
+        Kd = 0.11 * self.Ku * self.Tu
+        return Kp, Ki, Kd
+
+    def run(self):
+        """
+        Chạy trọn thí nghiệm không giao diện.
+
+        Returns:
+            tuple: (Ku, Tu), hoặc None nếu quá thời gian cho phép.
+        """
+        current_time = self.relay_start_time
+        while not self.timed_out(current_time):
+            self.step(current_time)
+            current_time += self.dt
+            if self.is_complete():
+                return self.calculate_parameters()
+        return None
+
 
 # --- LỚP GIAO DIỆN NGƯỜI DÙNG ---
 class SimulationGUI:
-    def __init__(self, root):
+    def __init__(self, root, startup=None):
         self.root = root
+        # Mốc thời gian khởi động (tính từ lúc tiến trình bắt đầu) tới lần vẽ đầu tiên
+        self.startup = startup if startup is not None else StartupTimer()
+        self.startup.mark('gui_start')
+        self.exit_after_startup = False  # --startup-report: in các mốc rồi thoát sau lần vẽ đầu tiên
         self.root.title("Nền tảng Phân tích Điều khiển Bồn Nước Đôi")
         self.root.geometry("1200x900")
         
@@ -472,12 +1965,18 @@ class SimulationGUI:
         self.simulation_speed = 1
         self.dt = 0.1
         self.simulation_time = 0.0
-        self.graph_time_window = 30.0
+        self.graph_time_window = 30.0  # None = toàn bộ lịch sử
+        self.graph_max_points = 2000  # Số điểm tối đa vẽ cho mỗi đường ở mọi mức zoom
+
+        # Đo hiệu năng từng giai đoạn của vòng lặp (bật qua menu hoặc biến môi trường COUPLED_TANK_PROFILE=1)
+        self.profiler = StageProfiler()
 
         self.tank_system = CoupledTankSystem()
-        output_limits = (0, 300) 
-        self.pid_controller = PIDController(Kp=83.5, Ki=14.5, Kd=120, set_point=25.0, output_limits=output_limits)
-        self.fuzzy_controller = FuzzyPIDController(set_point=self.pid_controller.set_point, output_limits=output_limits)
+        self.output_limits = (0, 300)
+        self.pid_controller = PIDController(Kp=83.5, Ki=14.5, Kd=120, set_point=25.0, output_limits=self.output_limits)
+        # Các bộ điều khiển còn lại (Fuzzy, Sugeno, MPC, lập lịch) được tạo ở lần dùng đầu, xem _controller()
+        self.initial_set_point = self.pid_controller.set_point
+        self._controllers = {'pid_controller': self.pid_controller}
         self.active_controller = self.pid_controller # Mặc định là PID truyền thống
 
         # Kích thước bồn nước (để sử dụng trong các phương thức khác) - Dùng giá trị ban đầu, sẽ tính lại trong _redraw_canvas
@@ -488,15 +1987,21 @@ class SimulationGUI:
         self.tank2_x0 = self.tank1_x0 + self.tank_width + 100
 
         # Dữ liệu cho biểu đồ
-        self.time_data = []
-        self.h2_data = []
-        self.setpoint_data = []
-        self.h1_data = [] # Thêm để xuất CSV
-        self.max_data_points = 200  
+        # Cửa sổ trượt max_data_points mẫu gần nhất (deque tự bỏ mẫu cũ, cả bốn chuỗi luôn cùng độ dài)
+        self.max_data_points = 200
+        self.time_data = deque(maxlen=self.max_data_points)
+        self.h2_data = deque(maxlen=self.max_data_points)
+        self.setpoint_data = deque(maxlen=self.max_data_points)
+        self.h1_data = deque(maxlen=self.max_data_points)  # Thêm để xuất CSV
+        # Lịch sử dài hạn nhiều độ phân giải cho biểu đồ (zoom từ giây tới hàng giờ)
+        self.trend = TrendPyramid(('h1', 'h2', 'qi1', 'setpoint'))
 
         # Các đối tượng hoạt họa dòng chảy
         self.flow_particles = [] 
-        self.flow_animation_id = None
+        # Các tác vụ giao diện chạy theo chu kỳ riêng trên bộ lập lịch sự kiện (đồng hồ thực);
+        # biểu đồ và hoạt họa chỉ được lên lịch khi mô phỏng đang chạy
+        self.ui_scheduler = EventScheduler(time.monotonic())
+        self.running_tasks = []
 
         # Biến cho van điều khiển
         self.valve1_open = 100.0  
@@ -511,6 +2016,11 @@ class SimulationGUI:
         self.kd_var = tk.DoubleVar(value=self.pid_controller.Kd)
         self.setpoint_var = tk.DoubleVar(value=self.pid_controller.set_point)
         self.relay_amplitude_var = tk.DoubleVar(value=100.0)  # Giá trị mặc định là 100
+        self.relay_hysteresis_var = tk.DoubleVar(value=0.1)  # Trễ relay (cm), quyết định Ku/Tu đo được
+        # Biến của tab PID tạo sẵn (tab chỉ được dựng khi mở lần đầu nhưng biến được dùng ở nhiều nơi)
+        self.controller_var = tk.StringVar(value="PID Truyền Thống")
+        self.valve1_var = tk.DoubleVar(value=self.valve1_open)
+        self.valve2_var = tk.DoubleVar(value=self.valve2_open)
 
         # Biến cho Auto-tuning (Module B) - Relay Method
         self.auto_tuning_active = False
@@ -520,27 +2030,76 @@ class SimulationGUI:
         
         # Relay Method variables
         self.relay_amplitude = 100.0  # Biên độ relay (cm³/s)
-        self.relay_state = 'off'  # Trạng thái relay ('on' hoặc 'off')
-        self.cycle_count = 0  # Đếm số chu kỳ để bỏ qua giai đoạn quá độ
-        self.relay_peaks = []  # Lưu các đỉnh của dao động relay
-        self.relay_troughs = []  # Lưu các đáy của dao động relay
-        self.relay_start_time = 0.0  # Thời gian bắt đầu relay
+        self.relay_hysteresis = 0.1  # Trễ relay ε (cm)
+        self.relay_tuner = None  # RelayAutoTuner của lần tinh chỉnh hiện tại
         self.transient_cycles = 3  # Số chu kỳ quá độ cần bỏ qua
         self.measurement_cycles = 4  # Số chu kỳ để đo lường
         self.AUTOTUNE_TIMEOUT_SECONDS = 200.0  # Thời gian tối đa cho quá trình tinh chỉnh
+        # Relay chuyển đúng thời điểm chạm ngưỡng nên thí nghiệm không cần bước nhỏ: hệ bồn được tích
+        # phân mỗi relay_substeps bước mô phỏng (khoảng 1 s), giữa hai lần giữ nguyên
+        self.RELAY_TUNING_STEP = 1.0
+        self.relay_substeps = 1
+        self._relay_substep = 0
+        # Kết quả relay đã chạy được lưu trên đĩa theo cấu hình thí nghiệm (xem tuning_cache.py)
+        self.tuning_cache = TuningCache()
+        self.autotune_cache_var = tk.BooleanVar(value=True)
+        self.autotune_config = None
 
         # Đối tượng canvas GUI (Sẽ được tạo trong _create_operate_tab)
         self.canvas = None
         
-        # Các đối tượng vẽ trên canvas (khởi tạo None để tránh lỗi AttributeErrors khi truy cập sớm)
+        # Các đối tượng vẽ trên canvas (khởi tạo None để tránh lỗi AttributeErrors khi truy cập sớm);
+        # scene: tên -> id item của sơ đồ, tạo một lần trong _create_scene
+        self.scene = {}
+        self.layout_size = None  # (rộng, cao) của canvas ở lần bố trí gần nhất
+        self._resize_job = None
+        self._drawn_levels = None  # Tọa độ y mực nước/setpoint đã vẽ, bỏ qua coords khi không đổi
+        self._valve_fills = {}
         self.water1_rect = None
         self.water2_rect = None
         self.setpoint_line = None
         self.valve1_rect = None
         self.valve2_rect = None
 
+        # Nhãn giá trị của tab PID (None cho tới khi tab được dựng)
+        self.kp_label = None
+        self.ki_label = None
+        self.kd_label = None
+        self.setpoint_label = None
+        self.valve1_label = None
+        self.valve2_label = None
+
+        # Biểu đồ matplotlib tạo sau lần vẽ đầu tiên (xem _ensure_graph)
+        self.graph_frame = None
+        self.graph_canvas = None
+
+        # Ghi và phát lại phiên chạy
+        self.recorder = None
+        self.replay_player = None
+        self.replay_window = None
+        self._replay_last_tick = None
+
+        self.profile_overlay_var = tk.BooleanVar(value=False)
+        self.profile_enabled_var = tk.BooleanVar(value=bool(os.environ.get('COUPLED_TANK_PROFILE')))
+        self.profile_overlay_item = None
+
+        # Công bố trạng thái qua bộ nhớ dùng chung cho tiến trình ngoài (xem shared_state.py)
+        self.shared_publisher = None
+        self.shared_state_var = tk.BooleanVar(value=False)
+
+        # Rẽ nhánh what-if: các nhánh chạy song song trong tiến trình con
+        self.branch_pool = None
+        self.branch_futures = None
+
+        # So sánh lockstep các bộ điều khiển trên hệ bồn nhân bản (xem lockstep_compare.py)
+        self.comparison = None
+        self.compare_var = tk.BooleanVar(value=False)
+        self.compare_trend = None
+        self.compare_lines = {}
+
         # Thiết lập giao diện
         self._create_menu_bar()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
 
         # Notebook (Tabbed Interface)
         self.notebook = ttk.Notebook(self.root)
@@ -550,25 +2109,140 @@ class SimulationGUI:
         self.tab_operate = ttk.Frame(self.notebook)
         self.tab_pid = ttk.Frame(self.notebook)
         self.tab_fuzzy = ttk.Frame(self.notebook)
+        self.tab_analysis = ttk.Frame(self.notebook)
         
         self.notebook.add(self.tab_operate, text="Vận hành")
         self.notebook.add(self.tab_pid, text="Tinh chỉnh PID")
         self.notebook.add(self.tab_fuzzy, text="Thiết lập Logic Mờ")
+        self.notebook.add(self.tab_analysis, text="Phân tích tần số")
 
-        # Tạo nội dung cho từng tab
+        # Tab Vận hành dựng ngay; các tab khác (bảng luật, hình matplotlib...) dựng khi mở lần đầu
         self._create_operate_tab(self.tab_operate)
-        self._create_pid_tab(self.tab_pid)
-        self._create_fuzzy_tab(self.tab_fuzzy)
+        self._pending_tabs = {str(self.tab_pid): (self.tab_pid, self._create_pid_tab),
+                              str(self.tab_fuzzy): (self.tab_fuzzy, self._create_fuzzy_tab),
+                              str(self.tab_analysis): (self.tab_analysis, self._create_analysis_tab)}
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
+
+        # Các giai đoạn của vòng lặp nóng được đo khi bật profiler (bộ điều khiển tạo sau được
+        # đăng ký trong _controller)
+        self.profiler.register(self.pid_controller, 'update')
+        self.profiler.register(self.tank_system, 'update')
+        self.profiler.register(self, '_animate_water_flow')
+        self.profiler.register(self, '_update_graph_data')
+        self.profiler.register(self, '_redraw_trend')
+        self.profiler.register(self, '_update_status_labels')
+        self.profiler.register(self, 'update_water_display')
+        self._toggle_profiler()
 
         # Bắt đầu vòng lặp cập nhật GUI
         # SỬA LỖI: Hoãn gọi update_gui để đảm bảo GUI đã được render đầy đủ
-        self.root.after(100, self.update_gui)
+        start = time.monotonic() + 0.1
+        self.ui_scheduler.call_every(self.UI_PERIODS['update'], lambda t: self.update_gui(), start=start,
+                                     name='update_gui', catch_up=False)
+        self.ui_scheduler.call_every(self.UI_PERIODS['overlay'], lambda t: self._refresh_overlays(), start=start,
+                                     name='overlay', catch_up=False)
+        self.root.after(100, self._pump_ui_events)
+
+        # Lần vẽ đầu tiên: canvas sơ đồ bồn nhận sự kiện Expose
+        self._first_paint_binding = self.canvas.bind("<Expose>", self._on_first_expose, add="+")
+        self.startup.mark('gui_init')
+
+    # Chu kỳ (giây) của các tác vụ giao diện: mô phỏng + nhãn, biểu đồ, hoạt họa, bảng phủ
+    UI_PERIODS = {'update': 0.03, 'graph': 0.1, 'animation': 0.05, 'overlay': 0.5}
+
+    def _pump_ui_events(self):
+        """Chạy các tác vụ giao diện đến hạn rồi hẹn Tk thức dậy đúng lúc sự kiện kế tiếp đến hạn."""
+        self.ui_scheduler.run_until(time.monotonic())
+        delay = self.ui_scheduler.next_time() - time.monotonic()
+        self.root.after(max(1, int(delay * 1000)), self._pump_ui_events)
+
+    def _start_running_tasks(self):
+        """Lên lịch các tác vụ chỉ cần khi mô phỏng chạy: vẽ lại biểu đồ và hoạt họa dòng chảy."""
+        if self.running_tasks:
+            return
+        scheduler = self.ui_scheduler
+        self.running_tasks = [
+            scheduler.call_every(self.UI_PERIODS['graph'], lambda t: self._redraw_trend(), name='graph',
+                                 catch_up=False),
+            scheduler.call_every(self.UI_PERIODS['animation'], lambda t: self._animate_water_flow(),
+                                 name='animation', catch_up=False),
+        ]
+
+    def _stop_running_tasks(self):
+        for event in self.running_tasks:
+            event.cancel()
+        self.running_tasks = []
+
+    def _refresh_overlays(self):
+        """Bảng chỉ số so sánh và lớp phủ hiệu năng (làm mới 2 lần mỗi giây)."""
+        if self.comparison is not None and self.is_running:
+            self._refresh_comparison_label()
+        if self.profiler.enabled and self.profile_overlay_var.get():
+            self._refresh_profile_overlay()
+
+    def _on_first_expose(self, event=None):
+        """Lần vẽ đầu tiên của cửa sổ: ghi mốc rồi tạo biểu đồ khi Tk rảnh."""
+        self.canvas.unbind("<Expose>", self._first_paint_binding)
+        self.root.update_idletasks()  # Hoàn tất các lệnh vẽ đang chờ trước khi ghi mốc
+        self.startup.mark('first_paint')
+        self.root.after_idle(self._finish_startup)
+
+    def _finish_startup(self):
+        self._ensure_graph()
+        self.root.update_idletasks()
+        self.startup.mark('graph_ready')
+        try:
+            self.startup.append_log(self.startup_log_path())
+        except OSError as e:
+            # Không chặn khởi động (và --startup-report) bằng hộp thoại: nhật ký chỉ để thống kê
+            logger.warning("Không ghi được nhật ký khởi động: %s", e)
+        if self.exit_after_startup:
+            print(json.dumps(self.startup.record(), ensure_ascii=False))
+            self._on_close()
+
+    def startup_log_path(self):
+        """Nhật ký thời gian khởi động, cùng thư mục với bộ nhớ đệm tinh chỉnh."""
+        return os.path.join(os.path.dirname(self.tuning_cache.path), 'startup_times.jsonl')
+
+    def show_startup_times(self):
+        """Mốc khởi động của lần chạy này và trung vị các lần gần đây trên máy này."""
+        path = self.startup_log_path()
+        records = StartupTimer.read_log(path)[-20:]
+        lines = [f"Lần này: {self.startup.format()}"]
+        if not self.startup.from_process_start:
+            lines.append("(tính từ lúc nạp mô-đun, không đọc được thời điểm tiến trình bắt đầu)")
+        for name in ('first_paint', 'graph_ready'):
+            values = [r['marks'][name] for r in records if name in r.get('marks', {})]
+            if values:
+                lines.append(f"{name}: trung vị {float(np.median(values)):.3f} s, lớn nhất {max(values):.3f} s "
+                             f"({len(values)} lần gần nhất)")
+        lines += ["", path]
+        messagebox.showinfo("Thời gian khởi động", "\n".join(lines))
 
     def _create_menu_bar(self):
         menubar = tk.Menu(self.root)
         filemenu = tk.Menu(menubar, tearoff=0)
         filemenu.add_command(label="Xuất dữ liệu ra CSV...", command=self.export_csv)
+        filemenu.add_separator()
+        filemenu.add_command(label="Bắt đầu ghi phiên chạy...", command=self.start_recording)
+        filemenu.add_command(label="Dừng ghi phiên chạy", command=self.stop_recording)
+        filemenu.add_command(label="Mở bản ghi để phát lại...", command=self.open_replay)
         menubar.add_cascade(label="Tệp", menu=filemenu)
+
+        toolsmenu = tk.Menu(menubar, tearoff=0)
+        toolsmenu.add_checkbutton(label="Đo hiệu năng vòng lặp", variable=self.profile_enabled_var,
+                                  command=self._toggle_profiler)
+        toolsmenu.add_checkbutton(label="Hiển thị lớp phủ hiệu năng", variable=self.profile_overlay_var,
+                                  command=self._refresh_profile_overlay)
+        toolsmenu.add_command(label="Xuất số liệu hiệu năng (JSON)...", command=self.export_profile)
+        toolsmenu.add_command(label="Thời gian khởi động...", command=self.show_startup_times)
+        toolsmenu.add_separator()
+        toolsmenu.add_command(label="Rẽ nhánh what-if từ trạng thái hiện tại", command=self.fork_what_if)
+        toolsmenu.add_checkbutton(label=f"Chia sẻ trạng thái qua bộ nhớ dùng chung ('{DEFAULT_SHM_NAME}')",
+                                  variable=self.shared_state_var, command=self._toggle_shared_state)
+        toolsmenu.add_separator()
+        toolsmenu.add_command(label="Xóa kết quả tinh chỉnh đã lưu", command=self.clear_tuning_cache)
+        menubar.add_cascade(label="Công cụ", menu=toolsmenu)
         self.root.config(menu=menubar)
 
     def export_csv(self):
@@ -595,106 +2269,322 @@ class SimulationGUI:
                 writer = csv.writer(f)
                 writer.writerow(['Time (s)', 'Setpoint (cm)', 'H1 (cm)', 'H2 (cm)'])
                 
-                for i in range(len(self.time_data)):
-                    writer.writerow([
-                        round(self.time_data[i], 3),
-                        round(self.setpoint_data[i], 3),
-                        round(self.h1_data[i], 3),
-                        round(self.h2_data[i], 3)
-                    ])
+                for t, sp, h1, h2 in zip(self.time_data, self.setpoint_data, self.h1_data, self.h2_data):
+                    writer.writerow([round(t, 3), round(sp, 3), round(h1, 3), round(h2, 3)])
             
             messagebox.showinfo("Thành công", f"Dữ liệu đã được xuất thành công tới:\n{os.path.basename(filepath)}")
         except Exception as e:
             messagebox.showerror("Lỗi", f"Đã xảy ra lỗi khi xuất file CSV: {e}")
 
+    def _toggle_profiler(self):
+        """Bật/tắt đo hiệu năng; khi tắt, các hàm bọc được gỡ nên không tốn chi phí."""
+        if self.profile_enabled_var.get():
+            self.profiler.reset()
+            self.profiler.enable()
+        else:
+            self.profiler.disable()
+        self._refresh_profile_overlay()
+
+    def _refresh_profile_overlay(self):
+        """Cập nhật lớp phủ p50/p95/p99 ở góc trên bên phải canvas."""
+        if self.canvas is None:
+            return
+        if not (self.profiler.enabled and self.profile_overlay_var.get()):
+            if self.profile_overlay_item is not None:
+                self.canvas.delete(self.profile_overlay_item)
+                self.profile_overlay_item = None
+            return
+        x = self.canvas.winfo_width() - 10
+        if self.profile_overlay_item is None:
+            self.profile_overlay_item = self.canvas.create_text(
+                x, 10, anchor=tk.NE, justify=tk.LEFT, font=("Courier", 9), fill="#333333")
+        self.canvas.coords(self.profile_overlay_item, x, 10)
+        text = self.profiler.format_overlay()
+        mpc = self._controllers.get('mpc_controller')
+        if mpc is not None and mpc.solves:
+            text += (f"\nMPC: {mpc.solves} lần giải QP, {mpc.budget_overruns} lần vượt ngân sách "
+                     f"{mpc.time_budget_ns / 1e6:.1f} ms")
+        self.canvas.itemconfig(self.profile_overlay_item, text=text)
+        self.canvas.tag_raise(self.profile_overlay_item)
+
+    def export_profile(self):
+        """Xuất thống kê hiệu năng từng giai đoạn ra file JSON."""
+        if not self.profiler.summary():
+            messagebox.showwarning("Không có dữ liệu", "Hãy bật 'Đo hiệu năng vòng lặp' và chạy mô phỏng trước.")
+            return
+        filepath = asksaveasfilename(
+            initialdir=os.getcwd(),
+            defaultextension=".json",
+            filetypes=[("JSON Files", "*.json"), ("All Files", "*.*")],
+            title="Lưu số liệu hiệu năng"
+        )
+        if not filepath:
+            return
+        try:
+            self.profiler.dump_json(filepath)
+        except OSError as e:
+            messagebox.showerror("Lỗi", f"Không thể ghi file: {e}")
+
+    def start_recording(self):
+        """Bắt đầu ghi từng bước mô phỏng ra file nhị phân."""
+        if self.recorder is not None:
+            messagebox.showinfo("Thông báo", "Đang ghi phiên chạy.")
+            return
+        filepath = asksaveasfilename(
+            initialdir=os.getcwd(),
+            defaultextension=".ctrun",
+            filetypes=[("Bản ghi phiên chạy", "*.ctrun"), ("All Files", "*.*")],
+            title="Ghi phiên chạy"
+        )
+        if not filepath:
+            return
+        try:
+            self.recorder = RunRecorder(filepath)
+        except OSError as e:
+            messagebox.showerror("Lỗi", f"Không thể tạo file ghi: {e}")
+
+    def stop_recording(self):
+        """Dừng ghi và đóng file."""
+        if self.recorder is None:
+            return
+        self.recorder.close()
+        self.recorder = None
+
+    def open_replay(self):
+        """Mở một bản ghi và chuyển GUI sang chế độ phát lại."""
+        if self.is_running:
+            self.stop_simulation()
+        filepath = askopenfilename(
+            initialdir=os.getcwd(),
+            filetypes=[("Bản ghi phiên chạy", "*.ctrun"), ("All Files", "*.*")],
+            title="Mở bản ghi để phát lại"
+        )
+        if not filepath:
+            return
+        try:
+            recording = RunRecording(filepath)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Lỗi", f"Không thể mở bản ghi: {e}")
+            return
+
+        self.close_replay()
+        self.replay_player = ReplayPlayer(recording)
+        self._replay_last_tick = time.monotonic()
+        self.start_button.config(state=tk.DISABLED)
+        self._create_replay_window(recording, os.path.basename(filepath))
+
+    def _create_replay_window(self, recording, title):
+        """Tạo cửa sổ điều khiển phát lại (tua, tốc độ, chiều phát)."""
+        win = tk.Toplevel(self.root)
+        win.title(f"Phát lại - {title}")
+        win.protocol("WM_DELETE_WINDOW", self.close_replay)
+        self.replay_window = win
+
+        frame = ttk.Frame(win, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        frame.grid_columnconfigure(0, weight=1)
+
+        self.replay_pos_var = tk.DoubleVar(value=recording.start_time)
+        ttk.Scale(frame, from_=recording.start_time, to=recording.end_time, orient=tk.HORIZONTAL,
+                  variable=self.replay_pos_var, length=500,
+                  command=lambda v: self.replay_player.seek(float(v))).grid(row=0, column=0, columnspan=4, sticky=tk.EW, pady=5)
+        self.replay_time_label = ttk.Label(frame, text="")
+        self.replay_time_label.grid(row=1, column=0, columnspan=4, sticky=tk.W)
+
+        self.replay_play_button = ttk.Button(frame, text="Phát", command=self._toggle_replay_play)
+        self.replay_play_button.grid(row=2, column=0, sticky=tk.EW, padx=2, pady=5)
+        self.replay_dir_button = ttk.Button(frame, text="Phát ngược", command=self._toggle_replay_direction)
+        self.replay_dir_button.grid(row=2, column=1, sticky=tk.EW, padx=2, pady=5)
+        ttk.Label(frame, text="Tốc độ:").grid(row=2, column=2, sticky=tk.E, padx=2)
+        self.replay_speed_var = tk.StringVar(value="1.0x")
+        speed_combo = ttk.Combobox(frame, textvariable=self.replay_speed_var, state="readonly", width=8,
+                                   values=[f"{s}x" for s in ReplayPlayer.SPEEDS])
+        speed_combo.grid(row=2, column=3, sticky=tk.W, padx=2)
+        speed_combo.bind("<<ComboboxSelected>>",
+                         lambda e: self.replay_player.set_speed(float(self.replay_speed_var.get().rstrip('x'))))
+
+    def _toggle_replay_play(self):
+        player = self.replay_player
+        if player is None:
+            return
+        # Phát lại từ đầu/cuối nếu đã chạm biên
+        if not player.playing:
+            if player.direction > 0 and player.position >= player.recording.end_time:
+                player.seek(player.recording.start_time)
+            elif player.direction < 0 and player.position <= player.recording.start_time:
+                player.seek(player.recording.end_time)
+        player.playing = not player.playing
+        self._replay_last_tick = time.monotonic()
+
+    def _toggle_replay_direction(self):
+        if self.replay_player is None:
+            return
+        self.replay_player.toggle_direction()
+        self.replay_dir_button.config(text="Phát xuôi" if self.replay_player.direction < 0 else "Phát ngược")
+
+    def close_replay(self):
+        """Thoát chế độ phát lại và trả GUI về mô phỏng trực tiếp."""
+        if self.replay_window is not None:
+            self.replay_window.destroy()
+            self.replay_window = None
+        if self.replay_player is not None:
+            self.replay_player = None
+            self.start_button.config(state=tk.NORMAL)
+            self.update_water_display(*self.tank_system.get_levels())
+            self._redraw_trend()
+
+    def _update_replay(self):
+        """Cập nhật canvas, nhãn và biểu đồ từ bản ghi tại vị trí phát hiện tại."""
+        now = time.monotonic()
+        player = self.replay_player
+        position = player.advance(now - self._replay_last_tick)
+        self._replay_last_tick = now
+
+        sample = player.current_sample()
+        h1, h2, qi1 = float(sample['h1']), float(sample['h2']), float(sample['qi1'])
+        self.h1_label.config(text=f"Mực nước H1: {h1:.2f} cm")
+        self.h2_label.config(text=f"Mực nước H2: {h2:.2f} cm")
+        self.qi1_label.config(text=f"Lưu lượng vào Qi1: {qi1:.2f} cm³/s")
+        self.update_water_display(h1, h2, setpoint=float(sample['setpoint']),
+                                  valves=(float(sample['valve1']), float(sample['valve2'])))
+
+        if self.replay_window is not None:
+            self.replay_pos_var.set(position)
+            self.replay_time_label.config(text=f"t = {position:.1f} s / {player.recording.end_time:.1f} s")
+            self.replay_play_button.config(text="Tạm dừng" if player.playing else "Phát")
+
+        # Biểu đồ: cửa sổ graph_time_window kết thúc tại vị trí phát
+        if self.graph_time_window is None:
+            start_time = player.recording.start_time
+        else:
+            start_time = max(player.recording.start_time, position - self.graph_time_window)
+        window = player.recording.window(start_time, position, self.graph_max_points)
+        self._ensure_graph()
+        self.line_h2.set_data(window['time'], window['h2'])
+        self.line_setpoint.set_data(window['time'], window['setpoint'])
+        self.line_h1.set_data(window['time'], window['h1'])
+        self.line_qi1.set_data(window['time'], window['qi1'])
+        self.ax.set_xlim(start_time, max(position, start_time + 1e-6))
+        if len(window):
+            min_val = min(window['h2'].min(), window['setpoint'].min())
+            max_val = max(window['h2'].max(), window['setpoint'].max())
+            margin = (max_val - min_val) * 0.1 if max_val > min_val else 1
+            self.ax.set_ylim(max(0, min_val - margin), max_val + margin)
+        self.graph_canvas.draw_idle()
+
+    RESIZE_DEBOUNCE_MS = 80  # Chỉ bố trí lại khi kích thước canvas đứng yên chừng này
+
+    @staticmethod
+    def _valve_color(opening):
+        if opening < 10:
+            return "#d32f2f"
+        elif opening < 70:
+            return "#fbc02d"
+        else:
+            return "#388e3c"
+
+    def _create_scene(self):
+        """
+        Tạo một lần các item của sơ đồ (bồn, ống, van, nhãn, mực nước, đường setpoint) theo thứ tự
+        chồng lớp; tọa độ do draw_tanks() đặt. Hạt nước tạo sau nên luôn nằm trên cùng.
+        """
+        c = self.canvas
+        scene = self.scene
+        for tank, label in (('tank1', "Bồn 1 (Tank 1)"), ('tank2', "Bồn 2 (Tank 2)")):
+            scene[tank] = c.create_rectangle(0, 0, 0, 0, outline="black", width=2)
+            scene[tank + '_label'] = c.create_text(0, 0, text=label)
+        scene['pipe'] = c.create_line(0, 0, 0, 0, width=10, fill="gray")  # Ống nối
+        scene['out_pipe1'] = c.create_line(0, 0, 0, 0, width=8, fill="gray")  # Ống ra
+        scene['out_pipe2'] = c.create_line(0, 0, 0, 0, width=8, fill="gray")
+        for valve, var, label in (('valve1', self.valve1_var, "V1"), ('valve2', self.valve2_var, "V2")):
+            scene[valve] = c.create_rectangle(0, 0, 0, 0, fill=self._valve_color(var.get()), outline="black", width=2)
+            scene[valve + '_label'] = c.create_text(0, 0, text=label, font=("Arial", 12, "bold"))
+        scene['inlet'] = c.create_line(0, 0, 0, 0, width=8, fill="gray", arrow=tk.LAST)  # Ống vào
+        scene['inlet_label'] = c.create_text(0, 0, text="Qi1")
+        scene['water1'] = c.create_rectangle(0, 0, 0, 0, fill="lightblue", outline="")
+        scene['water2'] = c.create_rectangle(0, 0, 0, 0, fill="lightblue", outline="")
+        scene['setpoint'] = c.create_line(0, 0, 0, 0, fill="red", dash=(4, 2), width=2)
+        self.valve1_rect, self.valve2_rect = scene['valve1'], scene['valve2']
+        self.water1_rect, self.water2_rect = scene['water1'], scene['water2']
+        self.setpoint_line = scene['setpoint']
+
+    def _on_canvas_configure(self, event):
+        """Gom các sự kiện đổi kích thước liên tiếp; lần đầu bố trí ngay để lần vẽ đầu đã có sơ đồ."""
+        size = (event.width, event.height)
+        if size == self.layout_size:
+            if self._resize_job is not None:  # Quay về đúng kích thước đang bố trí
+                self.canvas.after_cancel(self._resize_job)
+                self._resize_job = None
+            return
+        if self.layout_size is None:
+            self.draw_tanks()
+            return
+        if self._resize_job is not None:
+            self.canvas.after_cancel(self._resize_job)
+        self._resize_job = self.canvas.after(self.RESIZE_DEBOUNCE_MS, self._apply_resize)
+
+    def _apply_resize(self):
+        self._resize_job = None
+        self.draw_tanks()
+
     def draw_tanks(self):
-        # Xóa toàn bộ canvas
-        self.canvas.delete("all")
+        """
+        Bố trí sơ đồ theo kích thước canvas hiện tại: tính bố cục một lần rồi dời các item có sẵn
+        bằng coords (không xóa/tạo lại), các hạt nước đang bay được co giãn theo cùng tỉ lệ.
+        """
+        if not self.scene:
+            self._create_scene()
         w = self.canvas.winfo_width()
         h = self.canvas.winfo_height()
+        old_size = self.layout_size
+        self.layout_size = (w, h)
         # Tính toán lại vị trí/kích thước và lưu vào self.*
-        # Tăng kích thước bồn nước để tận dụng không gian tốt hơn
-        self.tank_width = int(w * 0.22) # Tăng từ 0.18
-        self.tank_height = int(h * 0.75) # Tăng từ 0.7
-        self.tank1_x0 = int(w * 0.1) # Điều chỉnh vị trí x
-        self.tank1_y0 = int(h * 0.1) # Điều chỉnh vị trí y
+        self.tank_width = int(w * 0.22)
+        self.tank_height = int(h * 0.75)
+        self.tank1_x0 = int(w * 0.1)
+        self.tank1_y0 = int(h * 0.1)
         self.tank2_x0 = self.tank1_x0 + self.tank_width + int(w * 0.18) # Khoảng cách giữa 2 bồn
-        # Vẽ bồn 1
-        self.canvas.create_rectangle(self.tank1_x0, self.tank1_y0, self.tank1_x0 + self.tank_width, self.tank1_y0 + self.tank_height, outline="black", width=2)
-        self.canvas.create_text(self.tank1_x0 + self.tank_width//2, self.tank1_y0 - 15, text="Bồn 1 (Tank 1)")
-        # Vẽ bồn 2
-        self.canvas.create_rectangle(self.tank2_x0, self.tank1_y0, self.tank2_x0 + self.tank_width, self.tank1_y0 + self.tank_height, outline="black", width=2)
-        self.canvas.create_text(self.tank2_x0 + self.tank_width//2, self.tank1_y0 - 15, text="Bồn 2 (Tank 2)")
-        # Ống nối
-        self.pipe_y = self.tank1_y0 + int(self.tank_height * 0.75) # Lưu pipe_y
-        self.canvas.create_line(self.tank1_x0 + self.tank_width, self.pipe_y, self.tank2_x0, self.pipe_y, width=10, fill="gray")
-        # Ống ra
-        self.out_pipe_y = self.tank1_y0 + self.tank_height - 10 # Lưu out_pipe_y
-        self.canvas.create_line(self.tank1_x0, self.out_pipe_y, self.tank1_x0 - 30, self.out_pipe_y + 10, width=8, fill="gray")
-        self.canvas.create_line(self.tank2_x0, self.out_pipe_y, self.tank2_x0 - 30, self.out_pipe_y + 10, width=8, fill="gray")
-        # Van (Cải thiện hiển thị van, dùng hình chữ nhật và vị trí chính xác)
-        valve_size = 25 # Kích thước van
-        
-        def valve_color(opening):
-            if opening < 10:
-                return "#d32f2f"
-            elif opening < 70:
-                return "#fbc02d"
-            else:
-                return "#388e3c"
-        
-        valve1_val = self.valve1_var.get() if hasattr(self, 'valve1_var') else self.valve1_open
-        valve2_val = self.valve2_var.get() if hasattr(self, 'valve2_var') else self.valve2_open
-
-        # Tính toán tọa độ trung tâm của van (cuối đường ống thoát nước)
-        valve1_center_x = self.tank1_x0 - 30
-        valve1_center_y = self.out_pipe_y + 10
-        valve2_center_x = self.tank2_x0 - 30
-        valve2_center_y = self.out_pipe_y + 10
-
-        # Van 1 (vẽ hình chữ nhật)
-        self.valve1_rect = self.canvas.create_rectangle(
-            valve1_center_x - valve_size/2, valve1_center_y - valve_size/2,
-            valve1_center_x + valve_size/2, valve1_center_y + valve_size/2,
-            fill=valve_color(valve1_val), outline="black", width=2
-        )
-        self.canvas.create_text(valve1_center_x, valve1_center_y + valve_size, text="V1", font=("Arial", 12, "bold"))
-
-        # Van 2 (vẽ hình chữ nhật)
-        self.valve2_rect = self.canvas.create_rectangle(
-            valve2_center_x - valve_size/2, valve2_center_y - valve_size/2,
-            valve2_center_x + valve_size/2, valve2_center_y + valve_size/2,
-            fill=valve_color(valve2_val), outline="black", width=2
-        )
-        self.canvas.create_text(valve2_center_x, valve2_center_y + valve_size, text="V2", font=("Arial", 12, "bold"))
-
-        # Ống vào
-        self.canvas.create_line(self.tank1_x0 + 20, self.tank1_y0, self.tank1_x0 + 20, self.tank1_y0 - 30, width=8, fill="gray", arrow=tk.LAST)
-        self.canvas.create_text(self.tank1_x0 + 20, self.tank1_y0 - 40, text="Qi1")
-        # Mực nước
+        self.pipe_y = self.tank1_y0 + int(self.tank_height * 0.75)
+        self.out_pipe_y = self.tank1_y0 + self.tank_height - 10
+        x1, x2, y0 = self.tank1_x0, self.tank2_x0, self.tank1_y0
+        tank_w, bottom = self.tank_width, self.tank1_y0 + self.tank_height
+        # Quy đổi mực nước (cm) sang pixel và các điểm phát/giới hạn của hạt nước, dùng ở mỗi khung hình
+        self.level_scale = self.tank_height / self.tank_system.max_height
+        self.tank_bottom = bottom
+        self.particle_bounds = (x1 - 100, x2 + tank_w + 100, bottom + 50)
+
+        valve_size = 25
+        valve_y = self.out_pipe_y + 10  # Van ở cuối đường ống thoát nước
+        layout = {
+            'tank1': (x1, y0, x1 + tank_w, bottom),
+            'tank1_label': (x1 + tank_w // 2, y0 - 15),
+            'tank2': (x2, y0, x2 + tank_w, bottom),
+            'tank2_label': (x2 + tank_w // 2, y0 - 15),
+            'pipe': (x1 + tank_w, self.pipe_y, x2, self.pipe_y),
+            'out_pipe1': (x1, self.out_pipe_y, x1 - 30, valve_y),
+            'out_pipe2': (x2, self.out_pipe_y, x2 - 30, valve_y),
+            'inlet': (x1 + 20, y0, x1 + 20, y0 - 30),
+            'inlet_label': (x1 + 20, y0 - 40),
+        }
+        for valve, x in (('valve1', x1 - 30), ('valve2', x2 - 30)):
+            layout[valve] = (x - valve_size / 2, valve_y - valve_size / 2, x + valve_size / 2, valve_y + valve_size / 2)
+            layout[valve + '_label'] = (x, valve_y + valve_size)
+        for name, coords in layout.items():
+            self.canvas.coords(self.scene[name], *coords)
+
+        # Hạt nước giữ nguyên item, chỉ co giãn vị trí theo kích thước mới
+        if old_size is not None and old_size[0] > 0 and old_size[1] > 0:
+            sx, sy = w / old_size[0], h / old_size[1]
+            for particle in self.flow_particles:
+                if not particle['active']:
+                    continue
+                particle['x'] *= sx
+                particle['y'] *= sy
+                self.canvas.coords(particle['id'], particle['x'] - 2, particle['y'] - 2,
+                                   particle['x'] + 2, particle['y'] + 2)
+        self._drawn_levels = None  # Buộc update_water_display đặt lại mực nước theo bố cục mới
         h1, h2 = self.tank_system.get_levels()
-        level1_px = (h1 / self.tank_system.max_height) * self.tank_height
-        level2_px = (h2 / self.tank_system.max_height) * self.tank_height
-        y1 = self.tank1_y0 + self.tank_height - level1_px
-        y2 = self.tank1_y0 + self.tank_height - level2_px
-        self.water1_rect = self.canvas.create_rectangle(self.tank1_x0, y1, self.tank1_x0 + self.tank_width, self.tank1_y0 + self.tank_height, fill="lightblue", outline="")
-        self.water2_rect = self.canvas.create_rectangle(self.tank2_x0, y2, self.tank2_x0 + self.tank_width, self.tank1_y0 + self.tank_height, fill="lightblue", outline="")
-        # Đường setpoint
-        setpoint_h = self.setpoint_var.get()
-        setpoint_px = (setpoint_h / self.tank_system.max_height) * self.tank_height
-        setpoint_y = self.tank1_y0 + self.tank_height - setpoint_px
-        self.setpoint_line = self.canvas.create_line(self.tank2_x0 - 5, setpoint_y, self.tank2_x0 + self.tank_width + 5, setpoint_y, fill="red", dash=(4, 2), width=2)
-        # Vẽ lại các hạt nước động (chỉ cập nhật vị trí, không tạo mới)
-        for particle in self.flow_particles:
-            if not particle['active']:
-                continue
-            # Cần tính toán lại vị trí tương đối của hạt nước nếu muốn chúng scale theo canvas
-            # Hiện tại, chỉ cập nhật tọa độ tuyệt đối mà chúng đã có
-            self.canvas.coords(
-                particle['id'],
-                particle['x']-2, particle['y']-2,
-                particle['x']+2, particle['y']+2
-            )
+        self.update_water_display(h1, h2)
 
     def _create_operate_tab(self, tab):
         # Configure the tab to expand to fill the notebook
@@ -722,8 +2612,8 @@ class SimulationGUI:
         self.canvas = tk.Canvas(canvas_frame, bg="white", bd=2, relief="groove")
         self.canvas.grid(row=0, column=0, sticky="nsew")
         
-        # Gắn sự kiện cấu hình để vẽ lại bồn nước khi thay đổi kích thước
-        self.canvas.bind("<Configure>", lambda e: self.draw_tanks())
+        # Bố trí lại sơ đồ khi thay đổi kích thước (gom các sự kiện liên tiếp, xem _on_canvas_configure)
+        self.canvas.bind("<Configure>", self._on_canvas_configure)
         
         # --- Controls frame for this tab (Start/Stop/Reset/Disturbance) ---
         controls_frame = ttk.LabelFrame(main_frame, text="Điều khiển Chung", padding="10")
@@ -748,6 +2638,10 @@ class SimulationGUI:
         self.disturbance_button = ttk.Button(controls_frame, text="Tạo Nhiễu", command=self.trigger_disturbance)
         self.disturbance_button.grid(row=button_row+1, column=0, sticky=tk.NSEW, pady=5, padx=2)
 
+        button_row += 2
+        ttk.Checkbutton(controls_frame, text="So sánh song song các bộ điều khiển", variable=self.compare_var,
+                        command=self._toggle_comparison).grid(row=button_row, column=0, sticky=tk.W, pady=5)
+
         # --- Information Display ---
         info_frame = ttk.LabelFrame(main_frame, text="Thông tin Trạng thái", padding="10")
         info_frame.grid(row=1, column=0, columnspan=2, sticky="nsew", padx=5, pady=5)
@@ -774,12 +2668,16 @@ class SimulationGUI:
         graph_frame.grid_rowconfigure(0, weight=1)
         graph_frame.grid_columnconfigure(0, weight=1)
 
-        self._setup_graph(graph_frame)
+        # Biểu đồ (và việc nạp matplotlib) để sau lần vẽ đầu tiên, xem _ensure_graph
+        self.graph_frame = graph_frame
+        self.graph_placeholder = ttk.Label(graph_frame, text="Đang tải biểu đồ...")
+        self.graph_placeholder.pack(expand=True)
 
         # KPIs frame
         self.kpi_frame = ttk.LabelFrame(graph_kpi_frame, text="Các chỉ số Hiệu năng (KPIs)", padding="10")
         self.kpi_frame.grid(row=1, column=0, sticky="nsew")
-        # Tạm thời để trống, sẽ điền sau
+        self.compare_label = ttk.Label(self.kpi_frame, text="", font=("Courier", 9), justify=tk.LEFT)
+        self.compare_label.pack(anchor=tk.W)
 
     def _create_pid_tab(self, tab):
         controls_frame = ttk.LabelFrame(tab, text="Bảng Điều Khiển PID", padding="10")
@@ -792,9 +2690,8 @@ class SimulationGUI:
         row_idx = 0
         # Combobox chọn bộ điều khiển
         ttk.Label(controls_frame, text="Chọn Bộ Điều Khiển:").grid(row=row_idx, column=0, sticky=tk.W, pady=5, padx=5)
-        self.controller_var = tk.StringVar(value="PID Truyền Thống")
         self.controller_combo = ttk.Combobox(controls_frame, textvariable=self.controller_var, state="readonly", 
-                                             values=["PID Truyền Thống", "PID Logic Mờ"])
+                                             values=list(self.CONTROLLER_CHOICES))
         self.controller_combo.grid(row=row_idx, column=1, sticky=(tk.W, tk.E), padx=5, pady=5, columnspan=2) # Span across slider and value columns
         self.controller_combo.bind("<<ComboboxSelected>>", self._on_controller_change)
         row_idx += 1
@@ -826,14 +2723,12 @@ class SimulationGUI:
 
         # Thanh trượt Van điều khiển
         ttk.Label(controls_frame, text="Độ mở Van 1 (%):").grid(row=row_idx, column=0, sticky=tk.W, pady=2, padx=5)
-        self.valve1_var = tk.DoubleVar(value=self.valve1_open)
         ttk.Scale(controls_frame, from_=0, to=100, orient=tk.HORIZONTAL, variable=self.valve1_var, command=self.update_valve_openings).grid(row=row_idx, column=1, sticky=tk.EW, padx=5, pady=2)
         self.valve1_label = ttk.Label(controls_frame, text=f"{self.valve1_var.get():.0f}%")
         self.valve1_label.grid(row=row_idx, column=2, padx=5)
         row_idx += 1
 
         ttk.Label(controls_frame, text="Độ mở Van 2 (%):").grid(row=row_idx, column=0, sticky=tk.W, pady=2, padx=5)
-        self.valve2_var = tk.DoubleVar(value=self.valve2_open)
         ttk.Scale(controls_frame, from_=0, to=100, orient=tk.HORIZONTAL, variable=self.valve2_var, command=self.update_valve_openings).grid(row=row_idx, column=1, sticky=tk.EW, padx=5, pady=2)
         self.valve2_label = ttk.Label(controls_frame, text=f"{self.valve2_var.get():.0f}%")
         self.valve2_label.grid(row=row_idx, column=2, padx=5)
@@ -845,6 +2740,12 @@ class SimulationGUI:
         relay_spinbox.grid(row=row_idx, column=1, sticky=tk.W, padx=5, pady=2)
         row_idx += 1
 
+        # Trễ relay: hệ hai bồn không có điểm tới hạn hữu hạn nên Ku/Tu phụ thuộc ε (xem RelayAutoTuner)
+        ttk.Label(controls_frame, text="Trễ Relay ε (cm):").grid(row=row_idx, column=0, sticky=tk.W, pady=2, padx=5)
+        hysteresis_spinbox = ttk.Spinbox(controls_frame, from_=0.02, to=2.0, increment=0.02, textvariable=self.relay_hysteresis_var, width=10)
+        hysteresis_spinbox.grid(row=row_idx, column=1, sticky=tk.W, padx=5, pady=2)
+        row_idx += 1
+
         # Nút tự động tinh chỉnh (Module B)
         ttk.Separator(controls_frame, orient=tk.HORIZONTAL).grid(row=row_idx, columnspan=3, sticky=tk.EW, pady=10)
         row_idx += 1
@@ -852,9 +2753,40 @@ class SimulationGUI:
         self.autotune_button.grid(row=row_idx, column=0, columnspan=3, sticky=tk.EW, pady=5, padx=5)
         self.autotune_status_label = ttk.Label(controls_frame, text="")
         self.autotune_status_label.grid(row=row_idx+1, column=0, columnspan=3, sticky=tk.W, padx=5)
+        ttk.Checkbutton(controls_frame, text="Dùng kết quả đã lưu nếu cấu hình trùng", variable=self.autotune_cache_var
+                        ).grid(row=row_idx+2, column=0, columnspan=3, sticky=tk.W, padx=5)
+
+    FUZZY_SURFACE_OUTPUTS = ('Kp', 'Ki', 'Kd')
 
     def _create_fuzzy_tab(self, tab):
-        fuzzy_frame = ttk.LabelFrame(tab, text="Bảng Luật Mờ (Kp, Ki, Kd)", padding="10")
+        """
+        Tab Logic Mờ: bảng luật (bấm vào ô để sửa), trình sửa hàm thành viên và bản đồ nhiệt
+        bề mặt Kp/Ki/Kd(E, CE). Mọi thay đổi áp dụng ngay cho cả hai bộ Fuzzy PID (Mamdani và
+        Sugeno); bề mặt chỉ tính lại vùng bị ảnh hưởng (fuzzy_surface.ControlSurface).
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        # Add explanation frame
+        explanation_frame = ttk.LabelFrame(tab, text="Giải thích Thuật ngữ Ngôn ngữ", padding="10")
+        explanation_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
+        
+        explanation_text = """
+        NB = Negative Big (Âm lớn), NM = Negative Medium (Âm trung bình), NS = Negative Small (Âm nhỏ)
+        ZO = Zero (Không), PS = Positive Small (Dương nhỏ), PM = Positive Medium (Dương trung bình), PB = Positive Big (Dương lớn)
+        
+        Bảng luật mờ này định nghĩa cách điều chỉnh các hệ số Kp, Ki, Kd dựa trên sai số (E) và tốc độ thay đổi sai số (CE).
+        Ví dụ: Khi E=NB (sai số âm lớn) và CE=NB (tốc độ thay đổi âm lớn), bộ điều khiển sẽ sử dụng Kp=PB, Ki=NB, Kd=PS.
+        """
+        
+        ttk.Label(explanation_frame, text=explanation_text, justify=tk.LEFT, wraplength=800).pack(anchor=tk.W)
+
+        left = ttk.Frame(tab)
+        left.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        right = ttk.Frame(tab)
+        right.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        fuzzy_frame = ttk.LabelFrame(left, text="Bảng Luật Mờ (Kp, Ki, Kd)", padding="10")
         fuzzy_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
         # Tạo frame chứa lưới (có thể cuộn nếu cần)
@@ -879,6 +2811,7 @@ class SimulationGUI:
 
         # Hiển thị bảng luật mờ dựa trên các thuật ngữ ngôn ngữ
         linguistic_terms = self.fuzzy_controller.linguistic_terms
+        ttk.Style().configure('SelectedRule.TLabel', background='#cce0ff')
         
         # Header row
         ttk.Label(scrollable_frame, text="Error (E) \\ CE", relief="solid", borderwidth=1, 
@@ -888,36 +2821,318 @@ class SimulationGUI:
                      width=12, justify=tk.CENTER).grid(row=0, column=j+1, padx=1, pady=1)
         
         # Data rows
+        self.rule_cells = {}
         for i, e_term in enumerate(linguistic_terms):
             ttk.Label(scrollable_frame, text=e_term, relief="solid", borderwidth=1, 
                      width=12, justify=tk.CENTER).grid(row=i+1, column=0, padx=1, pady=1)
             for j, ce_term in enumerate(linguistic_terms):
-                # Get rule output from rule base
-                if (e_term, ce_term) in self.fuzzy_controller.rule_base:
-                    kp_term, ki_term, kd_term = self.fuzzy_controller.rule_base[(e_term, ce_term)]
-                    rule_text = f"Kp={kp_term}\nKi={ki_term}\nKd={kd_term}"
-                else:
-                    rule_text = "N/A"
-                
-                ttk.Label(scrollable_frame, text=rule_text, borderwidth=1, relief="solid", 
-                         width=12, justify=tk.CENTER).grid(row=i+1, column=j+1, padx=1, pady=1)
-        
-        # Add explanation frame
-        explanation_frame = ttk.LabelFrame(tab, text="Giải thích Thuật ngữ Ngôn ngữ", padding="10")
-        explanation_frame.pack(fill=tk.X, padx=10, pady=5)
-        
-        explanation_text = """
-        NB = Negative Big (Âm lớn), NM = Negative Medium (Âm trung bình), NS = Negative Small (Âm nhỏ)
-        ZO = Zero (Không), PS = Positive Small (Dương nhỏ), PM = Positive Medium (Dương trung bình), PB = Positive Big (Dương lớn)
-        
-        Bảng luật mờ này định nghĩa cách điều chỉnh các hệ số Kp, Ki, Kd dựa trên sai số (E) và tốc độ thay đổi sai số (CE).
-        Ví dụ: Khi E=NB (sai số âm lớn) và CE=NB (tốc độ thay đổi âm lớn), bộ điều khiển sẽ sử dụng Kp=PB, Ki=NB, Kd=PS.
-        """
-        
-        ttk.Label(explanation_frame, text=explanation_text, justify=tk.LEFT, wraplength=800).pack(anchor=tk.W)
+                cell = ttk.Label(scrollable_frame, text=self._rule_text(e_term, ce_term), borderwidth=1,
+                                 relief="solid", width=12, justify=tk.CENTER, cursor="hand2")
+                cell.grid(row=i+1, column=j+1, padx=1, pady=1)
+                cell.bind("<Button-1>", lambda event, key=(e_term, ce_term): self._select_rule(*key))
+                self.rule_cells[(e_term, ce_term)] = cell
+
+        # Sửa luật đang chọn
+        rule_edit = ttk.LabelFrame(left, text="Sửa luật", padding=5)
+        rule_edit.pack(fill=tk.X, padx=10, pady=5)
+        self.rule_edit_label = ttk.Label(rule_edit, text="Bấm vào một ô của bảng luật", width=22)
+        self.rule_edit_label.pack(side=tk.LEFT, padx=5)
+        self.selected_rule = None
+        self.rule_output_vars = []
+        for name in self.FUZZY_SURFACE_OUTPUTS:
+            ttk.Label(rule_edit, text=f"{name}:").pack(side=tk.LEFT, padx=(10, 2))
+            var = tk.StringVar()
+            combo = ttk.Combobox(rule_edit, textvariable=var, state="readonly", width=5, values=linguistic_terms)
+            combo.pack(side=tk.LEFT)
+            combo.bind("<<ComboboxSelected>>", self._apply_rule_edit)
+            self.rule_output_vars.append(var)
+
+        # Sửa hàm thành viên tam giác (a, b, c)
+        mf_edit = ttk.LabelFrame(left, text="Hàm thành viên tam giác (a, b, c)", padding=5)
+        mf_edit.pack(fill=tk.X, padx=10, pady=5)
+        self.mf_variable_var = tk.StringVar(value='E')
+        self.mf_term_var = tk.StringVar(value='ZO')
+        for var, values, width in ((self.mf_variable_var, list(FuzzyPIDController.MF_VARIABLES), 4),
+                                   (self.mf_term_var, linguistic_terms, 5)):
+            combo = ttk.Combobox(mf_edit, textvariable=var, state="readonly", width=width, values=values)
+            combo.pack(side=tk.LEFT, padx=2)
+            combo.bind("<<ComboboxSelected>>", self._load_membership_params)
+        self.mf_param_vars = []
+        self.mf_spinboxes = []
+        for name in ('a', 'b', 'c'):
+            ttk.Label(mf_edit, text=f"{name}:").pack(side=tk.LEFT, padx=(8, 2))
+            var = tk.DoubleVar()
+            spinbox = ttk.Spinbox(mf_edit, textvariable=var, width=7, command=self._apply_membership_edit)
+            spinbox.pack(side=tk.LEFT)
+            spinbox.bind("<Return>", self._apply_membership_edit)
+            self.mf_param_vars.append(var)
+            self.mf_spinboxes.append(spinbox)
+        ttk.Button(mf_edit, text="Khôi phục mặc định", command=self._reset_fuzzy_configuration
+                   ).pack(side=tk.LEFT, padx=10)
+        self.mf_status_label = ttk.Label(left, text="")
+        self.mf_status_label.pack(anchor=tk.W, padx=10)
+        self._load_membership_params()
+
+        # Bản đồ nhiệt bề mặt điều khiển
+        surface_controls = ttk.Frame(right)
+        surface_controls.pack(fill=tk.X, pady=(10, 0))
+        self.surface_output_var = tk.StringVar(value='Kp')
+        for name in self.FUZZY_SURFACE_OUTPUTS:
+            ttk.Radiobutton(surface_controls, text=name, value=name, variable=self.surface_output_var,
+                            command=self._refresh_fuzzy_surface).pack(side=tk.LEFT, padx=5)
+        ttk.Label(surface_controls, text="Suy luận:").pack(side=tk.LEFT, padx=(15, 5))
+        self.surface_inference_var = tk.StringVar(value='mamdani')
+        for value, text in (('mamdani', "Mamdani"), ('sugeno', "Sugeno")):
+            ttk.Radiobutton(surface_controls, text=text, value=value, variable=self.surface_inference_var,
+                            command=self._refresh_fuzzy_surface).pack(side=tk.LEFT, padx=5)
+        self.surface_status_label = ttk.Label(right, text="")
+        self.surface_status_label.pack(side=tk.BOTTOM, anchor=tk.W)
+
+        self.fuzzy_surfaces = {}  # 'mamdani'/'sugeno' -> ControlSurface, tạo khi hiển thị lần đầu
+        self.surface_image = None
+        self.surface_region = None
+        self.surface_fig = Figure(figsize=(5, 4), dpi=100)
+        self.ax_surface = self.surface_fig.add_subplot(111)
+        self.surface_canvas = FigureCanvasTkAgg(self.surface_fig, right)
+        self.surface_canvas.get_tk_widget().pack(expand=True, fill=tk.BOTH)
+
+    def _rule_text(self, e_term, ce_term):
+        rule = self.fuzzy_controller.rule_base.get((e_term, ce_term))
+        if rule is None:
+            return "N/A"
+        kp_term, ki_term, kd_term = rule
+        return f"Kp={kp_term}\nKi={ki_term}\nKd={kd_term}"
+
+    def _fuzzy_editable(self):
+        """Các đối tượng nhận thay đổi: bề mặt đã tạo (để đánh dấu vùng), nếu không thì bộ điều khiển."""
+        return [self.fuzzy_surfaces.get(controller.inference, controller)
+                for controller in (self.fuzzy_controller, self.sugeno_controller)]
+
+    def _select_rule(self, e_term, ce_term):
+        if self.selected_rule is not None:
+            self.rule_cells[self.selected_rule].configure(style='TLabel')
+        self.selected_rule = (e_term, ce_term)
+        self.rule_cells[self.selected_rule].configure(style='SelectedRule.TLabel')
+        self.rule_edit_label.config(text=f"Luật E={e_term}, CE={ce_term}")
+        for var, term in zip(self.rule_output_vars, self.fuzzy_controller.rule_base.get((e_term, ce_term), ())):
+            var.set(term)
+
+    def _apply_rule_edit(self, event=None):
+        if self.selected_rule is None or not all(var.get() for var in self.rule_output_vars):
+            return
+        outputs = tuple(var.get() for var in self.rule_output_vars)
+        for target in self._fuzzy_editable():
+            target.set_rule(*self.selected_rule, outputs)
+        self.rule_cells[self.selected_rule].config(text=self._rule_text(*self.selected_rule))
+        self._refresh_fuzzy_surface()
+
+    def _load_membership_params(self, event=None):
+        """Nạp (a, b, c) của biến/thuật ngữ đang chọn vào các ô nhập; giới hạn theo tập nền."""
+        params_attr, _, universe_attr = FuzzyPIDController.MF_VARIABLES[self.mf_variable_var.get()]
+        universe = getattr(self.fuzzy_controller, universe_attr)
+        params = getattr(self.fuzzy_controller, params_attr)[self.mf_term_var.get()]
+        increment = (universe[-1] - universe[0]) / 100.0
+        for spinbox, var, value in zip(self.mf_spinboxes, self.mf_param_vars, params):
+            spinbox.configure(from_=universe[0], to=universe[-1], increment=increment)
+            var.set(value)
+
+    def _apply_membership_edit(self, event=None):
+        variable, term = self.mf_variable_var.get(), self.mf_term_var.get()
+        try:
+            params = tuple(var.get() for var in self.mf_param_vars)
+            for target in self._fuzzy_editable():
+                target.set_membership(variable, term, params)
+        except (tk.TclError, ValueError) as e:
+            self.mf_status_label.config(text=f"Không áp dụng: {e}")
+            return
+        self.mf_status_label.config(text=f"{variable} {term} = ({params[0]:g}, {params[1]:g}, {params[2]:g})")
+        self._refresh_fuzzy_surface()
+
+    def _reset_fuzzy_configuration(self):
+        for controller in (self.fuzzy_controller, self.sugeno_controller):
+            controller.reset_configuration()
+        for surface in self.fuzzy_surfaces.values():
+            surface.invalidate_all()
+        for key, cell in self.rule_cells.items():
+            cell.config(text=self._rule_text(*key))
+        if self.selected_rule is not None:
+            self._select_rule(*self.selected_rule)
+        self._load_membership_params()
+        self.mf_status_label.config(text="Đã khôi phục hàm thành viên và bảng luật mặc định")
+        self._refresh_fuzzy_surface()
+
+    def _refresh_fuzzy_surface(self):
+        """Tính lại vùng bị đánh dấu của bề mặt đang xem rồi cập nhật bản đồ nhiệt."""
+        from fuzzy_surface import ControlSurface
+        from matplotlib.patches import Rectangle
+
+        inference = self.surface_inference_var.get()
+        surface = self.fuzzy_surfaces.get(inference)
+        if surface is None:
+            controller = self.sugeno_controller if inference == 'sugeno' else self.fuzzy_controller
+            surface = self.fuzzy_surfaces[inference] = ControlSurface(controller)
+        count = surface.refresh()
+
+        output = self.surface_output_var.get()
+        data = surface.gains[self.FUZZY_SURFACE_OUTPUTS.index(output)].T  # Hàng = CE, cột = E
+        extent = (surface.e[0], surface.e[-1], surface.ce[0], surface.ce[-1])
+        if self.surface_image is None:
+            self.surface_image = self.ax_surface.imshow(data, origin='lower', extent=extent, aspect='auto',
+                                                        cmap='viridis', interpolation='nearest')
+            self.surface_fig.colorbar(self.surface_image, ax=self.ax_surface)
+            self.ax_surface.set_xlabel('Sai số E (cm)')
+            self.ax_surface.set_ylabel('Tốc độ thay đổi sai số CE (cm/s)')
+            self.surface_region = self.ax_surface.add_patch(
+                Rectangle((0, 0), 0, 0, fill=False, edgecolor='r', linewidth=1.2, visible=False))
+        else:
+            self.surface_image.set_data(data)
+        self.surface_image.set_clim(data.min(), max(data.max(), data.min() + 1e-9))
+        self.ax_surface.set_title(f"Bề mặt {output}(E, CE) — {inference.capitalize()}")
+
+        # Khung đỏ: vùng vừa tính lại (ẩn khi tính lại toàn bộ hoặc không có gì thay đổi)
+        if 0 < count < surface.size:
+            r0, r1, c0, c1 = surface.last_region
+            de = (surface.e[1] - surface.e[0]) / 2
+            dce = (surface.ce[1] - surface.ce[0]) / 2
+            self.surface_region.set_bounds(surface.e[r0] - de, surface.ce[c0] - dce,
+                                           surface.e[r1] - surface.e[r0] + 2 * de,
+                                           surface.ce[c1] - surface.ce[c0] + 2 * dce)
+            self.surface_region.set_visible(True)
+        elif count:
+            self.surface_region.set_visible(False)
+        self.surface_canvas.draw_idle()
+        if count:
+            self.surface_status_label.config(
+                text=f"Tính lại {count}/{surface.size} điểm trong {surface.last_elapsed_ms:.1f} ms")
+
+    # Lưới setpoint của tab phân tích tần số (độ mở van lấy từ thanh trượt hiện tại)
+    ANALYSIS_SETPOINTS = np.arange(5.0, 40.0, 5.0)
+    ANALYSIS_GAIN_SOURCES = ("Thanh trượt PID", "Bảng lập lịch hệ số")
+
+    def _create_analysis_tab(self, tab):
+        """Tab Bode/Nyquist và độ dự trữ ổn định của PID trên lưới điểm làm việc."""
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        controls = ttk.Frame(tab)
+        controls.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(controls, text="Hệ số PID:").pack(side=tk.LEFT, padx=5)
+        self.analysis_gains_var = tk.StringVar(value=self.ANALYSIS_GAIN_SOURCES[0])
+        gains_combo = ttk.Combobox(controls, textvariable=self.analysis_gains_var, state="readonly", width=22,
+                                   values=self.ANALYSIS_GAIN_SOURCES)
+        gains_combo.pack(side=tk.LEFT)
+        gains_combo.bind("<<ComboboxSelected>>", self.run_frequency_analysis)
+        ttk.Button(controls, text="Phân tích", command=self.run_frequency_analysis).pack(side=tk.LEFT, padx=10)
+        self.analysis_status_label = ttk.Label(controls, text="")
+        self.analysis_status_label.pack(side=tk.LEFT, padx=5)
+
+        # Bảng độ dự trữ theo điểm làm việc
+        columns = ('sp', 'gm', 'pm', 'wc', 'bw')
+        self.analysis_table = ttk.Treeview(tab, columns=columns, show='headings', height=len(self.ANALYSIS_SETPOINTS))
+        for column, heading in zip(columns, ("Setpoint (cm)", "Dự trữ biên độ (dB)", "Dự trữ pha (°)",
+                                             "Tần số cắt (rad/s)", "Băng thông (rad/s)")):
+            self.analysis_table.heading(column, text=heading)
+            self.analysis_table.column(column, width=140, anchor=tk.CENTER)
+        self.analysis_table.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=5)
+
+        self.analysis_fig = Figure(figsize=(10, 5), dpi=100)
+        self.ax_bode_mag = self.analysis_fig.add_subplot(2, 2, 1)
+        self.ax_bode_phase = self.analysis_fig.add_subplot(2, 2, 3, sharex=self.ax_bode_mag)
+        self.ax_nyquist = self.analysis_fig.add_subplot(1, 2, 2)
+        self.analysis_canvas = FigureCanvasTkAgg(self.analysis_fig, tab)
+        self.analysis_canvas.get_tk_widget().pack(expand=True, fill=tk.BOTH, padx=10)
+
+    def _on_tab_changed(self, event=None):
+        pending = self._pending_tabs.pop(self.notebook.select(), None)
+        if pending is not None:
+            tab, create = pending
+            create(tab)
+        if self.notebook.select() == str(self.tab_analysis):
+            self.run_frequency_analysis()
+        elif self.notebook.select() == str(self.tab_fuzzy):
+            self._refresh_fuzzy_surface()
+
+    def run_frequency_analysis(self, event=None):
+        """Phân tích lưới setpoint tại độ mở van hiện tại và vẽ Bode, Nyquist, bảng độ dự trữ."""
+        from frequency_analysis import analyze, bode
+        from matplotlib import colormaps
+
+        setpoints = self.ANALYSIS_SETPOINTS
+        valve1, valve2 = self.tank_system.valve1_open, self.tank_system.valve2_open
+        if self.analysis_gains_var.get() == self.ANALYSIS_GAIN_SOURCES[1]:
+            table = self.scheduled_controller.table
+            gains = np.array([table.lookup(sp, valve1, valve2) for sp in setpoints]).T
+        else:
+            gains = (self.kp_var.get(), self.ki_var.get(), self.kd_var.get())
+        t0 = time.perf_counter()
+        result = analyze(self.tank_system, gains, setpoints, [valve1], [valve2], sample_time=self.dt)
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        omega, L = result['omega'], result['loop']
+        magnitude_db, phase = bode(L)
+
+        for ax in (self.ax_bode_mag, self.ax_bode_phase, self.ax_nyquist):
+            ax.clear()
+            ax.grid(True, alpha=0.3)
+        colors = colormaps['viridis'](np.linspace(0, 0.9, len(setpoints)))
+        for i, sp in enumerate(setpoints):
+            label = f"SP {sp:.0f} cm"
+            self.ax_bode_mag.semilogx(omega, magnitude_db[i], color=colors[i], label=label)
+            self.ax_bode_phase.semilogx(omega, phase[i], color=colors[i])
+            self.ax_nyquist.plot(L[i].real, L[i].imag, color=colors[i])
+        self.ax_bode_mag.axhline(0.0, color='k', linewidth=0.8)
+        self.ax_bode_phase.axhline(-180.0, color='k', linewidth=0.8)
+        self.ax_bode_mag.set_ylabel('|L| (dB)')
+        self.ax_bode_mag.set_title('Bode vòng hở L = C·G')
+        self.ax_bode_mag.legend(fontsize=7, loc='lower left')
+        self.ax_bode_phase.set_ylabel('Pha (°)')
+        self.ax_bode_phase.set_xlabel('Tần số (rad/s)')
+        # Nyquist quanh điểm tới hạn -1: phần tần số thấp (tích phân) đi ra vô cùng nên cắt khung
+        circle = np.exp(1j * np.linspace(0, 2 * np.pi, 100))
+        self.ax_nyquist.plot(circle.real, circle.imag, 'k:', linewidth=0.8)
+        self.ax_nyquist.plot([-1], [0], 'r+', markersize=12)
+        self.ax_nyquist.set_xlim(-3, 3)
+        self.ax_nyquist.set_ylim(-3, 3)
+        self.ax_nyquist.set_aspect('equal', adjustable='box')
+        self.ax_nyquist.set_title('Nyquist')
+        self.ax_nyquist.set_xlabel('Re')
+        self.ax_nyquist.set_ylabel('Im')
+        self.analysis_fig.tight_layout()
+        self.analysis_canvas.draw_idle()
+
+        self.analysis_table.delete(*self.analysis_table.get_children())
+        for i, sp in enumerate(setpoints):
+            self.analysis_table.insert('', tk.END, values=(
+                f"{sp:.0f}", f"{result['gain_margin_db'][i]:.1f}", f"{result['phase_margin'][i]:.1f}",
+                f"{result['crossover'][i]:.3f}", f"{result['bandwidth'][i]:.3f}"))
+        self.analysis_status_label.config(
+            text=f"Van 1: {valve1:.0f}%, van 2: {valve2:.0f}% — {len(setpoints)} điểm x {len(omega)} tần số "
+                 f"trong {elapsed_ms:.1f} ms")
+
+    # Các mức zoom của biểu đồ xu hướng (giây); None = toàn bộ lịch sử
+    GRAPH_WINDOWS = {"30 giây": 30.0, "2 phút": 120.0, "10 phút": 600.0,
+                     "1 giờ": 3600.0, "6 giờ": 21600.0, "Toàn bộ": None}
+
+    def _ensure_graph(self):
+        """Tạo biểu đồ nếu chưa có (sau lần vẽ đầu tiên, hoặc sớm hơn nếu có thao tác cần tới)."""
+        if self.graph_canvas is None:
+            self.graph_placeholder.destroy()
+            self._setup_graph(self.graph_frame)
 
     def _setup_graph(self, parent_frame):
         """Thiết lập biểu đồ matplotlib."""
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        # Thanh chọn khung thời gian (zoom)
+        zoom_frame = ttk.Frame(parent_frame)
+        zoom_frame.pack(fill=tk.X)
+        ttk.Label(zoom_frame, text="Khung thời gian:").pack(side=tk.LEFT, padx=5)
+        self.graph_window_var = tk.StringVar(value="30 giây")
+        window_combo = ttk.Combobox(zoom_frame, textvariable=self.graph_window_var, state="readonly", width=10,
+                                    values=list(self.GRAPH_WINDOWS))
+        window_combo.pack(side=tk.LEFT)
+        window_combo.bind("<<ComboboxSelected>>", self._on_graph_window_change)
+
         # Tạo figure và axes
         self.fig = Figure(figsize=(10, 4), dpi=100)
         self.ax = self.fig.add_subplot(111)
@@ -931,46 +3146,84 @@ class SimulationGUI:
         # Khởi tạo đường dữ liệu
         self.line_h2, = self.ax.plot([], [], 'b-', linewidth=2, label='Mực nước thực tế (H2)')
         self.line_setpoint, = self.ax.plot([], [], 'r--', linewidth=2, label='Giá trị mong muốn (Setpoint)')
+        self.line_h1, = self.ax.plot([], [], 'c-', linewidth=1, alpha=0.7, label='Mực nước bồn 1 (H1)')
+
+        # Trục phụ cho lưu lượng vào Qi1
+        self.ax_qi1 = self.ax.twinx()
+        self.ax_qi1.set_ylabel('Qi1 (cm³/s)')
+        self.ax_qi1.set_ylim(0, self.pid_controller.output_max * 1.05)
+        self.line_qi1, = self.ax_qi1.plot([], [], color='gray', linewidth=1, alpha=0.5, label='Lưu lượng vào (Qi1)')
         
         # Thiết lập legend
-        self.ax.legend()
+        self.ax.legend(handles=[self.line_h2, self.line_setpoint, self.line_h1, self.line_qi1], loc='upper left')
         
         # Tạo canvas matplotlib
         self.graph_canvas = FigureCanvasTkAgg(self.fig, parent_frame)
         self.graph_canvas.get_tk_widget().pack(expand=True, fill=tk.BOTH)
+        # Cuộn chuột trên biểu đồ để phóng to/thu nhỏ khung thời gian
+        self.graph_canvas.mpl_connect('scroll_event', self._on_graph_scroll)
+
+    def _on_graph_window_change(self, event=None):
+        self.graph_time_window = self.GRAPH_WINDOWS[self.graph_window_var.get()]
+        self._redraw_trend()
+
+    def _on_graph_scroll(self, event):
+        """Cuộn lên: thu hẹp khung thời gian; cuộn xuống: mở rộng."""
+        history = max(self.trend.end_time - self.trend.start_time, 30.0)
+        window = self.graph_time_window if self.graph_time_window is not None else history
+        window = window / 2 if event.button == 'up' else window * 2
+        if window >= history:
+            self.graph_time_window = None
+            self.graph_window_var.set("Toàn bộ")
+        else:
+            self.graph_time_window = max(5.0, window)
+            self.graph_window_var.set(f"{self.graph_time_window:.0f} giây")
+        self._redraw_trend()
+
+    def _redraw_trend(self):
+        """Vẽ lại biểu đồ từ kim tự tháp xu hướng cho khung thời gian hiện tại."""
+        self._ensure_graph()
+        if len(self.trend) == 0:
+            self.graph_canvas.draw_idle()
+            return
+        current_time = self.trend.end_time
+        if self.graph_time_window is None:
+            start_time = self.trend.start_time
+        else:
+            start_time = max(0, current_time - self.graph_time_window)
+        times, series = self.trend.query(start_time, current_time, self.graph_max_points)
+
+        self.line_h2.set_data(times, series['h2'])
+        self.line_setpoint.set_data(times, series['setpoint'])
+        self.line_h1.set_data(times, series['h1'])
+        self.line_qi1.set_data(times, series['qi1'])
+        if self.comparison is not None and len(self.compare_trend):
+            # Các làn so sánh chỉ thêm một đường H2 mỗi làn, dùng chung lần vẽ với biểu đồ chính
+            compare_times, compare_series = self.compare_trend.query(start_time, current_time, self.graph_max_points)
+            for name, line in self.compare_lines.items():
+                line.set_data(compare_times, compare_series[name])
+            if len(compare_times):
+                series = dict(series, **compare_series)
+
+        self.ax.set_xlim(start_time, max(current_time, start_time + 1e-6))
+        if len(times):
+            plotted = [series[key] for key in ('h2', 'setpoint', 'h1', *self.compare_lines) if key in series]
+            min_val = min(values.min() for values in plotted)
+            max_val = max(values.max() for values in plotted)
+            margin = (max_val - min_val) * 0.1 if max_val > min_val else 1
+            self.ax.set_ylim(max(0, min_val - margin), max_val + margin)
+        self.graph_canvas.draw_idle()
 
-    def _update_graph_data(self, time, h1, h2, setpoint):
+    def _update_graph_data(self, time, h1, h2, setpoint, qi1=0.0):
         """Cập nhật dữ liệu biểu đồ."""
+        self.trend.append(time, h1, h2, qi1, setpoint)
+        if self.comparison is not None:
+            levels = self.comparison.levels()
+            self.compare_trend.append(time, *(levels[name] for name in self.compare_trend.channels))
         self.time_data.append(time)
         self.h1_data.append(h1)  # Đảm bảo dòng này tồn tại
         self.h2_data.append(h2)
         self.setpoint_data.append(setpoint)
-        
-        # Giới hạn số điểm dữ liệu để tránh lag
-        if len(self.time_data) > self.max_data_points:
-            self.time_data = self.time_data[-self.max_data_points:]
-            self.h2_data = self.h2_data[-self.max_data_points:]
-            self.setpoint_data = self.setpoint_data[-self.max_data_points:]
-        
-        # Cập nhật đường dữ liệu
-        self.line_h2.set_data(self.time_data, self.h2_data)
-        self.line_setpoint.set_data(self.time_data, self.setpoint_data)
-        
-        # Tự động điều chỉnh trục với cửa sổ thời gian cuộn
-        if self.time_data:
-            current_time = max(self.time_data)
-            start_time = max(0, current_time - self.graph_time_window)
-            self.ax.set_xlim(start_time, current_time)
-            
-            all_data = self.h2_data + self.setpoint_data
-            if all_data:
-                min_val = min(all_data)
-                max_val = max(all_data)
-                margin = (max_val - min_val) * 0.1 if max_val > min_val else 1
-                self.ax.set_ylim(max(0, min_val - margin), max_val + margin)
-        
-        # Vẽ lại biểu đồ
-        self.graph_canvas.draw_idle()
 
     def _create_flow_particle(self, x, y, direction='down', speed=2):
         """Tạo một hạt nước cho hoạt họa dòng chảy."""
@@ -1000,7 +3253,7 @@ class SimulationGUI:
 
     def _animate_water_flow(self):
         """Hoạt họa dòng chảy nước."""
-        if not self.is_running:
+        if not self.is_running or self.layout_size is None:
             return
         
         # Lấy dữ liệu hiện tại
@@ -1125,6 +3378,7 @@ class SimulationGUI:
                     self.flow_particles.append(particle)
         
         # Cập nhật vị trí các hạt nước
+        x_min, x_max, y_max = self.particle_bounds
         for particle in self.flow_particles:
             if not particle['active']:
                 continue
@@ -1144,60 +3398,243 @@ class SimulationGUI:
                              particle['x']-2, particle['y']-2, 
                              particle['x']+2, particle['y']+2)
             
-            # Đánh dấu hạt không hoạt động nếu hết tuổi thọ hoặc ra khỏi màn hình
-            if (particle['life'] <= 0 or 
-                particle['y'] > self.tank1_y0 + self.tank_height + 50 or
-                particle['x'] < self.tank1_x0 - 100 or particle['x'] > self.tank2_x0 + self.tank_width + 100):
+            # Đánh dấu hạt không hoạt động nếu hết tuổi thọ hoặc ra khỏi vùng sơ đồ
+            if (particle['life'] <= 0 or particle['y'] > y_max or
+                particle['x'] < x_min or particle['x'] > x_max):
                 particle['active'] = False
                 # Ẩn hạt thay vì xóa
                 self.canvas.coords(particle['id'], 0, 0, 0, 0)
         
-        # Lên lịch cho frame tiếp theo
-        self.flow_animation_id = self.root.after(50, self._animate_water_flow)
+
+    def clear_tuning_cache(self):
+        n = len(self.tuning_cache)
+        try:
+            self.tuning_cache.clear()
+        except OSError as e:
+            messagebox.showerror("Lỗi", f"Không xóa được bộ nhớ đệm tinh chỉnh:\n{e}")
+            return
+        messagebox.showinfo("Tinh chỉnh", f"Đã xóa {n} kết quả tinh chỉnh đã lưu.\n({self.tuning_cache.path})")
+
+    def _toggle_shared_state(self):
+        """Bật/tắt công bố trạng thái và nhận lệnh qua bộ nhớ dùng chung."""
+        if self.shared_state_var.get():
+            try:
+                self.shared_publisher = SharedStatePublisher(DEFAULT_SHM_NAME)
+            except OSError as e:
+                self.shared_state_var.set(False)
+                messagebox.showerror("Lỗi", f"Không thể tạo khối nhớ dùng chung: {e}")
+                return
+            self._publish_shared_state()
+        elif self.shared_publisher is not None:
+            self.shared_publisher.close()
+            self.shared_publisher = None
+
+    def _on_close(self):
+        """Giải phóng tài nguyên ngoài tiến trình trước khi đóng cửa sổ."""
+        # Gỡ khối nhớ dùng chung để không để lại /dev/shm/<tên> sau khi thoát
+        if self.shared_publisher is not None:
+            self.shared_publisher.close()
+            self.shared_publisher = None
+        if self.branch_pool is not None:
+            self.branch_pool.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
+    def _publish_shared_state(self):
+        ts = self.tank_system
+        self.shared_publisher.publish(
+            (self.simulation_time, ts.H1, ts.H2, self._current_inflow() if self.is_running else 0.0,
+             self.setpoint_var.get(), ts.valve1_open, ts.valve2_open, float(ts.disturbance_active))
+            + controller_internals(self.active_controller))
+
+    def _apply_shared_commands(self):
+        """Áp dụng lệnh từ tiến trình ngoài qua các biến Tk để thanh trượt hiển thị đúng giá trị."""
+        for code, a, b in self.shared_publisher.poll_commands():
+            if code == CMD_SETPOINT:
+                self.setpoint_var.set(a)
+                self.update_pid_setpoint()
+            elif code == CMD_VALVES:
+                self.valve1_var.set(a)
+                self.valve2_var.set(b)
+                self.update_valve_openings()
+            elif code == CMD_DISTURBANCE:
+                self.tank_system.disturbance_flow = a
+                self.tank_system.disturbance_duration = b
+                self.trigger_disturbance()
+
+    def snapshot_state(self):
+        """Ảnh chụp trạng thái mô phỏng hiện tại (cùng định dạng SimulationEngine.snapshot())."""
+        engine = SimulationEngine(self.active_controller, self.tank_system, self.dt)
+        engine.simulation_time = self.simulation_time
+        engine.last_inflow = self._current_inflow() if self.is_running else 0.0
+        return engine.snapshot()
+
+    WHAT_IF_DURATION = 60.0  # Thời gian mô phỏng mỗi nhánh (giây)
+
+    def fork_what_if(self):
+        """Chạy song song các nhánh what-if từ trạng thái hiện tại, không dừng mô phỏng đang chạy."""
+        from scenario_runner import run_branch, default_branches
+        from worker_pool import WarmWorkerPool
+
+        if self.auto_tuning_active:
+            messagebox.showwarning("Cảnh báo", "Không thể rẽ nhánh khi đang tự động tinh chỉnh.")
+            return
+        if self.branch_futures is not None:
+            messagebox.showinfo("Thông báo", "Các nhánh what-if trước vẫn đang chạy.")
+            return
+        snapshot = self.snapshot_state()
+        branches = default_branches(snapshot)
+        if self.branch_pool is None:
+            # Giữ pool lại giữa các lần rẽ nhánh để không phải khởi động lại tiến trình con;
+            # bảng MF/luật mờ được ánh xạ qua bộ nhớ dùng chung thay vì dựng lại ở mỗi nhánh
+            self.branch_pool = WarmWorkerPool(min(os.cpu_count() or 1, len(branches)),
+                                              fuzzy_controller=self.fuzzy_controller)
+        else:
+            self.branch_pool.publish_fuzzy_tables(self.fuzzy_controller)
+        self.branch_futures = [self.branch_pool.submit(run_branch, snapshot, branch, self.WHAT_IF_DURATION)
+                               for branch in branches]
+        self._fork_time = snapshot['time']
+        self.root.after(100, self._poll_what_if)
+
+    def _poll_what_if(self):
+        if not all(future.done() for future in self.branch_futures):
+            self.root.after(100, self._poll_what_if)
+            return
+        futures, self.branch_futures = self.branch_futures, None
+        lines = [f"Rẽ nhánh tại t = {self._fork_time:.1f} s, mỗi nhánh {self.WHAT_IF_DURATION:.0f} s:", ""]
+        for future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                lines.append(f"lỗi: {e}")
+                continue
+            m = result['metrics']
+            settling = f"{m['settling_time']:.1f} s" if m['settling_time'] is not None else "chưa ổn định"
+            lines.append(f"{result['name']}: IAE={m['iae']:.1f}, vọt lố={m['max_overshoot']:.2f} cm, "
+                         f"xác lập={settling}, H2 cuối={result['final_state']['H2']:.2f} cm")
+        from worker_pool import format_stats
+        lines += ["", f"Pool: {format_stats(self.branch_pool.stats())}"]
+        messagebox.showinfo("Kết quả what-if", "\n".join(lines))
+
+    COMPARE_LANE_LABELS = {'pid': 'PID', 'fuzzy': 'Fuzzy PID', 'mpc': 'MPC', 'scheduled': 'PID lập lịch'}
+    COMPARE_LINE_STYLES = ('m-', 'g-', 'y-', 'k-')
+
+    def _toggle_comparison(self):
+        """
+        Bật/tắt so sánh lockstep. Làn của bộ điều khiển đang chọn chạy trên chính hệ bồn của
+        GUI (canvas và hoạt họa không đổi); các bộ còn lại chạy trên bản sao và chỉ thêm một
+        đường H2 vào biểu đồ. Mọi bộ điều khiển được đặt lại để cùng xuất phát từ trạng thái hiện tại.
+        """
+        from lockstep_compare import ControllerComparison
+
+        self._stop_comparison()
+        if not self.compare_var.get():
+            return
+        if self.auto_tuning_active:
+            self.compare_var.set(False)
+            messagebox.showwarning("Cảnh báo", "Không thể so sánh khi đang tự động tinh chỉnh.")
+            return
+
+        primary = self.active_controller.controller_type
+        set_point = self.setpoint_var.get()
+        controllers = {}
+        for controller_type in CONTROLLER_TYPES:
+            if controller_type == primary:
+                controllers[controller_type] = self.active_controller
+            else:
+                gains = {'Kp': self.kp_var.get(), 'Ki': self.ki_var.get(), 'Kd': self.kd_var.get()}
+                controllers[controller_type] = create_controller(controller_type, set_point, gains,
+                                                                 plant=self.tank_system)
+        self.comparison = ControllerComparison(self.tank_system, controllers, self.dt, self.simulation_time, primary)
+
+        others = tuple(name for name in controllers if name != primary)
+        self.compare_trend = TrendPyramid(others)
+        self._ensure_graph()
+        for name, style in zip(others, self.COMPARE_LINE_STYLES):
+            self.compare_lines[name], = self.ax.plot([], [], style, linewidth=1.5,
+                                                     label=f"H2 ({self.COMPARE_LANE_LABELS.get(name, name)})")
+        self.line_h2.set_label(f"Mực nước thực tế (H2, {self.COMPARE_LANE_LABELS.get(primary, primary)})")
+        self._refresh_graph_legend()
+        self._refresh_comparison_label()
+
+    def _stop_comparison(self):
+        if self.comparison is None:
+            return
+        self.comparison = None
+        self.compare_trend = None
+        for line in self.compare_lines.values():
+            line.remove()
+        self.compare_lines = {}
+        self.line_h2.set_label('Mực nước thực tế (H2)')
+        self._refresh_graph_legend()
+        self.compare_label.config(text="")
+
+    def _refresh_graph_legend(self):
+        self._ensure_graph()
+        handles = [self.line_h2, *self.compare_lines.values(), self.line_setpoint, self.line_h1, self.line_qi1]
+        self.ax.legend(handles=handles, loc='upper left')
+        self.graph_canvas.draw_idle()
+
+    def _refresh_comparison_label(self):
+        """Bảng chỉ số từng làn và chênh lệch IAE so với bộ điều khiển đang chọn."""
+        lines = [f"{'Bộ điều khiển':<16}{'IAE':>10}{'ΔIAE':>10}{'ISE':>12}{'Vọt lố':>9}{'Sai số':>9}"]
+        for name, result in self.comparison.results().items():
+            label = self.COMPARE_LANE_LABELS.get(name, name) + (" *" if name == self.comparison.primary else "")
+            lines.append(f"{label:<16}{result['iae']:>10.1f}{result['delta_iae']:>+10.1f}"
+                         f"{result['ise']:>12.1f}{result['max_overshoot']:>9.2f}{result['error']:>9.2f}")
+        self.compare_label.config(text="\n".join(lines))
 
     def update_gui(self):
-        """Vòng lặp chính để cập nhật GUI và chạy mô phỏng."""
+        """Tác vụ "update_gui" (chu kỳ UI_PERIODS["update"]): chạy mô phỏng, cập nhật nhãn, canvas và dữ liệu biểu đồ."""
+        if self.replay_player is not None:
+            # Chế độ phát lại: dữ liệu lấy từ file, không chạy mô phỏng
+            self._update_replay()
+            return
+
+        if self.shared_publisher is not None:
+            self._apply_shared_commands()
+
         if self.is_running:
             self.run_simulation_step()
+        elif self.shared_publisher is not None:
+            self._publish_shared_state()
+
+        # Lấy mực nước hiện tại
+        h1, h2 = self.tank_system.get_levels()
+        qi1 = self.active_controller._last_output if self.is_running else 0
+
+        # Cập nhật các nhãn
+        self._update_status_labels(h1, h2, qi1)
         
-        # Cập nhật các nhãn giá trị
-        self.kp_label.config(text=f"{self.kp_var.get():.1f}")
-        self.ki_label.config(text=f"{self.ki_var.get():.1f}")
-        self.kd_label.config(text=f"{self.kd_var.get():.1f}")
-        self.setpoint_label.config(text=f"{self.setpoint_var.get():.1f} cm")
+        # Cập nhật hình ảnh trên canvas
+        self.update_water_display(h1, h2)
         
-        # Cập nhật nhãn van
-        self.valve1_label.config(text=f"{self.valve1_var.get():.0f}%")
-        self.valve2_label.config(text=f"{self.valve2_var.get():.0f}%")
+        # Ghi dữ liệu biểu đồ (vẽ lại là tác vụ 'graph' riêng, chu kỳ chậm hơn)
+        if self.is_running:
+            self._update_graph_data(self.simulation_time, h1, h2, self.setpoint_var.get(), qi1)
+
+    def _update_status_labels(self, h1, h2, qi1):
+        """Cập nhật các nhãn giá trị thanh trượt, nút nhiễu và thông tin trạng thái."""
+        # Cập nhật các nhãn giá trị (chỉ khi tab PID đã được dựng)
+        if self.kp_label is not None:
+            self.kp_label.config(text=f"{self.kp_var.get():.1f}")
+            self.ki_label.config(text=f"{self.ki_var.get():.1f}")
+            self.kd_label.config(text=f"{self.kd_var.get():.1f}")
+            self.setpoint_label.config(text=f"{self.setpoint_var.get():.1f} cm")
+
+            # Cập nhật nhãn van
+            self.valve1_label.config(text=f"{self.valve1_var.get():.0f}%")
+            self.valve2_label.config(text=f"{self.valve2_var.get():.0f}%")
         
         # Cập nhật trạng thái nút nhiễu
         if self.tank_system.disturbance_active:
             self.disturbance_button.config(text="Nhiễu Đang Hoạt Động", state=tk.DISABLED)
         else:
             self.disturbance_button.config(text="Tạo Nhiễu", state=tk.NORMAL)
-
-        # Lấy mực nước hiện tại
-        h1, h2 = self.tank_system.get_levels()
         
         # Cập nhật nhãn thông tin
         self.h1_label.config(text=f"Mực nước H1: {h1:.2f} cm")
         self.h2_label.config(text=f"Mực nước H2: {h2:.2f} cm")
-        qi1 = self.active_controller._last_output if self.is_running else 0
         self.qi1_label.config(text=f"Lưu lượng vào Qi1: {qi1:.2f} cm³/s")
-        
-        # Cập nhật hình ảnh trên canvas
-        self.update_water_display(h1, h2)
-        
-        # Cập nhật biểu đồ
-        if self.is_running:
-            self._update_graph_data(self.simulation_time, h1, h2, self.setpoint_var.get())
-        
-        # Bắt đầu hoạt họa dòng chảy nếu chưa có
-        if self.is_running and self.flow_animation_id is None:
-            self._animate_water_flow()
-
-        # Lên lịch cho lần cập nhật tiếp theo
-        self.root.after(30, self.update_gui)
 
     def run_simulation_step(self):
         """Thực hiện một bước của mô phỏng vật lý."""
@@ -1205,6 +3642,9 @@ class SimulationGUI:
             # Kiểm tra nếu đang trong quá trình auto-tuning
             if self.auto_tuning_active:
                 self._run_relay_tuning_step()
+            elif self.comparison is not None:
+                # Tất cả các làn (kể cả làn trên hệ bồn của GUI) chạy cùng một bước
+                self.comparison.step()
             else:
                 # Lấy giá trị mực nước hiện tại của bồn 2 (biến quá trình)
                 current_h2 = self.tank_system.H2
@@ -1219,78 +3659,85 @@ class SimulationGUI:
             # Cập nhật thời gian mô phỏng
             self.simulation_time += self.dt
 
-    def update_water_display(self, h1, h2):
-        """Cập nhật lại hình chữ nhật biểu diễn mực nước trên canvas."""
-        # Kiểm tra an toàn - chỉ cập nhật nếu các đối tượng đã được tạo
-        if not hasattr(self, 'canvas') or self.canvas is None:
+            # Ghi lại bước mô phỏng nếu đang bật ghi
+            if self.recorder is not None:
+                ts = self.tank_system
+                self.recorder.append(self.simulation_time, ts.H1, ts.H2, self._current_inflow(),
+                                     self.setpoint_var.get(), ts.valve1_open, ts.valve2_open,
+                                     ts.disturbance_active)
+
+            # Công bố mọi bước (không chỉ mỗi nhịp GUI) để tiến trình ngoài thấy đủ độ phân giải
+            if self.shared_publisher is not None:
+                self._publish_shared_state()
+
+    def _current_inflow(self):
+        """Lưu lượng Qi1 vừa được áp dụng (relay khi đang auto-tuning, ngược lại là đầu ra bộ điều khiển)."""
+        if self.auto_tuning_active:
+            return self.relay_tuner.last_output
+        return self.active_controller._last_output
+
+    def update_water_display(self, h1, h2, setpoint=None, valves=None):
+        """
+        Cập nhật lại hình chữ nhật biểu diễn mực nước trên canvas.
+        setpoint và valves (độ mở van 1, van 2) mặc định lấy từ thanh trượt;
+        chế độ phát lại truyền giá trị từ bản ghi.
+        """
+        # Chỉ cập nhật khi sơ đồ đã được bố trí (draw_tanks)
+        if self.canvas is None or self.layout_size is None:
             return
-            
-        # SỬA: dùng lại các biến động đã lưu
-        tank1_x0 = self.tank1_x0
-        tank1_y0 = self.tank1_y0
-        tank2_x0 = self.tank2_x0
-        tank_width = self.tank_width
-        tank_height = self.tank_height
-        # Mực nước động
-        level1_px = (h1 / self.tank_system.max_height) * tank_height
-        level2_px = (h2 / self.tank_system.max_height) * tank_height
-        y1 = tank1_y0 + tank_height - level1_px
-        y2 = tank1_y0 + tank_height - level2_px
-        
-        # Kiểm tra an toàn trước khi cập nhật
-        if self.water1_rect is not None:
-            self.canvas.coords(self.water1_rect, tank1_x0, y1, tank1_x0 + tank_width, tank1_y0 + tank_height)
-        if self.water2_rect is not None:
-            self.canvas.coords(self.water2_rect, tank2_x0, y2, tank2_x0 + tank_width, tank1_y0 + tank_height)
-            
-        # Đường setpoint
-        setpoint_h = self.setpoint_var.get()
-        setpoint_px = (setpoint_h / self.tank_system.max_height) * tank_height
-        setpoint_y = tank1_y0 + tank_height - setpoint_px
-        
-        # SỬA LỖI: Cập nhật tọa độ thay vì tạo lại
-        if self.setpoint_line is not None:
-            self.canvas.coords(self.setpoint_line, tank2_x0 - 5, setpoint_y, tank2_x0 + tank_width + 5, setpoint_y)
-            
+
+        # Bố cục (level_scale, tank_bottom...) đã tính sẵn trong draw_tanks
+        setpoint_h = self.setpoint_var.get() if setpoint is None else setpoint
+        bottom, scale = self.tank_bottom, self.level_scale
+        levels = (round(bottom - h1 * scale, 1), round(bottom - h2 * scale, 1), round(bottom - setpoint_h * scale, 1))
+        if levels != self._drawn_levels:
+            # Chỉ gọi coords khi vị trí trên màn hình thay đổi (khi dừng mô phỏng thì không có gì để vẽ)
+            y1, y2, setpoint_y = levels
+            x1, x2, tank_w = self.tank1_x0, self.tank2_x0, self.tank_width
+            self.canvas.coords(self.water1_rect, x1, y1, x1 + tank_w, bottom)
+            self.canvas.coords(self.water2_rect, x2, y2, x2 + tank_w, bottom)
+            self.canvas.coords(self.setpoint_line, x2 - 5, setpoint_y, x2 + tank_w + 5, setpoint_y)
+            self._drawn_levels = levels
+
         # Cập nhật màu van
-        self._update_valve_colors()
+        self._update_valve_colors(valves)
 
-    def _update_valve_colors(self):
-        """Cập nhật màu van theo độ mở."""
-        # Kiểm tra an toàn
-        if not hasattr(self, 'canvas') or self.canvas is None:
+    def _update_valve_colors(self, valves=None):
+        """Cập nhật màu van theo độ mở (chỉ khi màu đổi)."""
+        if self.canvas is None or not self.scene:
             return
-            
-        # Màu động
-        def valve_color(opening):
-            if opening < 10:
-                return "#d32f2f"
-            elif opening < 70:
-                return "#fbc02d"
-            else:
-                return "#388e3c"
-                
-        # Kiểm tra an toàn trước khi cập nhật
-        if self.valve1_rect is not None:
-            self.canvas.itemconfig(self.valve1_rect, fill=valve_color(self.valve1_var.get()))
-        if hasattr(self, 'valve1_label') and self.valve1_label is not None:
-            self.valve1_label.config(text=f"{self.valve1_var.get():.0f}%")
-            
-        if self.valve2_rect is not None:
-            self.canvas.itemconfig(self.valve2_rect, fill=valve_color(self.valve2_var.get()))
-        if hasattr(self, 'valve2_label') and self.valve2_label is not None:
-            self.valve2_label.config(text=f"{self.valve2_var.get():.0f}%")
+
+        if valves is None:
+            valves = (self.valve1_var.get(), self.valve2_var.get())
+            if self.valve1_label is not None:
+                self.valve1_label.config(text=f"{valves[0]:.0f}%")
+            if self.valve2_label is not None:
+                self.valve2_label.config(text=f"{valves[1]:.0f}%")
+        # Khi phát lại, độ mở van lấy từ bản ghi, không ghi đè thanh trượt
+        for item, opening in ((self.valve1_rect, valves[0]), (self.valve2_rect, valves[1])):
+            color = self._valve_color(opening)
+            if self._valve_fills.get(item) != color:
+                self.canvas.itemconfig(item, fill=color)
+                self._valve_fills[item] = color
 
     def update_pid_gains(self, _=None):
         """Cập nhật các hệ số PID từ thanh trượt."""
-        self.active_controller.set_gains(self.kp_var.get(), self.ki_var.get(), self.kd_var.get())
+        controllers = ([e.controller for e in self.comparison.engines.values()] if self.comparison is not None
+                       else [self.active_controller])
+        for controller in controllers:
+            if hasattr(controller, 'set_gains'):  # Fuzzy PID tự suy ra hệ số
+                controller.set_gains(self.kp_var.get(), self.ki_var.get(), self.kd_var.get())
 
     def update_pid_setpoint(self, _=None):
         """Cập nhật giá trị đặt từ thanh trượt."""
-        self.active_controller.set_setpoint(self.setpoint_var.get())
+        if self.comparison is not None:
+            self.comparison.set_setpoint(self.setpoint_var.get())
+        else:
+            self.active_controller.set_setpoint(self.setpoint_var.get())
 
     def start_simulation(self):
         self.is_running = True
+        self._start_running_tasks()
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
 
@@ -1298,14 +3745,19 @@ class SimulationGUI:
         self.is_running = False
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
+
+        # Đẩy dữ liệu ghi xuống đĩa để bản ghi có thể mở ngay
+        if self.recorder is not None:
+            self.recorder.flush()
         
-        # Dừng hoạt họa dòng chảy
-        if self.flow_animation_id:
-            self.root.after_cancel(self.flow_animation_id)
-            self.flow_animation_id = None
+        # Dừng vẽ biểu đồ và hoạt họa dòng chảy
+        self._stop_running_tasks()
+        self._redraw_trend()
 
     def reset_simulation(self):
         self.stop_simulation()
+        # Thời gian mô phỏng quay về 0 nên kết thúc bản ghi hiện tại
+        self.stop_recording()
         self.tank_system.reset()
         self.active_controller.reset()
         
@@ -1324,8 +3776,14 @@ class SimulationGUI:
         self.setpoint_data.clear()
         
         # Reset biểu đồ
+        self.trend.clear()
+        self._ensure_graph()
         self.line_h2.set_data([], [])
         self.line_setpoint.set_data([], [])
+        self.line_h1.set_data([], [])
+        self.line_qi1.set_data([], [])
+        if self.comparison is not None:
+            self._toggle_comparison()  # Nhân bản lại hệ bồn vừa reset
         self.ax.set_xlim(0, 10)
         self.ax.set_ylim(0, self.tank_system.max_height)
         self.graph_canvas.draw_idle()
@@ -1343,27 +3801,87 @@ class SimulationGUI:
 
     def update_valve_openings(self, _=None):
         """Cập nhật độ mở của các van từ thanh trượt."""
-        self.tank_system.set_valve_openings(self.valve1_var.get(), self.valve2_var.get())
+        if self.comparison is not None:
+            self.comparison.set_valve_openings(self.valve1_var.get(), self.valve2_var.get())
+        else:
+            self.tank_system.set_valve_openings(self.valve1_var.get(), self.valve2_var.get())
 
     def trigger_disturbance(self):
         """Kích hoạt nhiễu loạn."""
-        self.tank_system.trigger_disturbance(self.simulation_time)
+        if self.comparison is not None:
+            self.comparison.trigger_disturbance(self.tank_system.disturbance_flow, self.tank_system.disturbance_duration)
+        else:
+            self.tank_system.trigger_disturbance(self.simulation_time)
 
-    def _on_controller_change(self, event=None):
-        if self.controller_var.get() == "PID Truyền Thống":
-            self.active_controller = self.pid_controller
+    CONTROLLER_CHOICES = {"PID Truyền Thống": 'pid_controller', "PID Logic Mờ": 'fuzzy_controller',
+                          "PID Logic Mờ (Sugeno)": 'sugeno_controller',
+                          "MPC (Dự báo mô hình)": 'mpc_controller', "PID Lập lịch hệ số": 'scheduled_controller'}
+
+    def _controller(self, name):
+        """
+        Bộ điều khiển theo tên thuộc tính trong CONTROLLER_CHOICES. Trừ PID, mỗi bộ được tạo ở lần
+        dùng đầu (cùng setpoint ban đầu như khi tạo cùng giao diện) rồi đăng ký với profiler.
+        """
+        controller = self._controllers.get(name)
+        if controller is not None:
+            return controller
+        set_point, output_limits = self.initial_set_point, self.output_limits
+        stage = None
+        if name == 'fuzzy_controller':
+            controller = FuzzyPIDController(set_point=set_point, output_limits=output_limits)
+        elif name == 'sugeno_controller':
+            # Dùng lại bảng của bộ Mamdani (kể cả luật/hàm thành viên đã sửa) thay vì dựng lại
+            controller = FuzzyPIDController.from_tables(self.fuzzy_controller.config_tables(), set_point,
+                                                        output_limits, inference='sugeno')
+            stage = 'FuzzyPIDController.update[sugeno]'
+        elif name == 'mpc_controller':
+            controller = MPCController(set_point=set_point, output_limits=output_limits, plant=self.tank_system)
+            controller.profiler = self.profiler  # Thời gian giải QP: giai đoạn 'MPCController.qp'
+        elif name == 'scheduled_controller':
+            controller = GainScheduledPIDController(set_point=set_point, plant=self.tank_system,
+                                                    output_limits=output_limits)
         else:
-            self.active_controller = self.fuzzy_controller
+            raise AttributeError(name)
+        self._controllers[name] = controller
+        self.profiler.register(controller, 'update', stage)
+        return controller
+
+    @property
+    def fuzzy_controller(self):
+        return self._controller('fuzzy_controller')
+
+    @property
+    def sugeno_controller(self):
+        return self._controller('sugeno_controller')
+
+    @property
+    def mpc_controller(self):
+        return self._controller('mpc_controller')
+
+    @property
+    def scheduled_controller(self):
+        return self._controller('scheduled_controller')
+
+    def _on_controller_change(self, event=None):
+        self.active_controller = getattr(self, self.CONTROLLER_CHOICES[self.controller_var.get()])
+        # Làn chạy trên hệ bồn của GUI đổi theo, nên khởi động lại so sánh
+        if self.comparison is not None:
+            self._toggle_comparison()
 
     def start_auto_tuning(self):
         if self.is_running:
             messagebox.showwarning("Cảnh báo", "Hãy dừng mô phỏng trước khi tự động tinh chỉnh.")
             return
+        if self.relay_hysteresis_var.get() <= 0:
+            messagebox.showwarning("Cảnh báo", "Trễ relay ε phải lớn hơn 0.")
+            return
         
         confirm = messagebox.askyesno("Xác nhận", "Bắt đầu quá trình tự động tinh chỉnh Ziegler-Nichols (Relay Method)?\nHệ thống sẽ được reset và sử dụng phương pháp relay để tìm Ku và Tu.")
         if not confirm:
             return
 
+        self.compare_var.set(False)
+        self._stop_comparison()
         self.reset_simulation()  # Reset toàn bộ hệ thống
         self.auto_tuning_active = True
         self.autotune_status_label.config(text="Đang tự động tinh chỉnh (Relay Method)...")
@@ -1374,15 +3892,29 @@ class SimulationGUI:
         self.setpoint_var.set(self.initial_autotune_setpoint)
         self.pid_controller.set_setpoint(self.initial_autotune_setpoint)
         
-        # Lấy giá trị biên độ relay từ GUI
+        # Lấy giá trị biên độ và trễ relay từ GUI
         self.relay_amplitude = self.relay_amplitude_var.get()
-        
-        # Reset relay variables
-        self.relay_state = 'off'
-        self.cycle_count = 0
-        self.relay_peaks.clear()
-        self.relay_troughs.clear()
-        self.relay_start_time = self.simulation_time
+        self.relay_hysteresis = self.relay_hysteresis_var.get()
+        
+        # Tạo thí nghiệm relay mới, bước tích phân là bội số của dt gần RELAY_TUNING_STEP nhất
+        self.relay_substeps = max(1, round(self.RELAY_TUNING_STEP / self.dt))
+        self._relay_substep = 0
+        self.relay_tuner = RelayAutoTuner(
+            self.tank_system, set_point=self.initial_autotune_setpoint,
+            relay_amplitude=self.relay_amplitude, dt=self.dt * self.relay_substeps,
+            transient_cycles=self.transient_cycles, measurement_cycles=self.measurement_cycles,
+            timeout=self.AUTOTUNE_TIMEOUT_SECONDS, start_time=self.simulation_time,
+            hysteresis=self.relay_hysteresis)
+
+        # Cùng hệ bồn, van, setpoint và biên độ relay như một lần trước: lấy kết quả ngay
+        self.autotune_config = self.relay_tuner.config()
+        entry = self.tuning_cache.get(self.autotune_config) if self.autotune_cache_var.get() else None
+        if entry is not None:
+            self.relay_tuner.Ku, self.relay_tuner.Tu = entry['Ku'], entry['Tu']
+            self.auto_tuning_Ku, self.auto_tuning_Tu = entry['Ku'], entry['Tu']
+            self._set_tuned_gains(*entry['gains'])
+            self._complete_relay_tuning(cached=True)
+            return
         
         self.start_simulation()  # Bắt đầu mô phỏng cho quá trình autotune
 
@@ -1392,113 +3924,42 @@ class SimulationGUI:
             return
 
         # Kiểm tra timeout
-        if self.simulation_time - self.relay_start_time > self.AUTOTUNE_TIMEOUT_SECONDS:
+        if self.relay_tuner.timed_out(self.simulation_time):
             messagebox.showerror("Lỗi Tự động Tinh chỉnh", f"Quá trình tinh chỉnh đã vượt quá thời gian cho phép ({self.AUTOTUNE_TIMEOUT_SECONDS}s).\n\nHệ thống có thể không dao động. Hãy thử lại với giá trị 'Biên độ Relay' lớn hơn.")
             self._complete_relay_tuning()  # Gọi hàm này để dừng và reset các nút
             return
 
-        # Lấy giá trị hiện tại
-        setpoint = self.initial_autotune_setpoint
-        h2 = self.tank_system.H2
-        
-        # Áp dụng luật relay
-        if h2 < setpoint:
-            # Mực nước thấp hơn setpoint -> bật relay
-            if self.relay_state != 'on':
-                self.relay_state = 'on'
-                # Ghi nhận điểm chuyển đổi (từ off sang on)
-                self._record_relay_transition('on')
-            qi1 = self.relay_amplitude
-        else:
-            # Mực nước cao hơn hoặc bằng setpoint -> tắt relay
-            if self.relay_state != 'off':
-                self.relay_state = 'off'
-                # Ghi nhận điểm chuyển đổi (từ on sang off)
-                self._record_relay_transition('off')
-            qi1 = 0.0
-        
-        # Cập nhật hệ thống với lưu lượng relay
-        self.tank_system.update(qi1, 0, self.dt, self.simulation_time)
+        # Áp dụng luật relay và cập nhật hệ thống với lưu lượng relay: một bước lớn của thí nghiệm
+        # ở bước mô phỏng cuối cùng của nó, để hệ bồn khớp simulation_time sau bước này
+        self._relay_substep += 1
+        if self._relay_substep < self.relay_substeps:
+            return
+        self._relay_substep = 0
+        self.relay_tuner.step(self.simulation_time + self.dt - self.relay_tuner.dt)
         
         # Kiểm tra xem đã có đủ dữ liệu để tính toán chưa
-        if self._check_relay_completion():
+        if self.relay_tuner.is_complete():
             self._calculate_relay_parameters()
             self._apply_ziegler_nichols()
+            try:
+                self.tuning_cache.put(self.autotune_config, self.auto_tuning_Ku, self.auto_tuning_Tu,
+                                      self.relay_tuner.ziegler_nichols())
+            except OSError as e:
+                messagebox.showwarning("Cảnh báo", f"Không ghi được bộ nhớ đệm tinh chỉnh:\n{e}")
             self._complete_relay_tuning()
     
-    def _record_relay_transition(self, new_state):
-        """Ghi nhận điểm chuyển đổi trạng thái relay."""
-        current_time = self.simulation_time
-        h2 = self.tank_system.H2
-        
-        if new_state == 'on':
-            # Chuyển từ off sang on -> đây là một đáy (trough)
-            if len(self.relay_troughs) == 0 or (current_time - self.relay_troughs[-1][0]) > 0.5:
-                self.relay_troughs.append((current_time, h2))
-                self.cycle_count += 1
-        else:  # new_state == 'off'
-            # Chuyển từ on sang off -> đây là một đỉnh (peak)
-            if len(self.relay_peaks) == 0 or (current_time - self.relay_peaks[-1][0]) > 0.5:
-                self.relay_peaks.append((current_time, h2))
-    
-    def _check_relay_completion(self):
-        """Kiểm tra xem đã có đủ dữ liệu để tính toán chưa."""
-        # Cần ít nhất transient_cycles + measurement_cycles chu kỳ
-        total_cycles_needed = self.transient_cycles + self.measurement_cycles
-        
-        # Kiểm tra số chu kỳ đã hoàn thành
-        if self.cycle_count < total_cycles_needed:
-            return False
-        
-        # Kiểm tra xem có đủ đỉnh và đáy để đo lường không
-        if len(self.relay_peaks) < self.measurement_cycles or len(self.relay_troughs) < self.measurement_cycles:
-            return False
-        
-        return True
-    
     def _calculate_relay_parameters(self):
         """Tính toán Ku và Tu từ dữ liệu relay."""
-        # Lấy các đỉnh và đáy gần nhất để đo lường
-        recent_peaks = self.relay_peaks[-self.measurement_cycles:]
-        recent_troughs = self.relay_troughs[-self.measurement_cycles:]
-        
-        # Tính chu kỳ tới hạn Tu
-        peak_periods = []
-        for i in range(1, len(recent_peaks)):
-            period = recent_peaks[i][0] - recent_peaks[i-1][0]
-            peak_periods.append(period)
-        
-        trough_periods = []
-        for i in range(1, len(recent_troughs)):
-            period = recent_troughs[i][0] - recent_troughs[i-1][0]
-            trough_periods.append(period)
-        
-        # Tính Tu trung bình
-        all_periods = peak_periods + trough_periods
-        Tu = np.mean(all_periods)
-        
-        # Tính biên độ dao động a
-        amplitudes = []
-        for i in range(min(len(recent_peaks), len(recent_troughs))):
-            amplitude = abs(recent_peaks[i][1] - recent_troughs[i][1])
-            amplitudes.append(amplitude)
-        
-        a = np.mean(amplitudes)
-        
-        # Tính độ lợi tới hạn Ku
-        d = self.relay_amplitude
-        Ku = (4 * d) / (np.pi * a)
-        
-        # Lưu kết quả
-        self.auto_tuning_Ku = Ku
-        self.auto_tuning_Tu = Tu
+        self.auto_tuning_Ku, self.auto_tuning_Tu = self.relay_tuner.calculate_parameters()
     
-    def _complete_relay_tuning(self):
-        """Hoàn tất quá trình relay tuning."""
+    def _complete_relay_tuning(self, cached=False):
+        """Hoàn tất quá trình relay tuning (cached: kết quả lấy từ bộ nhớ đệm, không chạy thí nghiệm)."""
         self.auto_tuning_active = False
+        source = " (từ bộ nhớ đệm)" if cached else ""
         
         # Hiển thị kết quả
-        result_text = f"Tinh chỉnh hoàn tất! Ku={self.auto_tuning_Ku:.2f}, Tu={self.auto_tuning_Tu:.2f}"
+        result_text = (f"Tinh chỉnh hoàn tất{source}! Ku={self.auto_tuning_Ku:.2f}, Tu={self.auto_tuning_Tu:.2f}"
+                       f" (ε={self.relay_hysteresis:g} cm)")
         self.autotune_status_label.config(text=result_text)
         
         # Kích hoạt lại các nút
@@ -1510,23 +3971,20 @@ class SimulationGUI:
         
         # Hiển thị thông báo chi tiết
         messagebox.showinfo("Tự động tinh chỉnh", 
-                           f"Quá trình tự động tinh chỉnh Ziegler-Nichols (Relay Method) đã hoàn tất!\n\n"
+                           f"Quá trình tự động tinh chỉnh Ziegler-Nichols (Relay Method) đã hoàn tất{source}!\n\n"
                            f"Kết quả:\n"
                            f"• Ku (Độ lợi tới hạn): {self.auto_tuning_Ku:.2f}\n"
-                           f"• Tu (Chu kỳ tới hạn): {self.auto_tuning_Tu:.2f} s\n\n"
+                           f"• Tu (Chu kỳ tới hạn): {self.auto_tuning_Tu:.2f} s\n"
+                           f"(đo với trễ relay ε = {self.relay_hysteresis:g} cm)\n\n"
                            f"Các thông số PID mới đã được áp dụng.")
 
     def _apply_ziegler_nichols(self):
         """Áp dụng quy tắc Ziegler-Nichols để tính toán các thông số PID."""
-        Ku = self.auto_tuning_Ku
-        Tu = self.auto_tuning_Tu
-        
         # PID không dao động (No overshoot)
-        Kp = 0.33 * Ku
-        Ki = 0.6 * Ku / Tu
-        Kd = 0.11 * Ku * Tu
+        self._set_tuned_gains(*self.relay_tuner.ziegler_nichols())
 
-        # Cập nhật thanh trượt và PID controller
+    def _set_tuned_gains(self, Kp, Ki, Kd):
+        """Cập nhật thanh trượt và PID controller."""
         self.kp_var.set(Kp)
         self.ki_var.set(Ki)
         self.kd_var.set(Kd)
@@ -1534,6 +3992,16 @@ class SimulationGUI:
 
 
 if __name__ == "__main__":
+    import argparse
+
+    startup = StartupTimer()
+    startup.mark('import')
+    parser = argparse.ArgumentParser(description="Mô phỏng và điều khiển hệ bồn nước đôi")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="In các mốc thời gian khởi động (JSON) rồi thoát sau lần vẽ đầu tiên")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = SimulationGUI(root)
+    startup.mark('tk')
+    app = SimulationGUI(root, startup=startup)
+    app.exit_after_startup = args.startup_report
     root.mainloop()
@@ -0,0 +1,126 @@
+"""
+Bộ lập lịch sự kiện rời rạc dùng hàng đợi ưu tiên (heap).
+
+Sự kiện một lần (call_at, call_later) và sự kiện tuần hoàn (call_every) nằm trên cùng một
+dòng thời gian; sự kiện cùng thời điểm chạy theo priority (nhỏ trước) rồi theo thứ tự đăng ký.
+Thời điểm của sự kiện tuần hoàn được tính start + k * period nên không trôi theo sai số cộng dồn.
+Hủy sự kiện là hủy lười: sự kiện chỉ bị đánh dấu và bị bỏ qua khi tới đỉnh heap.
+Với đồng hồ thực, sự kiện tuần hoàn catch_up=False bỏ các lần lỡ hẹn thay vì chạy dồn.
+
+Đồng hồ là tham số: mô phỏng dùng thời gian mô phỏng (run_until với hàm advance để tích
+phân hệ bồn giữa hai sự kiện), GUI dùng time.monotonic() để ngủ tới sự kiện kế tiếp.
+"""
+import heapq
+import math
+from collections import Counter
+
+
+class ScheduledEvent:
+    """Một sự kiện trên dòng thời gian. Giữ đối tượng này để hủy (cancel) về sau."""
+    __slots__ = ('time', 'priority', 'callback', 'name', 'period', 'start', 'count', 'catch_up', 'cancelled')
+
+    def __init__(self, time, priority, callback, name=None, period=None, catch_up=True):
+        self.time = time
+        self.priority = priority
+        self.callback = callback
+        self.name = name or getattr(callback, '__name__', 'event')
+        self.period = period
+        self.start = time
+        self.count = 0
+        self.catch_up = catch_up
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        kind = f"mỗi {self.period:g}" if self.period else "một lần"
+        return f"<ScheduledEvent {self.name} t={self.time:g} ({kind}){' đã hủy' if self.cancelled else ''}>"
+
+
+class EventScheduler:
+    """
+    Dòng thời gian sự kiện rời rạc.
+
+    Callback nhận thời điểm của sự kiện làm đối số duy nhất. Callback có thể đăng ký hoặc hủy
+    sự kiện khác (kể cả sự kiện đang chạy).
+    """
+    def __init__(self, start_time=0.0):
+        self.now = start_time
+        self._heap = []
+        self._seq = 0
+        self.executed = Counter()  # Tên sự kiện -> số lần đã chạy
+
+    def __len__(self):
+        return sum(1 for entry in self._heap if not entry[3].cancelled)
+
+    def _push(self, event):
+        self._seq += 1
+        heapq.heappush(self._heap, (event.time, event.priority, self._seq, event))
+        return event
+
+    # --- Đăng ký ---
+    def call_at(self, time, callback, priority=0, name=None):
+        """Chạy callback(time) một lần tại thời điểm time."""
+        return self._push(ScheduledEvent(time, priority, callback, name))
+
+    def call_later(self, delay, callback, priority=0, name=None):
+        """Chạy callback một lần sau delay kể từ now."""
+        return self.call_at(self.now + delay, callback, priority, name)
+
+    def call_every(self, period, callback, start=None, priority=0, name=None, catch_up=True):
+        """
+        Chạy callback tại start, start + period, start + 2*period, ... (mặc định start = now).
+        catch_up=False: nếu run_until tới muộn hơn nhiều chu kỳ, chỉ chạy một lần rồi hẹn
+        lần kế tiếp sau end_time (dùng cho tác vụ giao diện trên đồng hồ thực).
+        """
+        if period <= 0:
+            raise ValueError("Chu kỳ của sự kiện tuần hoàn phải dương.")
+        return self._push(ScheduledEvent(self.now if start is None else start, priority, callback, name, period,
+                                         catch_up))
+
+    def clear(self):
+        self._heap.clear()
+
+    # --- Thực thi ---
+    def next_time(self):
+        """Thời điểm của sự kiện kế tiếp còn hiệu lực (math.inf nếu không còn sự kiện)."""
+        heap = self._heap
+        while heap and heap[0][3].cancelled:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else math.inf
+
+    def run_until(self, end_time, advance=None, inclusive=True):
+        """
+        Chạy mọi sự kiện có thời điểm <= end_time (< end_time nếu inclusive=False) theo thứ tự.
+
+        advance(t), nếu có, được gọi trước mỗi sự kiện và ở cuối để đưa hệ thống liên tục
+        (ví dụ hệ bồn) từ now tới t; giữa hai sự kiện không có gì khác chạy.
+
+        Returns:
+            int: Số sự kiện đã chạy.
+        """
+        limit = end_time + 1e-9 if inclusive else end_time - 1e-9
+        heap = self._heap
+        n = 0
+        while True:
+            t = self.next_time()
+            if t > limit:
+                break
+            _, _, _, event = heapq.heappop(heap)
+            if advance is not None and t > self.now:
+                advance(t)
+            self.now = max(self.now, t)
+            if event.period:
+                event.count += 1
+                if not event.catch_up:
+                    event.count = max(event.count, math.floor((end_time - event.start) / event.period) + 1)
+                event.time = event.start + event.count * event.period
+                self._push(event)
+            event.callback(t)
+            self.executed[event.name] += 1
+            n += 1
+        if advance is not None and end_time > self.now:
+            advance(end_time)
+        self.now = max(self.now, end_time)
+        return n
@@ -0,0 +1,190 @@
+"""
+Phân tích miền tần số của hệ bồn nước đôi với bộ điều khiển PID.
+
+Hệ bồn được tuyến tính hóa tại một lưới điểm làm việc (setpoint x độ mở van 1 x độ mở van 2);
+đáp ứng tần số H2/Qi1 của mọi điểm lưới và mọi tần số được tính trong một phép giải NumPy
+theo lô. Từ hàm truyền vòng hở L = C G suy ra dữ liệu Bode/Nyquist, độ dự trữ biên độ và
+pha, tần số cắt và băng thông vòng kín (-3 dB).
+
+PID được mô hình hóa đúng như PIDController rời rạc (tích phân chữ nhật, đạo hàm sai phân lùi)
+cộng trễ nửa chu kỳ của khâu giữ bậc không; đặt sample_time=None để dùng PID liên tục.
+
+Ví dụ:
+    python frequency_analysis.py --kp 83.5 --ki 14.5 --kd 120 --setpoints 5 10 20 30 --valve2 50 100
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from coupled_tank_gui import CoupledTankSystem, DEFAULT_PID_GAINS
+
+DEFAULT_OMEGA = np.logspace(-4, np.log10(np.pi / 0.1), 400)  # Tới tần số Nyquist của dt = 0.1 s
+
+
+def linearize_grid(plant, setpoints, valve1=None, valve2=None):
+    """
+    Tuyến tính hóa vector hóa tại lưới điểm làm việc (tích Descartes của ba trục).
+
+    Công thức giống CoupledTankSystem.steady_state() và linearize(), tính cho mọi điểm cùng lúc.
+    valve1/valve2 mặc định là độ mở van hiện tại của plant.
+
+    Returns:
+        dict: 'setpoint', 'valve1', 'valve2', 'H1', 'H2', 'Qi1' (mảng N phần tử),
+              'A' (N x 2 x 2), 'B' (N x 2).
+    """
+    valve1 = [plant.valve1_open] if valve1 is None else valve1
+    valve2 = [plant.valve2_open] if valve2 is None else valve2
+    sp, v1, v2 = (axis.ravel() for axis in np.meshgrid(np.asarray(setpoints, dtype=float),
+                                                        np.asarray(valve1, dtype=float),
+                                                        np.asarray(valve2, dtype=float), indexing='ij'))
+    c1 = v1 / 100.0 * plant.alpha1
+    c2 = v2 / 100.0 * plant.alpha2
+    H2 = np.maximum(sp, 0.5)
+    H1 = H2 * (1.0 + (c2 / plant.alpha3) ** 2)
+    Qi1 = c1 * np.sqrt(H1) + c2 * np.sqrt(H2)
+
+    eps = 1e-3
+    k1 = c1 / (2.0 * np.sqrt(np.maximum(H1, eps)))
+    k2 = c2 / (2.0 * np.sqrt(np.maximum(H2, eps)))
+    k3 = plant.alpha3 / (2.0 * np.sqrt(np.maximum(np.abs(H1 - H2), eps)))
+    A = np.empty((len(sp), 2, 2))
+    A[:, 0, 0] = -(k1 + k3) / plant.A1
+    A[:, 0, 1] = k3 / plant.A1
+    A[:, 1, 0] = k3 / plant.A2
+    A[:, 1, 1] = -(k2 + k3) / plant.A2
+    B = np.zeros((len(sp), 2))
+    B[:, 0] = 1.0 / plant.A1
+    return {'setpoint': sp, 'valve1': v1, 'valve2': v2, 'H1': H1, 'H2': H2, 'Qi1': Qi1, 'A': A, 'B': B}
+
+
+def plant_response(A, B, omega):
+    """
+    Đáp ứng tần số G(jw) = C (jwI - A)^-1 B với C = [0, 1] (đầu ra H2), mảng N x W.
+    Toàn bộ N điểm x W tần số được giải trong một lần gọi np.linalg.solve.
+    """
+    s = 1j * np.asarray(omega)[None, :, None, None]
+    M = s * np.eye(A.shape[-1]) - A[:, None]
+    x = np.linalg.solve(M, np.broadcast_to(B[:, None, :, None], M.shape[:-1] + (1,)).astype(complex))
+    return x[..., 1, 0]
+
+
+def pid_response(Kp, Ki, Kd, omega, sample_time=0.1):
+    """
+    Đáp ứng tần số của PID. Kp, Ki, Kd là vô hướng hoặc mảng N phần tử (hệ số theo điểm lưới).
+
+    Với sample_time: tích phân Ki*T/(1 - z^-1), đạo hàm Kd*(1 - z^-1)/T như PIDController.update(),
+    nhân trễ e^(-jwT/2) của khâu giữ bậc không. Với sample_time=None: Kp + Ki/s + Kd*s.
+    """
+    Kp, Ki, Kd = (np.asarray(k, dtype=float)[..., None] for k in (Kp, Ki, Kd))
+    omega = np.asarray(omega)
+    if sample_time is None:
+        s = 1j * omega
+        return Kp + Ki / s + Kd * s
+    T = sample_time
+    backward = 1.0 - np.exp(-1j * omega * T)  # 1 - z^-1
+    return (Kp + Ki * T / backward + Kd * backward / T) * np.exp(-0.5j * omega * T)
+
+
+def _first_crossing(y, level, log_omega):
+    """
+    Chỉ số và tần số (nội suy tuyến tính theo log w) của lần đầu y cắt xuống dưới level
+    trên mỗi hàng; NaN nếu không cắt.
+    """
+    above = y >= level
+    crossing = above[:, :-1] & ~above[:, 1:]
+    found = crossing.any(axis=1)
+    idx = crossing.argmax(axis=1)
+    rows = np.arange(len(y))
+    y0, y1 = y[rows, idx], y[rows, idx + 1]
+    frac = np.where(y0 != y1, (y0 - level) / (y0 - y1), 0.0)
+    log_w = log_omega[idx] + frac * (log_omega[idx + 1] - log_omega[idx])
+    return idx, frac, np.exp(np.where(found, log_w, np.nan))
+
+
+def loop_margins(L, omega):
+    """
+    Độ dự trữ từ hàm truyền vòng hở L (N x W).
+
+    Returns:
+        dict (mảng N phần tử): 'gain_margin_db' (inf nếu pha không cắt -180°),
+        'phase_margin' (độ; NaN nếu |L| không cắt 1), 'crossover' (tần số cắt biên độ, rad/s),
+        'phase_crossover' (rad/s), 'bandwidth' (băng thông vòng kín -3 dB, rad/s).
+    """
+    log_omega = np.log(omega)
+    rows = np.arange(len(L))
+    magnitude_db = 20.0 * np.log10(np.abs(L))
+    phase = np.degrees(np.unwrap(np.angle(L), axis=1))
+
+    idx, frac, crossover = _first_crossing(magnitude_db, 0.0, log_omega)
+    phase_at_crossover = phase[rows, idx] + frac * (phase[rows, idx + 1] - phase[rows, idx])
+    phase_margin = np.where(np.isnan(crossover), np.nan, 180.0 + phase_at_crossover)
+
+    idx, frac, phase_crossover = _first_crossing(phase, -180.0, log_omega)
+    gain_at_crossover = magnitude_db[rows, idx] + frac * (magnitude_db[rows, idx + 1] - magnitude_db[rows, idx])
+    gain_margin_db = np.where(np.isnan(phase_crossover), np.inf, -gain_at_crossover)
+
+    closed_loop_db = 20.0 * np.log10(np.abs(L / (1.0 + L)))
+    # -3 dB so với mức ở tần số thấp nhất (= 0 dB khi có tích phân)
+    _, _, bandwidth = _first_crossing(closed_loop_db - closed_loop_db[:, :1], -3.0, log_omega)
+    return {
+        'gain_margin_db': gain_margin_db,
+        'phase_margin': phase_margin,
+        'crossover': crossover,
+        'phase_crossover': phase_crossover,
+        'bandwidth': bandwidth,
+    }
+
+
+def analyze(plant, gains, setpoints, valve1=None, valve2=None, omega=DEFAULT_OMEGA, sample_time=0.1):
+    """
+    Phân tích đầy đủ trên lưới điểm làm việc.
+
+    Args:
+        plant (CoupledTankSystem): Tham số hệ bồn (và độ mở van mặc định).
+        gains (tuple): (Kp, Ki, Kd), mỗi phần tử vô hướng hoặc mảng N phần tử theo thứ tự lưới.
+        setpoints, valve1, valve2: Các trục lưới (xem linearize_grid).
+        omega (array): Các tần số (rad/s), tăng dần.
+        sample_time (float | None): Chu kỳ của PID rời rạc (None: PID liên tục).
+
+    Returns:
+        dict: các khóa của linearize_grid() và loop_margins(), cùng 'omega',
+              'plant' (G, N x W) và 'loop' (L, N x W).
+    """
+    omega = np.asarray(omega, dtype=float)
+    result = linearize_grid(plant, setpoints, valve1, valve2)
+    G = plant_response(result.pop('A'), result.pop('B'), omega)
+    L = pid_response(*gains, omega, sample_time) * G
+    result.update(omega=omega, plant=G, loop=L)
+    result.update(loop_margins(L, omega))
+    return result
+
+
+def bode(L):
+    """Biên độ (dB) và pha (độ, đã unwrap) từ đáp ứng tần số N x W."""
+    return 20.0 * np.log10(np.abs(L)), np.degrees(np.unwrap(np.angle(L), axis=-1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Độ dự trữ ổn định của PID trên lưới điểm làm việc.")
+    parser.add_argument('--kp', type=float, default=DEFAULT_PID_GAINS['Kp'])
+    parser.add_argument('--ki', type=float, default=DEFAULT_PID_GAINS['Ki'])
+    parser.add_argument('--kd', type=float, default=DEFAULT_PID_GAINS['Kd'])
+    parser.add_argument('--setpoints', type=float, nargs='+', default=[5, 10, 15, 20, 25, 30, 35])
+    parser.add_argument('--valve1', type=float, nargs='+', default=[100.0])
+    parser.add_argument('--valve2', type=float, nargs='+', default=[100.0])
+    parser.add_argument('--dt', type=float, default=0.1, help="Chu kỳ PID (0: PID liên tục)")
+    args = parser.parse_args(argv)
+
+    result = analyze(CoupledTankSystem(), (args.kp, args.ki, args.kd), args.setpoints, args.valve1, args.valve2,
+                     sample_time=args.dt or None)
+    print(f"{'SP':>5}{'V1':>6}{'V2':>6}{'GM (dB)':>10}{'PM (°)':>9}{'wc':>9}{'w180':>9}{'BW':>9}")
+    for i in range(len(result['setpoint'])):
+        print(f"{result['setpoint'][i]:>5.0f}{result['valve1'][i]:>6.0f}{result['valve2'][i]:>6.0f}"
+              f"{result['gain_margin_db'][i]:>10.1f}{result['phase_margin'][i]:>9.1f}"
+              f"{result['crossover'][i]:>9.3f}{result['phase_crossover'][i]:>9.3f}{result['bandwidth'][i]:>9.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
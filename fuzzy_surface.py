@@ -0,0 +1,128 @@
+"""
+Bề mặt điều khiển Kp/Ki/Kd(E, CE) của FuzzyPIDController, lưu đệm và tính lại từng phần.
+
+Bề mặt là lưới e_points x ce_points trên tập nền của E và CE. Mức độ thuộc của từng trục
+được lưu riêng (mảng N x 7), nên một thay đổi chỉ đánh dấu vùng bị ảnh hưởng:
+    - Sửa luật (E_i, CE_j): các điểm mà cả E_i lẫn CE_j có mức độ thuộc > 0 (một khối chữ nhật).
+    - Sửa hàm thành viên đầu vào: các hàng (E) hoặc cột (CE) có mức độ thuộc của thuật ngữ đó đổi.
+    - Sửa hàm thành viên đầu ra (hoặc singleton Sugeno): vùng kích hoạt của mọi luật có hệ quả
+      là thuật ngữ đó.
+refresh() chỉ tính lại các điểm đã đánh dấu, theo lô, bằng chính phương pháp suy luận của bộ
+điều khiển (gains_from_strengths), nên bề mặt khớp với update() tại các điểm lưới.
+
+Ví dụ:
+    surface = ControlSurface(controller)
+    surface.set_rule('ZO', 'ZO', ('PS', 'ZO', 'NS'))
+    surface.refresh()  # Chỉ khối quanh (E=ZO, CE=ZO)
+    surface.gains[0]   # Bề mặt Kp (e_points x ce_points)
+"""
+import time
+
+import numpy as np
+
+OUTPUT_NAMES = ('Kp', 'Ki', 'Kd')
+
+
+class ControlSurface:
+    """
+    Bộ đệm bề mặt điều khiển của một FuzzyPIDController.
+
+    Args:
+        controller (FuzzyPIDController): Bộ điều khiển; sửa đổi nên đi qua set_rule() và
+            set_membership() của lớp này để vùng bị ảnh hưởng được đánh dấu.
+        e_points, ce_points (int): Số điểm lưới theo E và CE.
+        chunk (int): Số điểm tối đa mỗi lô khi tính (giới hạn bộ nhớ tạm).
+    """
+    def __init__(self, controller, e_points=41, ce_points=41, chunk=512):
+        self.controller = controller
+        self.chunk = chunk
+        self.e = np.linspace(controller.error_universe[0], controller.error_universe[-1], e_points)
+        self.ce = np.linspace(controller.ce_universe[0], controller.ce_universe[-1], ce_points)
+        self.gains = np.zeros((3, e_points, ce_points))  # Kp, Ki, Kd
+        self._e_degrees = controller.membership_degrees('E', self.e)
+        self._ce_degrees = controller.membership_degrees('CE', self.ce)
+        self._dirty = np.ones((e_points, ce_points), dtype=bool)
+        self.last_region = None  # (hàng, cột) bao vùng tính lại gần nhất
+        self.last_count = 0
+        self.last_elapsed_ms = 0.0
+
+    @property
+    def size(self):
+        return self._dirty.size
+
+    @property
+    def pending(self):
+        """Số điểm đang chờ tính lại."""
+        return int(self._dirty.sum())
+
+    # --- Đánh dấu vùng bị ảnh hưởng ---
+    def invalidate_all(self):
+        self._e_degrees = self.controller.membership_degrees('E', self.e)
+        self._ce_degrees = self.controller.membership_degrees('CE', self.ce)
+        self._dirty[:] = True
+
+    def invalidate_rule(self, e_term, ce_term):
+        """Vùng kích hoạt của luật (E, CE): khối các điểm có cả hai mức độ thuộc > 0."""
+        rows = self._e_degrees[:, self.controller._e_terms.index(e_term)] > 0
+        cols = self._ce_degrees[:, self.controller._ce_terms.index(ce_term)] > 0
+        self._dirty |= rows[:, None] & cols[None, :]
+
+    def invalidate_input(self, variable, term):
+        """Sau khi sửa hàm thành viên đầu vào: đọc lại mức độ thuộc, đánh dấu hàng/cột thay đổi."""
+        if variable == 'E':
+            index = self.controller._e_terms.index(term)
+            new = self.controller.membership_degrees('E', self.e)
+            changed = new[:, index] != self._e_degrees[:, index]
+            self._e_degrees = new
+            self._dirty[changed, :] = True
+        else:
+            index = self.controller._ce_terms.index(term)
+            new = self.controller.membership_degrees('CE', self.ce)
+            changed = new[:, index] != self._ce_degrees[:, index]
+            self._ce_degrees = new
+            self._dirty[:, changed] = True
+
+    def invalidate_output(self, output, term):
+        """Sau khi sửa tập đầu ra (hoặc singleton) term của Kp/Ki/Kd: mọi luật có hệ quả đó."""
+        o = OUTPUT_NAMES.index(output)
+        for (e_term, ce_term), outputs in self.controller.rule_base.items():
+            if outputs[o] == term:
+                self.invalidate_rule(e_term, ce_term)
+
+    # --- Sửa bộ điều khiển và đánh dấu ---
+    def set_rule(self, e_term, ce_term, outputs):
+        previous = self.controller.set_rule(e_term, ce_term, outputs)
+        if previous != tuple(outputs):
+            self.invalidate_rule(e_term, ce_term)
+        return previous
+
+    def set_membership(self, variable, term, params):
+        if variable in OUTPUT_NAMES:
+            # Vùng của luật dùng thuật ngữ này không đổi khi chỉ sửa tập đầu ra
+            self.invalidate_output(variable, term)
+            return self.controller.set_membership(variable, term, params)
+        previous = self.controller.set_membership(variable, term, params)
+        self.invalidate_input(variable, term)
+        return previous
+
+    # --- Tính lại ---
+    def refresh(self):
+        """
+        Tính lại các điểm đã đánh dấu.
+
+        Returns:
+            int: Số điểm đã tính (0 nếu bề mặt đã cập nhật).
+        """
+        rows, cols = np.nonzero(self._dirty)
+        self.last_count = len(rows)
+        if not len(rows):
+            return 0
+        t0 = time.perf_counter()
+        for start in range(0, len(rows), self.chunk):
+            r, c = rows[start:start + self.chunk], cols[start:start + self.chunk]
+            strengths = np.minimum(self._e_degrees[r][:, :, None], self._ce_degrees[c][:, None, :])
+            self.gains[:, r, c] = self.controller.gains_from_strengths(strengths.reshape(len(r), -1)).T
+        self._dirty[:] = False
+        self.last_elapsed_ms = (time.perf_counter() - t0) * 1000
+        self.last_region = (rows.min(), rows.max(), cols.min(), cols.max())
+        return self.last_count
@@ -0,0 +1,175 @@
+"""
+Tinh chỉnh ngoại tuyến bảng hệ số cho GainScheduledPIDController.
+
+Tại mỗi điểm lưới (setpoint, độ mở van 1, độ mở van 2), hệ số khởi đầu theo SIMC trên mô
+hình tuyến tính hóa, rồi được tinh chỉnh bằng mô phỏng vòng kín phi tuyến (bước setpoint
+quanh điểm làm việc và một nhiễu rút nước): tìm tau_c theo lát cắt vàng cho vài hệ số nhân
+Ki, giữ tổ hợp có chi phí (IAE + phạt vọt lố) nhỏ nhất. Các điểm lưới chạy song song.
+
+Ví dụ:
+    python gain_schedule.py build -o gain_schedule.json -j 4
+    python gain_schedule.py report gain_schedule.json
+"""
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from coupled_tank_gui import (CoupledTankSystem, PIDController, GainScheduleTable, SimulationEngine,
+                              simc_pid_gains, DEFAULT_GAIN_SCHEDULE_PATH, DEFAULT_PID_GAINS)
+
+DEFAULT_SETPOINTS = np.arange(5.0, 40.0, 5.0)
+DEFAULT_VALVES = np.linspace(20.0, 100.0, 5)
+KI_FACTORS = (0.5, 1.0, 2.0)
+TAU_C_RANGE = (1.0, 20.0)  # Cận dưới giữ hệ số ở mức chịu được nhiễu đo
+OVERSHOOT_PENALTY = 10.0
+
+
+def evaluate_gains(gains, set_point, valve1, valve2, dt=0.1, step_duration=80.0, disturbance_duration=40.0):
+    """
+    Chi phí vòng kín của một bộ hệ số tại điểm làm việc: bước từ 80% setpoint lên setpoint
+    (xuất phát xác lập, không giật), sau đó nhiễu rút 50 cm³/s trong 5 giây.
+
+    Returns:
+        float: IAE + OVERSHOOT_PENALTY * vọt lố lớn nhất (cm).
+    """
+    plant = CoupledTankSystem()
+    plant.set_valve_openings(valve1, valve2)
+    start = 0.8 * set_point
+    plant.H1, plant.H2, u_start = plant.steady_state(start)
+    controller = PIDController(*gains, set_point=set_point)
+    controller._integral = min(u_start, controller.output_max)  # Khởi động không giật
+    controller._last_error = set_point - plant.H2
+    engine = SimulationEngine(controller, plant, dt)
+
+    iae = 0.0
+    overshoot = 0.0
+    n_step = int(step_duration / dt)
+    for i in range(n_step + int(disturbance_duration / dt)):
+        if i == n_step:
+            plant.trigger_disturbance(engine.simulation_time)
+        engine.step()
+        error = set_point - plant.H2
+        iae += abs(error) * dt
+        overshoot = max(overshoot, -error)
+    return iae + OVERSHOOT_PENALTY * overshoot
+
+
+def _golden_section(func, lo, hi, iterations=10):
+    """Cực tiểu hóa func trên [lo, hi] (hàm một biến, giả thiết đơn cực)."""
+    inv_phi = (math.sqrt(5) - 1) / 2
+    a, b = lo, hi
+    c, d = b - inv_phi * (b - a), a + inv_phi * (b - a)
+    fc, fd = func(c), func(d)
+    for _ in range(iterations):
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - inv_phi * (b - a)
+            fc = func(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + inv_phi * (b - a)
+            fd = func(d)
+    return (c, fc) if fc < fd else (d, fd)
+
+
+def tune_point(set_point, valve1, valve2):
+    """
+    Tinh chỉnh một điểm lưới. Trả về (Kp, Ki, Kd, chi phí, có đạt được không).
+    Điểm không đạt được (H1 xác lập vượt chiều cao bồn hoặc lưu lượng cần > 300) giữ hệ số SIMC.
+    """
+    plant = CoupledTankSystem()
+    plant.set_valve_openings(valve1, valve2)
+    H1, _, u_eq = plant.steady_state(set_point)
+    if H1 > plant.max_height or u_eq > 300:
+        return (*simc_pid_gains(plant, set_point, 2.0), None, False)
+
+    best = None
+    log_lo, log_hi = math.log(TAU_C_RANGE[0]), math.log(TAU_C_RANGE[1])
+    for ki_factor in KI_FACTORS:
+        def gains_for(log_tau_c):
+            Kp, Ki, Kd = simc_pid_gains(plant, set_point, math.exp(log_tau_c))
+            return Kp, Ki * ki_factor, Kd
+
+        log_tau_c, cost = _golden_section(
+            lambda x: evaluate_gains(gains_for(x), set_point, valve1, valve2), log_lo, log_hi)
+        if best is None or cost < best[1]:
+            best = (gains_for(log_tau_c), cost)
+    (Kp, Ki, Kd), cost = best
+    return Kp, Ki, Kd, cost, True
+
+
+def build_table(setpoints=DEFAULT_SETPOINTS, valve1=DEFAULT_VALVES, valve2=DEFAULT_VALVES, jobs=None, executor=None):
+    """
+    Tinh chỉnh toàn bộ lưới (song song) và trả về GainScheduleTable. executor: pool sẵn có
+    (ví dụ worker_pool.WarmWorkerPool) thay vì tạo ProcessPoolExecutor mới.
+    """
+    grid = [(sp, v1, v2) for sp in setpoints for v1 in valve1 for v2 in valve2]
+    if executor is not None:
+        results = list(executor.map(tune_point, *zip(*grid), chunksize=4))
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, jobs or os.cpu_count())) as pool:
+            results = list(pool.map(tune_point, *zip(*grid), chunksize=4))
+    shape = (len(setpoints), len(valve1), len(valve2))
+    gains = np.array([r[:3] for r in results]).reshape(shape + (3,))
+    unreachable = [list(point) for point, r in zip(grid, results) if not r[4]]
+    meta = {
+        'method': 'simc+simulation',
+        'ki_factors': list(KI_FACTORS),
+        'tau_c_range': list(TAU_C_RANGE),
+        'overshoot_penalty': OVERSHOOT_PENALTY,
+        'unreachable': unreachable,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return GainScheduleTable(setpoints, valve1, valve2, gains, meta)
+
+
+def report(table):
+    """So sánh chi phí của bảng với bộ hệ số PID cố định mặc định tại mọi điểm đạt được."""
+    fixed = (DEFAULT_PID_GAINS['Kp'], DEFAULT_PID_GAINS['Ki'], DEFAULT_PID_GAINS['Kd'])
+    unreachable = {tuple(p) for p in table.meta.get('unreachable', [])}
+    rows = []
+    for sp in table.axes[0]:
+        for v1 in table.axes[1]:
+            for v2 in table.axes[2]:
+                if (sp, v1, v2) in unreachable:
+                    continue
+                scheduled = evaluate_gains(table.lookup(sp, v1, v2), sp, v1, v2)
+                rows.append((sp, v1, v2, evaluate_gains(fixed, sp, v1, v2), scheduled))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tinh chỉnh ngoại tuyến bảng hệ số PID lập lịch.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="Tinh chỉnh lưới và ghi bảng JSON")
+    build.add_argument('-o', '--output', default=DEFAULT_GAIN_SCHEDULE_PATH)
+    build.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    rep = sub.add_parser('report', help="So sánh bảng với PID cố định")
+    rep.add_argument('table', nargs='?', default=DEFAULT_GAIN_SCHEDULE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        t0 = time.perf_counter()
+        table = build_table(jobs=args.jobs)
+        table.save(args.output)
+        print(f"Đã tinh chỉnh {table.gains.size // 3} điểm trong {time.perf_counter() - t0:.1f} s -> {args.output}")
+        return 0
+
+    rows = report(GainScheduleTable.load(args.table))
+    print(f"{'SP':>5}{'V1':>6}{'V2':>6}{'PID cố định':>14}{'Lập lịch':>12}")
+    for sp, v1, v2, fixed, scheduled in rows:
+        print(f"{sp:>5.0f}{v1:>6.0f}{v2:>6.0f}{fixed:>14.1f}{scheduled:>12.1f}")
+    fixed_total = sum(r[3] for r in rows)
+    scheduled_total = sum(r[4] for r in rows)
+    print(f"Tổng chi phí: PID cố định {fixed_total:.1f}, lập lịch {scheduled_total:.1f} "
+          f"({100 * (scheduled_total / fixed_total - 1):+.1f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
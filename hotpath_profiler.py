@@ -0,0 +1,189 @@
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+
+
+class StageSamples:
+    """Bộ đệm vòng chứa thời gian thực thi gần nhất (nano giây) của một giai đoạn."""
+    def __init__(self, window):
+        self.window = window
+        self._samples = [0] * window
+        self.count = 0
+
+    def add(self, elapsed_ns):
+        self._samples[self.count % self.window] = elapsed_ns
+        self.count += 1
+
+    def values(self):
+        n = min(self.count, self.window)
+        return np.asarray(self._samples[:n], dtype=float)
+
+    def clear(self):
+        self.count = 0
+
+
+class StageProfiler:
+    """
+    Đo thời gian từng giai đoạn của vòng lặp nóng bằng đồng hồ đơn điệu (perf_counter_ns)
+    và tính p50/p95/p99 trên cửa sổ trượt.
+
+    Các phương thức được đo bằng cách gắn hàm bọc lên chính đối tượng (instrument);
+    khi tắt, hàm bọc được gỡ bỏ nên đường nóng không tốn thêm chi phí nào.
+    """
+    def __init__(self, window=1000):
+        self.window = window
+        self.stages = {}
+        self.enabled = False
+        self._targets = []  # (đối tượng, tên phương thức, tên giai đoạn)
+
+    def stage(self, name):
+        """Lấy (hoặc tạo) bộ đệm mẫu cho một giai đoạn; dùng với record() cho đoạn mã tùy ý."""
+        samples = self.stages.get(name)
+        if samples is None:
+            samples = self.stages[name] = StageSamples(self.window)
+        return samples
+
+    def record(self, name, elapsed_ns):
+        """Ghi nhận thủ công một lần đo (chỉ khi đang bật)."""
+        if self.enabled:
+            self.stage(name).add(elapsed_ns)
+
+    def register(self, obj, method_name, stage_name=None):
+        """Đăng ký một phương thức cần đo; được bọc ngay nếu profiler đang bật."""
+        stage_name = stage_name or f"{type(obj).__name__}.{method_name}"
+        self._targets.append((obj, method_name, stage_name))
+        if self.enabled:
+            self._wrap(obj, method_name, stage_name)
+
+    def _wrap(self, obj, method_name, stage_name):
+        func = getattr(type(obj), method_name).__get__(obj)
+        samples = self.stage(stage_name)
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            t0 = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.add(clock() - t0)
+
+        setattr(obj, method_name, timed)
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        for obj, method_name, stage_name in self._targets:
+            self._wrap(obj, method_name, stage_name)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for obj, method_name, _ in self._targets:
+            obj.__dict__.pop(method_name, None)
+
+    def reset(self):
+        for samples in self.stages.values():
+            samples.clear()
+
+    def summary(self):
+        """Thống kê theo giai đoạn (micro giây): số lần, p50, p95, p99, trung bình, lớn nhất."""
+        result = {}
+        for name, samples in self.stages.items():
+            values = samples.values()
+            if len(values) == 0:
+                continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99)) / 1e3
+            result[name] = {
+                'count': samples.count,
+                'p50_us': float(p50),
+                'p95_us': float(p95),
+                'p99_us': float(p99),
+                'mean_us': float(values.mean() / 1e3),
+                'max_us': float(values.max() / 1e3),
+            }
+        return result
+
+    def format_overlay(self):
+        """Văn bản ngắn gọn cho lớp phủ trên màn hình."""
+        lines = [f"{'Giai đoạn':<28}{'p50':>8}{'p95':>8}{'p99':>8} (ms)"]
+        for name, stats in sorted(self.summary().items()):
+            lines.append(f"{name[-28:]:<28}{stats['p50_us'] / 1e3:>8.3f}"
+                         f"{stats['p95_us'] / 1e3:>8.3f}{stats['p99_us'] / 1e3:>8.3f}")
+        return "\n".join(lines)
+
+    def dump_json(self, filepath):
+        """Ghi thống kê ra file JSON (đọc được bằng máy)."""
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump({'window': self.window, 'stages': self.summary()}, f, indent=2, ensure_ascii=False)
+
+
+def process_age():
+    """Số giây từ khi tiến trình hiện tại bắt đầu (Linux, đọc /proc; nơi khác trả về None)."""
+    try:
+        with open('/proc/self/stat') as f:
+            # Trường 22 (starttime, tính bằng tick từ lúc khởi động máy) nằm sau tên lệnh trong ngoặc
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupTimer:
+    """
+    Các mốc thời gian khởi động (giây) tính từ lúc tiến trình bắt đầu. Khi không biết thời điểm
+    bắt đầu tiến trình (ngoài Linux), gốc là lúc tạo StartupTimer — nên tạo càng sớm càng tốt.
+    """
+    def __init__(self):
+        now = time.perf_counter()
+        age = process_age()
+        self.origin = now - (age or 0.0)  # perf_counter tại thời điểm gốc
+        self.from_process_start = age is not None
+        self.marks = {}
+
+    def mark(self, name):
+        """Ghi mốc name (chỉ lần đầu) và trả về thời gian từ gốc."""
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.origin
+        return self.marks[name]
+
+    def format(self):
+        return ", ".join(f"{name} {value:.3f} s" for name, value in self.marks.items())
+
+    def record(self):
+        """Một bản ghi cho nhật ký khởi động."""
+        return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(),
+                'python': platform.python_version(), 'platform': sys.platform,
+                'from_process_start': self.from_process_start, 'marks': dict(self.marks)}
+
+    def append_log(self, path, keep=500):
+        """Thêm bản ghi vào nhật ký JSON Lines ở path, giữ keep bản ghi gần nhất."""
+        records = self.read_log(path)[-(keep - 1):] if keep > 1 else []
+        records.append(self.record())
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_log(path):
+        """Các bản ghi trong nhật ký (bỏ qua dòng hỏng); danh sách rỗng nếu chưa có file."""
+        records = []
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return records
@@ -0,0 +1,93 @@
+"""
+So sánh song song nhiều bộ điều khiển trên các bản sao của cùng một hệ bồn.
+
+Mỗi bộ điều khiển ("làn") có hệ bồn riêng được nhân bản từ cùng một trạng thái; mọi thay
+đổi setpoint, độ mở van và nhiễu loạn được phát tới tất cả các làn, và các làn được chạy
+đồng bộ từng bước (lockstep) nên so sánh là công bằng. Chỉ số (IAE, ISE, vọt lố, thời gian
+xác lập) được tích lũy từng bước bằng ScenarioMetrics.
+"""
+from coupled_tank_gui import CoupledTankSystem, SimulationEngine
+from scenario_runner import ScenarioMetrics
+
+
+class ControllerComparison:
+    """
+    Chạy lockstep một tập bộ điều khiển trên các hệ bồn nhân bản.
+
+    Args:
+        tank_system (CoupledTankSystem): Hệ bồn gốc; làn `primary` dùng chính hệ này,
+            các làn khác dùng bản sao từ tank_system.snapshot().
+        controllers (dict): Tên làn -> bộ điều khiển (mỗi làn một đối tượng riêng).
+        dt (float): Bước thời gian mô phỏng.
+        start_time (float): Thời gian mô phỏng tại thời điểm bắt đầu so sánh.
+        primary (str): Tên làn dùng hệ bồn gốc (mặc định: không có, mọi làn đều là bản sao).
+        reset_controllers (bool): Đặt lại trạng thái tất cả bộ điều khiển để cùng xuất phát.
+    """
+    def __init__(self, tank_system, controllers, dt=0.1, start_time=0.0, primary=None,
+                 reset_controllers=True, settle_band=0.02):
+        state = tank_system.snapshot()
+        self.primary = primary
+        self.engines = {}
+        self.metrics = {}
+        for name, controller in controllers.items():
+            if name == primary:
+                plant = tank_system
+            else:
+                plant = CoupledTankSystem()
+                plant.restore(state)
+            if hasattr(controller, 'plant'):
+                controller.plant = plant  # MPC đọc độ mở van từ chính hệ bồn của làn
+            if reset_controllers:
+                controller.reset()
+            engine = SimulationEngine(controller, plant, dt)
+            engine.simulation_time = start_time
+            self.engines[name] = engine
+            self.metrics[name] = ScenarioMetrics(settle_band)
+            self.metrics[name].start_segment(start_time, controller.set_point, plant.H2)
+
+    def step(self):
+        """Chạy một bước cho tất cả các làn; trả về dict tên -> Qi1."""
+        inflows = {}
+        for name, engine in self.engines.items():
+            inflows[name] = engine.step()
+            self.metrics[name].add(engine.simulation_time, engine.tank_system.H2,
+                                   engine.controller.set_point, engine.dt)
+        return inflows
+
+    # --- Đầu vào chung cho tất cả các làn ---
+    def set_setpoint(self, set_point):
+        for name, engine in self.engines.items():
+            engine.set_setpoint(set_point)
+            self.metrics[name].start_segment(engine.simulation_time, set_point, engine.tank_system.H2)
+
+    def set_valve_openings(self, valve1_open, valve2_open):
+        for engine in self.engines.values():
+            engine.tank_system.set_valve_openings(valve1_open, valve2_open)
+
+    def trigger_disturbance(self, flow=None, duration=None):
+        for engine in self.engines.values():
+            engine.trigger_disturbance(flow, duration)
+
+    # --- Kết quả ---
+    def levels(self):
+        """Dict tên -> H2 hiện tại của từng làn."""
+        return {name: engine.tank_system.H2 for name, engine in self.engines.items()}
+
+    def results(self):
+        """
+        Chỉ số hiện tại của từng làn (không đóng đoạn đang chạy), kèm chênh lệch IAE so với
+        làn tham chiếu (làn primary, hoặc làn đầu tiên).
+        """
+        reference = self.primary if self.primary in self.engines else next(iter(self.engines))
+        results = {}
+        for name, metrics in self.metrics.items():
+            engine = self.engines[name]
+            results[name] = {
+                'iae': metrics.iae,
+                'ise': metrics.ise,
+                'max_overshoot': metrics.max_overshoot,
+                'error': engine.controller.set_point - engine.tank_system.H2,
+            }
+        for name, result in results.items():
+            result['delta_iae'] = result['iae'] - results[reference]['iae']
+        return results
@@ -0,0 +1,164 @@
+import os
+import numpy as np
+
+# --- ĐỊNH DẠNG FILE GHI PHIÊN CHẠY ---
+# Header cố định 64 byte, sau đó là các bản ghi nhị phân kích thước cố định
+# (little-endian float64) để có thể ánh xạ bộ nhớ (memory-map) trực tiếp.
+RECORDING_MAGIC = b'CTRUN\x00\x00\x01'
+RECORDING_VERSION = 1
+RECORDING_HEADER_SIZE = 64
+RECORD_FIELDS = ('time', 'h1', 'h2', 'qi1', 'setpoint', 'valve1', 'valve2', 'disturbance')
+RECORD_DTYPE = np.dtype([(name, '<f8') for name in RECORD_FIELDS])
+
+# Cứ mỗi INDEX_STRIDE bản ghi lấy một mốc thời gian cho chỉ mục thô
+INDEX_STRIDE = 4096
+
+
+def _build_header():
+    header = bytearray(RECORDING_HEADER_SIZE)
+    header[0:8] = RECORDING_MAGIC
+    header[8:12] = np.uint32(RECORDING_VERSION).tobytes()
+    header[12:16] = np.uint32(RECORD_DTYPE.itemsize).tobytes()
+    return bytes(header)
+
+
+class RunRecorder:
+    """
+    Ghi lại từng bước mô phỏng vào file nhị phân để phát lại sau này.
+    Các bản ghi được gom vào bộ đệm và ghi xuống đĩa theo từng khối.
+    """
+    def __init__(self, filepath, buffer_size=1024):
+        self.filepath = filepath
+        self._file = open(filepath, 'wb')
+        self._file.write(_build_header())
+        self._buffer = np.zeros(buffer_size, dtype=RECORD_DTYPE)
+        self._buffered = 0
+        self.record_count = 0
+
+    def append(self, time, h1, h2, qi1, setpoint, valve1, valve2, disturbance):
+        """Thêm một bản ghi trạng thái vào file."""
+        self._buffer[self._buffered] = (time, h1, h2, qi1, setpoint, valve1, valve2, float(disturbance))
+        self._buffered += 1
+        self.record_count += 1
+        if self._buffered == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        """Ghi toàn bộ bộ đệm xuống đĩa."""
+        if self._file is None or self._buffered == 0:
+            return
+        self._file.write(self._buffer[:self._buffered].tobytes())
+        self._file.flush()
+        self._buffered = 0
+
+    def close(self):
+        """Ghi nốt bộ đệm và đóng file."""
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+class RunRecording:
+    """
+    Đọc file ghi phiên chạy bằng memory-map. Dữ liệu không được nạp vào RAM;
+    việc tìm kiếm theo thời gian dùng một chỉ mục thô (mỗi INDEX_STRIDE bản ghi)
+    rồi tìm nhị phân trong khối tương ứng, nên tua tới bất kỳ thời điểm nào
+    trong bản ghi dài cũng gần như tức thời.
+    """
+    def __init__(self, filepath, index_stride=INDEX_STRIDE):
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            header = f.read(RECORDING_HEADER_SIZE)
+        if len(header) < RECORDING_HEADER_SIZE or header[0:8] != RECORDING_MAGIC:
+            raise ValueError(f"File không phải bản ghi phiên chạy hợp lệ: {os.path.basename(filepath)}")
+        record_size = int(np.frombuffer(header[12:16], dtype=np.uint32)[0])
+        if record_size != RECORD_DTYPE.itemsize:
+            raise ValueError("Kích thước bản ghi không khớp với phiên bản hiện tại.")
+
+        # Bỏ qua bản ghi cuối bị ghi dở (nếu chương trình dừng đột ngột)
+        payload = os.path.getsize(filepath) - RECORDING_HEADER_SIZE
+        count = payload // RECORD_DTYPE.itemsize
+        if count <= 0:
+            raise ValueError("Bản ghi không có dữ liệu.")
+        self.records = np.memmap(filepath, dtype=RECORD_DTYPE, mode='r',
+                                 offset=RECORDING_HEADER_SIZE, shape=(count,))
+        self.times = self.records['time']
+
+        # Chỉ mục thô: chỉ đọc một bản ghi trên mỗi khối
+        self.index_stride = index_stride
+        self._coarse_times = np.array(self.times[::index_stride])
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def start_time(self):
+        return float(self._coarse_times[0])
+
+    @property
+    def end_time(self):
+        return float(self.times[-1])
+
+    def index_at(self, t):
+        """Trả về chỉ số bản ghi cuối cùng có thời gian <= t."""
+        block = int(np.searchsorted(self._coarse_times, t, side='right')) - 1
+        if block < 0:
+            return 0
+        lo = block * self.index_stride
+        hi = min(lo + self.index_stride, len(self.records))
+        idx = lo + int(np.searchsorted(self.times[lo:hi], t, side='right')) - 1
+        return max(0, min(idx, len(self.records) - 1))
+
+    def sample_at(self, t):
+        """Trả về bản ghi tại thời điểm t (dạng numpy.void với các trường RECORD_FIELDS)."""
+        return self.records[self.index_at(t)]
+
+    def window(self, t_start, t_end, max_points=2000):
+        """
+        Trả về các bản ghi trong khoảng [t_start, t_end], được lấy mẫu thưa
+        để không vượt quá max_points điểm.
+        """
+        i0 = self.index_at(t_start)
+        i1 = self.index_at(t_end) + 1
+        step = max(1, -(-(i1 - i0) // max_points))
+        return self.records[i0:i1:step]
+
+
+class ReplayPlayer:
+    """
+    Điều khiển vị trí phát lại: tua, tốc độ thay đổi và phát ngược.
+    Không phụ thuộc Tkinter; GUI chỉ cần gọi advance() mỗi khung hình.
+    """
+    SPEEDS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 64.0)
+
+    def __init__(self, recording):
+        self.recording = recording
+        self.position = recording.start_time
+        self.speed = 1.0
+        self.direction = 1
+        self.playing = False
+
+    def seek(self, t):
+        """Tua tới thời điểm t (được giới hạn trong phạm vi bản ghi)."""
+        self.position = max(self.recording.start_time, min(t, self.recording.end_time))
+
+    def set_speed(self, speed):
+        self.speed = max(0.0, float(speed))
+
+    def toggle_direction(self):
+        self.direction = -self.direction
+
+    def advance(self, wall_dt):
+        """Tiến vị trí phát theo thời gian thực wall_dt; tự dừng khi chạm đầu/cuối bản ghi."""
+        if not self.playing:
+            return self.position
+        self.seek(self.position + self.direction * self.speed * wall_dt)
+        if (self.direction > 0 and self.position >= self.recording.end_time) or \
+                (self.direction < 0 and self.position <= self.recording.start_time):
+            self.playing = False
+        return self.position
+
+    def current_sample(self):
+        return self.recording.sample_at(self.position)
@@ -0,0 +1,423 @@
+"""
+Chạy các kịch bản mô phỏng (JSON hoặc TOML) không cần giao diện, song song nhiều tiến trình.
+
+Ví dụ:
+    python scenario_runner.py scenarios/*.json -o results -j 4
+
+Mỗi kịch bản ghi ra <output>/<tên>/metrics.json và recording.ctrun (mở được bằng
+Tệp > Mở bản ghi để phát lại trong GUI); tổng hợp được ghi vào <output>/summary.json.
+Mã thoát khác 0 nếu có kịch bản lỗi hoặc không đạt ngưỡng trong mục "expect".
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    tomllib = None
+
+from coupled_tank_gui import (CoupledTankSystem, SimulationEngine, MultiRateEngine, FuzzyPIDController,
+                              create_controller, CONTROLLER_TYPES)
+from run_recording import RunRecorder
+from worker_pool import WarmWorkerPool, format_stats
+
+EVENT_ACTIONS = ('setpoint', 'valves', 'disturbance', 'gains', 'controller')
+SCENARIO_DEFAULTS = {
+    'duration': 120.0,
+    'dt': 0.1,
+    'controller': {'type': 'pid'},
+    'initial': {},
+    'events': [],
+    'expect': {},
+    'rates': {},
+}
+RATE_KEYS = ('controller', 'sensor', 'actuator')
+
+
+class ScenarioError(ValueError):
+    """Kịch bản không hợp lệ."""
+
+
+def load_scenario(filepath):
+    """
+    Đọc và kiểm tra một file kịch bản.
+
+    Định dạng (JSON; TOML dùng cùng cấu trúc):
+        {
+          "name": "buoc_25cm",
+          "duration": 300, "dt": 0.1,
+          "controller": {"type": "pid", "Kp": 83.5, "Ki": 14.5, "Kd": 120},
+          "rates": {"controller": 1.0, "sensor": 0.5},
+          "initial": {"setpoint": 25, "valve1": 100, "valve2": 100, "H1": 0, "H2": 0},
+          "events": [
+            {"time": 100, "setpoint": 15},
+            {"time": 150, "valves": [50, 100]},
+            {"time": 200, "disturbance": {"duration": 5, "flow": 50}},
+            {"time": 220, "gains": {"Kp": 60}},
+            {"time": 250, "controller": "fuzzy"}
+          ],
+          "expect": {"iae_max": 500, "max_overshoot_max": 3}
+        }
+
+    Với "type": "fuzzy", "inference": "sugeno" chọn suy luận Sugeno bậc không (mặc định "mamdani").
+    "rates" (tùy chọn) đặt chu kỳ riêng (giây) cho bộ điều khiển, cảm biến và cơ cấu chấp hành;
+    khi có, kịch bản chạy trên MultiRateEngine (hệ bồn vẫn tích phân với bước dt).
+    """
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    if filepath.endswith('.toml'):
+        if tomllib is None:
+            raise ScenarioError("Cần Python >= 3.11 để đọc kịch bản TOML.")
+        data = tomllib.loads(raw.decode('utf-8'))
+    else:
+        data = json.loads(raw.decode('utf-8'))
+
+    if not isinstance(data, dict):
+        raise ScenarioError(f"{filepath}: kịch bản phải là một đối tượng (dict)")
+    scenario = dict(SCENARIO_DEFAULTS, **data)
+    scenario.setdefault('name', os.path.splitext(os.path.basename(filepath))[0])
+    if not isinstance(scenario['name'], str):
+        raise ScenarioError(f"{filepath}: name phải là chuỗi")
+
+    ctrl = _mapping(scenario['controller'], 'controller', filepath)
+    if ctrl.get('type') not in CONTROLLER_TYPES:
+        raise ScenarioError(f"{filepath}: controller.type phải là một trong {CONTROLLER_TYPES}")
+    if ctrl.get('inference', 'mamdani') not in FuzzyPIDController.INFERENCE_METHODS:
+        raise ScenarioError(f"{filepath}: controller.inference phải là một trong {FuzzyPIDController.INFERENCE_METHODS}")
+    _numbers(ctrl, ('Kp', 'Ki', 'Kd'), 'controller', filepath)
+    for key in ('duration', 'dt', 'settle_band'):
+        if key in scenario:
+            scenario[key] = _number(scenario[key], key, filepath, positive=True)
+    rates = _mapping(scenario['rates'], 'rates', filepath)
+    if any(key not in RATE_KEYS for key in rates):
+        raise ScenarioError(f"{filepath}: rates chỉ gồm {RATE_KEYS} với chu kỳ dương")
+    _numbers(rates, RATE_KEYS, 'rates', filepath, positive=True)
+    _numbers(_mapping(scenario['initial'], 'initial', filepath), ('setpoint', 'valve1', 'valve2', 'H1', 'H2'),
+             'initial', filepath)
+    expect = _mapping(scenario['expect'], 'expect', filepath)
+    _numbers(expect, tuple(expect), 'expect', filepath)
+    scenario['events'] = _validate_events(scenario['events'], filepath)
+    return scenario
+
+
+def _number(value, what, source, positive=False):
+    """Số thực hữu hạn (bool không tính là số); ScenarioError nếu sai kiểu hoặc không dương khi cần."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ScenarioError(f"{source}: {what} phải là số hữu hạn, nhận {value!r}")
+    if positive and value <= 0:
+        raise ScenarioError(f"{source}: {what} phải dương, nhận {value!r}")
+    return float(value)
+
+
+def _numbers(mapping, keys, what, source, positive=False):
+    """Chuyển các khóa có mặt trong mapping thành số thực đã kiểm tra (sửa tại chỗ)."""
+    for key in keys:
+        if key in mapping:
+            mapping[key] = _number(mapping[key], f"{what}.{key}", source, positive)
+
+
+def _mapping(value, what, source):
+    if not isinstance(value, dict):
+        raise ScenarioError(f"{source}: {what} phải là một đối tượng (dict), nhận {value!r}")
+    return value
+
+
+def _validate_events(events, source):
+    """Kiểm tra danh sách sự kiện (kiểu dữ liệu từng hành động) và trả về bản đã sắp xếp theo thời gian."""
+    if not isinstance(events, list):
+        raise ScenarioError(f"{source}: events phải là một danh sách")
+    checked = []
+    for event in events:
+        if not isinstance(event, dict):
+            raise ScenarioError(f"{source}: sự kiện phải là một đối tượng (dict): {event!r}")
+        if 'time' not in event:
+            raise ScenarioError(f"{source}: sự kiện thiếu 'time': {event}")
+        if not any(action in event for action in EVENT_ACTIONS):
+            raise ScenarioError(f"{source}: sự kiện không có hành động ({', '.join(EVENT_ACTIONS)}): {event}")
+        event = dict(event, time=_number(event['time'], 'time của sự kiện', source))
+        if 'controller' in event and event['controller'] not in CONTROLLER_TYPES:
+            raise ScenarioError(f"{source}: bộ điều khiển không hợp lệ trong sự kiện: {event}")
+        if 'setpoint' in event:
+            event['setpoint'] = _number(event['setpoint'], 'setpoint của sự kiện', source)
+        if 'valves' in event:
+            valves = event['valves']
+            if not isinstance(valves, (list, tuple)) or len(valves) != 2:
+                raise ScenarioError(f"{source}: valves phải là [van1, van2]: {event}")
+            event['valves'] = [_number(v, 'valves của sự kiện', source) for v in valves]
+        if 'disturbance' in event:
+            event['disturbance'] = dict(_mapping(event['disturbance'], 'disturbance', source))
+            _numbers(event['disturbance'], ('flow', 'duration'), 'disturbance', source)
+        if 'gains' in event:
+            event['gains'] = dict(_mapping(event['gains'], 'gains', source))
+            _numbers(event['gains'], ('Kp', 'Ki', 'Kd'), 'gains', source)
+        checked.append(event)
+    return sorted(checked, key=lambda e: e['time'])
+
+
+class ScenarioMetrics:
+    """Tích lũy các chỉ số hiệu năng theo từng bước, không cần lưu toàn bộ chuỗi dữ liệu."""
+    def __init__(self, settle_band=0.02):
+        self.settle_band = settle_band
+        self.iae = 0.0
+        self.ise = 0.0
+        self.max_overshoot = 0.0
+        self.settling_times = []
+        self._segment = None
+
+    def start_segment(self, t, setpoint, h2):
+        """Bắt đầu một đoạn mới khi setpoint thay đổi."""
+        self._close_segment()
+        self._segment = {'start': t, 'direction': 1 if setpoint >= h2 else -1, 'settled_at': None}
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self.settling_times.append(self._segment['settled_at'])
+
+    def add(self, t, h2, setpoint, dt):
+        error = setpoint - h2
+        self.iae += abs(error) * dt
+        self.ise += error * error * dt
+        seg = self._segment
+        self.max_overshoot = max(self.max_overshoot, -error * seg['direction'])
+        # Thời gian xác lập: lần cuối cùng sai số đi vào dải ±settle_band và ở lại đó
+        band = max(self.settle_band * abs(setpoint), 0.2)
+        if abs(error) > band:
+            seg['settled_at'] = None
+        elif seg['settled_at'] is None:
+            seg['settled_at'] = t - seg['start']
+
+    def result(self, final_error):
+        self._close_segment()
+        self._segment = None
+        settled = [st for st in self.settling_times if st is not None]
+        return {
+            'iae': self.iae,
+            'ise': self.ise,
+            'max_overshoot': self.max_overshoot,
+            'settling_times': self.settling_times,
+            'settling_time': max(settled) if len(settled) == len(self.settling_times) and settled else None,
+            'final_error': final_error,
+        }
+
+
+def _check_expectations(metrics, expect):
+    """So sánh chỉ số với các ngưỡng '<chỉ số>_max' / '<chỉ số>_min'. Trả về danh sách lỗi."""
+    failures = []
+    for key, limit in expect.items():
+        name, _, bound = key.rpartition('_')
+        if bound not in ('max', 'min') or name not in metrics:
+            failures.append(f"ngưỡng không hợp lệ: {key}")
+            continue
+        value = metrics[name]
+        if value is None:
+            failures.append(f"{name} không xác định (chưa ổn định)")
+        elif (bound == 'max' and abs(value) > limit) or (bound == 'min' and value < limit):
+            failures.append(f"{name}={value:.4g} vượt ngưỡng {key}={limit}")
+    return failures
+
+
+def _apply_event(engine, event, gains, metrics):
+    """Áp dụng một sự kiện kịch bản lên engine."""
+    ts = engine.tank_system
+    if 'controller' in event:
+        engine.controller = create_controller(event['controller'], engine.controller.set_point, gains,
+                                              plant=ts)
+    if 'gains' in event and hasattr(engine.controller, 'set_gains'):
+        gains.update(event['gains'])
+        g = engine.controller
+        g.set_gains(gains.get('Kp', g.Kp), gains.get('Ki', g.Ki), gains.get('Kd', g.Kd))
+    if 'setpoint' in event:
+        engine.set_setpoint(event['setpoint'])
+        metrics.start_segment(engine.simulation_time, event['setpoint'], ts.H2)
+    if 'valves' in event:
+        ts.set_valve_openings(*event['valves'])
+    if 'disturbance' in event:
+        dist = event['disturbance']
+        engine.trigger_disturbance(dist.get('flow'), dist.get('duration'))
+
+
+def _run_events(engine, events, n_steps, metrics, gains):
+    """Chạy n_steps bước, áp dụng các sự kiện (đã sắp xếp, thời gian tuyệt đối) khi đến hạn."""
+    ts = engine.tank_system
+    events = list(events)
+    for _ in range(n_steps):
+        # Áp dụng các sự kiện đến hạn trước bước mô phỏng
+        while events and events[0]['time'] <= engine.simulation_time + 1e-9:
+            _apply_event(engine, events.pop(0), gains, metrics)
+        engine.step()
+        metrics.add(engine.simulation_time, ts.H2, engine.controller.set_point, engine.dt)
+
+
+def run_scenario(scenario, output_dir=None):
+    """
+    Chạy một kịch bản đã nạp. Nếu có output_dir, ghi metrics.json và recording.ctrun vào đó.
+
+    Returns:
+        dict: Kết quả gồm tên, chỉ số, danh sách lỗi ngưỡng và thời gian chạy thực.
+    """
+    initial = scenario['initial']
+    ctrl_cfg = scenario['controller']
+    set_point = initial.get('setpoint', 25.0)
+    gains = {k: ctrl_cfg[k] for k in ('Kp', 'Ki', 'Kd') if k in ctrl_cfg}
+
+    ts = CoupledTankSystem()
+    ts.H1 = initial.get('H1', 0.0)
+    ts.H2 = initial.get('H2', 0.0)
+    ts.set_valve_openings(initial.get('valve1', 100.0), initial.get('valve2', 100.0))
+    controller = create_controller(ctrl_cfg['type'], set_point, gains, plant=ts,
+                                   fuzzy_inference=ctrl_cfg.get('inference', 'mamdani'))
+    rates = scenario.get('rates')
+    if rates:
+        engine = MultiRateEngine(controller, ts, dt=scenario['dt'], controller_period=rates.get('controller'),
+                                 sensor_period=rates.get('sensor'), actuator_period=rates.get('actuator'))
+    else:
+        engine = SimulationEngine(controller, ts, dt=scenario['dt'])
+
+    recorder = None
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        recorder = RunRecorder(os.path.join(output_dir, 'recording.ctrun'))
+        engine.recorder = recorder
+
+    metrics = ScenarioMetrics(scenario.get('settle_band', 0.02))
+    metrics.start_segment(0.0, set_point, ts.H2)
+    events = list(scenario['events'])
+    n_steps = int(round(scenario['duration'] / scenario['dt']))
+
+    wall_start = time.perf_counter()
+    _run_events(engine, events, n_steps, metrics, gains)
+    wall_time = time.perf_counter() - wall_start
+
+    if recorder is not None:
+        recorder.close()
+
+    result = {
+        'name': scenario['name'],
+        'controller': ctrl_cfg['type'],
+        'steps': n_steps,
+        'wall_time_s': wall_time,
+        'steps_per_s': n_steps / wall_time if wall_time > 0 else None,
+        'metrics': metrics.result(engine.controller.set_point - ts.H2),
+    }
+    result['failures'] = _check_expectations(result['metrics'], scenario['expect'])
+    result['passed'] = not result['failures']
+
+    if output_dir is not None:
+        with open(os.path.join(output_dir, 'metrics.json'), 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    return result
+
+
+def run_branch(snapshot, branch, duration, settle_band=0.02):
+    """
+    Chạy một nhánh "what-if" từ ảnh chụp SimulationEngine.snapshot().
+
+    Args:
+        snapshot (dict): Trạng thái tại điểm rẽ nhánh.
+        branch (dict): {"name": ..., "events": [...]} với thời gian sự kiện tính từ điểm rẽ
+            nhánh (cùng cú pháp sự kiện như kịch bản, ví dụ {"time": 0, "controller": "fuzzy"}).
+        duration (float): Thời gian mô phỏng của nhánh (giây).
+
+    Returns:
+        dict: Tên nhánh, chỉ số và trạng thái cuối.
+    """
+    engine = SimulationEngine.from_snapshot(snapshot)
+    t0 = engine.simulation_time
+    events = [dict(event, time=event['time'] + t0)
+              for event in _validate_events(branch.get('events', []), branch.get('name', 'nhánh'))]
+    ctrl = snapshot['controller']
+    gains = {k: ctrl[k] for k in ('Kp', 'Ki', 'Kd') if k in ctrl}
+
+    metrics = ScenarioMetrics(settle_band)
+    metrics.start_segment(t0, engine.controller.set_point, engine.tank_system.H2)
+    wall_start = time.perf_counter()
+    _run_events(engine, events, int(round(duration / engine.dt)), metrics, gains)
+    return {
+        'name': branch.get('name', 'nhánh'),
+        'wall_time_s': time.perf_counter() - wall_start,
+        'metrics': metrics.result(engine.controller.set_point - engine.tank_system.H2),
+        'final_state': engine.state(),
+    }
+
+
+def run_branches(snapshot, branches, duration, jobs=None, executor=None):
+    """
+    Chạy song song nhiều nhánh từ cùng một ảnh chụp (mỗi nhánh một tiến trình).
+
+    Trả về danh sách kết quả của run_branch theo thứ tự các nhánh. Có thể truyền
+    executor sẵn có (ví dụ worker_pool.WarmWorkerPool) để không phải khởi động lại tiến
+    trình con cho mỗi lần rẽ nhánh.
+    """
+    if executor is not None:
+        return list(executor.map(run_branch, [snapshot] * len(branches), branches, [duration] * len(branches)))
+    with WarmWorkerPool(max(1, min(jobs or os.cpu_count(), len(branches)))) as pool:
+        return run_branches(snapshot, branches, duration, executor=pool)
+
+
+def default_branches(snapshot):
+    """Các nhánh so sánh mặc định: giữ nguyên, đổi bộ điều khiển, nhiễu ngay, đổi setpoint ±5 cm."""
+    other = next(t for t in CONTROLLER_TYPES if t != snapshot['controller_type'])
+    set_point = snapshot['controller']['set_point']
+    return [
+        {'name': 'giữ nguyên', 'events': []},
+        {'name': f'chuyển sang {other}', 'events': [{'time': 0, 'controller': other}]},
+        {'name': 'nhiễu ngay bây giờ', 'events': [{'time': 0, 'disturbance': {}}]},
+        {'name': f'setpoint {set_point + 5:g} cm', 'events': [{'time': 0, 'setpoint': set_point + 5}]},
+        {'name': f'setpoint {max(set_point - 5, 0):g} cm', 'events': [{'time': 0, 'setpoint': max(set_point - 5, 0)}]},
+    ]
+
+
+def run_scenario_file(filepath, output_root=None):
+    """Nạp và chạy một file kịch bản (dùng trong tiến trình con)."""
+    try:
+        scenario = load_scenario(filepath)
+        output_dir = os.path.join(output_root, scenario['name']) if output_root else None
+        result = run_scenario(scenario, output_dir)
+    except (OSError, ValueError) as e:
+        result = {'name': os.path.basename(filepath), 'passed': False, 'failures': [f"lỗi: {e}"]}
+    except Exception as e:  # Lỗi khi chạy một kịch bản không được làm dừng cả lô
+        result = {'name': os.path.basename(filepath), 'passed': False,
+                  'failures': [f"lỗi: {type(e).__name__}: {e}"]}
+    result['file'] = filepath
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy hàng loạt kịch bản mô phỏng bồn nước đôi không giao diện.")
+    parser.add_argument('scenarios', nargs='+', help="Các file kịch bản (.json hoặc .toml)")
+    parser.add_argument('-o', '--output', default='scenario_results', help="Thư mục kết quả")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="Số tiến trình song song")
+    parser.add_argument('--no-output', action='store_true', help="Không ghi metrics/recording ra đĩa")
+    args = parser.parse_args(argv)
+
+    output_root = None if args.no_output else args.output
+    wall_start = time.perf_counter()
+    with WarmWorkerPool(max(1, min(args.jobs, len(args.scenarios)))) as pool:
+        results = list(pool.map(run_scenario_file, args.scenarios, [output_root] * len(args.scenarios)))
+        pool_stats = pool.stats()
+    wall_time = time.perf_counter() - wall_start
+
+    for result in results:
+        status = "ĐẠT " if result['passed'] else "LỖI "
+        detail = "; ".join(result['failures'])
+        iae = result.get('metrics', {}).get('iae')
+        iae_text = f"IAE={iae:.1f}" if iae is not None else ""
+        print(f"[{status}] {result['name']:<30} {iae_text:<14} {detail}")
+    n_failed = sum(not r['passed'] for r in results)
+    print(f"{len(results)} kịch bản, {n_failed} lỗi, {wall_time:.1f} s")
+    print(f"Pool: {format_stats(pool_stats)}")
+
+    if output_root is not None:
+        os.makedirs(output_root, exist_ok=True)
+        with open(os.path.join(output_root, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump({'wall_time_s': wall_time, 'pool': pool_stats, 'results': results}, f, indent=2,
+                      ensure_ascii=False)
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
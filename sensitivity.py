@@ -0,0 +1,307 @@
+"""
+Phân tích độ nhạy toàn cục (Sobol, dựa trên phương sai) của vòng kín PID-hệ bồn.
+
+Tham số đầu vào (PARAMETERS) gồm tham số hệ bồn A1, A2, alpha1-3, độ mở van và hệ số PID,
+mỗi tham số phân bố đều trong một khoảng. Đầu ra là các chỉ số của một bước setpoint:
+thời gian xác lập, vọt lố và IAE (cùng định nghĩa với scenario_runner.ScenarioMetrics).
+
+Mẫu Saltelli lấy từ dãy Sobol 2d chiều (số giả ngẫu nhiên độ chênh lệch thấp, dịch số ngẫu
+nhiên theo seed): hai ma trận A, B (N x d) và d ma trận AB_i (A với cột i lấy từ B), tổng
+N(d + 2) lần mô phỏng; N là lũy thừa 2 lớn nhất nằm trong ngân sách. Vòng kín được mô phỏng
+vector hóa cho cả lô tham số (simulate_batch), các lô chia cho nhiều tiến trình.
+
+Chỉ số bậc một S1 (ước lượng Saltelli 2010), chỉ số toàn phần ST (ước lượng Jansen), khoảng tin
+cậy bằng bootstrap trên các hàng mẫu.
+
+Ví dụ:
+    python sensitivity.py --budget 49152 -j 4
+    python sensitivity.py --outputs overshoot --setpoint 20 --duration 300
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from coupled_tank_gui import CoupledTankSystem, DEFAULT_PID_GAINS
+
+_PLANT = CoupledTankSystem()
+
+# Tên -> (cận dưới, cận trên): tham số hệ bồn ±20%, hệ số PID ±50% quanh giá trị mặc định
+PARAMETERS = {
+    'A1': (0.8 * _PLANT.A1, 1.2 * _PLANT.A1),
+    'A2': (0.8 * _PLANT.A2, 1.2 * _PLANT.A2),
+    'alpha1': (0.8 * _PLANT.alpha1, 1.2 * _PLANT.alpha1),
+    'alpha2': (0.8 * _PLANT.alpha2, 1.2 * _PLANT.alpha2),
+    'alpha3': (0.8 * _PLANT.alpha3, 1.2 * _PLANT.alpha3),
+    'valve1': (50.0, 100.0),
+    'valve2': (50.0, 100.0),
+    'Kp': (0.5 * DEFAULT_PID_GAINS['Kp'], 1.5 * DEFAULT_PID_GAINS['Kp']),
+    'Ki': (0.5 * DEFAULT_PID_GAINS['Ki'], 1.5 * DEFAULT_PID_GAINS['Ki']),
+    'Kd': (0.5 * DEFAULT_PID_GAINS['Kd'], 1.5 * DEFAULT_PID_GAINS['Kd']),
+}
+OUTPUTS = ('settling_time', 'overshoot', 'iae')
+
+# Số hướng Sobol (Joe & Kuo, new-joe-kuo-6.21201) cho chiều 2..21: (bậc s, hệ số a, m_1..m_s).
+# Chiều 1 là dãy van der Corput (mọi m_k = 1).
+_SOBOL_DIRECTIONS = (
+    (1, 0, (1,)), (2, 1, (1, 3)), (3, 1, (1, 3, 1)), (3, 2, (1, 1, 1)), (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)), (5, 2, (1, 1, 5, 5, 17)), (5, 4, (1, 1, 5, 5, 5)), (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)), (5, 13, (1, 1, 1, 3, 11)), (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)), (6, 13, (1, 1, 1, 15, 21, 21)), (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)), (6, 22, (1, 3, 1, 15, 13, 25)), (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)), (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+)
+_SOBOL_BITS = 32
+MAX_SOBOL_DIM = len(_SOBOL_DIRECTIONS) + 1
+
+
+def _direction_integers(d):
+    """Bảng số hướng (d x _SOBOL_BITS), mỗi số đã dịch về bit cao nhất."""
+    bits = _SOBOL_BITS
+    V = np.zeros((d, bits), dtype=np.uint64)
+    V[0] = [1 << (bits - 1 - k) for k in range(bits)]
+    for j in range(1, d):
+        s, a, m = _SOBOL_DIRECTIONS[j - 1]
+        v = [m[k] << (bits - 1 - k) for k in range(s)]
+        for k in range(s, bits):
+            value = v[k - s] ^ (v[k - s] >> s)
+            for i in range(1, s):
+                if (a >> (s - 1 - i)) & 1:
+                    value ^= v[k - i]
+            v.append(value)
+        V[j] = v
+    return V
+
+
+def sobol(n, d, seed=0):
+    """
+    n điểm đầu của dãy Sobol d chiều trong [0, 1)^d (thứ tự mã Gray), dịch số ngẫu nhiên (XOR
+    với một số ngẫu nhiên mỗi chiều) theo seed; seed=None: không dịch (điểm đầu là gốc tọa độ).
+    Dịch số giữ tính chất lưới (t, m, s) và làm ước lượng không chệch.
+    """
+    if not 1 <= d <= MAX_SOBOL_DIM:
+        raise ValueError(f"Số chiều Sobol phải trong 1..{MAX_SOBOL_DIM}")
+    if n > 1 << _SOBOL_BITS:
+        raise ValueError("Quá nhiều điểm Sobol")
+    V = _direction_integers(d)
+    index = np.arange(n, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+    x = np.zeros((n, d), dtype=np.uint64)
+    for k in range(_SOBOL_BITS):
+        bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        x[bit] ^= V[:, k]
+    if seed is not None:
+        x ^= np.random.default_rng(seed).integers(0, 1 << _SOBOL_BITS, size=d, dtype=np.uint64)
+    return x.astype(float) / float(1 << _SOBOL_BITS)
+
+
+def saltelli_sample(n, bounds, seed=0):
+    """
+    Ma trận mẫu Saltelli: các khối A, B, AB_1..AB_d (mỗi khối n hàng) xếp chồng thành
+    n(d + 2) x d, đã co giãn về bounds (danh sách (cận dưới, cận trên)).
+    """
+    d = len(bounds)
+    base = sobol(n, 2 * d, seed)
+    low, high = np.array(bounds, dtype=float).T
+    A = low + base[:, :d] * (high - low)
+    B = low + base[:, d:] * (high - low)
+    blocks = [A, B]
+    for i in range(d):
+        AB = A.copy()
+        AB[:, i] = B[:, i]
+        blocks.append(AB)
+    return np.vstack(blocks)
+
+
+def simulate_batch(params, set_point=15.0, duration=200.0, dt=0.1, h0=0.0, settle_band=0.02,
+                   output_limits=(0.0, 300.0)):
+    """
+    Mô phỏng vector hóa một bước setpoint cho cả lô tham số.
+
+    Giống từng bước SimulationEngine.step() với PIDController và CoupledTankSystem.update()
+    (Euler, giới hạn 0..max_height, chống bão hòa tích phân), xuất phát H1 = H2 = h0.
+
+    Args:
+        params (array): N x len(PARAMETERS), cột theo thứ tự PARAMETERS.
+
+    Returns:
+        dict: 'settling_time' (NaN nếu chưa xác lập), 'overshoot' (cm), 'iae' — mảng N phần tử.
+    """
+    params = np.asarray(params, dtype=float)
+    A1, A2, alpha1, alpha2, alpha3, valve1, valve2, Kp, Ki, Kd = params.T
+    c1 = np.where(valve1 < 1e-3, 0.0, valve1 / 100.0 * alpha1)
+    c2 = np.where(valve2 < 1e-3, 0.0, valve2 / 100.0 * alpha2)
+    out_min, out_max = output_limits
+    max_height = _PLANT.max_height
+    n = len(params)
+
+    H1 = np.full(n, float(h0))
+    H2 = np.full(n, float(h0))
+    integral = np.zeros(n)
+    last_error = np.zeros(n)
+    direction = 1.0 if set_point >= h0 else -1.0
+    band = max(settle_band * abs(set_point), 0.2)
+    overshoot = np.zeros(n)
+    iae = np.zeros(n)
+    settled_at = np.full(n, np.nan)
+
+    steps = int(round(duration / dt))
+    for step in range(1, steps + 1):
+        # PIDController.update
+        error = set_point - H2
+        integral = np.clip(integral + Ki * error * dt, out_min, out_max)
+        qi1 = np.clip(Kp * error + integral + Kd * ((error - last_error) / dt), out_min, out_max)
+        last_error = error
+        # CoupledTankSystem.update (Qi2 = 0, không nhiễu)
+        delta = H1 - H2
+        qo3 = np.sign(delta) * alpha3 * np.sqrt(np.abs(delta))
+        dH1 = (qi1 - c1 * np.sqrt(np.maximum(H1, 0.0)) - qo3) / A1
+        dH2 = (qo3 - c2 * np.sqrt(np.maximum(H2, 0.0))) / A2
+        H1 = np.clip(H1 + dH1 * dt, 0.0, max_height)
+        H2 = np.clip(H2 + dH2 * dt, 0.0, max_height)
+        # ScenarioMetrics.add
+        error = set_point - H2
+        iae += np.abs(error) * dt
+        np.maximum(overshoot, -error * direction, out=overshoot)
+        outside = np.abs(error) > band
+        settled_at[outside] = np.nan
+        settled_at[~outside & np.isnan(settled_at)] = step * dt
+    return {'settling_time': settled_at, 'overshoot': overshoot, 'iae': iae}
+
+
+def _simulate_chunk(params, **kwargs):
+    return simulate_batch(params, **kwargs)
+
+
+def evaluate(samples, jobs=None, batch_size=4096, executor=None, **sim_kwargs):
+    """
+    simulate_batch cho toàn bộ ma trận mẫu, chia lô batch_size hàng cho jobs tiến trình
+    (jobs=1: chạy trong tiến trình hiện tại) hoặc cho executor sẵn có (worker_pool.WarmWorkerPool).
+    """
+    chunks = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(chunks)))
+    run = partial(_simulate_chunk, **sim_kwargs)
+    if executor is not None:
+        results = list(executor.map(run, chunks))
+    elif jobs == 1:
+        results = [run(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(run, chunks))
+    return {name: np.concatenate([r[name] for r in results]) for name in results[0]}
+
+
+def sobol_indices(y, n, d, bootstrap=500, confidence=0.95, seed=0):
+    """
+    Chỉ số Sobol từ đầu ra y của ma trận saltelli_sample (n(d + 2) phần tử).
+
+    Returns:
+        dict: 'S1', 'ST' (d phần tử), 'S1_conf', 'ST_conf' (d x 2: cận dưới, cận trên của
+              khoảng tin cậy bootstrap theo phân vị), 'variance'.
+    """
+    y = np.asarray(y, dtype=float)
+    fA, fB = y[:n], y[n:2 * n]
+    fAB = y[2 * n:].reshape(d, n)
+
+    def estimate(rows):
+        # rows: R x n chỉ số hàng -> S1, ST dạng R x d
+        a, b = fA[rows], fB[rows]
+        ab = np.moveaxis(fAB[:, rows], 0, 1)  # R x d x n
+        variance = np.var(np.concatenate((a, b), axis=1), axis=1)
+        variance = np.where(variance > 0, variance, np.nan)[:, None]
+        first = np.mean(b[:, None, :] * (ab - a[:, None, :]), axis=2) / variance
+        total = 0.5 * np.mean((a[:, None, :] - ab) ** 2, axis=2) / variance
+        return first, total
+
+    first, total = estimate(np.arange(n)[None, :])
+    rng = np.random.default_rng(seed)
+    boot = [estimate(rng.integers(0, n, size=(min(64, bootstrap - start), n)))
+            for start in range(0, bootstrap, 64)]  # Theo khối để giới hạn bộ nhớ tạm
+    boot_first = np.concatenate([b[0] for b in boot])
+    boot_total = np.concatenate([b[1] for b in boot])
+    q = 100.0 * np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+    return {
+        'S1': first[0],
+        'ST': total[0],
+        'S1_conf': np.nanpercentile(boot_first, q, axis=0).T,
+        'ST_conf': np.nanpercentile(boot_total, q, axis=0).T,
+        'variance': float(np.var(np.concatenate((fA, fB)))),
+    }
+
+
+def analyze(budget=49152, parameters=None, outputs=OUTPUTS, jobs=None, seed=0, bootstrap=500, confidence=0.95,
+            batch_size=4096, executor=None, **sim_kwargs):
+    """
+    Phân tích độ nhạy trong ngân sách budget lần mô phỏng.
+
+    Args:
+        budget (int): Số lần mô phỏng tối đa; dùng N = lũy thừa 2 lớn nhất với N(d + 2) <= budget.
+        parameters (dict): Tên -> (cận dưới, cận trên), mặc định PARAMETERS (phải đủ 10 tham số,
+            có thể thu hẹp khoảng; đặt cận dưới = cận trên để cố định một tham số).
+        outputs (tuple): Các đầu ra cần phân tích (trong OUTPUTS).
+        executor: Pool sẵn có để chạy các lô (mặc định tạo ProcessPoolExecutor theo jobs).
+        sim_kwargs: Truyền cho simulate_batch (set_point, duration, dt, h0, settle_band).
+
+    Returns:
+        dict: 'parameters', 'n', 'evaluations', 'elapsed', và mỗi đầu ra -> kết quả sobol_indices
+              cùng 'mean', 'unsettled' (tỉ lệ lần chạy chưa xác lập, chỉ với settling_time).
+    """
+    parameters = dict(PARAMETERS if parameters is None else parameters)
+    if list(parameters) != list(PARAMETERS):
+        raise ValueError(f"Cần đủ các tham số theo thứ tự {list(PARAMETERS)}")
+    d = len(parameters)
+    n = 1 << int(np.floor(np.log2(budget / (d + 2)))) if budget >= 2 * (d + 2) else 0
+    if n < 2:
+        raise ValueError(f"Ngân sách quá nhỏ: cần ít nhất {2 * (d + 2)} lần mô phỏng")
+
+    t0 = time.perf_counter()
+    samples = saltelli_sample(n, list(parameters.values()), seed)
+    metrics = evaluate(samples, jobs, batch_size, executor, **sim_kwargs)
+    result = {'parameters': list(parameters), 'n': n, 'evaluations': len(samples)}
+    for name in outputs:
+        y = metrics[name]
+        entry = {}
+        if name == 'settling_time':
+            # Lần chạy chưa xác lập: kiểm duyệt tại duration để phương sai hữu hạn
+            unsettled = np.isnan(y)
+            entry['unsettled'] = float(unsettled.mean())
+            y = np.where(unsettled, sim_kwargs.get('duration', 200.0), y)
+        entry.update(sobol_indices(y, n, d, bootstrap, confidence, seed))
+        entry['mean'] = float(y.mean())
+        result[name] = entry
+    result['elapsed'] = time.perf_counter() - t0
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chỉ số Sobol của tham số hệ bồn và PID.")
+    parser.add_argument('--budget', type=int, default=49152, help="Số lần mô phỏng tối đa")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--outputs', nargs='+', choices=OUTPUTS, default=list(OUTPUTS))
+    parser.add_argument('--setpoint', type=float, default=15.0)
+    parser.add_argument('--duration', type=float, default=200.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bootstrap', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    result = analyze(args.budget, outputs=args.outputs, jobs=args.jobs, seed=args.seed, bootstrap=args.bootstrap,
+                     set_point=args.setpoint, duration=args.duration)
+    print(f"N = {result['n']}, {result['evaluations']} lần mô phỏng trong {result['elapsed']:.1f} s")
+    for name in args.outputs:
+        entry = result[name]
+        extra = f", chưa xác lập {100 * entry['unsettled']:.1f}%" if 'unsettled' in entry else ""
+        print(f"\n{name} (trung bình {entry['mean']:.3g}, phương sai {entry['variance']:.3g}{extra})")
+        print(f"{'Tham số':>8}{'S1':>8}{'KTC 95%':>18}{'ST':>8}{'KTC 95%':>18}")
+        for i, param in enumerate(result['parameters']):
+            (s1_lo, s1_hi), (st_lo, st_hi) = entry['S1_conf'][i], entry['ST_conf'][i]
+            print(f"{param:>8}{entry['S1'][i]:>8.3f}  [{s1_lo:>6.3f}, {s1_hi:>6.3f}]"
+                  f"{entry['ST'][i]:>8.3f}  [{st_lo:>6.3f}, {st_hi:>6.3f}]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Công bố trạng thái mô phỏng qua multiprocessing.shared_memory cho các tiến trình cục bộ
+khác (bảng giám sát, thiết bị giả lập hardware-in-the-loop) đọc/ghi mà không cần tuần tự hóa.
+
+Bố cục khối nhớ:
+    [0, 64)      header: magic, version, seq (seqlock), số trường, dung lượng vòng lệnh
+    [64, ...)    khối trạng thái: float64 cho mỗi trường trong STATE_FIELDS
+    (căn 64)     vòng lệnh: head (u64), tail (u64), rồi các ô [mã lệnh, tham số 1, tham số 2]
+
+Seqlock: bên ghi tăng seq lên số lẻ, ghi dữ liệu, rồi tăng lên số chẵn; bên đọc thử lại
+nếu seq lẻ hoặc thay đổi trong lúc sao chép. Vòng lệnh là hàng đợi một-nhà-sản-xuất /
+một-người-tiêu-thụ: mỗi khối nhớ chỉ nên có một client gửi lệnh.
+
+Ví dụ:
+    python shared_state.py serve --rate 1000      # chạy mô phỏng thời gian thực, công bố mỗi bước
+    python shared_state.py monitor                # đọc và in trạng thái
+    python shared_state.py command --setpoint 20
+"""
+import argparse
+import signal
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+DEFAULT_SHM_NAME = 'coupled_tank_state'
+SHM_MAGIC = 0x4D535443  # 'CTSM'
+SHM_VERSION = 1
+STATE_FIELDS = ('time', 'H1', 'H2', 'Qi1', 'setpoint', 'valve1', 'valve2', 'disturbance',
+                'error', 'integral', 'Kp', 'Ki', 'Kd')
+RING_CAPACITY = 256
+
+# Mã lệnh trong vòng lệnh
+CMD_SETPOINT = 1     # tham số: setpoint
+CMD_VALVES = 2       # tham số: độ mở van 1, van 2
+CMD_DISTURBANCE = 3  # tham số: lưu lượng, thời lượng
+
+_HEADER_SIZE = 64
+_CACHE_LINE = 64
+
+
+def _layout(n_fields, capacity):
+    state_offset = _HEADER_SIZE
+    ring_offset = state_offset + -(-8 * n_fields // _CACHE_LINE) * _CACHE_LINE
+    slots_offset = ring_offset + 2 * _CACHE_LINE  # head và tail nằm trên hai dòng cache khác nhau
+    size = slots_offset + capacity * 3 * 8
+    return state_offset, ring_offset, slots_offset, size
+
+
+def _attach(name):
+    """Gắn vào khối nhớ có sẵn mà không để resource_tracker của tiến trình này xóa nó khi thoát."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    # Python < 3.13 đăng ký cả khối chỉ được gắn vào, rồi unlink khi tiến trình kết thúc
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class _SharedBlock:
+    """Các view NumPy lên khối nhớ dùng chung (dùng chung cho bên công bố và client)."""
+    def _attach_views(self, n_fields, capacity):
+        buf = self.shm.buf
+        state_offset, ring_offset, slots_offset, _ = _layout(n_fields, capacity)
+        self._header = np.ndarray(4, dtype=np.uint32, buffer=buf, offset=0)
+        self._seq = np.ndarray(1, dtype=np.uint64, buffer=buf, offset=8)
+        self._state = np.ndarray(n_fields, dtype=np.float64, buffer=buf, offset=state_offset)
+        self._head = np.ndarray(1, dtype=np.uint64, buffer=buf, offset=ring_offset)
+        self._tail = np.ndarray(1, dtype=np.uint64, buffer=buf, offset=ring_offset + _CACHE_LINE)
+        self._slots = np.ndarray((capacity, 3), dtype=np.float64, buffer=buf, offset=slots_offset)
+        self.capacity = capacity
+
+    def close(self):
+        # Phải bỏ các view trước khi đóng, nếu không SharedMemory.close() báo BufferError
+        for name in ('_header', '_seq', '_state', '_head', '_tail', '_slots'):
+            setattr(self, name, None)
+        self.shm.close()
+
+
+class SharedStatePublisher(_SharedBlock):
+    """Bên mô phỏng: ghi trạng thái theo seqlock và đọc lệnh từ vòng lệnh."""
+    def __init__(self, name=DEFAULT_SHM_NAME, capacity=RING_CAPACITY):
+        _, _, _, size = _layout(len(STATE_FIELDS), capacity)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Khối còn sót lại từ lần chạy trước bị dừng đột ngột
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()  # Đồng thời hủy đăng ký khỏi resource_tracker
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._attach_views(len(STATE_FIELDS), capacity)
+        self._header[:] = (SHM_MAGIC, SHM_VERSION, 0, 0)
+        self._header_fields = np.ndarray(2, dtype=np.uint32, buffer=self.shm.buf, offset=16)
+        self._header_fields[:] = (len(STATE_FIELDS), capacity)
+        self._seq[0] = 0
+        self._head[0] = 0
+        self._tail[0] = 0
+
+    def publish(self, values):
+        """Ghi một bộ giá trị theo thứ tự STATE_FIELDS."""
+        seq = self._seq
+        seq[0] += 1  # Lẻ: đang ghi
+        self._state[:] = values
+        seq[0] += 1  # Chẵn: dữ liệu nhất quán
+
+    def poll_commands(self):
+        """Lấy tất cả lệnh đang chờ dưới dạng danh sách (mã lệnh, tham số 1, tham số 2)."""
+        head = int(self._head[0])
+        tail = int(self._tail[0])
+        commands = []
+        while tail < head:
+            code, a, b = self._slots[tail % self.capacity]
+            commands.append((int(code), float(a), float(b)))
+            tail += 1
+        self._tail[0] = tail
+        return commands
+
+    def close(self):
+        self._header_fields = None
+        super().close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedStateClient(_SharedBlock):
+    """Bên ngoài: đọc trạng thái nhất quán và gửi lệnh setpoint/van/nhiễu."""
+    def __init__(self, name=DEFAULT_SHM_NAME):
+        self.shm = _attach(name)
+        header = np.ndarray(6, dtype=np.uint32, buffer=self.shm.buf, offset=0)
+        if header[0] != SHM_MAGIC or header[1] != SHM_VERSION:
+            del header
+            self.shm.close()
+            raise ValueError(f"Khối nhớ '{name}' không đúng định dạng trạng thái bồn nước.")
+        n_fields, capacity = int(header[4]), int(header[5])
+        del header
+        self.fields = STATE_FIELDS[:n_fields]
+        self._attach_views(n_fields, capacity)
+
+    def read_state(self, max_retries=1000):
+        """Đọc bản chụp nhất quán của trạng thái (dict theo STATE_FIELDS)."""
+        for _ in range(max_retries):
+            seq1 = int(self._seq[0])
+            if seq1 & 1:
+                continue
+            values = self._state.copy()
+            if int(self._seq[0]) == seq1:
+                return dict(zip(self.fields, values.tolist())), seq1 // 2
+        raise TimeoutError("Không đọc được trạng thái nhất quán (bên ghi đang giữ khóa quá lâu).")
+
+    def _send(self, code, a=0.0, b=0.0):
+        head = int(self._head[0])
+        if head - int(self._tail[0]) >= self.capacity:
+            return False  # Vòng lệnh đầy
+        self._slots[head % self.capacity] = (code, a, b)
+        self._head[0] = head + 1  # Công bố ô lệnh sau khi đã ghi xong
+        return True
+
+    def send_setpoint(self, set_point):
+        return self._send(CMD_SETPOINT, set_point)
+
+    def send_valves(self, valve1_open, valve2_open):
+        return self._send(CMD_VALVES, valve1_open, valve2_open)
+
+    def send_disturbance(self, flow=50.0, duration=5.0):
+        return self._send(CMD_DISTURBANCE, flow, duration)
+
+
+def controller_internals(controller):
+    """
+    (sai số, tích phân, Kp, Ki, Kd) hiện tại của bộ điều khiển. Với MPC, "tích phân" là nhiễu
+    lưu lượng vào ước lượng và các hệ số là NaN.
+    """
+    if hasattr(controller, '_last_gains'):
+        Kp, Ki, Kd = controller._last_gains
+    else:
+        nan = float('nan')
+        Kp, Ki, Kd = getattr(controller, 'Kp', nan), getattr(controller, 'Ki', nan), getattr(controller, 'Kd', nan)
+    return controller._last_error, controller._integral, Kp, Ki, Kd
+
+
+def engine_values(engine):
+    """Bộ giá trị theo STATE_FIELDS từ một SimulationEngine."""
+    ts = engine.tank_system
+    return (engine.simulation_time, ts.H1, ts.H2, engine.last_inflow, engine.controller.set_point,
+            ts.valve1_open, ts.valve2_open, float(ts.disturbance_active)) + controller_internals(engine.controller)
+
+
+def apply_commands(engine, commands):
+    """Áp dụng các lệnh nhận được lên một SimulationEngine."""
+    ts = engine.tank_system
+    for code, a, b in commands:
+        if code == CMD_SETPOINT:
+            engine.set_setpoint(a)
+        elif code == CMD_VALVES:
+            ts.set_valve_openings(a, b)
+        elif code == CMD_DISTURBANCE:
+            ts.disturbance_flow = a
+            ts.disturbance_duration = b
+            ts.trigger_disturbance(engine.simulation_time)
+
+
+def _serve(args):
+    from coupled_tank_gui import CoupledTankSystem, SimulationEngine, create_controller
+
+    # MPC và PID lập lịch đọc độ mở van từ hệ bồn nhận lệnh CMD_VALVES
+    ts = CoupledTankSystem()
+    engine = SimulationEngine(create_controller(args.controller, args.setpoint, plant=ts), ts, dt=args.dt)
+    publisher = SharedStatePublisher(args.name)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # Dọn khối nhớ cả khi bị kill
+    period = 1.0 / args.rate
+    print(f"Đang công bố '{args.name}' ở {args.rate:.0f} bước/s (Ctrl+C để dừng)")
+    next_step = time.perf_counter()
+    try:
+        while True:
+            apply_commands(engine, publisher.poll_commands())
+            engine.step()
+            publisher.publish(engine_values(engine))
+            next_step += period
+            delay = next_step - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_step = time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.close()
+
+
+def _monitor(args):
+    client = SharedStateClient(args.name)
+    try:
+        last_version = None
+        reads = 0
+        t0 = time.perf_counter()
+        while True:
+            state, version = client.read_state()
+            reads += 1
+            if version != last_version and time.perf_counter() - t0 >= args.interval:
+                rate = reads / (time.perf_counter() - t0)
+                print(f"t={state['time']:8.1f}s  H1={state['H1']:6.2f}  H2={state['H2']:6.2f}  "
+                      f"Qi1={state['Qi1']:7.2f}  SP={state['setpoint']:5.1f}  ({rate:,.0f} lần đọc/s)")
+                last_version, reads, t0 = version, 0, time.perf_counter()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+def _command(args):
+    client = SharedStateClient(args.name)
+    try:
+        if args.setpoint is not None:
+            client.send_setpoint(args.setpoint)
+        if args.valves is not None:
+            client.send_valves(*args.valves)
+        if args.disturbance:
+            client.send_disturbance()
+    finally:
+        client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trạng thái mô phỏng bồn nước đôi qua bộ nhớ dùng chung.")
+    parser.add_argument('--name', default=DEFAULT_SHM_NAME, help="Tên khối nhớ dùng chung")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help="Chạy mô phỏng và công bố trạng thái")
+    serve.add_argument('--rate', type=float, default=1000.0, help="Số bước mô phỏng mỗi giây (thời gian thực)")
+    serve.add_argument('--dt', type=float, default=0.001)
+    serve.add_argument('--controller', default='pid')
+    serve.add_argument('--setpoint', type=float, default=25.0)
+    monitor = sub.add_parser('monitor', help="Đọc và in trạng thái")
+    monitor.add_argument('--interval', type=float, default=0.5)
+    command = sub.add_parser('command', help="Gửi lệnh")
+    command.add_argument('--setpoint', type=float)
+    command.add_argument('--valves', type=float, nargs=2)
+    command.add_argument('--disturbance', action='store_true')
+    args = parser.parse_args(argv)
+    {'serve': _serve, 'monitor': _monitor, 'command': _command}[args.command](args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
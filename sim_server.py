@@ -0,0 +1,419 @@
+"""
+Máy chủ mô phỏng asyncio: nhiều phiên bồn nước/bộ điều khiển độc lập trong một tiến trình.
+
+Giao thức: mỗi dòng là một JSON (đối tượng = một yêu cầu, mảng = một lô yêu cầu được
+trả lời bằng một dòng mảng). Các thao tác:
+    {"id": 1, "op": "create", "controller": "pid", "setpoint": 25, "gains": {"Kp": 80}}
+    {"id": 2, "op": "set", "session": 1, "setpoint": 20, "valves": [100, 60],
+                           "gains": {...}, "disturbance": {"flow": 50, "duration": 5}}
+    {"id": 3, "op": "subscribe", "session": 1, "every": 10}   # nhận trạng thái mỗi 10 bước
+    {"id": 4, "op": "unsubscribe", "session": 1}
+    {"id": 5, "op": "state", "session": 1}
+    {"id": 6, "op": "close", "session": 1}
+    {"id": 7, "op": "stats"}
+Cập nhật trạng thái được đẩy dưới dạng {"event": "state", "session": 1, "state": {...}}.
+Trường số sai kiểu hoặc không hữu hạn được trả lời {"ok": false, "error": ...} và không thay đổi
+phiên. Phiên gặp lỗi khi chạy bước mô phỏng bị dừng riêng (trạng thái có thêm "error"); các phiên
+khác vẫn chạy.
+
+Ví dụ:
+    python sim_server.py serve --port 8765
+    python sim_server.py serve --unix /tmp/coupled_tank.sock
+    python sim_server.py loadtest --sessions 100 500 1000 --duration 5
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+from coupled_tank_gui import CoupledTankSystem, SimulationEngine, create_controller
+
+
+# Kích thước tối đa của một dòng yêu cầu (các lô lớn có thể dài hàng trăm KB)
+MAX_LINE_BYTES = 1 << 24
+
+
+def _finite(value, name, positive=False):
+    """Trường số của yêu cầu dưới dạng float hữu hạn; ValueError nếu sai kiểu (kể cả bool, chuỗi)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{name} phải là số hữu hạn, nhận {value!r}")
+    if positive and value <= 0:
+        raise ValueError(f"{name} phải dương, nhận {value!r}")
+    return float(value)
+
+
+def _valves(value):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError(f"valves phải là [van1, van2], nhận {value!r}")
+    return [_finite(v, 'valves') for v in value]
+
+
+def _fields(value, name, keys):
+    """Đối tượng chỉ gồm các khóa trong `keys`, giá trị là số hữu hạn."""
+    if not isinstance(value, dict) or any(key not in keys for key in value):
+        raise ValueError(f"{name} phải là đối tượng với các khóa {keys}, nhận {value!r}")
+    return {key: _finite(v, f"{name}.{key}") for key, v in value.items()}
+
+
+class Session:
+    """Một phiên mô phỏng độc lập và các client đang theo dõi nó."""
+    def __init__(self, session_id, engine):
+        self.id = session_id
+        self.engine = engine
+        self.subscribers = {}  # ClientConnection -> số bước giữa hai lần gửi
+        self.steps = 0
+        self.error = None  # Lỗi khi chạy bước mô phỏng; phiên lỗi không được chạy tiếp
+
+
+class ClientConnection:
+    """
+    Kết nối của một client. Phản hồi được xếp hàng đầy đủ; cập nhật trạng thái được gộp
+    theo phiên (chỉ giữ bản mới nhất) nên client chậm không làm bộ nhớ máy chủ tăng lên.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.responses = []
+        self.pending_updates = {}
+        self.dropped_updates = 0
+        self.wakeup = asyncio.Event()
+        self.closed = False
+
+    def send_response(self, message):
+        self.responses.append(message)
+        self.wakeup.set()
+
+    def push_update(self, session_id, state):
+        if session_id in self.pending_updates:
+            self.dropped_updates += 1
+        self.pending_updates[session_id] = state
+        self.wakeup.set()
+
+    async def writer_loop(self):
+        """Ghi theo lô; trong lúc chờ drain() (backpressure TCP), cập nhật mới tiếp tục được gộp."""
+        while not self.closed:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            lines = [json.dumps(r) for r in self.responses]
+            lines += [json.dumps({'event': 'state', 'session': sid, 'state': state})
+                      for sid, state in self.pending_updates.items()]
+            self.responses = []
+            self.pending_updates = {}
+            if not lines:
+                continue
+            try:
+                self.writer.write(("\n".join(lines) + "\n").encode())
+                await self.writer.drain()
+            except (ConnectionError, RuntimeError):
+                self.closed = True
+
+
+class SimulationServer:
+    """
+    Chứa các phiên và bộ lập lịch chung: mỗi nhịp (tick_interval giây) mọi phiên được
+    chạy thêm step_rate * tick_interval bước mô phỏng.
+    """
+    def __init__(self, step_rate=10.0, tick_interval=0.05, dt=0.1):
+        self.step_rate = step_rate
+        self.tick_interval = tick_interval
+        self.dt = dt
+        self.sessions = {}
+        self.clients = set()
+        self._next_id = 1
+        self._step_credit = 0.0
+        self.steps_total = 0
+        self.ticks = 0
+        self.overruns = 0
+        self.failed_sessions = 0
+        self.started = time.monotonic()
+
+    # --- Bộ lập lịch ---
+    async def scheduler(self):
+        next_tick = time.monotonic()
+        while True:
+            self._step_credit += self.step_rate * self.tick_interval
+            n_steps = int(self._step_credit)
+            self._step_credit -= n_steps
+            for session in list(self.sessions.values()):
+                if session.error is not None:
+                    continue
+                engine = session.engine
+                try:
+                    for _ in range(n_steps):
+                        engine.step()
+                except Exception as e:
+                    # Một phiên lỗi chỉ dừng phiên đó, không dừng bộ lập lịch chung
+                    self._fail_session(session, e)
+                    continue
+                session.steps += n_steps
+                self.steps_total += n_steps
+                if session.subscribers and n_steps:
+                    state = engine.state()
+                    for client, every in session.subscribers.items():
+                        # Gửi khi vừa vượt qua một bội số của `every` bước
+                        if session.steps // every != (session.steps - n_steps) // every:
+                            client.push_update(session.id, state)
+            self.ticks += 1
+
+            next_tick += self.tick_interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # Không theo kịp nhịp: ghi nhận và bỏ qua phần trễ thay vì dồn bước
+                self.overruns += 1
+                next_tick = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def _fail_session(self, session, error):
+        session.error = f"{type(error).__name__}: {error}"
+        self.failed_sessions += 1
+        state = dict(session.engine.state(), error=session.error)
+        for client in session.subscribers:
+            client.push_update(session.id, state)
+
+    # --- Xử lý yêu cầu ---
+    def handle(self, client, request):
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': f"Yêu cầu phải là một đối tượng JSON, nhận {request!r}"}
+        op = request.get('op')
+        response = {'id': request.get('id'), 'ok': True}
+        try:
+            if op == 'create':
+                setpoint = _finite(request.get('setpoint', 25.0), 'setpoint')
+                dt = _finite(request.get('dt', self.dt), 'dt', positive=True)
+                gains = _fields(request['gains'], 'gains', ('Kp', 'Ki', 'Kd')) if 'gains' in request else None
+                valves = _valves(request['valves']) if 'valves' in request else None
+                # MPC và PID lập lịch đọc tham số, độ mở van từ chính hệ bồn của phiên
+                ts = CoupledTankSystem()
+                if valves is not None:
+                    ts.set_valve_openings(*valves)
+                controller = create_controller(request.get('controller', 'pid'), setpoint, gains, plant=ts)
+                session = Session(self._next_id, SimulationEngine(controller, ts, dt=dt))
+                self.sessions[session.id] = session
+                self._next_id += 1
+                response['session'] = session.id
+            elif op == 'stats':
+                response.update(self.stats())
+            else:
+                session = self.sessions.get(request.get('session'))
+                if session is None:
+                    raise KeyError(f"Không có phiên {request.get('session')!r}")
+                if op == 'close':
+                    del self.sessions[session.id]
+                elif op == 'state':
+                    response['state'] = session.engine.state()
+                    if session.error is not None:
+                        response['state']['error'] = session.error
+                elif op == 'subscribe':
+                    session.subscribers[client] = max(1, int(_finite(request.get('every', 1), 'every')))
+                elif op == 'unsubscribe':
+                    session.subscribers.pop(client, None)
+                elif op == 'set':
+                    self._apply_set(session, request)
+                else:
+                    raise ValueError(f"Thao tác không hợp lệ: {op!r}")
+        except (KeyError, ValueError, TypeError) as e:
+            response = {'id': request.get('id'), 'ok': False, 'error': str(e)}
+        return response
+
+    def _apply_set(self, session, request):
+        # Kiểm tra mọi trường trước khi áp dụng để yêu cầu lỗi không thay đổi phiên một nửa
+        setpoint = _finite(request['setpoint'], 'setpoint') if 'setpoint' in request else None
+        valves = _valves(request['valves']) if 'valves' in request else None
+        gains = _fields(request['gains'], 'gains', ('Kp', 'Ki', 'Kd')) if 'gains' in request else None
+        dist = (_fields(request['disturbance'], 'disturbance', ('flow', 'duration'))
+                if 'disturbance' in request else None)
+
+        engine = session.engine
+        ts = engine.tank_system
+        if setpoint is not None:
+            engine.set_setpoint(setpoint)
+        if valves is not None:
+            ts.set_valve_openings(*valves)
+        if gains is not None and hasattr(engine.controller, 'set_gains'):
+            c = engine.controller
+            c.set_gains(gains.get('Kp', c.Kp), gains.get('Ki', c.Ki), gains.get('Kd', c.Kd))
+        if dist is not None:
+            ts.disturbance_flow = dist.get('flow', ts.disturbance_flow)
+            ts.disturbance_duration = dist.get('duration', ts.disturbance_duration)
+            ts.trigger_disturbance(engine.simulation_time)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'sessions': len(self.sessions),
+            'clients': len(self.clients),
+            'steps_total': self.steps_total,
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'failed_sessions': self.failed_sessions,
+            'uptime_s': elapsed,
+            'dropped_updates': sum(c.dropped_updates for c in self.clients),
+        }
+
+    async def handle_client(self, reader, writer):
+        client = ClientConnection(reader, writer)
+        self.clients.add(client)
+        writer_task = asyncio.ensure_future(client.writer_loop())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError as e:
+                    client.send_response({'ok': False, 'error': f"JSON không hợp lệ: {e}"})
+                    continue
+                if isinstance(message, list):
+                    # Lô yêu cầu: xử lý tất cả rồi trả lời bằng một dòng
+                    client.send_response([self.handle(client, m) for m in message])
+                else:
+                    client.send_response(self.handle(client, message))
+        except (ConnectionError, ValueError):
+            # ValueError: dòng vượt quá MAX_LINE_BYTES
+            pass
+        finally:
+            client.closed = True
+            client.wakeup.set()
+            for session in self.sessions.values():
+                session.subscribers.pop(client, None)
+            self.clients.discard(client)
+            await writer_task
+            writer.close()
+
+
+async def serve(host='127.0.0.1', port=8765, unix_path=None, step_rate=10.0, tick_interval=0.05, ready=None):
+    """Chạy máy chủ cho tới khi bị hủy. `ready` (multiprocessing.Event) được set khi đã lắng nghe."""
+    server = SimulationServer(step_rate=step_rate, tick_interval=tick_interval)
+    if unix_path:
+        listener = await asyncio.start_unix_server(server.handle_client, path=unix_path, limit=MAX_LINE_BYTES)
+    else:
+        listener = await asyncio.start_server(server.handle_client, host, port, limit=MAX_LINE_BYTES)
+    scheduler = asyncio.ensure_future(server.scheduler())
+    if ready is not None:
+        ready.set()
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        scheduler.cancel()
+
+
+# --- Client kiểm thử tải ---
+async def _request(reader, writer, message):
+    """Gửi một yêu cầu (hoặc lô) và chờ phản hồi tương ứng, bỏ qua các cập nhật trạng thái."""
+    writer.write((json.dumps(message) + "\n").encode())
+    await writer.drain()
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Máy chủ đã đóng kết nối")
+        reply = json.loads(line)
+        if isinstance(reply, list) or 'event' not in reply:
+            return reply
+
+
+async def _load_level(host, port, unix_path, n_sessions, duration, controller, every):
+    if unix_path:
+        reader, writer = await asyncio.open_unix_connection(unix_path, limit=MAX_LINE_BYTES)
+    else:
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE_BYTES)
+
+    created = await _request(reader, writer, [{'op': 'create', 'controller': controller} for _ in range(n_sessions)])
+    session_ids = [r['session'] for r in created]
+    await _request(reader, writer, [{'op': 'subscribe', 'session': sid, 'every': every} for sid in session_ids])
+    start = await _request(reader, writer, {'op': 'stats'})
+
+    updates = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            break
+        if b'"event"' in line:
+            updates += 1
+
+    end = await _request(reader, writer, {'op': 'stats'})
+    await _request(reader, writer, [{'op': 'close', 'session': sid} for sid in session_ids])
+    writer.close()
+
+    elapsed = end['uptime_s'] - start['uptime_s']
+    return {
+        'sessions': n_sessions,
+        'steps_per_s': (end['steps_total'] - start['steps_total']) / elapsed,
+        'overruns': end['overruns'] - start['overruns'],
+        'ticks': end['ticks'] - start['ticks'],
+        'updates_per_s': updates / elapsed,
+    }
+
+
+def _run_server_process(host, port, unix_path, step_rate, ready):
+    try:
+        asyncio.run(serve(host, port, unix_path, step_rate, ready=ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def loadtest(args):
+    """Đo số phiên và số bước/giây mà một tiến trình máy chủ duy trì được."""
+    server_proc = None
+    if not args.external:
+        ready = multiprocessing.Event()
+        server_proc = multiprocessing.Process(target=_run_server_process, daemon=True,
+                                              args=(args.host, args.port, args.unix, args.step_rate, ready))
+        server_proc.start()
+        if not ready.wait(timeout=30):
+            raise RuntimeError("Máy chủ không khởi động được")
+
+    target = args.step_rate
+    print(f"{'Phiên':>8}{'bước/s':>14}{'mục tiêu':>12}{'đạt':>8}{'trễ nhịp':>10}{'cập nhật/s':>12}")
+    try:
+        for n in args.sessions:
+            r = asyncio.run(_load_level(args.host, args.port, args.unix, n, args.duration, args.controller, args.every))
+            achieved = r['steps_per_s'] / (n * target)
+            print(f"{n:>8}{r['steps_per_s']:>14.0f}{n * target:>12.0f}{achieved:>7.0%}"
+                  f"{r['overruns']:>10}{r['updates_per_s']:>12.0f}")
+    finally:
+        if server_proc is not None:
+            server_proc.terminate()
+            server_proc.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Máy chủ mô phỏng bồn nước đôi nhiều phiên (asyncio).")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'loadtest'):
+        p = sub.add_parser(name)
+        p.add_argument('--host', default='127.0.0.1')
+        p.add_argument('--port', type=int, default=8765)
+        p.add_argument('--unix', help="Đường dẫn Unix socket (thay cho TCP)")
+        p.add_argument('--step-rate', type=float, default=10.0,
+                       help="Số bước mô phỏng mỗi giây cho mỗi phiên (10 = thời gian thực với dt=0.1)")
+    lt = sub.choices['loadtest']
+    lt.add_argument('--sessions', type=int, nargs='+', default=[10, 100, 500])
+    lt.add_argument('--duration', type=float, default=5.0, help="Thời gian đo cho mỗi mức tải (giây)")
+    lt.add_argument('--controller', default='pid')
+    lt.add_argument('--every', type=int, default=10, help="Số bước giữa hai cập nhật trạng thái")
+    lt.add_argument('--external', action='store_true', help="Dùng máy chủ đang chạy thay vì tự khởi động")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+        try:
+            asyncio.run(serve(args.host, args.port, args.unix, args.step_rate))
+        except KeyboardInterrupt:
+            pass
+    else:
+        loadtest(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Chạy ngâm (soak test): mô phỏng một khoảng thời gian mô phỏng dài ở tốc độ cao và theo dõi bộ
+nhớ tăng dần của tiến trình.
+
+Hai chế độ:
+    engine  SimulationEngine không giao diện; setpoint, độ mở van và nhiễu đổi định kỳ để đi qua
+            mọi nhánh của bộ điều khiển và hệ bồn. Mỗi bước cũng được ghi vào một TrendPyramid như
+            biểu đồ của GUI.
+    gui     Chính SimulationGUI (cửa sổ ẩn, cần màn hình hoặc Xvfb) chạy bằng vòng sự kiện Tk: các
+            tác vụ update_gui, biểu đồ và hoạt họa theo UI_PERIODS, mỗi nhịp `speed` bước mô phỏng.
+
+Cứ mỗi sample_interval giây mô phỏng lấy một mẫu tracemalloc và RSS. Sau giai đoạn khởi động
+(warmup), độ dốc hồi quy tuyến tính của bộ nhớ theo thời gian mô phỏng là tăng trưởng ổn định
+(KB/giờ mô phỏng); vượt ngưỡng thì không đạt (mã thoát 1). Báo cáo liệt kê các dòng mã có cấp
+phát tăng nhiều nhất giữa cuối warmup và cuối lần chạy.
+
+Mọi cấp phát đều tính vào ngưỡng, kể cả lịch sử xu hướng (trend_pyramid.py): bộ đệm của mẫu gốc
+và các tầng gộp có giới hạn và được cấp phát sẵn khi tạo, chỉ tầng thô nhất thêm một hàng mỗi
+factor^(max_levels-1) mẫu, nên kết quả không phụ thuộc dt. RSS vẫn tăng dần trong vài giờ đầu
+khi các trang của bộ đệm cấp phát sẵn lần đầu được ghi (tối đa vài MB, không tính vào ngưỡng).
+
+Ví dụ:
+    python soak_test.py --duration 36000 --controller fuzzy
+    python soak_test.py --mode gui --duration 7200 --speed 200 -o soak.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tkinter as tk
+import tracemalloc
+
+import numpy as np
+
+from coupled_tank_gui import CONTROLLER_TYPES, CoupledTankSystem, SimulationEngine, create_controller
+from trend_pyramid import TrendPyramid
+
+MODES = ('engine', 'gui')
+# Bộ điều khiển (loại, kiểu suy luận) -> thuộc tính của SimulationGUI (xem CONTROLLER_CHOICES)
+_GUI_CONTROLLERS = {('pid', 'mamdani'): 'pid_controller', ('fuzzy', 'mamdani'): 'fuzzy_controller',
+                    ('fuzzy', 'sugeno'): 'sugeno_controller', ('mpc', 'mamdani'): 'mpc_controller',
+                    ('scheduled', 'mamdani'): 'scheduled_controller'}
+
+
+def rss_bytes():
+    """RSS hiện tại của tiến trình (byte; đọc /proc trên Linux), None nếu không đọc được."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _slope_per_hour(times, values):
+    """Độ dốc hồi quy tuyến tính (đơn vị/giờ mô phỏng); None nếu chưa đủ 3 mẫu."""
+    if len(times) < 3 or times[-1] <= times[0]:
+        return None
+    return float(np.polyfit(np.asarray(times) / 3600.0, np.asarray(values, dtype=float), 1)[0])
+
+
+class SoakMonitor:
+    """
+    Lấy mẫu bộ nhớ theo thời gian mô phỏng. Mỗi mẫu: tổng cấp phát còn sống do tracemalloc theo dõi
+    và RSS. Ảnh chụp cuối warmup và cuối cùng được giữ để so sánh theo dòng mã.
+    """
+    def __init__(self, warmup, frames=1):
+        self.warmup = warmup
+        self.frames = frames
+        self.samples = []  # (thời gian mô phỏng, byte tracemalloc, RSS)
+        self.baseline = None
+        self.last = None
+        self._started_tracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def sample(self, sim_time):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),  # Danh sách mẫu của chính SoakMonitor
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+        tracked = sum(stat.size for stat in snapshot.statistics('filename'))
+        self.samples.append((sim_time, tracked, rss_bytes()))
+        if self.baseline is None and sim_time >= self.warmup:
+            self.baseline = snapshot
+        self.last = snapshot
+
+    def report(self, threshold_kb_per_hour, top=10):
+        """
+        Returns:
+            dict: 'growth_kb_per_hour' (tracemalloc), 'rss_kb_per_hour', 'threshold_kb_per_hour',
+                  'passed', 'top_lines' (tăng nhiều nhất sau warmup: tệp, dòng, KB, số khối), 'samples'.
+        """
+        steady = [s for s in self.samples if s[0] >= self.warmup]
+        times = [s[0] for s in steady]
+        growth = _slope_per_hour(times, [s[1] for s in steady])
+        rss = None
+        if steady and all(s[2] is not None for s in steady):
+            rss = _slope_per_hour(times, [s[2] for s in steady])
+
+        top_lines = []
+        if self.baseline is not None and self.last is not None and self.last is not self.baseline:
+            for stat in self.last.compare_to(self.baseline, 'lineno'):
+                if stat.size_diff <= 0:
+                    continue
+                frame = stat.traceback[0]
+                top_lines.append({'file': frame.filename, 'line': frame.lineno,
+                                  'size_diff_kb': stat.size_diff / 1024, 'count_diff': stat.count_diff})
+                if len(top_lines) == top:
+                    break
+
+        def kb(value):
+            return None if value is None else value / 1024
+        return {
+            'growth_kb_per_hour': kb(growth),
+            'rss_kb_per_hour': kb(rss),
+            'threshold_kb_per_hour': threshold_kb_per_hour,
+            'passed': growth is not None and growth / 1024 <= threshold_kb_per_hour,
+            'top_lines': top_lines,
+            'samples': [{'time': t, 'traced_kb': a / 1024, 'rss_kb': None if r is None else r / 1024}
+                        for t, a, r in self.samples],
+        }
+
+
+class _EngineDriver:
+    """
+    SimulationEngine với setpoint, van và nhiễu đổi theo chu kỳ cố định (thời gian mô phỏng); mỗi bước
+    được ghi vào lịch sử xu hướng như _update_graph_data() của GUI.
+    """
+    SETPOINTS = (10.0, 30.0, 20.0)
+    VALVES = ((100.0, 100.0), (60.0, 90.0), (85.0, 50.0))
+
+    def __init__(self, controller_type, inference, dt):
+        tank_system = CoupledTankSystem()
+        controller = create_controller(controller_type, self.SETPOINTS[0], plant=tank_system,
+                                       fuzzy_inference=inference)
+        self.engine = SimulationEngine(controller, tank_system, dt)
+        self.trend = TrendPyramid(('h1', 'h2', 'qi1', 'setpoint'))
+        self._phase = 0
+
+    @property
+    def simulation_time(self):
+        return self.engine.simulation_time
+
+    def advance(self, until):
+        engine = self.engine
+        while engine.simulation_time < until - 1e-9:
+            phase = int(engine.simulation_time // 300.0)  # Đổi điểm làm việc mỗi 5 phút mô phỏng
+            if phase != self._phase:
+                self._phase = phase
+                engine.set_setpoint(self.SETPOINTS[phase % len(self.SETPOINTS)])
+                engine.tank_system.set_valve_openings(*self.VALVES[phase % len(self.VALVES)])
+                if phase % 2:
+                    engine.trigger_disturbance()
+            qi1 = engine.step()
+            ts = engine.tank_system
+            self.trend.append(engine.simulation_time, ts.H1, ts.H2, qi1, engine.controller.set_point)
+
+    def close(self):
+        pass
+
+
+class _GuiDriver:
+    """
+    SimulationGUI trên cửa sổ ẩn, chạy bằng chính vòng sự kiện Tk: ui_scheduler gọi update_gui,
+    biểu đồ và hoạt họa theo UI_PERIODS, mỗi nhịp update_gui tiến `speed` bước mô phỏng.
+    """
+    def __init__(self, controller_type, inference, speed):
+        from coupled_tank_gui import SimulationGUI
+
+        attr = _GUI_CONTROLLERS.get((controller_type, inference))
+        if attr is None:
+            raise ValueError(f"GUI không có bộ điều khiển {controller_type!r} với suy luận {inference!r}")
+        self.root = tk.Tk()  # Ném TclError nếu không có màn hình
+        self.root.withdraw()
+        gui = self.gui = SimulationGUI(self.root)
+        labels = {value: label for label, value in gui.CONTROLLER_CHOICES.items()}
+        gui.controller_var.set(labels[attr])
+        gui._on_controller_change()
+        gui.simulation_speed = max(1, int(speed))
+        gui.start_simulation()
+
+    @property
+    def simulation_time(self):
+        return self.gui.simulation_time
+
+    def advance(self, until):
+        while self.gui.simulation_time < until - 1e-9:
+            self.root.update()
+            time.sleep(0.001)  # Nhường CPU giữa hai nhịp; after() của Tk quyết định nhịp thật
+
+    def close(self):
+        self.gui.stop_simulation()
+        self.gui._on_close()
+
+
+def run_soak(mode='engine', duration=36000.0, controller='pid', inference='mamdani', dt=0.1, speed=100,
+             sample_interval=None, warmup=None, threshold_kb_per_hour=64.0, top=10, frames=1, progress=None):
+    """
+    Chạy ngâm và trả về báo cáo của SoakMonitor.report() kèm 'mode', 'controller', 'duration',
+    'wall_time_s'.
+
+    Args:
+        duration (float): Thời gian mô phỏng (giây).
+        speed (int): Chế độ gui: số bước mô phỏng mỗi nhịp giao diện.
+        sample_interval (float): Khoảng lấy mẫu (giây mô phỏng), mặc định duration / 40.
+        warmup (float): Bỏ qua phần đầu (giây mô phỏng) khi tính độ dốc, mặc định 20% duration.
+        threshold_kb_per_hour (float): Tăng trưởng ổn định tối đa (KB/giờ mô phỏng).
+        frames (int): Số khung ngăn xếp tracemalloc giữ cho mỗi cấp phát.
+        progress (callable): Gọi với (thời gian mô phỏng, mẫu vừa lấy) sau mỗi lần lấy mẫu.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Chế độ phải là một trong {MODES}")
+    sample_interval = sample_interval or duration / 40.0
+    warmup = duration * 0.2 if warmup is None else warmup
+    if warmup >= duration:
+        raise ValueError("warmup phải nhỏ hơn duration")
+
+    driver = (_GuiDriver(controller, inference, speed) if mode == 'gui'
+              else _EngineDriver(controller, inference, dt))
+    monitor = SoakMonitor(warmup, frames=frames)
+    monitor.start()
+    t0 = time.perf_counter()
+    try:
+        monitor.sample(driver.simulation_time)
+        next_sample = sample_interval
+        while driver.simulation_time < duration - 1e-9:
+            driver.advance(min(next_sample, duration))
+            monitor.sample(driver.simulation_time)
+            if progress is not None:
+                progress(driver.simulation_time, monitor.samples[-1])
+            next_sample += sample_interval
+    finally:
+        wall_time = time.perf_counter() - t0
+        driver.close()
+        monitor.stop()
+    report = monitor.report(threshold_kb_per_hour, top)
+    report.update(mode=mode, controller=controller, inference=inference, duration=duration, wall_time_s=wall_time)
+    return report
+
+
+def format_report(report):
+    """Báo cáo dạng văn bản."""
+    def rate(value):
+        return "chưa đủ mẫu" if value is None else f"{value:+.1f} KB/giờ"
+    lines = [f"Chạy ngâm {report['mode']} ({report['controller']}"
+             f"{', ' + report['inference'] if report['controller'] == 'fuzzy' else ''}): "
+             f"{report['duration'] / 3600:.1f} giờ mô phỏng trong {report['wall_time_s']:.1f} s",
+             f"Tăng trưởng ổn định (tracemalloc): {rate(report['growth_kb_per_hour'])} "
+             f"(ngưỡng {report['threshold_kb_per_hour']:g} KB/giờ)",
+             f"RSS: {rate(report['rss_kb_per_hour'])}"]
+    if report['top_lines']:
+        lines += ["", "Các dòng cấp phát tăng nhiều nhất sau warmup:"]
+        for item in report['top_lines']:
+            lines.append(f"  {item['size_diff_kb']:+9.1f} KB {item['count_diff']:+7d} khối  "
+                         f"{item['file']}:{item['line']}")
+    lines += ["", "ĐẠT" if report['passed'] else "KHÔNG ĐẠT"]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy ngâm dài hạn và theo dõi bộ nhớ tăng dần")
+    parser.add_argument('--mode', choices=MODES, default='engine')
+    parser.add_argument('--duration', type=float, default=36000.0, help="Thời gian mô phỏng (giây)")
+    parser.add_argument('--controller', choices=CONTROLLER_TYPES, default='pid')
+    parser.add_argument('--inference', choices=('mamdani', 'sugeno'), default='mamdani',
+                        help="Kiểu suy luận của Fuzzy PID")
+    parser.add_argument('--dt', type=float, default=0.1, help="Bước mô phỏng của chế độ engine (giây)")
+    parser.add_argument('--speed', type=int, default=100, help="Chế độ gui: số bước mô phỏng mỗi nhịp")
+    parser.add_argument('--sample-interval', type=float, default=None, help="Giây mô phỏng giữa hai mẫu")
+    parser.add_argument('--warmup', type=float, default=None, help="Giây mô phỏng bỏ qua khi tính độ dốc")
+    parser.add_argument('--threshold', type=float, default=64.0, help="Ngưỡng tăng trưởng (KB/giờ mô phỏng)")
+    parser.add_argument('--top', type=int, default=10, help="Số dòng mã liệt kê")
+    parser.add_argument('-o', '--output', help="Ghi báo cáo đầy đủ (JSON)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="In từng mẫu")
+    args = parser.parse_args(argv)
+
+    def progress(sim_time, sample):
+        _, tracked, rss = sample
+        rss_text = "?" if rss is None else f"{rss / 1024 ** 2:.1f} MB"
+        print(f"t={sim_time:9.0f} s  tracemalloc {tracked / 1024:9.1f} KB  RSS {rss_text}", file=sys.stderr)
+
+    try:
+        report = run_soak(args.mode, args.duration, args.controller, args.inference, args.dt, args.speed,
+                          args.sample_interval, args.warmup, args.threshold, args.top,
+                          progress=progress if args.verbose else None)
+    except ValueError as e:
+        parser.error(str(e))
+    except tk.TclError as e:
+        print(f"Không mở được cửa sổ Tk (cần màn hình hoặc Xvfb): {e}", file=sys.stderr)
+        return 2
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0 if report['passed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
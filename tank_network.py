@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class TankNetwork:
+    """
+    Mô phỏng mạng N bồn nước nối với nhau bằng ống (đồ thị bồn - ống - cửa xả).
+
+    Mọi lưu lượng giữa các bồn (Q = alpha * sign(ΔH) * sqrt(|ΔH|)) được tính trong một
+    lượt vector hóa trên danh sách cạnh, rồi cộng dồn vào từng bồn bằng np.bincount,
+    nên chi phí mỗi bước tăng tuyến tính theo số ống. Hệ hai bồn của CoupledTankSystem
+    là một cấu hình của mạng này (xem from_coupled_tank()).
+    """
+    def __init__(self, areas, pipes=(), outlets=(), max_height=40.0):
+        """
+        Args:
+            areas (sequence): Diện tích đáy từng bồn (cm^2).
+            pipes (sequence): Các ống nối (bồn_a, bồn_b, alpha) với alpha tính bằng cm^(3/2)/sec.
+            outlets (sequence): Các cửa xả (bồn, alpha) hoặc (bồn, alpha, độ mở van %).
+            max_height (float hoặc sequence): Chiều cao tối đa của bồn (cm).
+        """
+        self.A = np.asarray(areas, dtype=float)
+        n = len(self.A)
+        self.n_tanks = n
+        self.max_height = np.broadcast_to(np.asarray(max_height, dtype=float), (n,)).copy()
+        self.H = np.zeros(n)
+
+        pipes = list(pipes)
+        self.pipe_src = np.array([p[0] for p in pipes], dtype=np.intp)
+        self.pipe_dst = np.array([p[1] for p in pipes], dtype=np.intp)
+        self.pipe_alpha = np.array([p[2] for p in pipes], dtype=float)
+
+        outlets = list(outlets)
+        self.outlet_tank = np.array([o[0] for o in outlets], dtype=np.intp)
+        self.outlet_alpha = np.array([o[1] for o in outlets], dtype=float)
+        self.valve_open = np.array([o[2] if len(o) > 2 else 100.0 for o in outlets], dtype=float)
+
+        for idx in (self.pipe_src, self.pipe_dst, self.outlet_tank):
+            if len(idx) and (idx.min() < 0 or idx.max() >= n):
+                raise ValueError("Chỉ số bồn trong ống/cửa xả nằm ngoài phạm vi.")
+
+        # Nhiễu loạn đang hoạt động: (bồn, lưu lượng rút ra, thời điểm bắt đầu, thời lượng)
+        self.disturbances = []
+
+    # --- Các cấu hình dựng sẵn ---
+    @classmethod
+    def from_coupled_tank(cls, system):
+        """Tạo mạng tương đương với một CoupledTankSystem (hai bồn, một ống nối, hai cửa xả)."""
+        network = cls(
+            areas=(system.A1, system.A2),
+            pipes=[(0, 1, system.alpha3)],
+            outlets=[(0, system.alpha1, system.valve1_open), (1, system.alpha2, system.valve2_open)],
+            max_height=system.max_height,
+        )
+        network.H[:] = (system.H1, system.H2)
+        return network
+
+    @classmethod
+    def cascade(cls, n_tanks, area=32.0, pipe_alpha=20.0, outlet_alpha=14.30, max_height=40.0):
+        """Chuỗi n bồn nối tiếp, mỗi bồn có một cửa xả riêng."""
+        pipes = [(i, i + 1, pipe_alpha) for i in range(n_tanks - 1)]
+        outlets = [(i, outlet_alpha) for i in range(n_tanks)]
+        return cls([area] * n_tanks, pipes, outlets, max_height)
+
+    @classmethod
+    def grid(cls, rows, cols, area=32.0, pipe_alpha=20.0, outlet_alpha=14.30, max_height=40.0):
+        """Lưới rows x cols bồn, nối với các bồn kề phải và kề dưới."""
+        idx = lambda r, c: r * cols + c
+        pipes = []
+        for r in range(rows):
+            for c in range(cols):
+                if c + 1 < cols:
+                    pipes.append((idx(r, c), idx(r, c + 1), pipe_alpha))
+                if r + 1 < rows:
+                    pipes.append((idx(r, c), idx(r + 1, c), pipe_alpha))
+        outlets = [(i, outlet_alpha) for i in range(rows * cols)]
+        return cls([area] * (rows * cols), pipes, outlets, max_height)
+
+    # --- Mô phỏng ---
+    def pipe_flows(self):
+        """Lưu lượng qua từng ống, dương theo chiều bồn_a -> bồn_b (cm^3/s)."""
+        delta_H = self.H[self.pipe_src] - self.H[self.pipe_dst]
+        return self.pipe_alpha * np.sign(delta_H) * np.sqrt(np.abs(delta_H))
+
+    def outlet_flows(self):
+        """Lưu lượng ra qua từng cửa xả (cm^3/s)."""
+        H_safe = np.maximum(self.H[self.outlet_tank], 0.0)
+        opening = np.where(self.valve_open < 1e-3, 0.0, self.valve_open / 100.0)
+        return opening * self.outlet_alpha * np.sqrt(H_safe)
+
+    def update(self, inflows, dt, current_time=0.0):
+        """
+        Cập nhật mực nước tất cả các bồn qua một khoảng thời gian dt (Euler).
+
+        Args:
+            inflows (array): Lưu lượng vào từng bồn (cm^3/s), độ dài n_tanks.
+            dt (float): Khoảng thời gian (s).
+            current_time (float): Thời gian hiện tại để xử lý nhiễu.
+        """
+        n = self.n_tanks
+        q_pipe = self.pipe_flows()
+        net = np.array(inflows, dtype=float)
+        net += np.bincount(self.pipe_dst, q_pipe, n) - np.bincount(self.pipe_src, q_pipe, n)
+        net -= np.bincount(self.outlet_tank, self.outlet_flows(), n)
+
+        # Nhiễu loạn: rút lưu lượng khỏi bồn trong thời lượng đã đặt
+        if self.disturbances:
+            remaining = []
+            for tank, flow, start, duration in self.disturbances:
+                if current_time - start < duration:
+                    net[tank] -= flow
+                    remaining.append((tank, flow, start, duration))
+            self.disturbances = remaining
+
+        self.H += net / self.A * dt
+        np.clip(self.H, 0.0, self.max_height, out=self.H)
+
+    def set_valve_openings(self, openings):
+        """Đặt độ mở (0-100%) cho tất cả các cửa xả."""
+        self.valve_open[:] = np.clip(openings, 0, 100)
+
+    def trigger_disturbance(self, tank, current_time, flow=50.0, duration=5.0):
+        """Kích hoạt nhiễu loạn rút `flow` cm³/s khỏi bồn `tank` trong `duration` giây."""
+        self.disturbances.append((tank, flow, current_time, duration))
+
+    def get_levels(self):
+        """Trả về mảng mực nước hiện tại."""
+        return self.H.copy()
+
+    def reset(self):
+        """Đặt lại mực nước về 0."""
+        self.H[:] = 0.0
+        self.disturbances = []
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các mô-đun nằm ở gốc kho (không đóng gói): cho phép chạy `pytest` từ bất kỳ thư mục nào
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from coupled_tank_gui import MultiRateEngine, SimulationEngine, create_controller
+
+
+def _trace(engine, steps):
+    return [(engine.step(), engine.state()) for _ in range(steps)]
+
+
+@pytest.mark.parametrize('controller_type', ['pid', 'fuzzy'])
+def test_simulation_engine_round_trip(controller_type):
+    engine = SimulationEngine(create_controller(controller_type, 20.0), dt=0.1, measurement_noise=0.05, seed=3)
+    _trace(engine, 300)
+    engine.trigger_disturbance(flow=40.0, duration=8.0)
+    _trace(engine, 20)  # Nhiễu còn đang hoạt động lúc chụp
+    snapshot = json.loads(json.dumps(engine.snapshot()))  # Chỉ gồm kiểu thuần, ghi được JSON
+    expected = _trace(engine, 400)
+
+    engine.restore(snapshot)
+    assert _trace(engine, 400) == expected
+    assert _trace(SimulationEngine.from_snapshot(snapshot), 400) == expected
+
+
+def test_multirate_round_trip_keeps_pending_events():
+    engine = MultiRateEngine(create_controller('pid', 20.0), dt=0.1, controller_period=1.0, sensor_period=0.5,
+                             measurement_noise=0.05, seed=5)
+    engine.schedule_disturbance(40.0, flow=50.0, duration=20.0)
+    engine.schedule_setpoint(50.0, 15.0)
+    engine.schedule_setpoint(80.0, 25.0)
+    engine.run_until(45.05)  # Giữa chu kỳ bộ điều khiển, nhiễu đang bật
+    snapshot = json.loads(json.dumps(engine.snapshot()))
+    assert [(spec['name'], spec['time']) for spec in snapshot['timed_events']] == [
+        ('setpoint', 50.0), ('disturbance_end', 60.0), ('setpoint', 80.0)]
+    expected = _trace(engine, 600)
+    assert expected[-1][1]['setpoint'] == 25.0
+
+    engine.restore(snapshot)
+    assert _trace(engine, 600) == expected
+    branch = MultiRateEngine.from_snapshot(snapshot)
+    assert (branch.controller_period, branch.sensor_period) == (1.0, 0.5)
+    assert _trace(branch, 600) == expected
+
+
+def test_multirate_restore_drops_events_added_after_snapshot():
+    engine = MultiRateEngine(create_controller('pid', 20.0), dt=0.1)
+    engine.run_until(10.0)
+    snapshot = engine.snapshot()
+    expected = _trace(engine, 200)
+    engine.restore(snapshot)
+    engine.schedule_setpoint(15.0, 5.0)
+    engine.restore(snapshot)
+    assert _trace(engine, 200) == expected
@@ -0,0 +1,50 @@
+import numpy as np
+
+from coupled_tank_gui import FuzzyPIDController
+from fuzzy_surface import ControlSurface
+
+
+def test_sugeno_ignores_zero_width_consequents():
+    fuzzy = FuzzyPIDController(set_point=20.0, inference='sugeno')
+    zero_width = [term for term, (a, b, c) in fuzzy.kp_params.items() if c <= a]
+    assert zero_width  # Bảng mặc định có Kp PM/PB bề rộng 0
+    n_ce = len(fuzzy._ce_terms)
+    strengths = np.zeros(len(fuzzy._e_terms) * n_ce)
+    for (e_term, ce_term), (kp_term, _, _) in fuzzy.rule_base.items():
+        k = fuzzy._e_terms.index(e_term) * n_ce + fuzzy._ce_terms.index(ce_term)
+        strengths[k] = 1.0 if kp_term in zero_width else 0.0
+    # Chỉ các luật có hệ quả Kp bề rộng 0 kích hoạt: như Mamdani (không có diện tích), Kp = 0
+    assert fuzzy._sugeno_gains(strengths)[0] == 0.0
+
+
+def test_sugeno_surface_close_to_mamdani():
+    mamdani = ControlSurface(FuzzyPIDController(set_point=20.0))
+    sugeno = ControlSurface(FuzzyPIDController(set_point=20.0, inference='sugeno'))
+    mamdani.refresh()
+    sugeno.refresh()
+    difference = np.abs(mamdani.gains - sugeno.gains).max(axis=(1, 2))
+    # Sai khác còn lại do trung bình singleton khác trọng tâm Mamdani (FUZZY_PID_DOCUMENTATION.md)
+    assert np.all(difference < (25.0, 5.0, 40.0))
+
+
+def test_sugeno_gains_match_batch_path():
+    fuzzy = FuzzyPIDController(set_point=20.0, inference='sugeno')
+    strengths = np.random.default_rng(0).random((50, len(fuzzy._e_terms) * len(fuzzy._ce_terms)))
+    strengths[:5] = 0.0
+    batch = fuzzy.gains_from_strengths(strengths)
+    single = np.array([fuzzy._sugeno_gains(row) for row in strengths])
+    np.testing.assert_allclose(batch, single, rtol=1e-12, atol=1e-12)
+
+
+def test_analytic_centroid_matches_reference():
+    fuzzy = FuzzyPIDController(set_point=20.0)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        levels = rng.random((3, 7)) * (rng.random((3, 7)) < 0.5)
+        np.testing.assert_allclose(fuzzy._defuzzify_analytic(levels), fuzzy.centroid_reference(levels), atol=1e-5)
+    # Mức kích hoạt thực tế của bảng luật, kể cả khi không luật nào có diện tích (trọng tâm 0)
+    for e, ce in ((7.3, -2.1), (-15.0, 4.0), (0.0, 0.0)):
+        levels = fuzzy._rule_levels(fuzzy._fuzzify(e, fuzzy.error_universe, fuzzy.e_mf),
+                                    fuzzy._fuzzify(ce, fuzzy.ce_universe, fuzzy.ce_mf))
+        np.testing.assert_allclose(fuzzy._defuzzify_analytic(levels), fuzzy.centroid_reference(levels), atol=1e-5)
+    assert fuzzy._defuzzify_analytic(np.zeros((3, 7))) == fuzzy.centroid_reference(np.zeros((3, 7)))
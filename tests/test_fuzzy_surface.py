@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from coupled_tank_gui import FuzzyPIDController
+from fuzzy_surface import ControlSurface
+
+EDITS = [
+    ('rule', ('PS', 'ZO', ('PB', 'NS', 'ZO'))),
+    ('rule', ('NB', 'PB', ('ZO', 'ZO', 'ZO'))),
+    ('membership', ('E', 'PS', (0, 15, 30))),
+    ('membership', ('CE', 'NM', (-20, -12, -2))),
+    ('membership', ('Kd', 'NS', (60, 90, 160))),
+    ('membership', ('Kp', 'PM', (150, 200, 200))),  # Tập bề rộng 0 có diện tích: trọng số Sugeno đổi
+    ('rule', ('ZO', 'ZO', ('PM', 'PB', 'NB'))),
+]
+
+
+def _full(controller):
+    surface = ControlSurface(controller)
+    surface.refresh()
+    return surface.gains
+
+
+@pytest.mark.parametrize('inference', ['mamdani', 'sugeno'])
+def test_incremental_refresh_matches_full_recompute(inference):
+    controller = FuzzyPIDController(set_point=20.0, inference=inference)
+    surface = ControlSurface(controller, chunk=97)
+    assert surface.refresh() == surface.size
+    for kind, args in EDITS:
+        if kind == 'rule':
+            surface.set_rule(*args)
+        else:
+            surface.set_membership(*args)
+        pending = surface.pending
+        assert 0 < pending < surface.size
+        assert surface.refresh() == pending and surface.pending == 0
+        np.testing.assert_allclose(surface.gains, _full(controller), rtol=1e-12, atol=1e-9)
+
+
+def test_rule_edit_only_recomputes_its_region():
+    surface = ControlSurface(FuzzyPIDController(set_point=20.0))
+    surface.refresh()
+    surface.set_rule('PS', 'ZO', ('PB', 'NS', 'ZO'))
+    rows, cols = np.nonzero(surface._dirty)
+    e, ce = surface.e[rows], surface.ce[cols]
+    assert e.min() > 0 and e.max() < 30 and ce.min() > -10 and ce.max() < 10  # Vùng kích hoạt của luật
+    # Đặt lại đúng hệ quả cũ: không có gì để tính
+    surface.refresh()
+    previous = surface.set_rule('PS', 'ZO', ('PB', 'NS', 'ZO'))
+    assert previous == ('PB', 'NS', 'ZO') and surface.refresh() == 0
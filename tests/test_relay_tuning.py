@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from coupled_tank_gui import CoupledTankSystem, RelayAutoTuner
+from frequency_analysis import linearize_grid, plant_response
+
+
+def _plant_gain(Tu, set_point=20.0):
+    lin = linearize_grid(CoupledTankSystem(), [set_point])
+    return abs(plant_response(lin['A'], lin['B'], [2 * np.pi / Tu])[0, 0])
+
+
+@pytest.mark.parametrize('dt', [0.02, 0.1, 1.0])
+@pytest.mark.parametrize('hysteresis', [0.5, 0.1, 0.02])
+def test_ku_matches_linear_plant_gain(dt, hysteresis):
+    tuner = RelayAutoTuner(CoupledTankSystem(), set_point=20.0, relay_amplitude=200.0, dt=dt,
+                           hysteresis=hysteresis)
+    result = tuner.run()
+    assert result is not None
+    Ku, Tu = result
+    assert Ku * _plant_gain(Tu) == pytest.approx(1.0, rel=0.05)
+
+
+def test_sampled_switching_ku_matches_linear_plant_gain():
+    tuner = RelayAutoTuner(CoupledTankSystem(), set_point=20.0, relay_amplitude=200.0, dt=0.02,
+                           switching='sampled')
+    Ku, Tu = tuner.run()
+    assert Ku * _plant_gain(Tu) == pytest.approx(1.0, rel=0.05)
+
+
+def test_large_step_agrees_with_small_step():
+    fine = RelayAutoTuner(CoupledTankSystem(), set_point=20.0, relay_amplitude=200.0, dt=0.02).run()
+    coarse = RelayAutoTuner(CoupledTankSystem(), set_point=20.0, relay_amplitude=200.0, dt=1.0).run()
+    assert coarse == pytest.approx(fine, rel=0.03)
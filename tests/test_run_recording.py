@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from run_recording import RECORD_FIELDS, ReplayPlayer, RunRecorder, RunRecording
+
+DT = 0.25  # Thời gian biểu diễn chính xác trong float64
+
+
+@pytest.fixture
+def recording(tmp_path):
+    """10000 bản ghi (vượt vài khối chỉ mục thô) với giá trị suy ra được từ chỉ số."""
+    path = str(tmp_path / 'run.ctrun')
+    recorder = RunRecorder(path, buffer_size=300)
+    for i in range(10000):
+        recorder.append(i * DT, i, 2 * i, 3 * i, 20.0, 0.5, 0.6, i % 2)
+    recorder.close()
+    return RunRecording(path, index_stride=1024)
+
+
+def test_recorded_samples_round_trip(recording):
+    assert len(recording) == 10000
+    sample = recording.records[1234]
+    assert [float(sample[name]) for name in RECORD_FIELDS] == [1234 * DT, 1234, 2468, 3702, 20.0, 0.5, 0.6, 0.0]
+
+
+def test_seek_matches_recorded_samples(recording):
+    player = ReplayPlayer(recording)
+    times = np.asarray(recording.times)
+    for t in np.random.default_rng(0).uniform(times[0], times[-1], 200):
+        player.seek(t)
+        expected = int(np.searchsorted(times, t, side='right')) - 1  # Bản ghi cuối có time <= t
+        assert player.current_sample()['h1'] == expected
+    player.seek(-5.0)
+    assert player.position == recording.start_time and player.current_sample()['h1'] == 0
+    player.seek(1e9)
+    assert player.position == recording.end_time and player.current_sample()['h1'] == 9999
+
+
+def test_reverse_playback_walks_back_to_start(recording):
+    player = ReplayPlayer(recording)
+    player.seek(500.0)
+    player.set_speed(16.0)
+    player.toggle_direction()
+    player.playing = True
+    seen = [int(player.current_sample()['h1'])]
+    while player.playing:
+        player.advance(0.25)
+        seen.append(int(player.current_sample()['h1']))
+    # Mỗi khung lùi 16 * 0.25 = 4 s = 16 bản ghi, dừng ở bản ghi đầu tiên
+    assert seen[:3] == [2000, 1984, 1968]
+    assert all(b < a for a, b in zip(seen, seen[1:]))
+    assert seen[-1] == 0 and player.position == recording.start_time
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from scenario_runner import ScenarioError, load_scenario
+
+
+def _write(tmp_path, data, name='scenario.json'):
+    path = tmp_path / name
+    path.write_text(json.dumps(data), encoding='utf-8')
+    return str(path)
+
+
+def test_valid_scenario_is_normalised(tmp_path):
+    scenario = load_scenario(_write(tmp_path, {
+        'duration': 60, 'controller': {'type': 'fuzzy', 'inference': 'sugeno'},
+        'rates': {'controller': 1},
+        'events': [{'time': 30, 'valves': [50, 100]}, {'time': 10, 'setpoint': 15}],
+    }))
+    assert scenario['name'] == 'scenario'
+    assert scenario['duration'] == 60.0 and isinstance(scenario['duration'], float)
+    assert [event['time'] for event in scenario['events']] == [10.0, 30.0]
+    assert scenario['events'][1]['valves'] == [50.0, 100.0]
+
+
+@pytest.mark.parametrize('data', [
+    [1, 2, 3],
+    {'name': 5},
+    {'duration': '300'},
+    {'duration': True},
+    {'dt': 0},
+    {'dt': -0.1},
+    {'controller': 'pid'},
+    {'controller': {'type': 'lqr'}},
+    {'controller': {'type': 'fuzzy', 'inference': 'tsk'}},
+    {'controller': {'type': 'pid', 'Kp': '80'}},
+    {'rates': [1.0]},
+    {'rates': {'plant': 1.0}},
+    {'rates': {'controller': 0}},
+    {'initial': {'setpoint': None}},
+    {'expect': {'iae_max': 'small'}},
+    {'events': {'time': 10, 'setpoint': 15}},
+    {'events': [5]},
+    {'events': [{'setpoint': 15}]},
+    {'events': [{'time': 10}]},
+    {'events': [{'time': '10', 'setpoint': 15}]},
+    {'events': [{'time': 10, 'setpoint': 'high'}]},
+    {'events': [{'time': 10, 'valves': [50]}]},
+    {'events': [{'time': 10, 'valves': [50, 'open']}]},
+    {'events': [{'time': 10, 'disturbance': 50}]},
+    {'events': [{'time': 10, 'disturbance': {'flow': 'max'}}]},
+    {'events': [{'time': 10, 'gains': {'Kp': [60]}}]},
+    {'events': [{'time': 10, 'controller': 'lqr'}]},
+])
+def test_rejects_bad_types(tmp_path, data):
+    with pytest.raises(ScenarioError):
+        load_scenario(_write(tmp_path, data))
+
+
+def test_rejects_non_finite_numbers(tmp_path):
+    path = tmp_path / 'nan.json'
+    path.write_text('{"duration": NaN}', encoding='utf-8')
+    with pytest.raises(ScenarioError):
+        load_scenario(str(path))
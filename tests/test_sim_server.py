@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+import pytest
+
+from sim_server import SimulationServer
+
+
+@pytest.fixture
+def server():
+    return SimulationServer()
+
+
+def _create(server, **fields):
+    response = server.handle(None, dict({'id': 1, 'op': 'create'}, **fields))
+    assert response['ok'], response
+    return response['session']
+
+
+@pytest.mark.parametrize('request_', [
+    {'id': 1, 'op': 'create', 'setpoint': '25'},
+    {'id': 1, 'op': 'create', 'setpoint': float('nan')},
+    {'id': 1, 'op': 'create', 'dt': 0},
+    {'id': 1, 'op': 'create', 'dt': True},
+    {'id': 1, 'op': 'create', 'gains': {'Kp': 'high'}},
+    {'id': 1, 'op': 'create', 'gains': {'Kx': 1.0}},
+    {'id': 1, 'op': 'create', 'gains': [80, 10, 5]},
+    {'id': 1, 'op': 'create', 'valves': [100]},
+    {'id': 1, 'op': 'create', 'valves': [100, None]},
+    {'id': 1, 'op': 'create', 'controller': 'lqr'},
+    {'id': 1, 'op': 'launch'},
+    {'id': 1},
+])
+def test_rejects_bad_create(server, request_):
+    response = server.handle(None, request_)
+    assert response == {'id': 1, 'ok': False, 'error': response['error']}
+    assert not server.sessions
+
+
+@pytest.mark.parametrize('request_', [
+    [1, 2],
+    'create',
+    None,
+])
+def test_rejects_non_object_requests(server, request_):
+    response = server.handle(None, request_)
+    assert response['ok'] is False and response['id'] is None
+
+
+def test_rejects_unknown_session(server):
+    _create(server)
+    for op in ('state', 'set', 'subscribe', 'close'):
+        response = server.handle(None, {'id': 2, 'op': op, 'session': 99})
+        assert response['ok'] is False and response['id'] == 2
+    assert server.handle(None, {'id': 3, 'op': 'state', 'session': '1'})['ok'] is False
+
+
+def test_bad_set_leaves_session_unchanged(server):
+    session_id = _create(server, setpoint=20)
+    before = server.handle(None, {'id': 2, 'op': 'state', 'session': session_id})['state']
+    engine = server.sessions[session_id].engine
+    kp = engine.controller.Kp
+    # setpoint hợp lệ nhưng valves sai: cả yêu cầu bị từ chối, không áp dụng một nửa
+    response = server.handle(None, {'id': 3, 'op': 'set', 'session': session_id,
+                                    'setpoint': 30, 'valves': [50, 'x'], 'gains': {'Kp': 1}})
+    assert response['ok'] is False
+    for bad in ({'gains': {'Kp': 'x'}}, {'disturbance': {'flow': 50, 'length': 5}}, {'disturbance': 50}):
+        assert server.handle(None, dict({'id': 4, 'op': 'set', 'session': session_id}, **bad))['ok'] is False
+    assert server.handle(None, {'id': 5, 'op': 'state', 'session': session_id})['state'] == before
+    assert engine.controller.Kp == kp and not engine.tank_system.disturbance_active
+
+
+def test_bad_lines_over_socket(tmp_path):
+    """JSON hỏng và yêu cầu sai trong lô được trả lời lỗi; kết nối và các yêu cầu khác vẫn chạy."""
+    async def run():
+        server = SimulationServer()
+        path = str(tmp_path / 'sim.sock')
+        listener = await asyncio.start_unix_server(server.handle_client, path=path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'{"id": 1, "op": \n')
+        writer.write((json.dumps([{'id': 2, 'op': 'create'}, {'id': 3, 'op': 'create', 'dt': -1}, 7]) + '\n').encode())
+        await writer.drain()
+        replies = [json.loads(await asyncio.wait_for(reader.readline(), 5)) for _ in range(2)]
+        writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return replies
+
+    bad_json, batch = asyncio.run(run())
+    assert bad_json['ok'] is False
+    assert [reply['ok'] for reply in batch] == [True, False, False]
+    assert batch[0]['session'] == 1
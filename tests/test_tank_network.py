@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from coupled_tank_gui import CoupledTankSystem
+from tank_network import TankNetwork
+
+
+@pytest.mark.parametrize('valves', [(100.0, 100.0), (40.0, 75.0), (0.0, 100.0)])
+def test_from_coupled_tank_matches_update(valves):
+    system = CoupledTankSystem()
+    system.set_valve_openings(*valves)
+    system.H1, system.H2 = 3.0, 7.0  # Dòng qua ống nối đổi chiều trong lúc chạy
+    network = TankNetwork.from_coupled_tank(system)
+    rng = np.random.default_rng(0)
+    dt = 0.1
+    for i, qi1 in enumerate(rng.uniform(0.0, 300.0, 3000)):
+        t = i * dt
+        if i == 1000:
+            system.trigger_disturbance(t)
+            network.trigger_disturbance(1, t, flow=system.disturbance_flow, duration=system.disturbance_duration)
+        system.update(qi1, 0.0, dt, t)
+        network.update((qi1, 0.0), dt, t)
+        np.testing.assert_allclose(network.get_levels(), system.get_levels(), rtol=1e-12, atol=1e-12)
+
+
+def test_levels_saturate_like_coupled_tank():
+    system = CoupledTankSystem()
+    network = TankNetwork.from_coupled_tank(system)
+    for i in range(2000):
+        system.update(2000.0, 0.0, 0.1, i * 0.1)  # Đủ lớn để chạm max_height
+        network.update((2000.0, 0.0), 0.1, i * 0.1)
+    assert system.H1 == system.max_height
+    np.testing.assert_allclose(network.get_levels(), system.get_levels(), rtol=1e-12)
@@ -0,0 +1,67 @@
+import tracemalloc
+
+import numpy as np
+
+from trend_pyramid import TrendPyramid
+
+
+def _fill(pyramid, n, dt=0.1):
+    rng = np.random.default_rng(0)
+    for i, row in enumerate(rng.normal(size=(n, len(pyramid.channels)))):
+        pyramid.append(i * dt, *row)
+
+
+def test_memory_does_not_grow_with_samples():
+    pyramid = TrendPyramid(('h1', 'h2'), raw_limit=256, level_limit=64, max_levels=6)
+    _fill(pyramid, 4 ** 5)  # Mọi tầng đã có dữ liệu
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        _fill(pyramid, 4 ** 6)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, 'filename')
+                if stat.traceback[0].filename.endswith('trend_pyramid.py'))
+    assert grown < 4096
+
+
+def _samples(n, n_channels, dt=0.1):
+    rng = np.random.default_rng(1)
+    return np.arange(n) * dt, np.cumsum(rng.normal(size=(n, n_channels)), axis=0)
+
+
+def test_levels_match_naive_scan():
+    pyramid = TrendPyramid(('h1', 'h2'), raw_limit=256, level_limit=64, max_levels=6)
+    times, values = _samples(4 ** 6 + 123, 2)
+    for t, row in zip(times, values):
+        pyramid.append(t, *row)
+    for k, lvl in enumerate(pyramid.levels[1:], start=1):
+        group = pyramid.factor ** k
+        for j in range(lvl.n - lvl.start):
+            block = values[(lvl.start + j) * group:(lvl.start + j + 1) * group]
+            np.testing.assert_array_equal(lvl.mins[j], block.min(axis=0))
+            np.testing.assert_array_equal(lvl.maxs[j], block.max(axis=0))
+            np.testing.assert_allclose(lvl.means[j], block.mean(axis=0))
+            assert lvl.t_first[j] == times[(lvl.start + j) * group]
+            assert lvl.t_last[j] == times[(lvl.start + j + 1) * group - 1]
+
+
+def test_query_envelope_matches_naive_scan():
+    pyramid = TrendPyramid(('h1', 'h2'), raw_limit=256, level_limit=64, max_levels=6)
+    times, values = _samples(4 ** 6 + 123, 2)
+    for t, row in zip(times, values):
+        pyramid.append(t, *row)
+    group = pyramid.factor ** (pyramid.max_levels - 1)
+    for t_start, t_end, max_points in ((0.0, times[-1], 200), (37.3, 251.9, 100), (390.0, times[-1], 2000)):
+        q_times, q_values = pyramid.query(t_start, t_end, max_points=max_points)
+        assert len(q_times) <= 2 * max_points
+        inside = (times >= t_start) & (times <= t_end)
+        # Các nhóm ở biên có thể chứa mẫu ngoài khoảng (tối đa một nhóm thô nhất mỗi bên)
+        first, last = np.flatnonzero(inside)[[0, -1]]
+        widened = values[max(0, first - group):last + group + 1]
+        for i, ch in enumerate(pyramid.channels):
+            assert q_values[ch].min() <= values[inside, i].min()
+            assert q_values[ch].max() >= values[inside, i].max()
+            assert q_values[ch].min() >= widened[:, i].min()
+            assert q_values[ch].max() <= widened[:, i].max()
@@ -0,0 +1,60 @@
+import json
+
+import tuning_cache
+from tuning_cache import TUNING_CACHE_VERSION, TuningCache, config_key
+
+
+def _config(i):
+    return {'setpoint': 20.0, 'relay_amplitude': 100.0 + i, 'dt': 1.0}
+
+
+def test_lru_evicts_least_recently_used(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    cache = TuningCache(path, max_entries=3)
+    for i in range(3):
+        cache.put(_config(i), 100 + i, 10.0, (1.0, 2.0, 3.0))
+    assert cache.get(_config(0)) is not None  # 0 thành mới dùng gần nhất, 1 là cũ nhất
+    cache.put(_config(3), 103, 10.0, (1.0, 2.0, 3.0))
+    assert len(cache) == 3
+    assert cache.get(_config(1)) is None
+    assert [cache.get(_config(i))['Ku'] for i in (0, 2, 3)] == [100.0, 102.0, 103.0]
+    assert (cache.hits, cache.misses) == (4, 1)
+
+    # Thứ tự LRU được ghi ra file: bộ nhớ đệm mở lại loại đúng mục
+    reopened = TuningCache(path, max_entries=3)
+    reopened.put(_config(4), 104, 10.0, (1.0, 2.0, 3.0))
+    assert reopened.get(_config(0)) is None
+    assert reopened.get(_config(3)) is not None
+
+
+def test_put_replaces_existing_entry(tmp_path):
+    cache = TuningCache(str(tmp_path / 'cache.json'), max_entries=2)
+    cache.put(_config(0), 100, 10.0, (1.0, 2.0, 3.0))
+    cache.put(_config(0), 150, 12.0, (4.0, 5.0, 6.0))
+    assert len(cache) == 1
+    entry = cache.get(_config(0))
+    assert (entry['Ku'], entry['Tu'], entry['gains']) == (150.0, 12.0, [4.0, 5.0, 6.0])
+
+
+def test_version_change_invalidates_entries(tmp_path, monkeypatch):
+    path = tmp_path / 'cache.json'
+    TuningCache(str(path)).put(_config(0), 100, 10.0, (1.0, 2.0, 3.0))
+    assert json.loads(path.read_text(encoding='utf-8'))['version'] == TUNING_CACHE_VERSION
+    key = config_key(_config(0))
+
+    monkeypatch.setattr(tuning_cache, 'TUNING_CACHE_VERSION', TUNING_CACHE_VERSION + 1)
+    assert config_key(_config(0)) != key  # Phiên bản nằm trong khóa
+    cache = TuningCache(str(path))
+    assert len(cache) == 0 and cache.get(_config(0)) is None
+    cache.put(_config(1), 101, 10.0, (1.0, 2.0, 3.0))
+    data = json.loads(path.read_text(encoding='utf-8'))
+    assert data['version'] == TUNING_CACHE_VERSION + 1 and list(data['entries']) == [config_key(_config(1))]
+
+
+def test_unreadable_file_starts_empty(tmp_path):
+    path = tmp_path / 'cache.json'
+    path.write_text('{not json', encoding='utf-8')
+    cache = TuningCache(str(path))
+    assert cache.get(_config(0)) is None
+    cache.put(_config(0), 100, 10.0, (1.0, 2.0, 3.0))
+    assert TuningCache(str(path)).get(_config(0))['Ku'] == 100.0
@@ -0,0 +1,199 @@
+import numpy as np
+
+
+class _Level:
+    """
+    Một tầng của kim tự tháp: mỗi phần tử tổng hợp `factor` phần tử của tầng dưới.
+
+    Chỉ số phần tử là tuyệt đối (tính từ đầu phiên): n phần tử đã thêm, còn giữ [start, n),
+    lưu ở vị trí [0, n - start) của các mảng. Với `limit`, bộ đệm được cấp phát đủ 2 * limit phần
+    tử ngay khi tạo tầng (bộ nhớ không tăng sau đó, không phụ thuộc tốc độ lấy mẫu); khi đầy thì nửa
+    cũ bị bỏ nên tầng luôn giữ từ limit tới 2 * limit phần tử mới nhất. Không có `limit` thì bộ đệm
+    bắt đầu từ `capacity` và nhân đôi khi đầy.
+    """
+    # Tên mảng -> mỗi phần tử có một giá trị cho từng kênh hay không
+    FIELDS = {'t_first': False, 't_last': False, 'mins': True, 'maxs': True, 'means': True}
+
+    def __init__(self, n_channels, capacity, limit=None):
+        self.n = 0
+        self.start = 0
+        self.limit = limit
+        if limit is not None:
+            capacity = 2 * limit
+        for name, per_channel in self.FIELDS.items():
+            setattr(self, name, np.empty((capacity, n_channels) if per_channel else capacity))
+
+    def _make_room(self):
+        stored = self.n - self.start
+        capacity = len(getattr(self, next(iter(self.FIELDS))))
+        if stored < capacity:
+            return
+        if self.limit is not None and stored >= 2 * self.limit:
+            # Bỏ nửa cũ, dồn limit phần tử mới nhất về đầu (trung bình O(1) mỗi lần thêm)
+            for name in self.FIELDS:
+                arr = getattr(self, name)
+                arr[:self.limit] = arr[stored - self.limit:stored]
+            self.start += stored - self.limit
+            return
+        capacity *= 2
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:])
+            new[:stored] = old[:stored]
+            setattr(self, name, new)
+
+    def push(self, *row):
+        self._make_room()
+        i = self.n - self.start
+        for name, value in zip(self.FIELDS, row):
+            getattr(self, name)[i] = value
+        self.n += 1
+
+
+class _RawLevel(_Level):
+    """Tầng 0: mỗi mẫu gốc lưu một lần (thời gian, giá trị); min = max = mean = giá trị."""
+    FIELDS = {'t': False, 'values': True}
+
+    t_first = t_last = property(lambda self: self.t)
+    mins = maxs = means = property(lambda self: self.values)
+
+
+class TrendPyramid:
+    """
+    Kho dữ liệu xu hướng nhiều độ phân giải (min/max/mean) được xây dựng dần
+    khi dữ liệu tới. Tầng 0 giữ mẫu gốc; tầng k gộp factor^k mẫu gốc.
+    Truy vấn chọn tầng thô nhất vẫn đủ chi tiết để trả về không quá
+    max_points điểm, nên chi phí vẽ không tăng theo độ dài lịch sử.
+
+    Bộ nhớ có giới hạn: tầng 0 chỉ giữ từ raw_limit tới 2 * raw_limit mẫu gốc mới nhất, các
+    tầng gộp giữ từ level_limit tới 2 * level_limit nhóm; chỉ tầng trên cùng (factor^(max_levels-1)
+    mẫu mỗi nhóm) giữ toàn bộ phiên. Khoảng đã bị bỏ ở tầng mịn được vẽ từ tầng thô hơn.
+    Bộ đệm của các tầng có giới hạn được cấp phát đủ trong clear() (khoảng 4 MB với tham số mặc định
+    và 4 kênh), nên bộ nhớ không tăng theo thời gian chạy hay tốc độ lấy mẫu; tầng trên cùng thêm
+    một nhóm mỗi factor^(max_levels-1) mẫu. raw_limit/level_limit = None giữ mọi thứ.
+    """
+    def __init__(self, channels, factor=4, max_levels=10, capacity=4096, raw_limit=8192, level_limit=2048):
+        self.channels = tuple(channels)
+        self.factor = factor
+        self.max_levels = max_levels
+        self._capacity = capacity
+        self.raw_limit = raw_limit
+        self.level_limit = level_limit
+        self.clear()
+
+    def clear(self):
+        """Xóa toàn bộ lịch sử."""
+        n_channels = len(self.channels)
+        self.levels = [_RawLevel(n_channels, self._capacity, self.raw_limit if self.max_levels > 1 else None)]
+        # Các tầng gộp được tạo (và cấp phát bộ đệm) ngay, nhưng chỉ vào self.levels khi có nhóm đầu
+        # tiên: bộ nhớ của kim tự tháp cố định từ đầu phiên thay vì tăng theo số mẫu đã thêm
+        self._pending_levels = [
+            _Level(n_channels, max(16, self._capacity // self.factor ** k),
+                   self.level_limit if k + 1 < self.max_levels else None)
+            for k in range(1, self.max_levels)]
+        self._start_time = 0.0
+
+    def __len__(self):
+        return self.levels[0].n
+
+    def append(self, t, *values):
+        """Thêm một mẫu (thời gian tăng dần) cho tất cả các kênh."""
+        if self.levels[0].n == 0:
+            self._start_time = float(t)
+        self.levels[0].push(t, values)
+
+        # Gộp lên các tầng trên mỗi khi tầng dưới đủ một nhóm factor phần tử
+        k = 0
+        while self.levels[k].n % self.factor == 0 and k + 1 < self.max_levels:
+            lower = self.levels[k]
+            if k + 1 == len(self.levels):
+                self.levels.append(self._pending_levels[k])
+            stored = lower.n - lower.start
+            s = slice(stored - self.factor, stored)
+            self.levels[k + 1].push(lower.t_first[s.start], lower.t_last[s.stop - 1],
+                                    lower.mins[s].min(axis=0), lower.maxs[s].max(axis=0),
+                                    lower.means[s].mean(axis=0))
+            k += 1
+
+    def _choose_level(self, t_start, t_end, max_points):
+        # Tầng mịn nhất còn giữ dữ liệu từ t_start; số mẫu gốc trong khoảng ước lượng từ tầng đó
+        cover = len(self.levels) - 1
+        for k, lvl in enumerate(self.levels):
+            if lvl.start == 0 or lvl.t_first[0] <= t_start:
+                cover = k
+                break
+        lvl = self.levels[cover]
+        t_first = lvl.t_first[:lvl.n - lvl.start]
+        count = (np.searchsorted(t_first, t_end, side='right')
+                 - np.searchsorted(t_first, t_start, side='left')) * self.factor ** cover
+        # Mẫu gốc trả về 1 điểm/mẫu; các tầng gộp trả về 2 điểm (min, max)/nhóm
+        if cover == 0 and count <= max_points:
+            return 0
+        level = max(1, cover)
+        while level + 1 < len(self.levels) and 2 * count / self.factor ** level > max_points:
+            level += 1
+        return level
+
+    def query(self, t_start, t_end, max_points=2000, mode='minmax'):
+        """
+        Lấy dữ liệu trong khoảng [t_start, t_end] để vẽ.
+
+        Args:
+            mode (str): 'minmax' trả về đường bao (mỗi nhóm 2 điểm min, max),
+                        'mean' trả về giá trị trung bình mỗi nhóm.
+
+        Returns:
+            tuple: (times, dict{kênh: mảng giá trị})
+        """
+        if len(self) == 0:
+            return np.empty(0), {ch: np.empty(0) for ch in self.channels}
+
+        level = self._choose_level(t_start, t_end, max_points)
+
+        # Các nhóm hoàn chỉnh ở tầng đã chọn, cộng phần đuôi chưa đủ nhóm ở các tầng dưới
+        segments = []
+        covered = None
+        for k in range(level, -1, -1):
+            lvl = self.levels[k]
+            # Chỉ số cục bộ trong các mảng của tầng (phần còn giữ bắt đầu ở chỉ số tuyệt đối lvl.start)
+            start = 0 if covered is None else max(0, covered * self.factor - lvl.start)
+            stored = lvl.n - lvl.start
+            covered = lvl.n
+            if start >= stored:
+                continue
+            t_first = lvl.t_first[start:stored]
+            t_last = lvl.t_last[start:stored]
+            lo = start + int(np.searchsorted(t_last, t_start, side='left'))
+            hi = start + int(np.searchsorted(t_first, t_end, side='right'))
+            if hi > lo:
+                segments.append((k, lo, hi))
+
+        times_parts = []
+        value_parts = []
+        for k, lo, hi in segments:
+            lvl = self.levels[k]
+            if k == 0 or mode == 'mean':
+                times_parts.append(0.5 * (lvl.t_first[lo:hi] + lvl.t_last[lo:hi]))
+                value_parts.append(lvl.means[lo:hi])
+            else:
+                mid = 0.5 * (lvl.t_first[lo:hi] + lvl.t_last[lo:hi])
+                times_parts.append(np.repeat(mid, 2))
+                pairs = np.empty((2 * (hi - lo), len(self.channels)))
+                pairs[0::2] = lvl.mins[lo:hi]
+                pairs[1::2] = lvl.maxs[lo:hi]
+                value_parts.append(pairs)
+
+        if not times_parts:
+            return np.empty(0), {ch: np.empty(0) for ch in self.channels}
+        times = np.concatenate(times_parts)
+        values = np.concatenate(value_parts)
+        return times, {ch: values[:, i] for i, ch in enumerate(self.channels)}
+
+    @property
+    def start_time(self):
+        return self._start_time
+
+    @property
+    def end_time(self):
+        base = self.levels[0]
+        return float(base.t[base.n - base.start - 1]) if len(self) else 0.0
@@ -0,0 +1,151 @@
+"""
+Bộ nhớ đệm bền (trên đĩa) cho kết quả tự động tinh chỉnh relay.
+
+Khóa là SHA-256 của cấu hình thí nghiệm (tham số và trạng thái hệ bồn, setpoint, biên độ
+relay, dt, số chu kỳ, timeout; xem RelayAutoTuner.config()) cộng phiên bản thuật toán, nên
+chạy lại cùng thí nghiệm trả kết quả ngay. Giá trị gồm Ku, Tu và hệ số PID suy ra.
+
+File JSON có trường phiên bản: khi TUNING_CACHE_VERSION tăng (thay đổi cách ước lượng Ku/Tu
+hoặc quy tắc tính hệ số), toàn bộ mục cũ bị bỏ. Khi vượt max_entries, mục ít được dùng gần
+đây nhất bị loại (LRU). File được ghi nguyên tử (file tạm + os.replace).
+
+Vị trí mặc định: $COUPLED_TANK_CACHE_DIR hoặc $XDG_CACHE_HOME/coupled_tank (~/.cache/coupled_tank).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+TUNING_CACHE_VERSION = 5
+
+
+def default_cache_path():
+    cache_dir = os.environ.get('COUPLED_TANK_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'coupled_tank')
+    return os.path.join(cache_dir, 'tuning_cache.json')
+
+
+def _canonical(value):
+    """Chuẩn hóa để băm: số thực làm tròn 9 chữ số có nghĩa, kiểu NumPy về kiểu Python."""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    return float(f"{float(value):.9g}")
+
+
+def config_key(config):
+    """Khóa băm (hex) của một cấu hình thí nghiệm."""
+    payload = json.dumps({'version': TUNING_CACHE_VERSION, 'config': _canonical(config)},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class TuningCache:
+    """
+    Kho kết quả tinh chỉnh: get(config) / put(config, Ku, Tu, gains).
+
+    Args:
+        path (str): File JSON (mặc định default_cache_path()).
+        max_entries (int): Số mục tối đa trước khi loại theo LRU.
+    """
+    def __init__(self, path=None, max_entries=64):
+        self.path = path or default_cache_path()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None  # Nạp lười; dict giữ thứ tự dùng (cũ -> mới)
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        self._entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self._entries
+        if data.get('version') == TUNING_CACHE_VERSION:
+            self._entries = dict(data.get('entries', {}))
+        return self._entries
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tuning_cache.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': TUNING_CACHE_VERSION, 'entries': self._entries}, f, indent=1,
+                          ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def __len__(self):
+        return len(self._load())
+
+    def get(self, config):
+        """Kết quả đã lưu ({'Ku', 'Tu', 'gains', ...}) cho cấu hình, hoặc None."""
+        entries = self._load()
+        key = config_key(config)
+        entry = entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['last_used'] = time.time()
+        entries[key] = entry  # Đưa về cuối (mới dùng gần nhất)
+        try:
+            self._save()
+        except OSError:
+            pass  # Chỉ mất thứ tự LRU, kết quả vẫn dùng được
+        return entry
+
+    def put(self, config, Ku, Tu, gains):
+        """Lưu kết quả của một thí nghiệm; loại mục LRU nếu vượt max_entries."""
+        entries = self._load()
+        key = config_key(config)
+        entries.pop(key, None)
+        now = time.time()
+        entries[key] = {
+            'Ku': float(Ku),
+            'Tu': float(Tu),
+            'gains': [float(g) for g in gains],
+            'config': _canonical(config),
+            'created': now,
+            'last_used': now,
+        }
+        while len(entries) > self.max_entries:
+            entries.pop(next(iter(entries)))
+        self._save()
+        return entries[key]
+
+    def clear(self):
+        self._entries = {}
+        self._save()
+
+
+def cached_relay_tuning(tuner, cache=None):
+    """
+    Chạy thí nghiệm relay (RelayAutoTuner.run) hoặc lấy kết quả từ bộ nhớ đệm.
+
+    Returns:
+        tuple: (Ku, Tu, (Kp, Ki, Kd), lấy từ bộ nhớ đệm hay không), hoặc None nếu thí nghiệm
+        quá thời gian (kết quả thất bại không được lưu).
+    """
+    cache = cache if cache is not None else TuningCache()
+    config = tuner.config()
+    entry = cache.get(config)
+    if entry is not None:
+        tuner.Ku, tuner.Tu = entry['Ku'], entry['Tu']
+        return entry['Ku'], entry['Tu'], tuple(entry['gains']), True
+    if tuner.run() is None:
+        return None
+    entry = cache.put(config, tuner.Ku, tuner.Tu, tuner.ziegler_nichols())
+    return entry['Ku'], entry['Tu'], tuple(entry['gains']), False
@@ -0,0 +1,406 @@
+"""
+Pool tiến trình cục bộ sống lâu ("ấm") cho các tác vụ song song (kịch bản, what-if, quét tham số).
+
+Khác ProcessPoolExecutor tạo mới cho mỗi đợt việc:
+    - Mỗi tiến trình con nạp sẵn lõi mô phỏng (PRELOAD_MODULES: NumPy, coupled_tank_gui...) một lần
+      khi khởi động rồi nhận việc suốt vòng đời của pool.
+    - Bảng hàm thành viên và luật của Fuzzy PID (FuzzyPIDController.config_tables()) nằm trong một
+      khối multiprocessing.shared_memory: các mảng được ánh xạ chỉ đọc vào mọi tiến trình con, phần
+      còn lại (dict tham số, cơ sở luật) nhỏ nên được pickle kèm mô tả khối. create_controller()
+      ở tiến trình con dựng bộ 'fuzzy' từ các bảng này (from_tables) thay vì tính lại.
+      publish_fuzzy_tables() công bố bảng mới (ví dụ sau khi sửa luật trên GUI); mỗi lô việc mang
+      tên khối hiện hành nên tiến trình con gắn lại khi bảng đổi.
+    - Việc được gửi theo lô qua một hàng đợi (map(..., chunksize) gói nhiều lời gọi vào một lô),
+      tiến trình con rảnh lấy lô kế tiếp.
+    - stats() báo cáo mức sử dụng: thời gian bận của từng tiến trình, số việc, việc đang chờ.
+
+WarmWorkerPool là một concurrent.futures.Executor nên dùng được ở mọi chỗ nhận executor
+(ví dụ scenario_runner.run_branches).
+
+Ví dụ:
+    with WarmWorkerPool(4) as pool:
+        results = list(pool.map(run_scenario_file, files, chunksize=2))
+        print(format_stats(pool.stats()))
+    python worker_pool.py --workers 4 --jobs 200   # đo chi phí khởi động và mức sử dụng
+"""
+import argparse
+import importlib
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Executor, Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+PRELOAD_MODULES = ('numpy', 'coupled_tank_gui', 'scenario_runner')
+_ALIGN = 64
+
+
+# --- Bảng chỉ đọc trong shared memory ---
+def _split_arrays(value, arrays):
+    """Thay mọi mảng NumPy trong cấu trúc dict/list/tuple bằng chỉ số vào danh sách arrays."""
+    if isinstance(value, np.ndarray):
+        arrays.append(value)
+        return _ArrayRef(len(arrays) - 1)
+    if isinstance(value, dict):
+        return {key: _split_arrays(v, arrays) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_split_arrays(v, arrays) for v in value)
+    return value
+
+
+def _join_arrays(value, views):
+    if isinstance(value, _ArrayRef):
+        return views[value.index]
+    if isinstance(value, dict):
+        return {key: _join_arrays(v, views) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_join_arrays(v, views) for v in value)
+    return value
+
+
+class _ArrayRef:
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __reduce__(self):
+        return _ArrayRef, (self.index,)
+
+
+class SharedTables:
+    """
+    Một cấu trúc dict/list/tuple chứa mảng NumPy, đặt các mảng vào một khối shared memory.
+
+    spec (tên khối, khung cấu trúc, vị trí từng mảng) nhỏ và pickle được; attach(spec) ở tiến trình
+    khác trả về cùng cấu trúc với các mảng là view chỉ đọc lên khối nhớ (không sao chép).
+    """
+    def __init__(self, tables):
+        arrays = []
+        skeleton = _split_arrays(tables, arrays)
+        layout, offset = [], 0
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            layout.append((offset, array.shape, array.dtype.str))
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for array, (start, shape, dtype) in zip(arrays, layout):
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=start)[...] = array
+        self.spec = (self.shm.name, skeleton, layout)
+        self.nbytes = offset
+
+    @staticmethod
+    def attach(spec):
+        """
+        Gắn vào khối của spec từ một tiến trình con. Trả về (SharedMemory, cấu trúc với mảng chỉ đọc).
+
+        Tiến trình con (fork, spawn hay forkserver) dùng chung resource_tracker với tiến trình tạo
+        khối, nên không hủy đăng ký như shared_state._attach (việc đó sẽ xóa đăng ký của chính
+        khối do tiến trình cha tạo); đăng ký lại cùng tên không có tác dụng.
+        """
+        name, skeleton, layout = spec
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+        views = []
+        for start, shape, dtype in layout:
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+            view.flags.writeable = False
+            views.append(view)
+        return shm, _join_arrays(skeleton, views)
+
+    def close(self):
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+# --- Tiến trình con ---
+def _worker_main(index, tasks, results, preload):
+    start = time.perf_counter()
+    for module in preload:
+        importlib.import_module(module)
+    results.put(('ready', index, os.getpid(), time.perf_counter() - start))
+
+    attached_name, attached_shm = None, None
+    while True:
+        item = tasks.get()
+        if item is None:
+            break
+        batch_id, spec, fn, calls = item
+        name = spec[0] if spec is not None else None
+        if name != attached_name:
+            import coupled_tank_gui
+            coupled_tank_gui.install_fuzzy_tables(None)
+            if attached_shm is not None:
+                attached_shm.close()
+            attached_shm, tables = SharedTables.attach(spec) if spec is not None else (None, None)
+            coupled_tank_gui.install_fuzzy_tables(tables)
+            attached_name = name
+        busy_start = time.perf_counter()
+        outcomes = []
+        for args, kwargs in calls:
+            try:
+                outcomes.append((True, fn(*args, **kwargs)))
+            except BaseException as e:
+                try:
+                    pickle.dumps(e)
+                except Exception:
+                    e = RuntimeError(f"{type(e).__name__}: {e}")
+                outcomes.append((False, e))
+        results.put(('done', index, batch_id, outcomes, time.perf_counter() - busy_start))
+
+
+# --- Pool ---
+class WarmWorkerPool(Executor):
+    """
+    Pool tiến trình sống lâu, nạp sẵn lõi mô phỏng và dùng chung bảng Fuzzy PID.
+
+    Args:
+        workers (int): Số tiến trình con (mặc định os.cpu_count()).
+        preload (tuple): Module nạp sẵn trong mỗi tiến trình con khi khởi động.
+        fuzzy_controller (FuzzyPIDController): Bộ điều khiển có bảng cần công bố (mặc định bảng
+            chuẩn); False: không công bố bảng nào.
+        mp_context: Ngữ cảnh multiprocessing (mặc định của hệ điều hành).
+    """
+    def __init__(self, workers=None, preload=PRELOAD_MODULES, fuzzy_controller=None, mp_context=None):
+        ctx = mp_context or multiprocessing.get_context()
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}  # batch_id -> (danh sách Future theo thứ tự lời gọi, SharedTables của lô)
+        self._batch_ids = itertools.count()
+        self._shutdown = False
+        self._broken = None
+        self._tables = None
+        self._retired_tables = []
+
+        self.created = time.perf_counter()
+        self.ready_times = [None] * self.workers  # Thời gian nạp sẵn (s) của từng tiến trình
+        self.busy = [0.0] * self.workers  # Tổng thời gian bận (s)
+        self.batches_done = [0] * self.workers
+        self.calls_done = 0
+        self.calls_submitted = 0
+
+        if fuzzy_controller is not False:
+            if fuzzy_controller is None:
+                from coupled_tank_gui import FuzzyPIDController
+                fuzzy_controller = FuzzyPIDController(set_point=0.0)
+            self.publish_fuzzy_tables(fuzzy_controller)
+
+        self._processes = [ctx.Process(target=_worker_main, name=f'warm-worker-{i}', daemon=True,
+                                       args=(i, self._tasks, self._results, tuple(preload)))
+                           for i in range(self.workers)]
+        for process in self._processes:
+            process.start()
+        self._collector = threading.Thread(target=self._collect, name='warm-pool-collector', daemon=True)
+        self._collector.start()
+
+    # --- Bảng dùng chung ---
+    def publish_fuzzy_tables(self, controller):
+        """
+        Công bố bảng của controller cho các lô gửi sau lời gọi này. Khối cũ được giải phóng khi
+        không còn lô đang chờ nào dùng nó (tiến trình con đã ánh xạ vẫn giữ được vùng nhớ).
+        """
+        tables = SharedTables(controller.config_tables())
+        with self._lock:
+            if self._tables is not None:
+                self._retired_tables.append(self._tables)
+            self._tables = tables
+            self._release_retired()
+        return tables.nbytes
+
+    def _release_retired(self):
+        """Gỡ các khối bảng cũ không còn lô đang chờ tham chiếu (gọi khi đang giữ _lock)."""
+        in_use = {id(tables) for _, tables in self._pending.values()}
+        keep = []
+        for tables in self._retired_tables:
+            if id(tables) in in_use:
+                keep.append(tables)
+            else:
+                tables.close()
+        self._retired_tables = keep
+
+    # --- Gửi việc ---
+    def _enqueue(self, fn, calls, futures):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Không thể gửi việc sau khi pool đã đóng.")
+            if self._broken:
+                raise RuntimeError(self._broken)
+            batch_id = next(self._batch_ids)
+            self._pending[batch_id] = (futures, self._tables)
+            self.calls_submitted += len(calls)
+            spec = self._tables.spec if self._tables is not None else None
+        self._tasks.put((batch_id, spec, fn, calls))
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._enqueue(fn, [(args, kwargs)], [future])
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        """Như Executor.map, nhưng mỗi chunksize lời gọi liên tiếp đi chung một lô."""
+        end_time = None if timeout is None else time.monotonic() + timeout
+        futures = []
+        calls = [(args, {}) for args in zip(*iterables)]
+        for start in range(0, len(calls), max(1, chunksize)):
+            chunk = calls[start:start + max(1, chunksize)]
+            chunk_futures = [Future() for _ in chunk]
+            for future in chunk_futures:
+                future.set_running_or_notify_cancel()
+            self._enqueue(fn, chunk, chunk_futures)
+            futures += chunk_futures
+
+        def results():
+            for future in futures:
+                yield future.result(None if end_time is None else max(0.0, end_time - time.monotonic()))
+        return results()
+
+    # --- Nhận kết quả ---
+    def _collect(self):
+        while True:
+            try:
+                message = self._results.get(timeout=0.5)
+            except queue.Empty:
+                if self._shutdown and not self._pending:
+                    return
+                dead = [p.name for p in self._processes if not p.is_alive()]
+                if dead and not self._shutdown:
+                    self._fail_pending(f"Tiến trình con đã dừng bất thường: {', '.join(dead)}")
+                continue
+            if message is None:
+                return
+            if message[0] == 'ready':
+                _, index, _, elapsed = message
+                self.ready_times[index] = elapsed
+                continue
+            _, index, batch_id, outcomes, elapsed = message
+            with self._lock:
+                futures, tables = self._pending.pop(batch_id, ([], None))
+                self.busy[index] += elapsed
+                self.batches_done[index] += 1
+                self.calls_done += len(outcomes)
+                if tables is not None and tables in self._retired_tables:
+                    self._release_retired()
+            for future, (ok, value) in zip(futures, outcomes):
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _fail_pending(self, reason):
+        with self._lock:
+            self._broken = reason
+            pending, self._pending = self._pending, {}
+        for futures, _ in pending.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(RuntimeError(reason))
+
+    # --- Thống kê ---
+    def stats(self):
+        """
+        Mức sử dụng của pool.
+
+        Returns:
+            dict: 'workers', 'uptime_s', 'startup_s' (thời gian nạp sẵn lâu nhất, None nếu chưa sẵn sàng),
+                  'busy_s' và 'utilization' của từng tiến trình, 'utilization' chung (bận / (số tiến trình
+                  x thời gian sống)), 'batches', 'calls_done', 'calls_pending', 'tables_bytes'.
+        """
+        with self._lock:
+            uptime = time.perf_counter() - self.created
+            ready = [t for t in self.ready_times if t is not None]
+            return {
+                'workers': self.workers,
+                'uptime_s': uptime,
+                'startup_s': max(ready) if len(ready) == self.workers else None,
+                'busy_s': list(self.busy),
+                'worker_utilization': [b / uptime for b in self.busy],
+                'utilization': sum(self.busy) / (self.workers * uptime),
+                'batches': sum(self.batches_done),
+                'calls_done': self.calls_done,
+                'calls_pending': self.calls_submitted - self.calls_done,
+                'tables_bytes': self._tables.nbytes if self._tables is not None else 0,
+            }
+
+    def wait_ready(self, timeout=None):
+        """Chờ mọi tiến trình con nạp sẵn xong. Trả về True nếu đã sẵn sàng."""
+        end_time = None if timeout is None else time.monotonic() + timeout
+        while any(t is None for t in self.ready_times):
+            if end_time is not None and time.monotonic() > end_time or self._broken:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+        if cancel_futures:
+            self._fail_pending("Pool đã đóng trước khi việc được thực hiện.")
+        for _ in self._processes:
+            self._tasks.put(None)
+        if wait:
+            for process in self._processes:
+                process.join()
+            self._results.put(None)
+            self._collector.join()
+        for tables in self._retired_tables + ([self._tables] if self._tables is not None else []):
+            tables.close()
+        self._retired_tables, self._tables = [], None
+
+
+def format_stats(stats):
+    """Một dòng tóm tắt stats() cho giao diện và dòng lệnh."""
+    startup = f"{stats['startup_s']:.2f} s" if stats['startup_s'] is not None else "đang khởi động"
+    return (f"{stats['workers']} tiến trình (nạp sẵn {startup}), sử dụng {100 * stats['utilization']:.0f}% "
+            f"trong {stats['uptime_s']:.1f} s, {stats['calls_done']} việc / {stats['batches']} lô, "
+            f"chờ {stats['calls_pending']}")
+
+
+def _demo_job(set_point, steps):
+    """Việc mẫu: mô phỏng Fuzzy PID vài bước (bộ điều khiển dựng từ bảng dùng chung)."""
+    from coupled_tank_gui import SimulationEngine, create_controller
+    engine = SimulationEngine(create_controller('fuzzy', set_point))
+    for _ in range(steps):
+        engine.step()
+    return engine.tank_system.H2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo chi phí khởi động và mức sử dụng của pool tiến trình ấm.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--jobs', type=int, default=200, help="Số việc mẫu mỗi đợt")
+    parser.add_argument('--steps', type=int, default=50, help="Số bước mô phỏng mỗi việc")
+    parser.add_argument('--rounds', type=int, default=3, help="Số đợt việc gửi vào cùng pool")
+    parser.add_argument('--chunksize', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    with WarmWorkerPool(args.workers) as pool:
+        pool.wait_ready()
+        print(f"Khởi động: {time.perf_counter() - start:.2f} s")
+        for round_index in range(args.rounds):
+            t0 = time.perf_counter()
+            list(pool.map(_demo_job, [20.0] * args.jobs, [args.steps] * args.jobs, chunksize=args.chunksize))
+            print(f"Đợt {round_index + 1}: {args.jobs} việc trong {time.perf_counter() - t0:.3f} s")
+        print(format_stats(pool.stats()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())